@@ -0,0 +1,390 @@
+import argparse
+import base64
+from collections import OrderedDict
+import datetime
+import hashlib
+import hmac
+import logging
+import secrets
+import signal
+import threading
+import time
+import jwt
+from db_modules import (DBConnectionManager, LRUTTLCache, SQLiteDBFactory, SQLiteLoginAttemptRepository,
+                        SQLiteSecretRepository)
+
+logger = logging.getLogger(__name__)
+
+
+def key_id(key: str):
+    """Идентификатор ключа без kid: первые символы SHA-256 от ключа."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+class SecretKeyProvider:
+    """Ключи подписи токенов с идентификаторами (kid) и ротацией.
+
+    loader() возвращает список пар (ключ, kid или None), первым - текущий ключ
+    подписи; остальные принимаются только при проверке ранее выданных токенов.
+    Ключи загружаются один раз при первом обращении. reload() перечитывает их,
+    фоновый поток делает это раз в interval секунд и по сигналу (SIGHUP).
+    refresh() - перечитывание по требованию (например, при токене с неизвестным
+    kid), не чаще раза в min_reload_interval секунд.
+    version увеличивается при каждой смене набора ключей; после смены уже
+    загруженных ключей вызывается on_change() (например, чтобы сообщить о ней
+    другим процессам).
+    """
+    def __init__(self, loader, min_reload_interval: float = 5.0):
+        self.__loader = loader
+        self.min_reload_interval = min_reload_interval
+        self.__keys = None  # kid -> ключ, текущий ключ первым
+        self.__version = 0
+        self.__last_reload = None  # time.monotonic() последнего перечитывания
+        self.__lock = threading.Lock()
+        self.__reload_requested = threading.Event()
+        self.__stopped = threading.Event()
+        self.__thread = None
+        self.on_change = None
+
+    @property
+    def version(self):
+        self.__ensure_loaded()
+        return self.__version
+
+    def __ensure_loaded(self):
+        if self.__keys is None:
+            with self.__lock:
+                loaded = self.__keys is not None
+            if not loaded:
+                self.reload()
+
+    def reload(self):
+        """Перечитывание ключей. Возвращает True, если набор ключей изменился."""
+        with self.__lock:
+            self.__last_reload = time.monotonic()
+        keys = {}
+        for key, kid in self.__loader():
+            keys.setdefault(kid or key_id(key), key)
+        if not keys:
+            raise RuntimeError("Нет ключей подписи токенов")
+        with self.__lock:
+            initial = self.__keys is None
+            changed = initial or list(keys.items()) != list(self.__keys.items())
+            if changed:
+                self.__keys = keys
+                self.__version += 1
+        if changed:
+            logger.warning("Загружены ключи подписи токенов, текущий kid: %s, всего: %s",
+                            next(iter(keys)), len(keys))
+            if not initial and self.on_change is not None:
+                self.on_change()
+        return changed
+
+    def refresh(self):
+        """Перечитывание ключей, если с прошлого прошло не меньше min_reload_interval
+        секунд (поток запросов с неизвестным kid не перегружает БД). Возвращает True,
+        если набор ключей изменился; ошибка загрузки записывается в журнал."""
+        now = time.monotonic()
+        with self.__lock:
+            if self.__last_reload is not None and now - self.__last_reload < self.min_reload_interval:
+                return False
+            self.__last_reload = now
+        try:
+            return self.reload()
+        except Exception as e:
+            logger.error("Ошибка перечитывания ключей подписи токенов: %s", e)
+            return False
+
+    def signing_key(self):
+        """Текущий ключ подписи: пара (kid, ключ)."""
+        self.__ensure_loaded()
+        with self.__lock:
+            return next(iter(self.__keys.items()))
+
+    def get(self, kid: str):
+        """Ключ по идентификатору или None, если такого ключа нет (удален при ротации)."""
+        self.__ensure_loaded()
+        with self.__lock:
+            return self.__keys.get(kid)
+
+    def keys(self):
+        """Все действующие ключи, текущий первым."""
+        self.__ensure_loaded()
+        with self.__lock:
+            return list(self.__keys.values())
+
+    def request_reload(self, *args):
+        """Запрос перечитывания ключей фоновым потоком (безопасно вызывать из обработчика сигнала)."""
+        self.__reload_requested.set()
+
+    def install_signal_handler(self, signum=signal.SIGHUP):
+        """Перечитывание ключей по сигналу (обработчик ставится только из главного потока)."""
+        try:
+            signal.signal(signum, self.request_reload)
+        except (ValueError, AttributeError) as e:
+            logger.warning("Обработчик сигнала перечитывания ключей не установлен: %s", e)
+
+    def start(self, interval: float = None):
+        """Запуск фонового перечитывания ключей: раз в interval секунд (None - только по запросу)."""
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, args=(interval,),
+                                         name="secret-key-reloader", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__reload_requested.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self, interval):
+        while True:
+            self.__reload_requested.wait(interval)
+            self.__reload_requested.clear()
+            if self.__stopped.is_set():
+                return
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error("Ошибка перечитывания ключей подписи токенов: %s", e)
+
+
+class TokenVerifier:
+    """Выпуск и проверка JWT (HS256) с кэшем результатов проверки.
+
+    Кэш ограничен по размеру, ключ записи - SHA-256 токена (сами токены не
+    хранятся). Запись действительна до exp токена и до смены набора ключей,
+    поэтому повторная проверка того же токена обходится без HMAC и разбора JSON.
+    """
+    algorithm = "HS256"
+
+    def __init__(self, key_provider: SecretKeyProvider, lifetime: float = 3600.0,
+                 cache_size: int = 10000, cache_ttl: float = 300.0):
+        self.key_provider = key_provider
+        self.lifetime = lifetime  # Срок годности токена, секунд
+        self.cache = LRUTTLCache(max_size=cache_size, ttl=cache_ttl)
+
+    def generate(self, username: str):
+        """Создание токена для пользователя, подписанного текущим ключом (kid в заголовке)."""
+        kid, key = self.key_provider.signing_key()
+        payload = {
+            "username": username,
+            "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.lifetime)
+        }
+        return jwt.encode(payload, key, algorithm=self.algorithm, headers={"kid": kid})
+
+    def verify(self, token: str):
+        """Имя пользователя из действительного токена или None."""
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        version = self.key_provider.version
+        entry = self.cache.get(digest)
+        if entry is not None:
+            username, expires, entry_version = entry
+            if time.time() < expires and entry_version == version:
+                return username
+            self.cache.invalidate(digest)
+        try:
+            # Токены без kid выпущены до ротации ключей - проверяются текущим ключом
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = self.key_provider.get(kid) if kid else self.key_provider.signing_key()[1]
+            # Неизвестный kid: ключ мог быть выпущен после загрузки (ротация в другом процессе)
+            if key is None and self.key_provider.refresh():
+                version = self.key_provider.version
+                key = self.key_provider.get(kid)
+            if key is None:
+                raise jwt.InvalidTokenError(f"Неизвестный ключ подписи: {kid}")
+            payload = jwt.decode(token, key, algorithms=[self.algorithm], options={"require": ["exp"]})
+        except jwt.ExpiredSignatureError:
+            logger.error('Токен истек')
+            return None
+        except jwt.InvalidTokenError as e:
+            logger.error('Невалидный токен: %s', e)
+            return None
+        self.cache.set(digest, (payload["username"], payload["exp"], version))
+        return payload["username"]
+
+
+class PasswordHasher:
+    """Хэширование паролей scrypt (hashlib) с настраиваемой стоимостью.
+
+    Формат хэша: scrypt$n$r$p$соль$хэш (соль и хэш в base64), параметры хранятся
+    вместе с хэшем, поэтому смена стоимости не ломает проверку старых хэшей, а
+    needs_rehash() показывает, что хэш пора пересчитать. Вычисление занимает
+    десятки миллисекунд и около 128 * n * r байт памяти - его выполняют в
+    отдельном пуле потоков (hashlib.scrypt отпускает GIL).
+    """
+    prefix = "scrypt"
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1, salt_size: int = 16, dklen: int = 64):
+        if n < 2 or n & (n - 1):
+            raise ValueError("Параметр n scrypt должен быть степенью двойки больше 1")
+        self.n = n
+        self.r = r
+        self.p = p
+        self.salt_size = salt_size
+        self.dklen = dklen
+        # Хэш для несуществующего пользователя: проверка занимает то же время
+        self.__dummy_hash = self.hash(secrets.token_urlsafe(16))
+
+    @staticmethod
+    def __derive(password: str, salt: bytes, n: int, r: int, p: int, dklen: int):
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=dklen,
+                              maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+
+    @classmethod
+    def is_hashed(cls, stored: str):
+        return stored.startswith(cls.prefix + "$")
+
+    def hash(self, password: str):
+        salt = secrets.token_bytes(self.salt_size)
+        derived = self.__derive(password, salt, self.n, self.r, self.p, self.dklen)
+        return "$".join((self.prefix, str(self.n), str(self.r), str(self.p),
+                         base64.b64encode(salt).decode("ascii"), base64.b64encode(derived).decode("ascii")))
+
+    def verify(self, password: str, stored: str = None):
+        """Проверка пароля по сохраненному хэшу. stored=None (пользователя нет)
+        проверяется по фиктивному хэшу и всегда дает False. Пароль открытым текстом
+        (учетная запись до миграции) сравнивается за постоянное время."""
+        if stored is None:
+            self.verify(password, self.__dummy_hash)
+            return False
+        if not self.is_hashed(stored):
+            return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        try:
+            _, n, r, p, salt, expected = stored.split("$")
+            expected = base64.b64decode(expected)
+            derived = self.__derive(password, base64.b64decode(salt), int(n), int(r), int(p), len(expected))
+        except ValueError as e:
+            logger.error("Некорректный хэш пароля: %s", e)
+            return False
+        return hmac.compare_digest(derived, expected)
+
+    def needs_rehash(self, stored: str):
+        """True для пароля открытым текстом и для хэша с другими параметрами стоимости."""
+        if not self.is_hashed(stored):
+            return True
+        return stored.split("$")[1:4] != [str(self.n), str(self.r), str(self.p)]
+
+
+class LoginRateLimiter:
+    """Ограничение частоты попыток входа по ключу - логину или адресу клиента (token bucket).
+
+    На ключ дается burst попыток, далее - rate попыток в секунду. Лишние
+    попытки отклоняются сразу, без вычисления хэша, поэтому перебор пароля
+    одного пользователя не занимает пул хэширования. Хранится не больше
+    max_logins ключей: вытесняются давно неиспользуемые, но не заблокированные
+    (без доступных попыток) - иначе перебор можно продолжить, вытеснив счетчик
+    жертвы потоком попыток с другими логинами.
+    """
+    def __init__(self, rate: float = 0.2, burst: int = 5, max_logins: int = 10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Частота и число попыток входа должны быть больше 0")
+        self.rate = rate
+        self.burst = burst
+        self.max_logins = max_logins
+        self.__buckets = OrderedDict()  # логин -> (число доступных попыток, время обновления)
+        self.__lock = threading.Lock()
+
+    def acquire(self, login: str):
+        """Попытка входа. Возвращает 0, если она разрешена, иначе через сколько секунд повторить."""
+        now = time.monotonic()
+        with self.__lock:
+            tokens, updated = self.__buckets.pop(login, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                retry_after = 0.0
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / self.rate
+            self.__buckets[login] = (tokens, now)
+            if len(self.__buckets) > self.max_logins:
+                self.__evict(now)
+        return retry_after
+
+    def __evict(self, now: float):
+        """Вытеснение давно неиспользуемого ключа, у которого есть доступная попытка.
+        Заблокированные ключи переносятся в конец очереди; если заблокированы все,
+        вытесняется самый старый (размер хранилища ограничен в любом случае)."""
+        for _ in range(len(self.__buckets)):
+            login, (tokens, updated) = next(iter(self.__buckets.items()))
+            if tokens + (now - updated) * self.rate >= 1:
+                del self.__buckets[login]
+                return
+            self.__buckets.move_to_end(login)
+        self.__buckets.popitem(last=False)
+
+    def reset(self, login: str):
+        """Сброс счетчика после успешного входа."""
+        with self.__lock:
+            self.__buckets.pop(login, None)
+
+
+class SharedLoginRateLimiter:
+    """Ограничение частоты попыток входа со счетчиками в БД (tbl_login_attempts),
+    общими для всех процессов сервера: при нескольких процессах попытки считаются
+    вместе, а не в каждом процессе отдельно.
+
+    Интерфейс и алгоритм - как у LoginRateLimiter, scope - имя ограничения в
+    таблице. Вместо вытеснения не чаще раза в cleanup_interval секунд удаляются
+    счетчики, восстановившиеся до burst попыток. Методы обращаются к БД, из
+    асинхронных обработчиков их вызывают через DBExecutor.
+    """
+    def __init__(self, db_factory, path_to_db: str, scope: str, rate: float = 0.2, burst: int = 5,
+                 cleanup_interval: float = 60.0):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Частота и число попыток входа должны быть больше 0")
+        self.__db_factory = db_factory
+        self.__path_to_db = path_to_db
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.cleanup_interval = cleanup_interval
+        self.__next_cleanup = time.monotonic() + cleanup_interval
+        self.__lock = threading.Lock()
+
+    def acquire(self, login: str):
+        """Попытка входа. Возвращает 0, если она разрешена, иначе через сколько секунд повторить."""
+        now = time.time()
+        with DBConnectionManager(self.__db_factory, self.__path_to_db) as conn:
+            repository = SQLiteLoginAttemptRepository(conn)
+            retry_after = repository.acquire(self.scope, login, self.rate, self.burst, now)
+            if self.__cleanup_due():
+                removed = repository.remove_recovered(self.scope, self.rate, self.burst, now)
+                logger.debug("Удалено восстановившихся счетчиков попыток входа (%s): %s", self.scope, removed)
+        return retry_after
+
+    def __cleanup_due(self):
+        now = time.monotonic()
+        with self.__lock:
+            if now < self.__next_cleanup:
+                return False
+            self.__next_cleanup = now + self.cleanup_interval
+            return True
+
+    def reset(self, login: str):
+        """Сброс счетчика после успешного входа."""
+        with DBConnectionManager(self.__db_factory, self.__path_to_db) as conn:
+            SQLiteLoginAttemptRepository(conn).reset(self.scope, login)
+
+
+def rotate_secret_key(db_factory, path_to_db: str, keep: int = 2):
+    """Создание нового ключа подписи. Работающий сервер подхватит его при
+    следующем перечитывании ключей (по интервалу или по SIGHUP)."""
+    key = secrets.token_urlsafe(32)
+    kid = key_id(key)
+    with DBConnectionManager(db_factory, path_to_db) as conn:
+        repository = SQLiteSecretRepository(conn)
+        repository.create_key_columns()
+        repository.add_key(key, kid, keep)
+    return kid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ротация ключа подписи токенов")
+    parser.add_argument("--db", default="prod.db")
+    parser.add_argument("--keep", type=int, default=2, help="Сколько последних ключей оставить")
+    args = parser.parse_args()
+    print(f"kid: {rotate_secret_key(SQLiteDBFactory(pool_size=1), args.db, args.keep)}")
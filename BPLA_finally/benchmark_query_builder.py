@@ -0,0 +1,109 @@
+"""Микробенчмарк накладных расходов QueryBuilder на вызов для get_drone,
+update_drone и get_drone_status_mgn: сборка запроса на каждый вызов (как было)
+против готовых шаблонов QueryBuilder.get_template (как стало).
+
+Запуск: python benchmark_query_builder.py [--number 20000]
+"""
+import argparse
+import sqlite3
+import timeit
+from db_modules import Drone, QueryBuilder, SQLiteDroneMapper
+
+
+def create_db():
+    conn = sqlite3.connect(':memory:', check_same_thread=False, cached_statements=512)
+    conn.executescript('''
+        CREATE TABLE tbl_drones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, serial_number TEXT UNIQUE NOT NULL,
+            max_altitude INTEGER, max_speed INTEGER, max_flight_time INTEGER, max_flight_dist INTEGER,
+            payload INTEGER, model TEXT NOT NULL, manufacturer TEXT NOT NULL, battery_capacity INTEGER,
+            n_rotors INTEGER, purchase_date DATE, year INTEGER);
+        CREATE TABLE tbl_drones_mgn (id INTEGER PRIMARY KEY, status_mgn TEXT);
+    ''')
+    conn.executemany('INSERT INTO tbl_drones (id, serial_number, model, manufacturer) VALUES (?, ?, ?, ?)',
+                     [(i, f'SN{i}', 'M', 'X') for i in range(1, 1001)])
+    conn.executemany('INSERT INTO tbl_drones_mgn VALUES (?, ?)', [(i, 'release') for i in range(1, 1001)])
+    conn.commit()
+    return conn
+
+
+# Сборка запросов на каждый вызов - так мапер работал до кэша шаблонов
+def build_get_drone(drone_id):
+    query_builder = QueryBuilder()
+    query = query_builder.select("tbl_drones", "id", ",".join(Drone.tbl_drones_cols)).where(
+        "id=?", (drone_id,)).build()
+    return query, query_builder.get_params()
+
+
+def build_update_drone(drone_id, **kwargs):
+    query_builder = QueryBuilder()
+    query = query_builder.update("tbl_drones", **kwargs).where("id=?", (drone_id,)).build()
+    return query, query_builder.get_params()
+
+
+def build_get_drone_status_mgn(drone_id):
+    query_builder = QueryBuilder()
+    query = query_builder.select("tbl_drones_mgn", 'id', 'status_mgn').where("id=?", (drone_id,)).build()
+    return query, query_builder.get_params()
+
+
+def template_get_drone(drone_id):
+    return QueryBuilder.get_template("SELECT", "tbl_drones", Drone.tbl_drones_cols, "id=?", "id"), (drone_id,)
+
+
+def template_update_drone(drone_id, **kwargs):
+    return QueryBuilder.get_template("UPDATE", "tbl_drones", tuple(kwargs), "id=?"), [*kwargs.values(), drone_id]
+
+
+def template_get_drone_status_mgn(drone_id):
+    return QueryBuilder.get_template("SELECT", "tbl_drones_mgn", ("status_mgn",), "id=?", "id"), (drone_id,)
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def run(number: int):
+    conn = create_db()
+    mapper = SQLiteDroneMapper(conn)
+
+    def execute_built(builder, *args, commit=False, **kwargs):
+        query, params = builder(*args, **kwargs)
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        result = cursor.fetchone()
+        if commit:
+            conn.commit()
+        return result
+
+    cases = {
+        "get_drone": (
+            lambda: build_get_drone(7),
+            lambda: template_get_drone(7),
+            lambda: execute_built(build_get_drone, 7),
+            lambda: mapper.get_drone(7)),
+        "update_drone": (
+            lambda: build_update_drone(7, model='M2', max_speed=30),
+            lambda: template_update_drone(7, model='M2', max_speed=30),
+            lambda: execute_built(build_update_drone, 7, commit=True, model='M2', max_speed=30),
+            lambda: mapper.update_drone(7, model='M2', max_speed=30)),
+        "get_drone_status_mgn": (
+            lambda: build_get_drone_status_mgn(7),
+            lambda: template_get_drone_status_mgn(7),
+            lambda: execute_built(build_get_drone_status_mgn, 7),
+            lambda: mapper.get_drone_status_mgn(7)),
+    }
+    print(f"{'операция':<22}{'сборка, мкс':>14}{'шаблон, мкс':>14}{'вызов до, мкс':>16}{'вызов после, мкс':>18}")
+    results = {}
+    for name, (build_old, build_new, call_old, call_new) in cases.items():
+        row = [per_call_us(func, number) for func in (build_old, build_new, call_old, call_new)]
+        results[name] = row
+        print(f"{name:<22}{row[0]:>14.2f}{row[1]:>14.2f}{row[2]:>16.2f}{row[3]:>18.2f}")
+    conn.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="Число вызовов в одном замере")
+    run(parser.parse_args().number)
@@ -0,0 +1,421 @@
+"""Набор бенчмарков с сохранением результатов в JSON и сравнением с baseline:
+CRUD SQLiteDroneMapper на таблицах разного размера, QueryBuilder.build, рендеринг
+/drones через тестовый клиент Flask, обработчики Socket.IO get_drone_status и
+request_telemetry при конкурентных клиентах (тестовый клиент Flask-SocketIO),
+пространственный индекс на потоке позиций парка, кодирование телеметрии
+(JSON и двоичные кадры) и пропускная способность HTTP сервера из нескольких
+процессов (server_workers.py).
+
+Запуск: python benchmark_suite.py [--rows 1000,100000,1000000] [--output results.json]
+                                  [--baseline baseline.json] [--tolerance 0.25]
+                                  [--workers 1,2,4 [--workers-seconds 5]]
+
+Масштабирование по процессам (--workers): процессы нагрузки (по
+--clients-per-worker на процесс сервера) в течение --workers-seconds секунд
+запрашивают /api/drones; scaling_efficiency - прирост
+пропускной способности относительно первого замера, деленный на прирост числа
+процессов (1.0 - линейное масштабирование). Процессы нагрузки работают на той же
+машине, поэтому для честного замера N процессов сервера нужно не меньше 2N ядер.
+Код возврата 1, если какой-либо замер медленнее baseline больше чем на tolerance.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import numpy as np
+from db_modules import Drone, QueryBuilder, SQLiteDBFactory, SQLiteDroneMapper
+from fleet_simulator import FleetSimulator
+from server_workers import WorkerGroup
+from spatial_index import SpatialIndex
+from telemetry import decode_frame, TelemetryEngine
+
+# Показатель, по которому результаты сравниваются с baseline
+COMPARE_METRIC = "p50_us"
+
+SCHEMA = '''
+CREATE TABLE tbl_drones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, serial_number TEXT UNIQUE NOT NULL,
+    max_altitude INTEGER, max_speed INTEGER, max_flight_time INTEGER, max_flight_dist INTEGER,
+    payload INTEGER, model TEXT NOT NULL, manufacturer TEXT NOT NULL, battery_capacity INTEGER,
+    n_rotors INTEGER, purchase_date DATE, year INTEGER);
+CREATE TABLE tbl_drones_mgn (id INTEGER PRIMARY KEY, status_mgn TEXT, FOREIGN KEY (id) REFERENCES tbl_drones(id));
+'''
+MANUFACTURERS = ("DJI", "Parrot", "Autel", "Skydio")
+
+
+def summarize(timings):
+    """Статистика по времени отдельных вызовов (секунды) в микросекундах."""
+    timings = np.asarray(timings) * 1e6
+    return {
+        "n": int(timings.size),
+        "mean_us": float(timings.mean()),
+        "p50_us": float(np.percentile(timings, 50)),
+        "p95_us": float(np.percentile(timings, 95)),
+        "p99_us": float(np.percentile(timings, 99)),
+        "ops_per_s": float(1e6 / timings.mean()) if timings.mean() > 0 else 0.0,
+    }
+
+
+def measure(func, number: int, warmup: int = 10):
+    """Замер number вызовов func(i) по perf_counter."""
+    for i in range(warmup):
+        func(i)
+    timings = []
+    for i in range(number):
+        started = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def fill_drones(conn, start: int, rows: int):
+    """Пакетное заполнение таблиц дронами с id start..start+rows-1."""
+    drones = ((i, f"SN{i:08d}", 100 + i % 400, 10 + i % 60, 20 + i % 40, 1000 + i % 9000, i % 5,
+               f"Model{i % 20}", MANUFACTURERS[i % len(MANUFACTURERS)], 5000, 4, "2021-05-01", 2015 + i % 10)
+              for i in range(start, start + rows))
+    with conn:
+        conn.executemany(f"INSERT INTO tbl_drones ({','.join(Drone.tbl_drones_cols)}) "
+                         f"VALUES ({','.join('?' * len(Drone.tbl_drones_cols))})", drones)
+        conn.executemany("INSERT INTO tbl_drones_mgn (id, status_mgn) VALUES (?, 'release')",
+                         ((i,) for i in range(start, start + rows)))
+
+
+def bench_mapper(directory: str, rows: int, number: int):
+    """CRUD SQLiteDroneMapper на файловой БД с rows дронами."""
+    path = os.path.join(directory, f"drones_{rows}.db")
+    factory = SQLiteDBFactory(pool_size=1)
+    conn = factory.connect(path)
+    conn.executescript(SCHEMA)
+    fill_drones(conn, 1, rows)
+    mapper = SQLiteDroneMapper(conn)
+    mapper.create_indexes()
+    mapper.create_lock_columns()
+    mapper.create_version_table()
+    rng = random.Random(rows)
+    serials = itertools.count(rows + 1)
+    added = []
+
+    def add_drone(_):
+        drone = Drone(id=None, serial_number=f"BENCH{next(serials)}", model="Bench", manufacturer="DJI", year=2024)
+        mapper.add_drone(drone)
+        added.append(drone.id)
+
+    name = f"[rows={rows}]"
+    results = {
+        f"mapper.get_drone{name}": measure(lambda _: mapper.get_drone(rng.randint(1, rows)), number),
+        f"mapper.update_drone{name}": measure(
+            lambda i: mapper.update_drone(rng.randint(1, rows), max_speed=i % 100), number),
+        f"mapper.add_drone{name}": measure(add_drone, number),
+        f"mapper.remove_drone{name}": measure(lambda _: mapper.remove_drone(added.pop()), number),
+        f"mapper.get_drones_page{name}": measure(
+            lambda _: mapper.get_drones_page({"manufacturer": "DJI"}, sort="year", limit=50), number),
+        f"mapper.get_drones_page_keyset{name}": measure(
+            lambda _: mapper.get_drones_page({}, limit=50, after=(rows // 2, rows // 2)), number),
+    }
+    factory.release(conn)
+    return results
+
+
+def bench_query_builder(number: int):
+    def build(i):
+        query_builder = QueryBuilder()
+        query_builder.select("tbl_drones", "id", ",".join(Drone.tbl_drones_cols)).where(
+            "manufacturer=?", ("DJI",)).where("year>=?", (2015 + i % 10,)).limit(50).build()
+
+    return {"query_builder.build": measure(build, number * 10)}
+
+
+def bench_spatial(drones: int, number: int, rate_hz: float = 5.0):
+    """SpatialIndex на парке из drones дронов в районе города: пакетное обновление
+    позиций после шага симулятора, запросы по радиусу, ближайшие и сближения."""
+    simulator = FleetSimulator(drones, seed=drones)
+    rng = np.random.default_rng(drones)
+    simulator.latitude[:] = simulator.home_latitude[:] = 55.75 + rng.uniform(-0.2, 0.2, drones)
+    simulator.longitude[:] = simulator.home_longitude[:] = 37.6 + rng.uniform(-0.3, 0.3, drones)
+    index = SpatialIndex()
+    drone_ids = simulator.ids.tolist()
+    index.update_many(drone_ids, simulator.latitude, simulator.longitude)
+
+    def update(_):
+        simulator.step(1.0 / rate_hz)
+        index.update_many(drone_ids, simulator.latitude, simulator.longitude)
+
+    name = f"[drones={drones}]"
+    return {
+        f"spatial.update_many{name}": measure(update, max(number // 10, 10)),
+        f"spatial.within_radius{name}": measure(lambda i: index.within_radius(55.75, 37.6, 500), number),
+        f"spatial.nearest{name}": measure(lambda i: index.nearest(55.75, 37.6, 10), number),
+        f"spatial.close_pairs{name}": measure(lambda i: index.close_pairs(50), max(number // 10, 10)),
+    }
+
+
+def bench_telemetry_codec(drones: int, number: int):
+    """Кодирование полного состояния drones дронов: сообщения JSON (по одному на дрон)
+    и один двоичный кадр, а также разбор кадра. В результатах - время и размер
+    в пересчете на дрон."""
+    engine = TelemetryEngine(seed=drones)
+    drone_ids = range(1, drones + 1)
+    for drone_id in drone_ids:
+        engine.subscribe(drone_id, "binary", binary=True)
+    engine.tick()
+    messages = [json.dumps(engine.snapshot(drone_id)) for drone_id in drone_ids]
+    frame = engine.frames()[0][1]
+
+    def encode_json(_):
+        for drone_id in drone_ids:
+            json.dumps(engine.snapshot(drone_id))
+
+    def per_drone(result, size):
+        for key in ("mean_us", "p50_us", "p95_us", "p99_us"):
+            result[key] /= drones
+        result.update(drones=drones, bytes_per_drone=size / drones)
+        return result
+
+    name = f"[drones={drones}]"
+    return {
+        f"telemetry.encode_json{name}": per_drone(measure(encode_json, number), sum(map(len, messages))),
+        f"telemetry.encode_binary{name}": per_drone(measure(lambda _: engine.frames(), number), len(frame)),
+        f"telemetry.decode_binary{name}": per_drone(measure(lambda _: decode_frame(frame).tolist(), number),
+                                                    len(frame)),
+    }
+
+
+def prepare_server_directory(directory: str, rows: int):
+    """Рабочая копия prod.db в directory с rows дополнительными дронами."""
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prod.db")
+    shutil.copy(source, os.path.join(directory, "prod.db"))
+    import sqlite3
+    conn = sqlite3.connect(os.path.join(directory, "prod.db"))
+    start = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM tbl_drones").fetchone()[0]
+    fill_drones(conn, start, rows)
+    conn.close()
+
+
+def load_server(directory: str, rows: int):
+    """Импорт flask_server с рабочей копией prod.db (rows дронов) в directory."""
+    prepare_server_directory(directory, rows)
+    os.environ.setdefault("BPLA_LOG_FILE", os.path.join(directory, "server.log"))
+    os.environ.setdefault("BPLA_LOG_LEVEL", "WARNING")
+    os.chdir(directory)
+    import flask_server
+    return flask_server
+
+
+def login(server, client):
+    response = client.post("/login", data={"login": "admin", "password": "admin"})
+    if response.status_code != 302:
+        raise RuntimeError(f"Вход в систему не выполнен: {response.status_code}")
+
+
+def bench_web(server, number: int):
+    client = server.app.test_client()
+    login(server, client)
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: {response.status_code}")
+
+    return {
+        "web.drones": measure(lambda _: get("/drones"), number),
+        "web.drones_filtered": measure(lambda _: get("/drones?manufacturer=DJI&sort=year"), number),
+        "web.api_drones": measure(lambda _: get("/api/drones"), number),
+    }
+
+
+def bench_socket(server, event: str, make_data, clients: int, events: int):
+    """Обработчик Socket.IO при clients конкурентных клиентах, по events событий на клиента.
+    Задержка - время emit (обработчик выполняется синхронно в потоке клиента)."""
+    flask_client = server.app.test_client()
+    login(server, flask_client)
+    socket_clients = [server.socketio.test_client(server.app, flask_test_client=flask_client) for _ in range(clients)]
+    timings = [[] for _ in range(clients)]
+    barrier = threading.Barrier(clients)
+
+    def run(number):
+        socket_client = socket_clients[number]
+        barrier.wait()
+        for i in range(events):
+            started = time.perf_counter()
+            socket_client.emit(event, make_data(number, i))
+            timings[number].append(time.perf_counter() - started)
+            if i % 50 == 0:
+                socket_client.get_received()
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for socket_client in socket_clients:
+        socket_client.disconnect()
+    result = summarize(list(itertools.chain.from_iterable(timings)))
+    result.update(clients=clients, throughput_per_s=clients * events / elapsed)
+    return {f"socket.{event}[clients={clients}]": result}
+
+
+def http_login(port: int):
+    """Вход в систему по HTTP, возвращает cookie сессии."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("POST", "/login", body=urllib.parse.urlencode({"login": "admin", "password": "admin"}),
+                       headers={"Content-Type": "application/x-www-form-urlencoded"})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 302:
+        raise RuntimeError(f"Вход в систему не выполнен: {response.status}")
+    return response.getheader("Set-Cookie").split(";")[0]
+
+
+def http_load(port: int, path: str, cookie: str, seconds: float):
+    """Запросы GET path подряд в течение seconds секунд
+    (выполняется в процессе нагрузки). Возвращает время отдельных запросов."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    timings = []
+    deadline = time.perf_counter() + seconds
+    while True:
+        started = time.perf_counter()
+        if started >= deadline:
+            break
+        connection.request("GET", path, headers={"Cookie": cookie})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{path}: {response.status}")
+        timings.append(time.perf_counter() - started)
+    connection.close()
+    return timings
+
+
+def bench_workers(directory: str, workers: int, seconds: float, clients: int, path: str = "/api/drones"):
+    """Пропускная способность сервера из workers процессов (server_workers.py) при
+    clients процессах нагрузки. prod.db берется из directory."""
+    with WorkerGroup(workers, port=0, cwd=directory, env={"BPLA_LOG_LEVEL": "WARNING"}) as group:
+        group.wait_ready()
+        cookie = http_login(group.port)
+        with multiprocessing.get_context("spawn").Pool(clients) as pool:
+            timings = pool.starmap(http_load, [(group.port, path, cookie, seconds)] * clients)
+    result = summarize(list(itertools.chain.from_iterable(timings)))
+    result.update(workers=workers, clients=clients, throughput_per_s=result["n"] / seconds)
+    return {f"workers.api_drones[workers={workers}]": result}
+
+
+def bench_scaling(directory: str, workers_list, seconds: float, clients_per_worker: int = 2):
+    """bench_workers для каждого числа процессов с эффективностью масштабирования
+    относительно первого замера."""
+    results = {}
+    for workers in workers_list:
+        results.update(bench_workers(directory, workers, seconds, clients_per_worker * workers))
+    base = next(iter(results.values()))
+    for result in results.values():
+        speedup = result["throughput_per_s"] / base["throughput_per_s"]
+        result["scaling_efficiency"] = round(speedup * base["workers"] / result["workers"], 3)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, metric: str = COMPARE_METRIC):
+    """Сравнение с baseline: список замеров, ставших медленнее больше чем на tolerance."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get(metric) or metric not in result:
+            continue
+        ratio = result[metric] / base[metric]
+        if ratio > 1 + tolerance:
+            regressions.append({"name": name, "baseline": base[metric], "current": result[metric],
+                                "ratio": round(ratio, 3)})
+    return regressions
+
+
+def run(rows_list, number: int, web_rows: int, clients_list, socket_events: int, spatial_drones: int = 10000,
+        workers_list=(), workers_seconds: float = 5.0, clients_per_worker: int = 2):
+    results = {}
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        if workers_list:
+            workers_directory = os.path.join(directory, "workers")
+            os.mkdir(workers_directory)
+            prepare_server_directory(workers_directory, web_rows)
+            results.update(bench_scaling(workers_directory, workers_list, workers_seconds, clients_per_worker))
+        for rows in rows_list:
+            results.update(bench_mapper(directory, rows, number))
+        results.update(bench_query_builder(number))
+        results.update(bench_spatial(spatial_drones, number))
+        results.update(bench_telemetry_codec(1000, max(number // 10, 10)))
+        try:
+            server = load_server(directory, web_rows)
+            results.update(bench_web(server, number))
+            for clients in clients_list:
+                results.update(bench_socket(server, "get_drone_status",
+                                            lambda number, i: {"drone_id": 1 + i % 4}, clients, socket_events))
+                results.update(bench_socket(server, "request_telemetry",
+                                            lambda number, i: {"drone_id": 1 + number}, clients, socket_events))
+        finally:
+            os.chdir(workdir)
+    return results
+
+
+def print_results(results: dict):
+    print(f"{'замер':<48}{'p50, мкс':>12}{'p95, мкс':>12}{'p99, мкс':>12}{'оп/с':>12}")
+    for name, result in results.items():
+        print(f"{name:<48}{result['p50_us']:>12.1f}{result['p95_us']:>12.1f}{result['p99_us']:>12.1f}"
+              f"{result.get('throughput_per_s', result['ops_per_s']):>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="1000,100000", help="Размеры таблицы дронов через запятую")
+    parser.add_argument("--number", type=int, default=500, help="Число вызовов в одном замере")
+    parser.add_argument("--web-rows", type=int, default=10000, help="Число дронов в БД для /drones и Socket.IO")
+    parser.add_argument("--clients", default="1,8", help="Число конкурентных клиентов Socket.IO через запятую")
+    parser.add_argument("--spatial-drones", type=int, default=10000, help="Число дронов в пространственном индексе")
+    parser.add_argument("--socket-events", type=int, default=200, help="Событий Socket.IO на клиента")
+    parser.add_argument("--workers", default="", help="Число процессов сервера через запятую (например, 1,2,4)")
+    parser.add_argument("--workers-seconds", type=float, default=5.0, help="Длительность замера процессов, с")
+    parser.add_argument("--clients-per-worker", type=int, default=2, help="Процессов нагрузки на процесс сервера")
+    parser.add_argument("--output", default="benchmark_results.json", help="Файл результатов JSON")
+    parser.add_argument("--baseline", help="Файл результатов для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимое замедление (доля)")
+    args = parser.parse_args(argv)
+
+    results = run([int(rows) for rows in args.rows.split(",")], args.number, args.web_rows,
+                  [int(clients) for clients in args.clients.split(",")], args.socket_events, args.spatial_drones,
+                  [int(workers) for workers in args.workers.split(",") if workers], args.workers_seconds,
+                  args.clients_per_worker)
+    print_results(results)
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        report["regressions"] = compare(results, baseline, args.tolerance)
+        for regression in report["regressions"]:
+            print(f"РЕГРЕССИЯ {regression['name']}: {regression['baseline']:.1f} -> "
+                  f"{regression['current']:.1f} мкс (x{regression['ratio']})")
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
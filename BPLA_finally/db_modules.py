@@ -1,6 +1,31 @@
 from abc import ABC, abstractmethod
+import asyncio
+import base64
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import csv
+import datetime
+import io
+import itertools
+import json
 import logging
+import queue
+import re
 import sqlite3
+import threading
+import time
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.pool
+except ImportError:  # PostgreSQL - необязательная зависимость
+    psycopg2 = None
+else:
+    # Даты PostgreSQL отдаются строками ISO, как из SQLite
+    _PG_DATE_AS_TEXT = psycopg2.extensions.new_type(
+        psycopg2.extensions.DATE.values, "DATE_AS_TEXT", lambda value, cursor: value)
+
+logger = logging.getLogger(__name__)
 
 
 class Drone:
@@ -22,6 +47,8 @@ class Drone:
     tbl_status_mgn = [
         "id",
         "status_mgn"]
+    # Без __dict__ у каждого экземпляра: при выгрузке всего парка дронов это основная часть памяти
+    __slots__ = tuple(tbl_drones_cols)
 
     def __init__(self, id, serial_number=None,
                        max_altitude=None,
@@ -50,6 +77,19 @@ class Drone:
         self.purchase_date = purchase_date
         self.year = year
 
+    @classmethod
+    def from_row(cls, cursor, row):
+        """Создание дрона из строки SELECT колонок tbl_drones_cols без промежуточного словаря.
+        Подходит как row_factory курсора sqlite3."""
+        drone = cls.__new__(cls)
+        for setter, value in zip(cls._setters, row):
+            setter(drone, value)
+        return drone
+
+    def to_dict(self):
+        """Представление дрона в виде словаря (для JSON-ответов)."""
+        return {col: getattr(self, col) for col in self.tbl_drones_cols}
+
     def __str__(self):
         return (
                 f"ID: {self.id},"
@@ -69,6 +109,10 @@ class Drone:
         return False
 
 
+# Дескрипторы слотов в порядке tbl_drones_cols - для быстрого заполнения в Drone.from_row
+Drone._setters = tuple(getattr(Drone, col).__set__ for col in Drone.tbl_drones_cols)
+
+
 class IDroneMapper(ABC):
     """Интерфейс преобразователя данных между моделью и БД."""
     def __init__(self, conn):
@@ -83,12 +127,170 @@ class IDroneMapper(ABC):
         pass
 
 
+class BatchResult:
+    """Результат пакетной операции: число успешных строк и ошибки по строкам"""
+    def __init__(self, max_errors: int = 1000):
+        self.succeeded = 0
+        self.affected = 0
+        self.error_count = 0
+        self.errors = []
+        self.__max_errors = max_errors
+
+    def add_error(self, key, error):
+        """Регистрация ошибки строки (хранятся первые max_errors ошибок)."""
+        self.error_count += 1
+        if len(self.errors) < self.__max_errors:
+            self.errors.append((key, str(error)))
+
+    def to_dict(self):
+        return {
+            "succeeded": self.succeeded,
+            "affected": self.affected,
+            "error_count": self.error_count,
+            "errors": [{"row": key, "error": error} for key, error in self.errors]
+        }
+
+
+class _SQLiteTransaction:
+    """Контекстный менеджер явной транзакции SQLite: COMMIT при успехе, ROLLBACK при ошибке.
+    Если транзакция уже открыта, работает внутри нее и не завершает ее."""
+    def __init__(self, conn):
+        self.__conn = conn
+        self.__owner = False
+
+    def __enter__(self):
+        if not self.__conn.in_transaction:
+            self.__conn.execute("BEGIN IMMEDIATE")
+            self.__owner = True
+        return self.__conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.__owner:
+            return
+        if exc_type is None:
+            self.__conn.commit()
+        else:
+            self.__conn.rollback()
+
+
+def _iter_chunks(items, size: int):
+    """Разбиение итерируемого объекта на списки по size элементов."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _prefix_upper_bound(prefix: str):
+    """Наименьшая строка больше всех строк с префиксом prefix (по кодам символов) или
+    None, если ее нет (префикс только из символов U+10FFFF). Суррогаты пропускаются:
+    их нельзя передать в БД."""
+    prefix = prefix.rstrip("\U0010ffff")
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+def _apply_drone_filters(query_builder, filters: dict):
+    """Добавление условий фильтрации списка дронов, использующих индексы."""
+    if filters.get("manufacturer"):
+        query_builder.where("manufacturer=?", (filters["manufacturer"],))
+    if filters.get("model"):
+        query_builder.where("model=?", (filters["model"],))
+    prefix = filters.get("serial_prefix")
+    if prefix:
+        # Префиксный поиск как диапазон, чтобы работал индекс по serial_number
+        upper = _prefix_upper_bound(prefix)
+        if upper is None:
+            query_builder.where("serial_number>=?", (prefix,))
+        else:
+            query_builder.where("serial_number>=? AND serial_number<?", (prefix, upper))
+    if filters.get("year_from") is not None:
+        query_builder.where("year>=?", (filters["year_from"],))
+    if filters.get("year_to") is not None:
+        query_builder.where("year<=?", (filters["year_to"],))
+
+
+def _select_drones_query(order_by: str, filters: dict = None, paramstyle: str = "qmark"):
+    """Запрос всех колонок дронов с фильтрами списка: кортеж (запрос, параметры).
+    Без фильтров берется кэшированный шаблон запроса."""
+    if not filters or not any(value not in (None, "") for value in filters.values()):
+        return QueryBuilder.get_template("SELECT", "tbl_drones", Drone.tbl_drones_cols, order_by=order_by,
+                                         paramstyle=paramstyle), []
+    query_builder = QueryBuilder(paramstyle)
+    query_builder.select("tbl_drones", order_by, ",".join(Drone.tbl_drones_cols))
+    _apply_drone_filters(query_builder, filters)
+    return query_builder.build(), query_builder.get_params()
+
+
+def _apply_drone_keyset(query_builder, sort: str, descending: bool, last_value, last_id):
+    """Добавление условия keyset-пагинации после строки (last_value, last_id).
+
+    NULL считается меньше любого значения: при ASC они идут первыми, при DESC - последними
+    (так сортирует SQLite, в PostgreSQL порядок NULL задается в ORDER BY явно).
+    """
+    op = "<" if descending else ">"
+    if sort == "id":
+        query_builder.where(f"id{op}?", (last_id,))
+    elif last_value is None:
+        if descending:
+            query_builder.where(f"{sort} IS NULL AND id<?", (last_id,))
+        else:
+            query_builder.where(f"({sort} IS NOT NULL OR id>?)", (last_id,))
+    elif descending:
+        query_builder.where(f"(({sort}, id)<(?, ?) OR {sort} IS NULL)", (last_value, last_id))
+    else:
+        query_builder.where(f"({sort}, id)>(?, ?)", (last_value, last_id))
+
+
 class SQLiteDroneMapper(IDroneMapper):
     """Преобразователь данных между моделью и БД SQLite"""
+    # Колонки, по которым разрешена серверная сортировка списка дронов
+    sortable_cols = ("id", "serial_number", "model", "manufacturer", "n_rotors", "year")
+    # Индексы под фильтры и keyset-пагинацию списка дронов
+    indexes = (
+        "CREATE INDEX IF NOT EXISTS idx_drones_manufacturer ON tbl_drones (manufacturer, id)",
+        "CREATE INDEX IF NOT EXISTS idx_drones_model ON tbl_drones (model, id)",
+        "CREATE INDEX IF NOT EXISTS idx_drones_year ON tbl_drones (year, id)",
+        "CREATE INDEX IF NOT EXISTS idx_drones_n_rotors ON tbl_drones (n_rotors, id)",
+    )
+
+    # Размер порции строк для одного вызова executemany
+    batch_chunk_size = 500
+
+    def __init__(self, conn):
+        super().__init__(conn)
+        # Объявленные типы колонок по таблицам этого соединения (схема читается из БД один раз
+        # на преобразователь и сбрасывается при ее изменении через преобразователь)
+        self.__column_types = {}
+
+    def get_column_types(self, table: str):
+        """Метод для получения объявленных типов колонок таблицы: {колонка: тип}."""
+        types = self.__column_types.get(table)
+        if types is None:
+            cursor = self.conn.cursor()
+            cursor.execute(f"PRAGMA table_info({table})")
+            types = {row[1]: row[2].upper() for row in cursor.fetchall()}
+            if types:
+                self.__column_types[table] = types
+        return types
+
+    def create_indexes(self):
+        """Метод для создания индексов (повторный вызов безопасен)."""
+        cursor = self.conn.cursor()
+        for index in self.indexes:
+            cursor.execute(index)
+        self.conn.commit()
 
     def get_new_drone_id(self):
-        query_builder = QueryBuilder()
-        query = query_builder.select_last_drone_id()
+        query = QueryBuilder.select_last_drone_id()
         cursor = self.conn.cursor()
         cursor.execute(query)
         self.conn.commit()
@@ -97,84 +299,1076 @@ class SQLiteDroneMapper(IDroneMapper):
 
     def add_drone(self, drone: Drone):
         """Метод для добавления данных в БД."""
-        query_builder = QueryBuilder()
-        query = query_builder.insert_into("tbl_drones", Drone.tbl_drones_cols).values(
-                    drone.id,
-                            drone.serial_number,
-                            drone.model,
-                            drone.manufacturer,
-                            drone.max_altitude,
-                            drone.max_speed,
-                            drone.max_flight_time,
-                            drone.max_flight_dist,
-                            drone.payload,
-                            drone.battery_capacity,
-                            drone.n_rotors,
-                            drone.purchase_date,
-                            drone.year
-                        ).build()
+        query = QueryBuilder.get_template("INSERT", "tbl_drones", Drone.tbl_drones_cols)
         cursor = self.conn.cursor()
         try:
-            cursor.execute(query, query_builder.get_params())
+            cursor.execute(query, [getattr(drone, col) for col in Drone.tbl_drones_cols])
+            self.bump_fleet_version(commit=False)
         except sqlite3.IntegrityError as error:
-            logging.error(f"Ошибка при добавлении дрона в БД. {error}")
+            logger.error("Ошибка при добавлении дрона в БД. %s", error)
         self.conn.commit()
         drone.id = cursor.lastrowid
 
     def get_drone(self, drone_id: int):
         """Метод для извлечения данных дрона из БД."""
-        query_builder = QueryBuilder()
-        query = query_builder.select("tbl_drones", "id", ",".join(Drone.tbl_drones_cols)).where(
-                                  "id=?", (drone_id,)).build()
+        query = QueryBuilder.get_template("SELECT", "tbl_drones", Drone.tbl_drones_cols, "id=?", "id")
         cursor = self.conn.cursor()
-        cursor.execute(query, query_builder.get_params())
+        cursor.execute(query, (drone_id,))
         return cursor.fetchone()
 
     def get_drone_status_mgn(self, drone_id: int):
         """Метод извлечения состояния управления дрона (lock или release)"""
-        query_builder = QueryBuilder()
-        query = query_builder.select("tbl_drones_mgn", 'id', 'status_mgn').where(
-                                     "id=?", (drone_id,)).build()
+        query = QueryBuilder.get_template("SELECT", "tbl_drones_mgn", ("status_mgn",), "id=?", "id")
         cursor = self.conn.cursor()
-        cursor.execute(query, query_builder.get_params())
+        cursor.execute(query, (drone_id,))
         return cursor.fetchone()[0]
 
+    def get_drones_status_mgn(self, drone_ids=None):
+        """Метод извлечения состояний управления многих дронов: один запрос на порцию id
+        (все дроны, если drone_ids=None). Возвращает словарь id -> статус; у дрона без
+        строки в tbl_drones_mgn статус None, несуществующие дроны в словарь не попадают."""
+        query = ("SELECT d.id, m.status_mgn FROM tbl_drones d "
+                 "LEFT JOIN tbl_drones_mgn m ON m.id = d.id")
+        cursor = self.conn.cursor()
+        if drone_ids is None:
+            cursor.execute(query)
+            return dict(cursor.fetchall())
+        statuses = {}
+        for chunk in _iter_chunks(dict.fromkeys(drone_ids), self.batch_chunk_size):
+            cursor.execute(f"{query} WHERE d.id IN ({','.join('?' * len(chunk))})", chunk)
+            statuses.update(cursor.fetchall())
+        return statuses
+
     def update_drone(self, drone_id: int, **kwargs):
         """Метод для изменения данных в БД."""
-        query_builder = QueryBuilder()
-        query = query_builder.update("tbl_drones", **kwargs).where(
-                                  "id=?", (drone_id,)).build()
+        query = QueryBuilder.get_template("UPDATE", "tbl_drones", tuple(kwargs), "id=?")
         cursor = self.conn.cursor()
-        cursor.execute(query, query_builder.get_params())
+        cursor.execute(query, [*kwargs.values(), drone_id])
+        self.bump_fleet_version(commit=False)
         self.conn.commit()
 
     def update_drone_status_mgn(self, drone_id: int, status: str):
         """Метод для изменения статуса управления дроном (lock или release)"""
-        status_dict = dict(zip(Drone.tbl_status_mgn, (drone_id, status)))
-        query_builder = QueryBuilder()
-        query = query_builder.update("tbl_drones_mgn", **status_dict).where(
-                                     "id=?", (drone_id,)).build()
+        query = QueryBuilder.get_template("UPDATE", "tbl_drones_mgn", Drone.tbl_status_mgn, "id=?")
         cursor = self.conn.cursor()
-        cursor.execute(query, query_builder.get_params())
+        cursor.execute(query, (drone_id, status, drone_id))
+        self.conn.commit()
+
+    def create_lock_columns(self):
+        """Метод для добавления в tbl_drones_mgn колонок владельца и срока аренды управления."""
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA table_info(tbl_drones_mgn)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "owner" not in columns:
+            cursor.execute("ALTER TABLE tbl_drones_mgn ADD COLUMN owner TEXT")
+        if "lease_until" not in columns:
+            cursor.execute("ALTER TABLE tbl_drones_mgn ADD COLUMN lease_until REAL")
+        self.conn.commit()
+        self.__column_types.clear()
+
+    def create_version_table(self):
+        """Метод для создания таблицы версии данных парка (одна строка, повторный вызов безопасен)."""
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS tbl_fleet_version ("
+                       "id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, updated_at REAL NOT NULL)")
+        cursor.execute("INSERT OR IGNORE INTO tbl_fleet_version (id, version, updated_at) VALUES (1, 0, ?)",
+                       (time.time(),))
+        self.conn.commit()
+
+    def get_fleet_version(self):
+        """Метод для чтения версии данных парка: (номер, время изменения)."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT version, updated_at FROM tbl_fleet_version WHERE id=1")
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else (0, 0.0)
+
+    def bump_fleet_version(self, commit: bool = True):
+        """Метод для увеличения версии данных парка. Методы записи в tbl_drones вызывают его
+        с commit=False в своей транзакции: версия и данные фиксируются вместе."""
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO tbl_fleet_version (id, version, updated_at) VALUES (1, 1, ?) "
+                       "ON CONFLICT (id) DO UPDATE SET version=version+1, updated_at=excluded.updated_at",
+                       (time.time(),))
+        if commit:
+            self.conn.commit()
+
+    def acquire_drone_lock(self, drone_id: int, owner: str, lease_until: float, now: float):
+        """Атомарный захват управления дроном (compare-and-set).
+
+        Управление захватывается, если дрон свободен, аренда истекла (или ее нет -
+        блокировка старого формата), либо им уже управляет тот же владелец.
+        Возвращает True при успешном захвате.
+        """
+        with _SQLiteTransaction(self.conn):
+            cursor = self.conn.cursor()
+            # Для дронов без строки статуса создаем ее в состоянии release
+            cursor.execute("INSERT OR IGNORE INTO tbl_drones_mgn (id, status_mgn) "
+                           "SELECT id, 'release' FROM tbl_drones WHERE id=?", (drone_id,))
+            cursor.execute("UPDATE tbl_drones_mgn SET status_mgn='lock', owner=?, lease_until=? "
+                           "WHERE id=? AND (status_mgn IS NOT 'lock' OR lease_until IS NULL "
+                           "OR lease_until<? OR owner=?)",
+                           (owner, lease_until, drone_id, now, owner))
+            return cursor.rowcount == 1
+
+    def renew_drone_lock(self, drone_id: int, owner: str, lease_until: float):
+        """Продление аренды управления владельцем. Возвращает False, если аренда потеряна."""
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE tbl_drones_mgn SET lease_until=? "
+                       "WHERE id=? AND status_mgn='lock' AND owner=?",
+                       (lease_until, drone_id, owner))
+        self.conn.commit()
+        return cursor.rowcount == 1
+
+    def release_drone_lock(self, drone_id: int, owner: str):
+        """Освобождение управления его владельцем. Возвращает True, если дрон освобожден."""
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE tbl_drones_mgn SET status_mgn='release', owner=NULL, lease_until=NULL "
+                       "WHERE id=? AND status_mgn='lock' AND owner=?",
+                       (drone_id, owner))
         self.conn.commit()
+        return cursor.rowcount == 1
+
+    def release_expired_locks(self, now: float):
+        """Освобождение всех дронов с истекшей арендой. Возвращает список их id."""
+        with _SQLiteTransaction(self.conn):
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id FROM tbl_drones_mgn WHERE status_mgn='lock' AND lease_until<?", (now,))
+            drone_ids = [row[0] for row in cursor.fetchall()]
+            if drone_ids:
+                cursor.execute("UPDATE tbl_drones_mgn SET status_mgn='release', owner=NULL, lease_until=NULL "
+                               "WHERE status_mgn='lock' AND lease_until<?", (now,))
+        return drone_ids
 
     def remove_drone(self, drone_id: int):
         """Метод для удаления данных из БД."""
-        query_builder = QueryBuilder()
-        query = query_builder.delete("tbl_drones").where(
-                                  "id=?", (drone_id,)).build()
+        query = QueryBuilder.get_template("DELETE", "tbl_drones", where="id=?")
         cursor = self.conn.cursor()
-        cursor.execute(query, query_builder.get_params())
+        cursor.execute(query, (drone_id,))
+        self.bump_fleet_version(commit=False)
         self.conn.commit()
 
     def get_drones(self, order_by: str):
         """Метод для извлечения данных всех дронов из БД."""
+        query = QueryBuilder.get_template("SELECT", "tbl_drones", Drone.tbl_drones_cols, order_by=order_by)
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        return cursor.fetchall()
+
+    def iter_drones(self, order_by: str, row_factory=None, arraysize: int = 500, filters: dict = None):
+        """Метод для потокового чтения всех дронов порциями по arraysize строк.
+
+        row_factory(cursor, row) задает представление строки (по умолчанию кортеж),
+        filters - фильтры списка дронов (см. get_drones_page).
+        """
+        query, params = _select_drones_query(order_by, filters)
+        cursor = self.conn.cursor()
+        cursor.row_factory = row_factory
+        cursor.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(arraysize)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def get_drones_page(self, filters: dict, sort: str = "id", descending: bool = False,
+                        limit: int = 50, after=None):
+        """Метод для извлечения одной страницы дронов из БД.
+
+        filters - словарь фильтров (manufacturer, model, serial_prefix, year_from, year_to),
+        after - пара (значение колонки сортировки, id) последней строки предыдущей страницы.
+        Возвращает не более limit + 1 строк: лишняя строка означает наличие следующей страницы.
+        """
+        if sort not in self.sortable_cols:
+            raise ValueError(f"Недопустимая колонка сортировки: {sort}")
+        direction = "DESC" if descending else "ASC"
+        order_by = f"id {direction}" if sort == "id" else f"{sort} {direction}, id {direction}"
         query_builder = QueryBuilder()
-        query = query_builder.select("tbl_drones", order_by, ",".join(Drone.tbl_drones_cols)).build()
+        query_builder.select("tbl_drones", order_by, ",".join(Drone.tbl_drones_cols))
+        _apply_drone_filters(query_builder, filters)
+        if after is not None:
+            _apply_drone_keyset(query_builder, sort, descending, *after)
+        query = query_builder.limit(limit + 1).build()
         cursor = self.conn.cursor()
         cursor.execute(query, query_builder.get_params())
         return cursor.fetchall()
 
+    def add_drones(self, drones, prepare=None):
+        """Метод для пакетного добавления дронов в одной транзакции.
+
+        drones - любой итерируемый объект (в том числе генератор), читается порциями.
+        Дронам без id назначаются последовательные id одним запросом на всю пачку.
+        prepare(drone) - проверка дрона перед записью, ValueError учитывается как ошибка строки.
+        """
+        query = QueryBuilder.get_template("INSERT", "tbl_drones", Drone.tbl_drones_cols)
+        result = BatchResult()
+        with self.__transaction():
+            next_id = self.__get_max_drone_id() + 1
+            for chunk in _iter_chunks(enumerate(drones), self.batch_chunk_size):
+                rows = []
+                for index, drone in chunk:
+                    if prepare is not None:
+                        try:
+                            prepare(drone)
+                        except ValueError as error:
+                            result.add_error(index, error)
+                            continue
+                    if drone.id is None:
+                        drone.id = next_id
+                    next_id = max(next_id, int(drone.id) + 1)
+                    rows.append((index, [getattr(drone, col) for col in Drone.tbl_drones_cols], drone))
+                if rows:
+                    self.__executemany(query, rows, result)
+            self.bump_fleet_version(commit=False)
+        return result
+
+    def update_drones(self, updates: dict, prepare=None):
+        """Метод для пакетного изменения дронов: {drone_id: {колонка: значение}}.
+
+        Строки с одинаковым набором колонок выполняются одним executemany.
+        prepare(values) - проверка значений строки, ValueError учитывается как ошибка строки.
+        """
+        result = BatchResult()
+        with self.__transaction():
+            groups = {}
+            for drone_id, values in updates.items():
+                if prepare is not None:
+                    try:
+                        values = prepare(values)
+                    except ValueError as error:
+                        result.add_error(drone_id, error)
+                        continue
+                groups.setdefault(tuple(sorted(values)), []).append((drone_id, values))
+            for columns, items in groups.items():
+                query = QueryBuilder.get_template("UPDATE", "tbl_drones", columns, "id=?")
+                for chunk in _iter_chunks(items, self.batch_chunk_size):
+                    rows = [(drone_id, [values[col] for col in columns] + [drone_id], None)
+                            for drone_id, values in chunk]
+                    self.__executemany(query, rows, result)
+            self.bump_fleet_version(commit=False)
+        return result
+
+    def remove_drones(self, drone_ids):
+        """Метод для пакетного удаления дронов в одной транзакции."""
+        query = QueryBuilder.get_template("DELETE", "tbl_drones", where="id=?")
+        result = BatchResult()
+        with self.__transaction():
+            for chunk in _iter_chunks(drone_ids, self.batch_chunk_size):
+                self.__executemany(query, [(drone_id, [drone_id], None) for drone_id in chunk], result)
+            self.bump_fleet_version(commit=False)
+        return result
+
+    def __get_max_drone_id(self):
+        """Наибольший выданный id с учетом AUTOINCREMENT (sqlite_sequence)."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name='tbl_drones'), 0), "
+                       "COALESCE((SELECT MAX(id) FROM tbl_drones), 0))")
+        return cursor.fetchone()[0]
+
+    def __transaction(self):
+        """Явная транзакция (BEGIN IMMEDIATE ... COMMIT) для пакетных операций."""
+        return _SQLiteTransaction(self.conn)
+
+    def __executemany(self, query: str, rows: list, result: BatchResult):
+        """Выполнение порции строк одним executemany.
+
+        rows - список (ключ строки, параметры, дрон или None). При ошибке порция
+        откатывается к точке сохранения и выполняется построчно, чтобы собрать
+        ошибки по каждой строке без отката остальных.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SAVEPOINT batch_chunk")
+        try:
+            cursor.executemany(query, [params for _, params, _ in rows])
+            result.succeeded += len(rows)
+            result.affected += cursor.rowcount
+        except sqlite3.Error:
+            cursor.execute("ROLLBACK TO batch_chunk")
+            for key, params, drone in rows:
+                try:
+                    cursor.execute(query, params)
+                    result.succeeded += 1
+                    result.affected += cursor.rowcount
+                except sqlite3.Error as error:
+                    logger.error("Ошибка пакетной операции в строке %s: %s", key, error)
+                    result.add_error(key, error)
+                    if drone is not None:
+                        drone.id = None
+        cursor.execute("RELEASE batch_chunk")
+
+
+class _PostgreSQLTransaction:
+    """Контекстный менеджер транзакции PostgreSQL: COMMIT при успехе, ROLLBACK при ошибке.
+    psycopg2 открывает транзакцию неявно; если она уже открыта, работает внутри нее."""
+    def __init__(self, conn):
+        self.__conn = conn
+        self.__owner = False
+
+    def __enter__(self):
+        self.__owner = self.__conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        return self.__conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.__owner:
+            return
+        if exc_type is None:
+            self.__conn.commit()
+        else:
+            self.__conn.rollback()
+
+
+class PostgreSQLDroneMapper(IDroneMapper):
+    """Преобразователь данных между моделью и БД PostgreSQL (драйвер psycopg2).
+
+    Запросы строятся тем же QueryBuilder в стиле параметров "%s". Пакетное
+    добавление выполняется через COPY, полный список дронов читается серверным
+    курсором порциями.
+    """
+    sortable_cols = SQLiteDroneMapper.sortable_cols
+    paramstyle = "format"
+    tables = (
+        "CREATE TABLE IF NOT EXISTS tbl_drones ("
+        "id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, serial_number TEXT UNIQUE NOT NULL, "
+        "max_altitude INTEGER, max_speed INTEGER, max_flight_time INTEGER, max_flight_dist INTEGER, "
+        "payload INTEGER, model TEXT NOT NULL, manufacturer TEXT NOT NULL, battery_capacity INTEGER, "
+        "n_rotors INTEGER, purchase_date DATE, year INTEGER)",
+        "CREATE TABLE IF NOT EXISTS tbl_drones_mgn ("
+        "id BIGINT PRIMARY KEY, status_mgn TEXT, owner TEXT, lease_until DOUBLE PRECISION)",
+        "CREATE TABLE IF NOT EXISTS tbl_fleet_version ("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), version BIGINT NOT NULL, updated_at DOUBLE PRECISION NOT NULL)",
+    )
+    # NULL в начале по возрастанию, как в SQLite: условия keyset-пагинации общие для обеих БД
+    indexes = (
+        "CREATE INDEX IF NOT EXISTS idx_drones_manufacturer ON tbl_drones (manufacturer NULLS FIRST, id)",
+        "CREATE INDEX IF NOT EXISTS idx_drones_model ON tbl_drones (model NULLS FIRST, id)",
+        "CREATE INDEX IF NOT EXISTS idx_drones_year ON tbl_drones (year NULLS FIRST, id)",
+        "CREATE INDEX IF NOT EXISTS idx_drones_n_rotors ON tbl_drones (n_rotors NULLS FIRST, id)",
+    )
+    # Размер порции строк для одного COPY или executemany
+    batch_chunk_size = 5000
+
+    __cursor_numbers = itertools.count(1)
+
+    def __init__(self, conn):
+        super().__init__(conn)
+        # Типы колонок по таблицам этого соединения (см. SQLiteDroneMapper)
+        self.__column_types = {}
+
+    def __template(self, operation: str, table: str, columns=(), where: str = None, order_by: str = None):
+        return QueryBuilder.get_template(operation, table, columns, where, order_by, self.paramstyle)
+
+    def __execute(self, query: str, params=(), commit: bool = False):
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        if commit:
+            self.conn.commit()
+        return cursor
+
+    def create_tables(self):
+        """Метод для создания таблиц дронов (повторный вызов безопасен)."""
+        cursor = self.conn.cursor()
+        for table in self.tables:
+            cursor.execute(table)
+        self.conn.commit()
+        self.__column_types.clear()
+
+    def get_column_types(self, table: str):
+        """Метод для получения типов колонок таблицы: {колонка: тип}."""
+        types = self.__column_types.get(table)
+        if types is None:
+            cursor = self.__execute("SELECT column_name, data_type FROM information_schema.columns "
+                                    "WHERE table_schema=current_schema() AND table_name=%s", (table,))
+            types = {row[0]: row[1].upper() for row in cursor.fetchall()}
+            self.conn.commit()
+            if types:
+                self.__column_types[table] = types
+        return types
+
+    def create_indexes(self):
+        """Метод для создания индексов (повторный вызов безопасен)."""
+        cursor = self.conn.cursor()
+        for index in self.indexes:
+            cursor.execute(index)
+        self.conn.commit()
+
+    def get_new_drone_id(self):
+        """Следующий id из последовательности таблицы (не совпадет с id другого запроса)."""
+        cursor = self.__execute("SELECT nextval(pg_get_serial_sequence('tbl_drones', 'id'))", commit=True)
+        return cursor.fetchone()[0]
+
+    def add_drone(self, drone: Drone):
+        """Метод для добавления данных в БД."""
+        columns = [col for col in Drone.tbl_drones_cols if col != "id" or drone.id is not None]
+        query = self.__template("INSERT", "tbl_drones", columns) + " RETURNING id"
+        try:
+            cursor = self.__execute(query, [getattr(drone, col) for col in columns])
+            drone.id = cursor.fetchone()[0]
+            self.bump_fleet_version()
+        except psycopg2.IntegrityError as error:
+            self.conn.rollback()
+            logger.error("Ошибка при добавлении дрона в БД. %s", error)
+            drone.id = None
+
+    def get_drone(self, drone_id: int):
+        """Метод для извлечения данных дрона из БД."""
+        query = self.__template("SELECT", "tbl_drones", Drone.tbl_drones_cols, "id=?", "id")
+        return self.__execute(query, (drone_id,)).fetchone()
+
+    def get_drone_status_mgn(self, drone_id: int):
+        """Метод извлечения состояния управления дрона (lock или release)"""
+        query = self.__template("SELECT", "tbl_drones_mgn", ("status_mgn",), "id=?", "id")
+        return self.__execute(query, (drone_id,)).fetchone()[0]
+
+    def get_drones_status_mgn(self, drone_ids=None):
+        """Метод извлечения состояний управления многих дронов (см. SQLiteDroneMapper)."""
+        query = "SELECT d.id, m.status_mgn FROM tbl_drones d LEFT JOIN tbl_drones_mgn m ON m.id = d.id"
+        if drone_ids is None:
+            return dict(self.__execute(query).fetchall())
+        statuses = {}
+        for chunk in _iter_chunks(dict.fromkeys(drone_ids), self.batch_chunk_size):
+            statuses.update(self.__execute(query + " WHERE d.id = ANY(%s)", (list(chunk),)).fetchall())
+        return statuses
+
+    def update_drone(self, drone_id: int, **kwargs):
+        """Метод для изменения данных в БД."""
+        query = self.__template("UPDATE", "tbl_drones", tuple(kwargs), "id=?")
+        self.__execute(query, [*kwargs.values(), drone_id])
+        self.bump_fleet_version()
+
+    def update_drone_status_mgn(self, drone_id: int, status: str):
+        """Метод для изменения статуса управления дроном (lock или release)"""
+        query = self.__template("UPDATE", "tbl_drones_mgn", Drone.tbl_status_mgn, "id=?")
+        self.__execute(query, (drone_id, status, drone_id), commit=True)
+
+    def create_lock_columns(self):
+        """Метод для добавления в tbl_drones_mgn колонок владельца и срока аренды управления."""
+        cursor = self.conn.cursor()
+        cursor.execute("ALTER TABLE tbl_drones_mgn ADD COLUMN IF NOT EXISTS owner TEXT")
+        cursor.execute("ALTER TABLE tbl_drones_mgn ADD COLUMN IF NOT EXISTS lease_until DOUBLE PRECISION")
+        self.conn.commit()
+        self.__column_types.clear()
+
+    def create_version_table(self):
+        """Метод для создания таблицы версии данных парка (см. SQLiteDroneMapper)."""
+        cursor = self.conn.cursor()
+        cursor.execute(self.tables[-1])
+        cursor.execute("INSERT INTO tbl_fleet_version (id, version, updated_at) VALUES (1, 0, %s) "
+                       "ON CONFLICT (id) DO NOTHING", (time.time(),))
+        self.conn.commit()
+
+    def get_fleet_version(self):
+        """Метод для чтения версии данных парка: (номер, время изменения)."""
+        row = self.__execute("SELECT version, updated_at FROM tbl_fleet_version WHERE id=1").fetchone()
+        self.conn.commit()
+        return (row[0], row[1]) if row else (0, 0.0)
+
+    def bump_fleet_version(self, commit: bool = True):
+        """Метод для увеличения версии данных парка (см. SQLiteDroneMapper): одиночные записи
+        в tbl_drones вызывают его последним запросом своей транзакции, пакетные - с commit=False."""
+        self.__execute("INSERT INTO tbl_fleet_version (id, version, updated_at) VALUES (1, 1, %s) "
+                       "ON CONFLICT (id) DO UPDATE SET version=tbl_fleet_version.version+1, "
+                       "updated_at=excluded.updated_at", (time.time(),), commit=commit)
+
+    def acquire_drone_lock(self, drone_id: int, owner: str, lease_until: float, now: float):
+        """Атомарный захват управления дроном (compare-and-set, см. SQLiteDroneMapper).
+
+        При параллельных захватах UPDATE перепроверяет условие на актуальной версии
+        строки, поэтому управление получает только один оператор.
+        """
+        with _PostgreSQLTransaction(self.conn):
+            cursor = self.conn.cursor()
+            cursor.execute("INSERT INTO tbl_drones_mgn (id, status_mgn) "
+                           "SELECT id, 'release' FROM tbl_drones WHERE id=%s ON CONFLICT (id) DO NOTHING",
+                           (drone_id,))
+            cursor.execute("UPDATE tbl_drones_mgn SET status_mgn='lock', owner=%s, lease_until=%s "
+                           "WHERE id=%s AND (status_mgn IS DISTINCT FROM 'lock' OR lease_until IS NULL "
+                           "OR lease_until<%s OR owner=%s)",
+                           (owner, lease_until, drone_id, now, owner))
+            return cursor.rowcount == 1
+
+    def renew_drone_lock(self, drone_id: int, owner: str, lease_until: float):
+        """Продление аренды управления владельцем. Возвращает False, если аренда потеряна."""
+        cursor = self.__execute("UPDATE tbl_drones_mgn SET lease_until=%s "
+                                "WHERE id=%s AND status_mgn='lock' AND owner=%s",
+                                (lease_until, drone_id, owner), commit=True)
+        return cursor.rowcount == 1
+
+    def release_drone_lock(self, drone_id: int, owner: str):
+        """Освобождение управления его владельцем. Возвращает True, если дрон освобожден."""
+        cursor = self.__execute("UPDATE tbl_drones_mgn SET status_mgn='release', owner=NULL, lease_until=NULL "
+                                "WHERE id=%s AND status_mgn='lock' AND owner=%s",
+                                (drone_id, owner), commit=True)
+        return cursor.rowcount == 1
+
+    def release_expired_locks(self, now: float):
+        """Освобождение всех дронов с истекшей арендой одним запросом. Возвращает список их id."""
+        cursor = self.__execute("UPDATE tbl_drones_mgn SET status_mgn='release', owner=NULL, lease_until=NULL "
+                                "WHERE status_mgn='lock' AND lease_until<%s RETURNING id", (now,))
+        drone_ids = [row[0] for row in cursor.fetchall()]
+        self.conn.commit()
+        return drone_ids
+
+    def remove_drone(self, drone_id: int):
+        """Метод для удаления данных из БД."""
+        self.__execute(self.__template("DELETE", "tbl_drones", where="id=?"), (drone_id,))
+        self.bump_fleet_version()
+
+    def get_drones(self, order_by: str):
+        """Метод для извлечения данных всех дронов из БД."""
+        query = self.__template("SELECT", "tbl_drones", Drone.tbl_drones_cols, order_by=order_by)
+        return self.__execute(query).fetchall()
+
+    def iter_drones(self, order_by: str, row_factory=None, arraysize: int = 500, filters: dict = None):
+        """Метод для потокового чтения всех дронов серверным курсором порциями по arraysize строк.
+
+        Курсор живет в транзакции соединения; она откатывается при возврате соединения в пул.
+        """
+        query, params = _select_drones_query(order_by, filters, self.paramstyle)
+        cursor = self.conn.cursor(name=f"iter_drones_{next(self.__cursor_numbers)}")
+        cursor.itersize = arraysize
+        cursor.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(arraysize)
+                if not rows:
+                    return
+                if row_factory is None:
+                    yield from rows
+                else:
+                    for row in rows:
+                        yield row_factory(cursor, row)
+        finally:
+            cursor.close()
+
+    def get_drones_page(self, filters: dict, sort: str = "id", descending: bool = False,
+                        limit: int = 50, after=None):
+        """Метод для извлечения одной страницы дронов из БД (см. SQLiteDroneMapper.get_drones_page)."""
+        if sort not in self.sortable_cols:
+            raise ValueError(f"Недопустимая колонка сортировки: {sort}")
+        direction = "DESC" if descending else "ASC"
+        nulls = "NULLS LAST" if descending else "NULLS FIRST"
+        order_by = f"id {direction}" if sort == "id" else f"{sort} {direction} {nulls}, id {direction}"
+        query_builder = QueryBuilder(self.paramstyle)
+        query_builder.select("tbl_drones", order_by, ",".join(Drone.tbl_drones_cols))
+        _apply_drone_filters(query_builder, filters)
+        if after is not None:
+            _apply_drone_keyset(query_builder, sort, descending, *after)
+        query = query_builder.limit(limit + 1).build()
+        return self.__execute(query, query_builder.get_params()).fetchall()
+
+    def add_drones(self, drones, prepare=None):
+        """Метод для пакетного добавления дронов через COPY в одной транзакции.
+
+        Дронам без id назначаются значения из последовательности таблицы одним
+        запросом на порцию. Если COPY порции не прошел, порция записывается
+        построчно, чтобы собрать ошибки по каждой строке.
+        """
+        result = BatchResult()
+        copy_query = f"COPY tbl_drones ({','.join(Drone.tbl_drones_cols)}) FROM STDIN WITH (FORMAT csv)"
+        with _PostgreSQLTransaction(self.conn):
+            cursor = self.conn.cursor()
+            max_id = 0
+            for chunk in _iter_chunks(enumerate(drones), self.batch_chunk_size):
+                rows = []
+                for index, drone in chunk:
+                    if prepare is not None:
+                        try:
+                            prepare(drone)
+                        except ValueError as error:
+                            result.add_error(index, error)
+                            continue
+                    rows.append((index, [getattr(drone, col) for col in Drone.tbl_drones_cols], drone))
+                if not rows:
+                    continue
+                self.__assign_ids(cursor, [drone for _, _, drone in rows if drone.id is None], rows)
+                max_id = max(max_id, *(int(drone.id) for _, _, drone in rows))
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(params for _, params, _ in rows)
+                buffer.seek(0)
+                cursor.execute("SAVEPOINT batch_chunk")
+                try:
+                    cursor.copy_expert(copy_query, buffer)
+                    result.succeeded += len(rows)
+                    result.affected += len(rows)
+                except psycopg2.Error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT batch_chunk")
+                    self.__execute_rows(cursor, self.__template("INSERT", "tbl_drones", Drone.tbl_drones_cols),
+                                        rows, result)
+                cursor.execute("RELEASE SAVEPOINT batch_chunk")
+            if max_id:
+                # Явно заданные id не должны совпасть с будущими значениями последовательности
+                cursor.execute("SELECT setval(pg_get_serial_sequence('tbl_drones', 'id'), "
+                               "GREATEST(%s, nextval(pg_get_serial_sequence('tbl_drones', 'id'))))", (max_id,))
+            self.bump_fleet_version(commit=False)
+        return result
+
+    def update_drones(self, updates: dict, prepare=None):
+        """Метод для пакетного изменения дронов: {drone_id: {колонка: значение}}.
+
+        prepare(values) - проверка значений строки, ValueError учитывается как ошибка строки.
+        """
+        result = BatchResult()
+        with _PostgreSQLTransaction(self.conn):
+            cursor = self.conn.cursor()
+            groups = {}
+            for drone_id, values in updates.items():
+                if prepare is not None:
+                    try:
+                        values = prepare(values)
+                    except ValueError as error:
+                        result.add_error(drone_id, error)
+                        continue
+                groups.setdefault(tuple(sorted(values)), []).append((drone_id, values))
+            for columns, items in groups.items():
+                query = self.__template("UPDATE", "tbl_drones", columns, "id=?")
+                for chunk in _iter_chunks(items, self.batch_chunk_size):
+                    rows = [(drone_id, [values[col] for col in columns] + [drone_id], None)
+                            for drone_id, values in chunk]
+                    cursor.execute("SAVEPOINT batch_chunk")
+                    try:
+                        cursor.executemany(query, [params for _, params, _ in rows])
+                        result.succeeded += len(rows)
+                        result.affected += cursor.rowcount
+                    except psycopg2.Error:
+                        cursor.execute("ROLLBACK TO SAVEPOINT batch_chunk")
+                        self.__execute_rows(cursor, query, rows, result)
+                    cursor.execute("RELEASE SAVEPOINT batch_chunk")
+            self.bump_fleet_version(commit=False)
+        return result
+
+    def remove_drones(self, drone_ids):
+        """Метод для пакетного удаления дронов: один DELETE на порцию id."""
+        result = BatchResult()
+        with _PostgreSQLTransaction(self.conn):
+            cursor = self.conn.cursor()
+            for chunk in _iter_chunks(drone_ids, self.batch_chunk_size):
+                cursor.execute("DELETE FROM tbl_drones WHERE id = ANY(%s)", (list(chunk),))
+                result.succeeded += len(chunk)
+                result.affected += cursor.rowcount
+            self.bump_fleet_version(commit=False)
+        return result
+
+    @staticmethod
+    def __assign_ids(cursor, new_drones: list, rows: list):
+        if not new_drones:
+            return
+        cursor.execute("SELECT nextval(pg_get_serial_sequence('tbl_drones', 'id')) "
+                       "FROM generate_series(1, %s)", (len(new_drones),))
+        for drone, (drone_id,) in zip(new_drones, cursor.fetchall()):
+            drone.id = drone_id
+        id_index = Drone.tbl_drones_cols.index("id")
+        for _, params, drone in rows:
+            params[id_index] = drone.id
+
+    @staticmethod
+    def __execute_rows(cursor, query: str, rows: list, result: BatchResult):
+        """Построчное выполнение с точкой сохранения на строку: в PostgreSQL ошибка
+        прерывает транзакцию, поэтому каждую неудачную строку нужно откатить отдельно."""
+        for key, params, drone in rows:
+            cursor.execute("SAVEPOINT batch_row")
+            try:
+                cursor.execute(query, params)
+                result.succeeded += 1
+                result.affected += cursor.rowcount
+                cursor.execute("RELEASE SAVEPOINT batch_row")
+            except psycopg2.Error as error:
+                cursor.execute("ROLLBACK TO SAVEPOINT batch_row")
+                logger.error("Ошибка пакетной операции в строке %s: %s", key, error)
+                result.add_error(key, error)
+                if drone is not None:
+                    drone.id = None
+
+
+class SQLiteTelemetryMapper:
+    """Преобразователь данных телеметрии (временные ряды) для БД SQLite"""
+    # Поля образца телеметрии в порядке колонок таблицы
+    sample_fields = ("current_latitude", "current_longitude", "speed", "direction",
+                     "altitude", "flight_time", "battery_level")
+    # Усредняемые в агрегатах поля
+    rollup_fields = ("current_latitude", "current_longitude", "speed", "altitude", "battery_level")
+    # Разрешения агрегатов, секунды
+    resolutions = (1, 60)
+    tables = (
+        """CREATE TABLE IF NOT EXISTS tbl_telemetry (
+            drone_id INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            current_latitude REAL,
+            current_longitude REAL,
+            speed REAL,
+            direction INTEGER,
+            altitude REAL,
+            flight_time REAL,
+            battery_level REAL,
+            PRIMARY KEY (drone_id, timestamp)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS tbl_telemetry_rollup (
+            drone_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            sum_current_latitude REAL,
+            sum_current_longitude REAL,
+            sum_speed REAL,
+            sum_altitude REAL,
+            sum_battery_level REAL,
+            PRIMARY KEY (drone_id, resolution, bucket)
+        ) WITHOUT ROWID""",
+    )
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def create_tables(self):
+        """Метод для создания таблиц телеметрии (повторный вызов безопасен)."""
+        cursor = self.conn.cursor()
+        for table in self.tables:
+            cursor.execute(table)
+        self.conn.commit()
+
+    def add_samples(self, samples):
+        """Метод для записи пачки образцов (drone_id, timestamp, values) одной транзакцией
+        вместе с обновлением агрегатов 1 с и 1 мин."""
+        return self.add_sample_rows([(drone_id, timestamp) + tuple(values[field] for field in self.sample_fields)
+                                     for drone_id, timestamp, values in samples])
+
+    def add_sample_rows(self, rows):
+        """Метод для записи пачки строк образцов (drone_id, timestamp, *sample_fields)
+        одной транзакцией вместе с обновлением агрегатов 1 с и 1 мин. Повторно
+        присланный образец (те же drone_id и timestamp) не перезаписывается и не
+        учитывается в агрегатах второй раз. Возвращает число записанных образцов."""
+        if not rows:
+            return 0
+        cols = ("drone_id", "timestamp") + self.sample_fields
+        insert = (QueryBuilder().insert_into("tbl_telemetry", cols).build()
+                  + " ON CONFLICT (drone_id, timestamp) DO NOTHING")
+        sums = ", ".join(f"sum_{field}" for field in self.rollup_fields)
+        upsert = (
+            f"INSERT INTO tbl_telemetry_rollup (drone_id, resolution, bucket, n, {sums}) "
+            f"VALUES ({', '.join(['?'] * (4 + len(self.rollup_fields)))}) "
+            f"ON CONFLICT (drone_id, resolution, bucket) DO UPDATE SET n = n + excluded.n, "
+            + ", ".join(f"sum_{field} = sum_{field} + excluded.sum_{field}" for field in self.rollup_fields)
+        )
+        with _SQLiteTransaction(self.conn):
+            cursor = self.conn.cursor()
+            cursor.execute("SAVEPOINT telemetry_batch")
+            cursor.executemany(insert, rows)
+            inserted = rows
+            if cursor.rowcount != len(rows):
+                # В пачке есть повторы: откат и построчная вставка, чтобы в агрегаты
+                # попали только действительно записанные строки
+                cursor.execute("ROLLBACK TO SAVEPOINT telemetry_batch")
+                inserted = []
+                for row in rows:
+                    cursor.execute(insert, row)
+                    if cursor.rowcount > 0:
+                        inserted.append(row)
+            cursor.execute("RELEASE SAVEPOINT telemetry_batch")
+            cursor.executemany(upsert, self.__rollups(inserted))
+        return len(inserted)
+
+    def __rollups(self, rows):
+        """Предварительная агрегация строк в памяти: одна строка upsert на корзину."""
+        # Позиции усредняемых полей в строке образца
+        positions = [2 + self.sample_fields.index(field) for field in self.rollup_fields]
+        rollups = {}
+        for row in rows:
+            drone_id, timestamp = row[0], row[1]
+            for resolution in self.resolutions:
+                key = (drone_id, resolution, int(timestamp // resolution) * resolution)
+                bucket = rollups.get(key)
+                if bucket is None:
+                    bucket = rollups[key] = [0] + [0.0] * len(self.rollup_fields)
+                bucket[0] += 1
+                for i, position in enumerate(positions, 1):
+                    bucket[i] += row[position]
+        return [key + tuple(bucket) for key, bucket in rollups.items()]
+
+    def iter_samples(self, drone_id: int, since: float, until: float, arraysize: int = 500):
+        """Метод для потокового чтения образцов за интервал времени (без fetchall)."""
+        query_builder = QueryBuilder()
+        query = query_builder.select("tbl_telemetry", "timestamp", ",".join(("timestamp",) + self.sample_fields)).where(
+                                     "drone_id=?", (drone_id,)).where(
+                                     "timestamp>=? AND timestamp<=?", (since, until)).build()
+        yield from self.__iter_cursor(query, query_builder.get_params(), arraysize)
+
+    def iter_rollups(self, drone_id: int, resolution: int, since: float, until: float,
+                     arraysize: int = 500):
+        """Метод для потокового чтения средних значений по корзинам resolution секунд."""
+        if resolution not in self.resolutions:
+            raise ValueError(f"Недопустимое разрешение агрегатов: {resolution}")
+        averages = ", ".join(f"sum_{field} / n" for field in self.rollup_fields)
+        query_builder = QueryBuilder()
+        query = query_builder.select("tbl_telemetry_rollup", "bucket", f"bucket, n, {averages}").where(
+                                     "drone_id=? AND resolution=?", (drone_id, resolution)).where(
+                                     "bucket>=? AND bucket<=?", (int(since // resolution) * resolution, until)).build()
+        yield from self.__iter_cursor(query, query_builder.get_params(), arraysize)
+
+    def __iter_cursor(self, query: str, params: list, arraysize: int):
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(arraysize)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Истекло время ожидания свободного соединения в пуле."""
+
+
+class SQLiteConnectionPool:
+    """Пул долгоживущих соединений с БД SQLite.
+
+    Соединения создаются лениво (не больше size штук), PRAGMA применяются один раз
+    при создании соединения. Соединение можно передавать между потоками Flask и
+    asyncio.to_thread, пул гарантирует, что одновременно им пользуется один владелец.
+    """
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA cache_size=-8000",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    # Размер кэша подготовленных выражений sqlite3 на соединение: шаблоны QueryBuilder
+    # плюс варианты фильтров списка дронов с запасом
+    cached_statements = 512
+
+    def __init__(self, path_to_db: str, size: int = 5, timeout: float = 5.0,
+                 health_check_interval: float = 30.0):
+        if size < 1:
+            raise ValueError("Размер пула должен быть больше 0")
+        self.__path_to_db = path_to_db
+        self.__size = size
+        self.__timeout = timeout
+        self.__health_check_interval = health_check_interval
+        # LIFO: первым выдается самое "горячее" соединение
+        self.__idle = queue.LifoQueue()
+        self.__last_used = {}
+        self.__owned = set()
+        self.__created = 0
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.__metrics = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+    def __create_connection(self):
+        """Создание нового соединения и однократная настройка PRAGMA."""
+        conn = sqlite3.connect(self.__path_to_db, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        self.__owned.add(id(conn))
+        logger.info("Создано новое соединение пула с БД %s", self.__path_to_db)
+        return conn
+
+    def __is_alive(self, conn):
+        """Проверка работоспособности соединения, простаивавшего дольше интервала."""
+        last_used = self.__last_used.get(id(conn), 0.0)
+        if time.monotonic() - last_used < self.__health_check_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning("Соединение пула не прошло проверку: %s", e)
+            return False
+
+    def __discard(self, conn):
+        """Удаление неисправного соединения из пула."""
+        self.__last_used.pop(id(conn), None)
+        self.__owned.discard(id(conn))
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self.__lock:
+            self.__created -= 1
+            self.__metrics["discarded"] += 1
+
+    def acquire(self):
+        """Получение соединения из пула."""
+        if self.__closed:
+            raise sqlite3.ProgrammingError("Пул соединений закрыт")
+        while True:
+            try:
+                conn = self.__idle.get_nowait()
+                hit = True
+            except queue.Empty:
+                conn = None
+                hit = False
+            if conn is None:
+                with self.__lock:
+                    can_create = self.__created < self.__size
+                    if can_create:
+                        self.__created += 1
+                if can_create:
+                    try:
+                        conn = self.__create_connection()
+                    except sqlite3.Error:
+                        with self.__lock:
+                            self.__created -= 1
+                        raise
+                    with self.__lock:
+                        self.__metrics["misses"] += 1
+                    return conn
+                start = time.perf_counter()
+                try:
+                    conn = self.__idle.get(timeout=self.__timeout)
+                except queue.Empty:
+                    with self.__lock:
+                        self.__metrics["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений в пуле за {self.__timeout} с")
+                with self.__lock:
+                    self.__metrics["waits"] += 1
+                    self.__metrics["wait_time"] += time.perf_counter() - start
+            if self.__is_alive(conn):
+                if hit:
+                    with self.__lock:
+                        self.__metrics["hits"] += 1
+                return conn
+            self.__discard(conn)
+
+    def owns(self, conn):
+        """Проверка, что соединение было создано этим пулом."""
+        return id(conn) in self.__owned
+
+    def release(self, conn):
+        """Возврат соединения в пул. Незавершенная транзакция откатывается."""
+        if self.__closed:
+            self.__discard(conn)
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning("Не удалось откатить транзакцию соединения пула: %s", e)
+            self.__discard(conn)
+            return
+        self.__last_used[id(conn)] = time.monotonic()
+        self.__idle.put(conn)
+
+    def close(self):
+        """Закрытие всех свободных соединений пула."""
+        self.__closed = True
+        while True:
+            try:
+                conn = self.__idle.get_nowait()
+            except queue.Empty:
+                break
+            self.__last_used.pop(id(conn), None)
+            self.__owned.discard(id(conn))
+            conn.close()
+            with self.__lock:
+                self.__created -= 1
+
+    def get_metrics(self):
+        """Метрики пула: попадания, промахи, ожидания и текущая заполненность."""
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["size"] = self.__size
+            metrics["created"] = self.__created
+        metrics["idle"] = self.__idle.qsize()
+        metrics["in_use"] = metrics["created"] - metrics["idle"]
+        return metrics
+
+
+class PostgreSQLConnectionPool:
+    """Пул соединений с БД PostgreSQL поверх psycopg2.pool.ThreadedConnectionPool.
+
+    ThreadedConnectionPool при исчерпании сразу бросает PoolError, поэтому число
+    выданных соединений ограничивается семафором: acquire() ждет свободное
+    соединение до timeout секунд, как SQLiteConnectionPool. Даты читаются
+    строками ISO, как из SQLite.
+    """
+    def __init__(self, dsn: str, size: int = 5, timeout: float = 5.0):
+        if psycopg2 is None:
+            raise RuntimeError("Для работы с PostgreSQL нужен пакет psycopg2")
+        if size < 1:
+            raise ValueError("Размер пула должен быть больше 0")
+        self.__size = size
+        self.__timeout = timeout
+        self.__pool = psycopg2.pool.ThreadedConnectionPool(0, size, dsn)
+        self.__slots = threading.BoundedSemaphore(size)
+        self.__owned = set()
+        self.__lock = threading.Lock()
+        self.__metrics = {"acquired": 0, "waits": 0, "wait_time": 0.0, "timeouts": 0, "discarded": 0}
+
+    def acquire(self):
+        """Получение соединения; PoolTimeoutError, если за timeout секунд свободного не нашлось."""
+        started = time.monotonic()
+        if not self.__slots.acquire(blocking=False):
+            with self.__lock:
+                self.__metrics["waits"] += 1
+            if not self.__slots.acquire(timeout=self.__timeout):
+                with self.__lock:
+                    self.__metrics["timeouts"] += 1
+                raise PoolTimeoutError(f"Нет свободного соединения в пуле за {self.__timeout} с")
+        try:
+            conn = self.__pool.getconn()
+            if conn.closed:
+                self.__pool.putconn(conn, close=True)
+                conn = self.__pool.getconn()
+            psycopg2.extensions.register_type(_PG_DATE_AS_TEXT, conn)
+        except Exception:
+            self.__slots.release()
+            raise
+        with self.__lock:
+            self.__owned.add(id(conn))
+            self.__metrics["acquired"] += 1
+            self.__metrics["wait_time"] += time.monotonic() - started
+        return conn
+
+    def owns(self, conn):
+        with self.__lock:
+            return id(conn) in self.__owned
+
+    def release(self, conn):
+        """Возврат соединения в пул: незавершенная транзакция откатывается,
+        сломанное соединение закрывается."""
+        with self.__lock:
+            if id(conn) not in self.__owned:
+                return
+            self.__owned.discard(id(conn))
+        broken = bool(conn.closed)
+        try:
+            if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error as e:
+            logger.warning("Соединение с PostgreSQL закрыто как неисправное: %s", e)
+            broken = True
+        if broken:
+            with self.__lock:
+                self.__metrics["discarded"] += 1
+        try:
+            self.__pool.putconn(conn, close=broken)
+        finally:
+            self.__slots.release()
+
+    def close(self):
+        self.__pool.closeall()
+
+    def get_metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["in_use"] = len(self.__owned)
+        metrics["size"] = self.__size
+        return metrics
+
 
 class DBFactory(ABC):
     """Интерфейс фабрики для работы с базами данных."""
@@ -182,34 +1376,168 @@ class DBFactory(ABC):
     def connect(self, path_to_db: str):
         pass
 
+    def release(self, conn):
+        """Освобождение соединения, полученного через connect."""
+        conn.close()
+
+    @abstractmethod
+    def create_drone_repository(self, conn):
+        """Репозиторий дронов для соединения этой фабрики."""
+        pass
+
 
 class SQLiteDBFactory(DBFactory):
-    """Реализация фабрики для подключения к SQLite"""
+    """Реализация фабрики для подключения к SQLite через пул соединений.
+    mapper_class - преобразователь репозиториев дронов фабрики (по умолчанию
+    SQLiteDroneMapper), например подкласс с замером времени запросов."""
+    def __init__(self, pool_size: int = 5, timeout: float = 5.0,
+                 health_check_interval: float = 30.0, mapper_class=None):
+        self.__mapper_class = mapper_class
+        self.__pool_size = pool_size
+        self.__timeout = timeout
+        self.__health_check_interval = health_check_interval
+        self.__pools = {}
+        self.__lock = threading.Lock()
+
+    def get_pool(self, path_to_db: str):
+        """Пул соединений для указанной БД (создается при первом обращении)."""
+        pool = self.__pools.get(path_to_db)
+        if pool is None:
+            with self.__lock:
+                pool = self.__pools.get(path_to_db)
+                if pool is None:
+                    pool = SQLiteConnectionPool(path_to_db, self.__pool_size, self.__timeout,
+                                                self.__health_check_interval)
+                    self.__pools[path_to_db] = pool
+        return pool
+
     def connect(self, path_to_db: str):
-        logging.info('Работаем с БД SQLite')
+        """Соединение из пула. PoolTimeoutError - свободного соединения нет за timeout секунд,
+        sqlite3.Error - БД не открывается; вместо None вызывающий получает исключение."""
         try:
-            # Подключение к базе данных
-            conn = sqlite3.connect(path_to_db, check_same_thread=False)
-            logging.info(f"Подключение к БД установлено")
-            return conn
+            # Получение соединения из пула
+            return self.get_pool(path_to_db).acquire()
         except sqlite3.Error as e:
             # Обработка ошибки подключения
-            logging.warning(f"Ошибка подключения: {e}")
-            return None
+            logger.warning("Ошибка подключения: %s", e)
+            raise
+
+    def release(self, conn):
+        for pool in self.__pools.values():
+            if pool.owns(conn):
+                pool.release(conn)
+                return
+        conn.close()
+
+    def create_drone_repository(self, conn):
+        return SQLiteIDroneRepository(conn, self.__mapper_class)
+
+    def get_pool_metrics(self):
+        """Метрики всех пулов фабрики по путям к БД."""
+        return {path: pool.get_metrics() for path, pool in self.__pools.items()}
+
+    def close(self):
+        """Закрытие всех пулов фабрики."""
+        with self.__lock:
+            for pool in self.__pools.values():
+                pool.close()
+            self.__pools.clear()
 
 
 class PostgreSQLDBFactory(DBFactory):
-    """Реализация фабрики для подключения к PostgreSQL"""
+    """Реализация фабрики для подключения к PostgreSQL через пул соединений.
+    Вместо пути к файлу БД передается строка подключения (DSN), mapper_class -
+    как у SQLiteDBFactory (по умолчанию PostgreSQLDroneMapper)."""
+    def __init__(self, pool_size: int = 5, timeout: float = 5.0, mapper_class=None):
+        if psycopg2 is None:
+            raise RuntimeError("Для работы с PostgreSQL нужен пакет psycopg2")
+        self.__mapper_class = mapper_class
+        self.__pool_size = pool_size
+        self.__timeout = timeout
+        self.__pools = {}
+        self.__lock = threading.Lock()
+
+    def get_pool(self, dsn: str):
+        """Пул соединений для указанной БД (создается при первом обращении)."""
+        pool = self.__pools.get(dsn)
+        if pool is None:
+            with self.__lock:
+                pool = self.__pools.get(dsn)
+                if pool is None:
+                    logger.info('Работаем с БД PostgreSQL')
+                    pool = PostgreSQLConnectionPool(dsn, self.__pool_size, self.__timeout)
+                    self.__pools[dsn] = pool
+        return pool
+
     def connect(self, path_to_db: str):
-        logging.info('Работаем с БД PostgreSQL')
-        logging.info(f"Подключение к БД установлено")
-        return True
+        try:
+            return self.get_pool(path_to_db).acquire()
+        except (psycopg2.OperationalError, PoolTimeoutError) as e:
+            logger.warning("Ошибка подключения: %s", e)
+            raise
+
+    def release(self, conn):
+        for pool in self.__pools.values():
+            if pool.owns(conn):
+                pool.release(conn)
+                return
+        conn.close()
+
+    def create_drone_repository(self, conn):
+        return PostgreSQLIDroneRepository(conn, self.__mapper_class)
+
+    def get_pool_metrics(self):
+        """Метрики всех пулов фабрики по строкам подключения."""
+        return {dsn: pool.get_metrics() for dsn, pool in self.__pools.items()}
+
+    def close(self):
+        """Закрытие всех пулов фабрики."""
+        with self.__lock:
+            for pool in self.__pools.values():
+                pool.close()
+            self.__pools.clear()
+
+
+def coerce_value(value, declared_type: str):
+    """Приведение значения к объявленному типу колонки по правилам родства типов SQLite.
+
+    Пустая строка означает NULL. Значение, которое нельзя привести, - ValueError.
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        if isinstance(value, bool):
+            raise ValueError(f"Ожидалось целое число, получено: {value!r}")
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            try:
+                return int(value.strip())
+            except ValueError:
+                pass
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(f"Ожидалось целое число, получено: {value!r}")
+        return int(number)
+    if any(name in declared_type for name in ("CHAR", "CLOB", "TEXT")):
+        return str(value)
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return float(value)
+    if "DATE" in declared_type:
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return datetime.date.fromisoformat(str(value).strip()).isoformat()
+    return value
 
 
 class IDroneRepository(ABC):
     """Интерфейс доступа к данным БД"""
-    def __init__(self, conn):
-        self.mapper = SQLiteDroneMapper(conn)
+    # Мапер конкретной БД
+    mapper_class = SQLiteDroneMapper
+
+    def __init__(self, conn, mapper_class=None):
+        self.mapper = (mapper_class or self.mapper_class)(conn)
 
     @abstractmethod
     def add_drone(self, drone: Drone):
@@ -234,80 +1562,655 @@ class IDroneRepository(ABC):
 
 class SQLiteIDroneRepository(IDroneRepository):
     """Реализация доступа к данным БД."""
+    # Колонки, которые нельзя изменять через update_drone(s)
+    readonly_cols = ("id",)
+
+    def coerce_drone_values(self, values: dict, readonly=True):
+        """Проверка имен колонок по Drone.tbl_drones_cols и приведение значений
+        к типам, объявленным в схеме tbl_drones. Ошибка - ValueError."""
+        types = self.mapper.get_column_types("tbl_drones") or {}
+        result = {}
+        for col, value in values.items():
+            if col not in Drone.tbl_drones_cols or (readonly and col in self.readonly_cols):
+                raise ValueError(f"Недопустимая колонка: {col!r}")
+            try:
+                result[col] = coerce_value(value, types.get(col, ""))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Некорректное значение колонки {col}: {value!r}") from e
+        return result
+
+    def prepare_drone(self, drone: Drone):
+        """Приведение атрибутов дрона к типам колонок перед записью."""
+        values = self.coerce_drone_values(
+            {col: getattr(drone, col) for col in Drone.tbl_drones_cols if col != "id"})
+        for col, value in values.items():
+            setattr(drone, col, value)
+        return drone
+
+    @staticmethod
+    def check_order_by(order_by: str):
+        """Сортировка списка дронов допускается только по колонкам tbl_drones."""
+        for part in order_by.split(","):
+            words = part.split()
+            if (not 1 <= len(words) <= 2 or words[0] not in Drone.tbl_drones_cols
+                    or (len(words) == 2 and words[1].upper() not in ("ASC", "DESC"))):
+                raise ValueError(f"Недопустимая сортировка: {order_by!r}")
+        return order_by
 
     def get_drone_id(self):
         return self.mapper.get_new_drone_id()
 
+    def create_version_table(self):
+        """Подготовка счетчика версии данных парка."""
+        self.mapper.create_version_table()
+
+    def get_fleet_version(self):
+        """Версия данных парка: (номер, время изменения). Номер увеличивается в транзакции
+        каждой записи дронов (статусы управления не учитываются)."""
+        return self.mapper.get_fleet_version()
+
     def add_drone(self, drone: Drone):
         """Добавление дрона."""
-        self.mapper.add_drone(drone)
+        self.mapper.add_drone(self.prepare_drone(drone))
 
     def remove_drone(self, drone_id: int):
         """Удаление дрона."""
-        logging.info(f'Удаляем дрон с ID: {drone_id}.')
+        logger.info('Удаляем дрон с ID: %s.', drone_id)
         self.mapper.remove_drone(drone_id)
 
     def get_drone(self, drone_id: int):
         """Извлечение данных дрона."""
         drone_values = self.mapper.get_drone(drone_id)
         if drone_values:
-            drone_dict = dict(zip(Drone.tbl_drones_cols, drone_values))
-            return Drone(**drone_dict)
-        logging.warning(f'В таблице tbl_drones нет дрона с id = {drone_id}')
+            return Drone.from_row(None, drone_values)
+        logger.warning('В таблице tbl_drones нет дрона с id = %s', drone_id)
         return None
 
     def get_drone_status_mgn(self, drone_id: int):
-        """Извлечение статуса управления дроном (lock или release)"""
-        value = self.mapper.get_drone_status_mgn(drone_id)
-        if value:
-            return value
-        logging.warning(f'В таблице tbl_drones_mgn нет данных о статусе управления дроном c id = {drone_id}')
+        """Извлечение статуса управления дроном (lock или release) с тем же правилом,
+        что и get_drones_status_mgn: дрон без строки статуса свободен, None - дрона нет."""
+        return self.get_drones_status_mgn([drone_id]).get(drone_id)
+
+    def get_drones_status_mgn(self, drone_ids=None):
+        """Извлечение статусов управления многих (или всех) дронов одним запросом.
+        Дрон без строки статуса считается свободным (release), как при захвате."""
+        return {drone_id: status or "release"
+                for drone_id, status in self.mapper.get_drones_status_mgn(drone_ids).items()}
 
     def get_drones(self, order_by: str):
-        """Извлечение данных всех дронов."""
-        drones = []
-        list_drones_values = self.mapper.get_drones(order_by)
-        for drone_values in list_drones_values:
-            drone_dict = dict(zip(Drone.tbl_drones_cols, drone_values))
-            drone_dict_del_id = drone_dict.copy()
-            drone_dict_del_id.pop('id')
-            drones.append(Drone(**drone_dict_del_id))
+        """Извлечение данных всех дронов (без id)."""
+        drones = self.get_drones_with_id(order_by)
+        for drone in drones:
+            drone.id = None
         return drones
 
     def get_drones_with_id(self, order_by: str):
         """Извлечение данных всех дронов."""
-        drones = []
-        list_drones_values = self.mapper.get_drones(order_by)
-        for drone_values in list_drones_values:
-            drone_dict = dict(zip(Drone.tbl_drones_cols, drone_values))
-            drones.append(Drone(**drone_dict))
-        return drones
+        return list(self.iter_drones(order_by))
+
+    def iter_drones(self, order_by: str = "id", arraysize: int = 500, filters: dict = None):
+        """Потоковое извлечение всех дронов (с фильтрами списка filters): строки читаются
+        с курсора порциями, полный список не строится. Итерацию нужно завершить,
+        пока открыто соединение."""
+        return self.mapper.iter_drones(self.check_order_by(order_by), Drone.from_row, arraysize, filters)
+
+    def get_drones_page(self, filters: dict = None, sort: str = "id", descending: bool = False,
+                        limit: int = 50, cursor: str = None):
+        """Извлечение страницы дронов с фильтрами, сортировкой и keyset-курсором.
+
+        Возвращает кортеж (список дронов, курсор следующей страницы или None).
+        """
+        after = self.decode_cursor(cursor) if cursor else None
+        rows = self.mapper.get_drones_page(filters or {}, sort, descending, limit, after)
+        drones = [Drone.from_row(None, row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = drones[-1]
+            next_cursor = self.encode_cursor(getattr(last, sort), last.id)
+        return drones, next_cursor
+
+    def add_drones(self, drones):
+        """Пакетное добавление дронов."""
+        result = self.mapper.add_drones(drones, prepare=self.prepare_drone)
+        logger.info("Пакетно добавлено дронов: %s, ошибок: %s", result.succeeded, result.error_count)
+        return result
+
+    def update_drones(self, updates: dict):
+        """Пакетное изменение данных дронов."""
+        result = self.mapper.update_drones(updates, prepare=self.coerce_drone_values)
+        logger.info("Пакетно обновлено дронов: %s, ошибок: %s", result.affected, result.error_count)
+        return result
+
+    def remove_drones(self, drone_ids):
+        """Пакетное удаление дронов."""
+        result = self.mapper.remove_drones(drone_ids)
+        logger.info("Пакетно удалено дронов: %s, ошибок: %s", result.affected, result.error_count)
+        return result
+
+    def create_lock_columns(self):
+        """Подготовка таблицы tbl_drones_mgn к арендам управления."""
+        self.mapper.create_lock_columns()
+
+    def acquire_drone_lock(self, drone_id: int, owner: str, lease_until: float, now: float):
+        """Атомарный захват управления дроном."""
+        acquired = self.mapper.acquire_drone_lock(drone_id, owner, lease_until, now)
+        logger.info("Захват управления дроном ID = %s оператором %s: %s", drone_id, owner, acquired)
+        return acquired
+
+    def renew_drone_lock(self, drone_id: int, owner: str, lease_until: float):
+        """Продление аренды управления дроном."""
+        return self.mapper.renew_drone_lock(drone_id, owner, lease_until)
+
+    def release_drone_lock(self, drone_id: int, owner: str):
+        """Освобождение управления дроном владельцем."""
+        released = self.mapper.release_drone_lock(drone_id, owner)
+        logger.info("Освобождение управления дроном ID = %s оператором %s: %s", drone_id, owner, released)
+        return released
+
+    def release_expired_locks(self, now: float):
+        """Освобождение дронов с истекшей арендой управления."""
+        drone_ids = self.mapper.release_expired_locks(now)
+        if drone_ids:
+            logger.warning("Истекла аренда управления дронами: %s", drone_ids)
+        return drone_ids
+
+    def create_indexes(self):
+        """Создание индексов таблицы дронов."""
+        self.mapper.create_indexes()
+
+    @staticmethod
+    def encode_cursor(last_value, last_id: int):
+        """Кодирование позиции последней строки страницы в непрозрачный курсор."""
+        raw = json.dumps([last_value, last_id], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """Декодирование курсора страницы в пару (значение сортировки, id)."""
+        try:
+            last_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return last_value, int(last_id)
+        except (ValueError, TypeError) as e:
+            # Не JSON, не пара или id не число (в том числе null)
+            raise ValueError(f"Некорректный курсор страницы: {cursor}") from e
 
     def update_drone(self, drone_id: int, **kwargs):
         """Изменение данных дрона"""
-        logging.info(f"Обновляем данные дрона c ID = {drone_id}")
-        self.mapper.update_drone(drone_id, **kwargs)
+        values = self.coerce_drone_values(kwargs)
+        logger.info("Обновляем данные дрона c ID = %s", drone_id)
+        self.mapper.update_drone(drone_id, **values)
 
     def update_drone_status_mgn(self, drone_id: int, status: str):
         """Изменение данных состояния упарвления дроном (lock или release)"""
-        logging.info(f"Обновляем состояние управления дрона c ID = {drone_id}")
+        logger.info("Обновляем состояние управления дрона c ID = %s", drone_id)
         self.mapper.update_drone_status_mgn(drone_id, status)
 
 
+class PostgreSQLIDroneRepository(SQLiteIDroneRepository):
+    """Реализация доступа к данным дронов в БД PostgreSQL: логика репозитория
+    общая с SQLite, отличается мапер."""
+    mapper_class = PostgreSQLDroneMapper
+
+    def create_tables(self):
+        """Создание таблиц дронов."""
+        self.mapper.create_tables()
+
+
+class SQLiteTelemetryRepository:
+    """Доступ к сохраненной телеметрии дронов."""
+    def __init__(self, conn):
+        self.mapper = SQLiteTelemetryMapper(conn)
+
+    def create_tables(self):
+        """Создание таблиц телеметрии."""
+        self.mapper.create_tables()
+
+    def add_samples(self, samples):
+        """Запись пачки образцов телеметрии."""
+        return self.mapper.add_samples(samples)
+
+    def add_sample_rows(self, rows):
+        """Запись пачки строк образцов телеметрии (drone_id, timestamp, *sample_fields)."""
+        return self.mapper.add_sample_rows(rows)
+
+    def get_samples(self, drone_id: int, since: float, until: float):
+        """Итератор образцов телеметрии дрона за интервал (словари)."""
+        cols = ("timestamp",) + SQLiteTelemetryMapper.sample_fields
+        for row in self.mapper.iter_samples(drone_id, since, until):
+            yield dict(zip(cols, row))
+
+    def get_rollups(self, drone_id: int, resolution: int, since: float, until: float):
+        """Итератор средних значений телеметрии дрона по корзинам 1 с или 60 с."""
+        cols = ("timestamp", "n") + SQLiteTelemetryMapper.rollup_fields
+        for row in self.mapper.iter_rollups(drone_id, resolution, since, until):
+            yield dict(zip(cols, row))
+
+
+class SQLiteSecretRepository:
+    """Доступ к ключам подписи токенов (tbl_secret).
+
+    Ключ без kid (старый формат таблицы) по-прежнему используется, его
+    идентификатор вычисляется из самого ключа.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def create_key_columns(self):
+        """Добавление колонок идентификатора ключа и времени его создания."""
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA table_info(tbl_secret)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "kid" not in columns:
+            cursor.execute("ALTER TABLE tbl_secret ADD COLUMN kid TEXT")
+        if "created" not in columns:
+            cursor.execute("ALTER TABLE tbl_secret ADD COLUMN created REAL")
+        self.conn.commit()
+
+    def get_keys(self):
+        """Список пар (ключ, kid): первым идет самый новый - текущий ключ подписи."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT key, kid FROM tbl_secret ORDER BY created IS NULL, created DESC, rowid DESC")
+        return cursor.fetchall()
+
+    def add_key(self, key: str, kid: str, keep: int = 2):
+        """Добавление нового текущего ключа; остаются keep самых новых ключей."""
+        with _SQLiteTransaction(self.conn):
+            cursor = self.conn.cursor()
+            cursor.execute("INSERT INTO tbl_secret (key, kid, created) VALUES (?, ?, ?)", (key, kid, time.time()))
+            cursor.execute("DELETE FROM tbl_secret WHERE rowid NOT IN (SELECT rowid FROM tbl_secret "
+                           "ORDER BY created IS NULL, created DESC, rowid DESC LIMIT ?)", (keep,))
+
+
+class SQLiteUserRepository:
+    """Доступ к учетным записям пользователей (tbl_users)."""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get_password_hash(self, login: str):
+        """Сохраненный хэш пароля пользователя или None, если пользователя нет."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT password FROM tbl_users WHERE login = ?", (login,))
+        row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def set_password_hash(self, login: str, password_hash: str):
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE tbl_users SET password = ? WHERE login = ?", (password_hash, login))
+        self.conn.commit()
+
+    def migrate_passwords(self, hash_password, is_hashed):
+        """Замена паролей, хранящихся открытым текстом, на хэши hash_password(password).
+        Возвращает число обновленных учетных записей."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT login, password FROM tbl_users")
+        updates = [(hash_password(password), login)
+                   for login, password in cursor.fetchall() if not is_hashed(password)]
+        if updates:
+            with _SQLiteTransaction(self.conn):
+                self.conn.executemany("UPDATE tbl_users SET password = ? WHERE login = ?", updates)
+        return len(updates)
+
+
+class SQLiteLoginAttemptRepository:
+    """Счетчики попыток входа (tbl_login_attempts), общие для процессов сервера.
+
+    Строка - корзина token bucket: число доступных попыток и время последнего
+    обновления (time.time(), одно для всех процессов). scope разделяет счетчики
+    разных ограничений (по логину, по адресу клиента) в одной таблице.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS tbl_login_attempts ("
+                       "scope TEXT NOT NULL, key TEXT NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                       "PRIMARY KEY (scope, key))")
+        self.conn.commit()
+
+    def acquire(self, scope: str, key: str, rate: float, burst: int, now: float):
+        """Попытка входа по ключу. Возвращает 0, если она разрешена, иначе через сколько
+        секунд повторить. Корзина читается и записывается в одной транзакции на запись
+        (BEGIN IMMEDIATE), поэтому одновременные попытки в разных процессах не теряются."""
+        with _SQLiteTransaction(self.conn):
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT tokens, updated FROM tbl_login_attempts WHERE scope=? AND key=?", (scope, key))
+            tokens, updated = cursor.fetchone() or (burst, now)
+            # Часы могли быть переведены назад: время без попыток не бывает отрицательным
+            tokens = min(burst, tokens + max(now - updated, 0.0) * rate)
+            if tokens >= 1:
+                retry_after = 0.0
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            cursor.execute("INSERT INTO tbl_login_attempts (scope, key, tokens, updated) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT (scope, key) DO UPDATE SET tokens=excluded.tokens, updated=excluded.updated",
+                           (scope, key, tokens, now))
+        return retry_after
+
+    def reset(self, scope: str, key: str):
+        """Сброс счетчика ключа (после успешного входа)."""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM tbl_login_attempts WHERE scope=? AND key=?", (scope, key))
+        self.conn.commit()
+
+    def remove_recovered(self, scope: str, rate: float, burst: int, now: float):
+        """Удаление счетчиков, восстановившихся до burst попыток (они не отличаются от
+        отсутствующих). Возвращает число удаленных строк."""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM tbl_login_attempts WHERE scope=? AND tokens + (? - updated) * ? >= ?",
+                       (scope, now, rate, burst))
+        self.conn.commit()
+        return cursor.rowcount
+
+
+class LRUTTLCache:
+    """Потокобезопасный кэш с вытеснением давно неиспользуемых записей (LRU)
+    и ограниченным временем жизни записи (TTL)."""
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0):
+        if max_size < 1:
+            raise ValueError("Размер кэша должен быть больше 0")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__data = OrderedDict()  # ключ -> (срок годности, значение)
+        self.__lock = threading.Lock()
+        # Поколение данных: ключи с номером поколения устаревают при его увеличении
+        self.generation = 0
+        self.__metrics = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        # Номер сброса: token() до чтения из БД, set(..., token=...) после - значение, прочитанное
+        # до сброса ключа, не записывается. Номера последних сбросов хранятся для max_size ключей,
+        # для вытесненных из этого списка считается номер __floor (сброшены не позже него)
+        self.__clock = 0
+        self.__invalidated = OrderedDict()  # ключ -> номер последнего сброса
+        self.__floor = 0
+        # Вызывается после сброса записей в этом процессе: on_change(список ключей, поколение увеличено)
+        # (через него кэши нескольких процессов сервера согласуются, см. message_queue.share_invalidations)
+        self.on_change = None
+
+    def get(self, key, default=None):
+        """Значение по ключу или default, если записи нет или она устарела."""
+        now = time.monotonic()
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None:
+                self.__metrics["misses"] += 1
+                return default
+            expires, value = item
+            if expires <= now:
+                del self.__data[key]
+                self.__metrics["expirations"] += 1
+                self.__metrics["misses"] += 1
+                return default
+            self.__data.move_to_end(key)
+            self.__metrics["hits"] += 1
+            return value
+
+    def token(self):
+        """Номер для set(): берется до чтения значения из источника."""
+        with self.__lock:
+            return self.__clock
+
+    def set(self, key, value, token=None):
+        """Запись значения. С token значение не записывается (возвращается False),
+        если ключ сбрасывался после получения token."""
+        with self.__lock:
+            if token is not None and self.__invalidated.get(key, self.__floor) > token:
+                return False
+            self.__data[key] = (time.monotonic() + self.ttl, value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.max_size:
+                self.__data.popitem(last=False)
+                self.__metrics["evictions"] += 1
+            return True
+
+    def invalidate(self, *keys, propagate: bool = True):
+        with self.__lock:
+            for key in keys:
+                if self.__data.pop(key, None) is not None:
+                    self.__metrics["invalidations"] += 1
+                self.__clock += 1
+                self.__invalidated[key] = self.__clock
+                self.__invalidated.move_to_end(key)
+            while len(self.__invalidated) > self.max_size:
+                _, self.__floor = self.__invalidated.popitem(last=False)
+        if propagate and keys and self.on_change is not None:
+            self.on_change(list(keys), False)
+
+    def bump_generation(self, propagate: bool = True):
+        with self.__lock:
+            self.generation += 1
+        if propagate and self.on_change is not None:
+            self.on_change([], True)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            # Значения, читавшиеся во время очистки, тоже не записываются
+            self.__clock += 1
+            self.__invalidated.clear()
+            self.__floor = self.__clock
+
+    def get_metrics(self):
+        """Счетчики кэша и доля попаданий."""
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["size"] = len(self.__data)
+        requests = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / requests if requests else 0.0
+        return metrics
+
+
+class CachedDroneRepository:
+    """Кэширующий слой перед репозиторием дронов.
+
+    Чтения дрона, статуса управления и полного списка идут через общий кэш,
+    записи через этот слой сбрасывают затронутые записи. Списки хранятся под
+    ключом с номером поколения: любая запись увеличивает поколение, и старые
+    списки становятся недостижимы без перебора кэша. Остальные методы
+    передаются репозиторию без изменений. Возвращаемые объекты общие для
+    всех запросов и не должны изменяться вызывающим кодом.
+    """
+    def __init__(self, repository, cache: LRUTTLCache):
+        self.__repository = repository
+        self.__cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.__repository, name)
+
+    def __cached(self, key, loader, use_cache: bool):
+        if not use_cache:
+            return loader()
+        missing = object()
+        value = self.__cache.get(key, missing)
+        if value is missing:
+            # Сброс ключа во время чтения из БД (запись в другом потоке) отменяет запись в кэш
+            token = self.__cache.token()
+            value = loader()
+            # Отсутствующие записи не кэшируются
+            if value is not None:
+                self.__cache.set(key, value, token)
+        return value
+
+    def __invalidate_lists(self):
+        self.__cache.bump_generation()
+
+    def get_drone(self, drone_id: int, use_cache: bool = True):
+        return self.__cached(("drone", drone_id),
+                             lambda: self.__repository.get_drone(drone_id), use_cache)
+
+    def get_drone_status_mgn(self, drone_id: int, use_cache: bool = True):
+        return self.__cached(("status_mgn", drone_id),
+                             lambda: self.__repository.get_drone_status_mgn(drone_id), use_cache)
+
+    def get_drones_status_mgn(self, drone_ids=None, use_cache: bool = True):
+        """Статусы из кэша, промахи - одним запросом к репозиторию; все дроны - всегда из БД.
+        Статусы, сброшенные во время запроса (см. __cached), в кэш не записываются."""
+        if drone_ids is None or not use_cache:
+            token = self.__cache.token()
+            statuses = self.__repository.get_drones_status_mgn(drone_ids)
+            for drone_id, status in statuses.items():
+                self.__cache.set(("status_mgn", drone_id), status, token)
+            return statuses
+        statuses = {}
+        missing = object()
+        misses = []
+        for drone_id in dict.fromkeys(drone_ids):
+            status = self.__cache.get(("status_mgn", drone_id), missing)
+            if status is missing:
+                misses.append(drone_id)
+            else:
+                statuses[drone_id] = status
+        if misses:
+            token = self.__cache.token()
+            loaded = self.__repository.get_drones_status_mgn(misses)
+            for drone_id, status in loaded.items():
+                self.__cache.set(("status_mgn", drone_id), status, token)
+            statuses.update(loaded)
+        return statuses
+
+    def get_drones_with_id(self, order_by: str, use_cache: bool = True):
+        return self.__cached(("drones", self.__cache.generation, order_by),
+                             lambda: self.__repository.get_drones_with_id(order_by), use_cache)
+
+    def add_drone(self, drone: Drone):
+        self.__repository.add_drone(drone)
+        self.__invalidate_lists()
+
+    def add_drones(self, drones):
+        try:
+            return self.__repository.add_drones(drones)
+        finally:
+            self.__invalidate_lists()
+
+    def update_drone(self, drone_id: int, **kwargs):
+        try:
+            self.__repository.update_drone(drone_id, **kwargs)
+        finally:
+            self.__cache.invalidate(("drone", drone_id))
+            self.__invalidate_lists()
+
+    def update_drones(self, updates: dict):
+        try:
+            return self.__repository.update_drones(updates)
+        finally:
+            self.__cache.invalidate(*(("drone", drone_id) for drone_id in updates))
+            self.__invalidate_lists()
+
+    def remove_drone(self, drone_id: int):
+        try:
+            self.__repository.remove_drone(drone_id)
+        finally:
+            self.__cache.invalidate(("drone", drone_id), ("status_mgn", drone_id))
+            self.__invalidate_lists()
+
+    def remove_drones(self, drone_ids):
+        drone_ids = list(drone_ids)
+        try:
+            return self.__repository.remove_drones(drone_ids)
+        finally:
+            self.__cache.invalidate(*(key for drone_id in drone_ids
+                                      for key in (("drone", drone_id), ("status_mgn", drone_id))))
+            self.__invalidate_lists()
+
+    def update_drone_status_mgn(self, drone_id: int, status: str):
+        try:
+            self.__repository.update_drone_status_mgn(drone_id, status)
+        finally:
+            self.__cache.invalidate(("status_mgn", drone_id))
+
+    def acquire_drone_lock(self, drone_id: int, owner: str, lease_until: float, now: float):
+        try:
+            return self.__repository.acquire_drone_lock(drone_id, owner, lease_until, now)
+        finally:
+            self.__cache.invalidate(("status_mgn", drone_id))
+
+    def release_drone_lock(self, drone_id: int, owner: str):
+        try:
+            return self.__repository.release_drone_lock(drone_id, owner)
+        finally:
+            self.__cache.invalidate(("status_mgn", drone_id))
+
+    def release_expired_locks(self, now: float):
+        drone_ids = self.__repository.release_expired_locks(now)
+        self.__cache.invalidate(*(("status_mgn", drone_id) for drone_id in drone_ids))
+        return drone_ids
+
+
+# Допустимые имена таблиц и колонок и выражение сортировки "колонка [ASC|DESC] [NULLS FIRST|LAST], ..."
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_ORDER_BY_TERM = r"[A-Za-z_][A-Za-z0-9_]*(\s+(ASC|DESC))?(\s+NULLS\s+(FIRST|LAST))?"
+_ORDER_BY_RE = re.compile(rf"\s*{_ORDER_BY_TERM}(\s*,\s*{_ORDER_BY_TERM})*\s*", re.IGNORECASE)
+
+
 class QueryBuilder:
-    """Конструктор SQL-запросов SELECT, INSERT, UPDATE, DELETE"""
-    def __init__(self):
+    """Конструктор SQL-запросов SELECT, INSERT, UPDATE, DELETE.
+
+    Части запроса пишутся с заполнителями "?" (стиль qmark, sqlite3). Для драйверов
+    со стилем format (psycopg2) build() заменяет их на "%s".
+    """
+    # Кэш готовых шаблонов запросов: (операция, таблица, колонки, условие, сортировка, стиль) -> SQL
+    __templates = {}
+    # Ограничение размера кэша шаблонов (набор колонок UPDATE приходит извне)
+    templates_max_size = 256
+    paramstyles = ("qmark", "format")
+
+    def __init__(self, paramstyle: str = "qmark"):
         """Инициализация словаря для хранения частей запроса и списка параметров"""
+        if paramstyle not in self.paramstyles:
+            raise ValueError(f"Неподдерживаемый стиль параметров: {paramstyle}")
+        self.paramstyle = paramstyle
         self.__query_parts = {}
         self.__params = []
+        self.__limit = None
 
-    def select_last_drone_id(self):
+    @staticmethod
+    def select_last_drone_id():
         query = 'SELECT id FROM tbl_drones ORDER BY id DESC LIMIT 1'
         return query
 
+    @staticmethod
+    def to_format_paramstyle(query: str):
+        """Перевод запроса из стиля "?" в стиль "%s" (символ % экранируется).
+        Знак "?" внутри строковых литералов запроса не поддерживается."""
+        return query.replace("%", "%%").replace("?", "%s")
+
+    @classmethod
+    def get_template(cls, operation: str, table: str, columns=(), where: str = None, order_by: str = None,
+                     paramstyle: str = "qmark"):
+        """Метод для получения готового SQL-запроса с параметрами-заполнителями "?".
+
+        Запрос собирается один раз для каждой формы (операция, таблица, колонки,
+        условие WHERE, сортировка), далее берется из кэша. Значения передаются
+        только через параметры при выполнении.
+        Пример: get_template("SELECT", "tbl_drones", ("id", "model"), "id=?", "id")
+        """
+        columns = tuple(columns)
+        key = (operation, table, columns, where, order_by, paramstyle)
+        query = cls.__templates.get(key)
+        if query is not None:
+            return query
+        query_builder = cls(paramstyle)
+        if operation == "SELECT":
+            query_builder.select(table, order_by, ",".join(columns) or "*")
+        elif operation == "INSERT":
+            query_builder.insert_into(table, columns)
+        elif operation == "UPDATE":
+            query_builder.update(table, **dict.fromkeys(columns))
+        elif operation == "DELETE":
+            query_builder.delete(table)
+        else:
+            raise ValueError(f"Неизвестная операция: {operation}")
+        if where:
+            query_builder.where(where)
+        query = query_builder.build()
+        if len(cls.__templates) < cls.templates_max_size:
+            cls.__templates[key] = query
+        return query
+
     def insert_into(self, table: str, columns: list):
         """Метод для создания части запроса для добавления данных в БД - INSERT INTO.
         Пример: "INSERT INTO tbl_users (id, name) VALUES (?, ?)" """
+        self.__check_identifiers(table, *columns)
         cols = ','.join(columns)  # ["id", "name"] -> "id,name"
         question_marks = ','.join(['?'] * len(columns))  # ["?"] * 3 = ["?", "?", "?"]
         self.__query_parts["INSERT INTO"] = f"INSERT INTO {table} ({cols}) VALUES ({question_marks})"
@@ -315,23 +2218,36 @@ class QueryBuilder:
 
     def select(self, table: str, order_by, columns="*"):
         """Метод для создания части запроса на выборку данных из БД - SELECT."""
+        self.__check_identifiers(table)
+        if order_by and not _ORDER_BY_RE.fullmatch(order_by):
+            raise ValueError(f"Недопустимое выражение сортировки: {order_by}")
         self.__query_parts["SELECT"] = f"SELECT {columns}"
         self.__query_parts["FROM"] = f"FROM {table}"
-        self.__query_parts["ORDER BY"] = f"ORDER BY {order_by}"
+        if order_by:
+            self.__query_parts["ORDER BY"] = f"ORDER BY {order_by}"
         return self
 
     def delete(self, table: str):
         """Метод для создания части запроса на удаление данных из БД - DELETE."""
+        self.__check_identifiers(table)
         self.__query_parts["DELETE"] = f"DELETE FROM {table} "
         return self
 
     def update(self, table: str, **kwargs):
         """Метод для создания части запроса на изменение данных в БД - UPDATE."""
+        self.__check_identifiers(table, *kwargs)
         set_clause = ', '.join(f'{key}=?' for key in kwargs.keys())
         self.__query_parts["UPDATE"] = f"UPDATE {table} SET {set_clause} "
         self.__params = list(kwargs.values())
         return self
 
+    @staticmethod
+    def __check_identifiers(*names):
+        """Защита от SQL-инъекций через имена таблиц и колонок."""
+        for name in names:
+            if not _IDENTIFIER_RE.fullmatch(name):
+                raise ValueError(f"Недопустимое имя таблицы или колонки: {name!r}")
+
     def values(self, *columns: list):
         """Метод для добавления значений для части запроса INSERT INTO."""
         self.__params.extend(columns)
@@ -339,13 +2255,25 @@ class QueryBuilder:
 
     def get_params(self):
         """Метод для получения списка параметров для добавления к частям запросов."""
+        if "LIMIT" in self.__query_parts:
+            return self.__params + [self.__limit]
         return self.__params
 
     def where(self, condition: str, params=None):
-        """Метод для создания фильтра выборки данных из БД - WHERE."""
-        self.__query_parts["WHERE"] = f"WHERE {condition}"
+        """Метод для создания фильтра выборки данных из БД - WHERE.
+        Повторные вызовы объединяют условия через AND."""
+        if "WHERE" in self.__query_parts:
+            self.__query_parts["WHERE"] += f" AND {condition}"
+        else:
+            self.__query_parts["WHERE"] = f"WHERE {condition}"
         if params:
-            self.__params.append(params[0])
+            self.__params.extend(params)
+        return self
+
+    def limit(self, count: int):
+        """Метод для ограничения количества строк выборки - LIMIT."""
+        self.__query_parts["LIMIT"] = "LIMIT ?"
+        self.__limit = int(count)
         return self
 
     def build(self):
@@ -363,6 +2291,10 @@ class QueryBuilder:
             query += f'{self.__query_parts["WHERE"]} '
         if "ORDER BY" in self.__query_parts:
             query += self.__query_parts["ORDER BY"]
+        if "LIMIT" in self.__query_parts:
+            query += f' {self.__query_parts["LIMIT"]}'
+        if self.paramstyle == "format":
+            query = self.to_format_paramstyle(query)
         return query
 
 
@@ -379,5 +2311,261 @@ class DBConnectionManager:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.__connection:
-            self.__connection.close()
-            logging.info("Соединение с БД закрыто.")
+            self.__db_factory.release(self.__connection)
+            self.__connection = None
+            logger.debug("Соединение с БД освобождено.")
+
+
+class TelemetryBatchWriter:
+    """Буферизованная запись телеметрии в БД пачками из фонового потока.
+
+    add() и add_many() только кладут образцы в буфер (строками таблицы, без словарей).
+    Поток записывает буфер, когда набралось
+    batch_size образцов или прошло flush_interval секунд. При переполнении буфера
+    (БД не успевает) самые старые образцы вытесняются из очереди (deque с maxlen)
+    и учитываются в метриках.
+    """
+    def __init__(self, db_factory, path_to_db, batch_size: int = 1000,
+                 flush_interval: float = 1.0, max_buffer: int = 100000):
+        self.__db_factory = db_factory
+        self.__path_to_db = path_to_db
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__max_buffer = max_buffer
+        self.__buffer = deque(maxlen=max_buffer)
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__thread = None
+        self.__running = False
+        self.__metrics = {"written": 0, "dropped": 0, "flushes": 0, "errors": 0}
+
+    def add(self, drone_id: int, timestamp: float, values: dict):
+        """Добавление образца телеметрии в буфер."""
+        self.__extend([(drone_id, timestamp) + tuple(values[field] for field in SQLiteTelemetryMapper.sample_fields)])
+
+    def add_many(self, drone_ids, timestamp: float, columns: dict):
+        """Добавление образцов многих дронов за один шаг: columns - {поле: список значений
+        в порядке drone_ids} (списки Python, а не массивы NumPy, - значения пишутся в БД как есть)."""
+        self.__extend(list(zip(drone_ids, itertools.repeat(timestamp, len(drone_ids)),
+                               *(columns[field] for field in SQLiteTelemetryMapper.sample_fields))))
+
+    def __extend(self, rows):
+        with self.__lock:
+            overflow = len(self.__buffer) + len(rows) - self.__max_buffer
+            if overflow > 0:
+                self.__metrics["dropped"] += overflow
+            self.__buffer.extend(rows)
+            full = len(self.__buffer) >= self.__batch_size
+        if full:
+            self.__wakeup.set()
+
+    def flush(self):
+        """Запись всего накопленного буфера в БД. Возвращает число записанных образцов."""
+        with self.__lock:
+            samples = list(self.__buffer)
+            self.__buffer.clear()
+        if not samples:
+            return 0
+        try:
+            with DBConnectionManager(self.__db_factory, self.__path_to_db) as conn:
+                written = SQLiteTelemetryRepository(conn).add_sample_rows(samples)
+        except Exception as e:
+            logger.error("Ошибка записи телеметрии в БД: %s", e)
+            with self.__lock:
+                self.__metrics["errors"] += 1
+                self.__metrics["dropped"] += len(samples)
+            return 0
+        with self.__lock:
+            self.__metrics["written"] += written
+            self.__metrics["flushes"] += 1
+        return written
+
+    def start(self):
+        """Запуск фонового потока записи."""
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="telemetry-writer", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Остановка потока с записью оставшегося буфера."""
+        self.__running = False
+        self.__wakeup.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.flush()
+
+    def get_metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["buffered"] = len(self.__buffer)
+        return metrics
+
+    def __run(self):
+        while self.__running:
+            self.__wakeup.wait(self.__flush_interval)
+            self.__wakeup.clear()
+            self.flush()
+
+
+class DBExecutorOverloadedError(RuntimeError):
+    """Очередь задач исполнителя БД заполнена."""
+
+
+class DBExecutor:
+    """Выделенные потоки для блокирующих операций с БД с ограниченной очередью задач.
+
+    Число потоков фиксировано (меньше размера пула соединений, чтобы другим
+    пользователям пула оставались соединения), поэтому нагрузка на БД и число
+    потоков не растут вместе с числом запросов. Если очередь заполнена, новая
+    задача сразу отклоняется DBExecutorOverloadedError, а не ждет, блокируя цикл
+    событий.
+    """
+    def __init__(self, workers: int = 4, max_queue: int = 1000, name: str = "db-executor"):
+        if workers < 1:
+            raise ValueError("Число потоков исполнителя БД должно быть больше 0")
+        self.workers = workers
+        self.name = name  # Префикс имен потоков
+        self.__queue = queue.Queue(max_queue)
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__metrics = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "cancelled": 0}
+
+    def submit(self, func, *args, **kwargs):
+        """Постановка вызова в очередь. Возвращает concurrent.futures.Future."""
+        self.start()
+        future = Future()
+        try:
+            self.__queue.put_nowait((future, func, args, kwargs))
+        except queue.Full:
+            with self.__lock:
+                self.__metrics["rejected"] += 1
+            raise DBExecutorOverloadedError(
+                f"Очередь операций с БД заполнена ({self.__queue.maxsize} задач)") from None
+        with self.__lock:
+            self.__metrics["submitted"] += 1
+        return future
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнение вызова в потоке БД без блокировки цикла событий."""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def start(self):
+        """Запуск потоков (выполняется автоматически при первой задаче)."""
+        if self.__threads:
+            return
+        with self.__lock:
+            if self.__threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.__work, name=f"{self.name}-{number}", daemon=True)
+                thread.start()
+                self.__threads.append(thread)
+
+    def shutdown(self):
+        """Остановка потоков после выполнения уже поставленных задач."""
+        with self.__lock:
+            threads, self.__threads = self.__threads, []
+        for _ in threads:
+            self.__queue.put((None, None, None, None))
+        for thread in threads:
+            thread.join()
+
+    def get_metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+        metrics.update(workers=self.workers, queued=self.__queue.qsize(), max_queue=self.__queue.maxsize)
+        return metrics
+
+    def __work(self):
+        while True:
+            future, func, args, kwargs = self.__queue.get()
+            if future is None:
+                return
+            # Задача, ожидание которой уже отменено, не выполняется
+            if not future.set_running_or_notify_cancel():
+                with self.__lock:
+                    self.__metrics["cancelled"] += 1
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                key = "failed"
+            else:
+                future.set_result(result)
+                key = "completed"
+            with self.__lock:
+                self.__metrics[key] += 1
+
+
+class AsyncSQLiteDroneRepository:
+    """Асинхронный репозиторий дронов поверх DBExecutor.
+
+    Каждый метод - одна задача исполнителя БД: в его потоке берется соединение
+    из пула, вызывается метод синхронного репозитория, соединение возвращается.
+    repository_factory(conn) создает синхронный репозиторий (например, с кэшем).
+    """
+    def __init__(self, db_factory, path_to_db, executor: DBExecutor,
+                 repository_factory=SQLiteIDroneRepository):
+        self.__db_factory = db_factory
+        self.__path_to_db = path_to_db
+        self.executor = executor
+        self.__repository_factory = repository_factory
+
+    def __call_repository(self, method: str, args, kwargs):
+        with DBConnectionManager(self.__db_factory, self.__path_to_db) as conn:
+            return getattr(self.__repository_factory(conn), method)(*args, **kwargs)
+
+    def __call_with_connection(self, func, args):
+        with DBConnectionManager(self.__db_factory, self.__path_to_db) as conn:
+            return func(conn, *args)
+
+    async def call(self, method: str, *args, **kwargs):
+        """Вызов произвольного метода синхронного репозитория."""
+        return await self.executor.run(self.__call_repository, method, args, kwargs)
+
+    async def run_in_connection(self, func, *args):
+        """Выполнение func(conn, *args) с соединением из пула в потоке БД."""
+        return await self.executor.run(self.__call_with_connection, func, args)
+
+    async def get_drone_id(self):
+        return await self.call("get_drone_id")
+
+    async def get_drone(self, drone_id: int):
+        return await self.call("get_drone", drone_id)
+
+    async def get_drone_status_mgn(self, drone_id: int):
+        return await self.call("get_drone_status_mgn", drone_id)
+
+    async def get_drones_status_mgn(self, drone_ids=None):
+        return await self.call("get_drones_status_mgn", drone_ids)
+
+    async def get_fleet_version(self):
+        return await self.call("get_fleet_version")
+
+    async def get_drones_with_id(self, order_by: str):
+        return await self.call("get_drones_with_id", order_by)
+
+    async def get_drones_page(self, **params):
+        return await self.call("get_drones_page", **params)
+
+    async def add_drone(self, drone: Drone):
+        return await self.call("add_drone", drone)
+
+    async def update_drone(self, drone_id: int, **kwargs):
+        return await self.call("update_drone", drone_id, **kwargs)
+
+    async def remove_drone(self, drone_id: int):
+        return await self.call("remove_drone", drone_id)
+
+    async def add_drones(self, drones):
+        return await self.call("add_drones", drones)
+
+    async def update_drones(self, updates: dict):
+        return await self.call("update_drones", updates)
+
+    async def remove_drones(self, drone_ids):
+        return await self.call("remove_drones", drone_ids)
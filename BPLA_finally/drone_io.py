@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+import tempfile
+import zlib
+from db_modules import Drone
+
+# Размер блока чтения загружаемого файла
+READ_CHUNK_SIZE = 64 * 1024
+# Размер блока выгрузки: строки копятся в буфере и отдаются блоками не меньше этого размера
+WRITE_CHUNK_SIZE = 64 * 1024
+# Сколько байт проверенного импорта держать в памяти, больше - во временном файле
+SPOOL_MAX_MEMORY = 1024 * 1024
+# Форматы выгрузки и их MIME-типы
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def drone_from_record(record: dict):
+    """Создание дрона из записи импорта. id всегда назначает БД, неизвестные поля
+    и пустые значения отбрасываются."""
+    values = {
+        col: record[col]
+        for col in Drone.tbl_drones_cols
+        if col != 'id' and record.get(col) not in (None, '')
+    }
+    return Drone(id=None, **values)
+
+
+def iter_csv_records(stream, encoding='utf-8'):
+    """Построчное чтение CSV с заголовком из бинарного потока."""
+    text_stream = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    try:
+        yield from csv.DictReader(text_stream)
+    finally:
+        # Поток принадлежит вызывающему коду - отсоединяем обертку, не закрывая его
+        text_stream.detach()
+
+
+def iter_json_records(stream, encoding='utf-8'):
+    """Потоковое чтение JSON-объектов из бинарного потока.
+
+    Поддерживаются NDJSON (по объекту на строку) и JSON-массив объектов.
+    В памяти держится только текущий блок и недочитанный объект.
+    """
+    decoder = json.JSONDecoder()
+    text_stream = io.TextIOWrapper(stream, encoding=encoding)
+    buffer = ''
+    eof = False
+    try:
+        while True:
+            # Пропуск разделителей между объектами: пробелы, запятые и скобки массива
+            pos = 0
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]':
+                pos += 1
+            buffer = buffer[pos:]
+            if not buffer:
+                if eof:
+                    return
+                chunk = text_stream.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Объект не дочитан целиком - добираем следующий блок
+                chunk = text_stream.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            yield record
+    finally:
+        text_stream.detach()
+
+
+def iter_import_drones(stream, file_format: str):
+    """Генератор дронов из загружаемого файла формата csv или json/ndjson."""
+    if file_format == 'csv':
+        records = iter_csv_records(stream)
+    elif file_format in ('json', 'ndjson'):
+        records = iter_json_records(stream)
+    else:
+        raise ValueError(f'Неподдерживаемый формат импорта: {file_format}')
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError(f'Ожидался объект дрона, получено: {record!r}')
+        yield drone_from_record(record)
+
+
+def spool_import_drones(stream, file_format: str, max_memory: int = SPOOL_MAX_MEMORY):
+    """Разбор и проверка загружаемого файла до записи в БД.
+
+    Дроны пишутся во временный файл в NDJSON (первые max_memory байт - в памяти),
+    файл возвращается перемотанным в начало и читается через
+    iter_import_drones(spool, 'ndjson'). Ошибки формата (ValueError,
+    UnicodeDecodeError, csv.Error) возникают здесь, а транзакция импорта потом
+    читает локальный файл, а не медленного клиента.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    try:
+        for chunk in iter_ndjson_export(iter_import_drones(stream, file_format)):
+            spool.write(chunk.encode('utf-8'))
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def iter_drone_pages(fetch_page):
+    """Дроны выгрузки страница за страницей: fetch_page(cursor) возвращает
+    (список дронов, курсор следующей страницы или None) и сам берет и освобождает
+    соединение, поэтому между страницами соединение и транзакция не удерживаются,
+    пока клиент читает ответ."""
+    cursor = None
+    while True:
+        drones, cursor = fetch_page(cursor)
+        yield from drones
+        if cursor is None:
+            return
+
+
+def iter_csv_export(drones, chunk_size: int = WRITE_CHUNK_SIZE):
+    """Выгрузка дронов в CSV с заголовком блоками текста (колонки tbl_drones_cols,
+    файл загружается обратно через импорт)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(Drone.tbl_drones_cols)
+    for drone in drones:
+        writer.writerow([getattr(drone, col) for col in Drone.tbl_drones_cols])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson_export(drones, chunk_size: int = WRITE_CHUNK_SIZE):
+    """Выгрузка дронов в NDJSON (по объекту на строку) блоками текста."""
+    lines, size = [], 0
+    for drone in drones:
+        line = json.dumps(drone.to_dict(), ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines)
+
+
+def iter_export_drones(drones, file_format: str, chunk_size: int = WRITE_CHUNK_SIZE):
+    """Генератор блоков текста выгрузки дронов в формате csv или ndjson."""
+    if file_format == 'csv':
+        return iter_csv_export(drones, chunk_size)
+    if file_format == 'ndjson':
+        return iter_ndjson_export(drones, chunk_size)
+    raise ValueError(f'Неподдерживаемый формат выгрузки: {file_format}')
+
+
+def iter_gzip(chunks, level: int = 6, encoding='utf-8'):
+    """Сжатие потока текстовых блоков в gzip на лету: в памяти только текущий блок
+    и состояние компрессора."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode(encoding))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from db_modules import DBConnectionManager, SQLiteIDroneRepository
+
+logger = logging.getLogger(__name__)
+
+
+def lock_room(drone_id: int):
+    """Имя комнаты Socket.IO для операторов, ожидающих освобождения дрона."""
+    return f"drone_lock_{drone_id}"
+
+
+def lease_owner(user: str, lease: str):
+    """Владелец аренды в БД: пользователь и токен аренды, выданный странице управления
+    при захвате. У каждой вкладки свой токен, поэтому продлить и освободить аренду
+    может только получившая ее вкладка, а не любая вкладка того же пользователя."""
+    return f"{user}:{lease}"
+
+
+def status_room(drone_id: int = None):
+    """Имя комнаты Socket.IO подписчиков переходов статуса управления дрона
+    (без drone_id - комната подписчиков всего парка)."""
+    return "drone_status_all" if drone_id is None else f"drone_status_{drone_id}"
+
+
+class DroneLockManager:
+    """Аренда управления дронами.
+
+    Захват выполняется одной атомарной операцией в БД и действует lease_seconds
+    секунд, страница управления продлевает аренду heartbeat-запросами. Фоновый
+    поток освобождает дроны с истекшей арендой (оператор закрыл браузер).
+    При каждом освобождении вызывается on_release(drone_id), через который
+    ожидающие операторы получают уведомление, при каждом захвате - on_acquire(drone_id).
+    Повторный вход оператора, который уже управляет дроном, захватом не считается.
+    Переходы определяются по результату операций в БД, а не по памяти процесса,
+    поэтому уведомления верны и при нескольких процессах сервера.
+    """
+    def __init__(self, db_factory, path_to_db, lease_seconds: float = 30.0,
+                 repository_factory=SQLiteIDroneRepository, on_release=None, on_acquire=None):
+        self.__db_factory = db_factory
+        self.__path_to_db = path_to_db
+        self.lease_seconds = lease_seconds
+        self.__repository_factory = repository_factory
+        self.on_release = on_release
+        self.on_acquire = on_acquire
+        self.__thread = None
+        self.__stopped = threading.Event()
+
+    def __call_repository(self, method: str, *args):
+        with DBConnectionManager(self.__db_factory, self.__path_to_db) as conn:
+            return getattr(self.__repository_factory(conn), method)(*args)
+
+    @staticmethod
+    def __notify(callback, drone_id: int):
+        if callback is None:
+            return
+        try:
+            callback(drone_id)
+        except Exception as e:
+            logger.error("Ошибка уведомления о смене управления дроном ID = %s: %s", drone_id, e)
+
+    def acquire(self, drone_id: int, owner: str):
+        """Захват управления. Возвращает True, если управление получено."""
+        now = time.time()
+        if self.__call_repository("renew_drone_lock", drone_id, owner, now + self.lease_seconds):
+            return True  # Повторный вход владельца: аренда продлена, перехода нет
+        acquired = self.__call_repository("acquire_drone_lock", drone_id, owner, now + self.lease_seconds, now)
+        if acquired:
+            self.__notify(self.on_acquire, drone_id)
+        return acquired
+
+    def renew(self, drone_id: int, owner: str):
+        """Продление аренды (heartbeat). Возвращает False, если аренда уже потеряна."""
+        return self.__call_repository("renew_drone_lock", drone_id, owner, time.time() + self.lease_seconds)
+
+    def release(self, drone_id: int, owner: str):
+        """Освобождение управления владельцем с уведомлением ожидающих."""
+        released = self.__call_repository("release_drone_lock", drone_id, owner)
+        if released:
+            self.__notify(self.on_release, drone_id)
+        return released
+
+    def sweep(self):
+        """Освобождение дронов с истекшей арендой. Возвращает список их id."""
+        drone_ids = self.__call_repository("release_expired_locks", time.time())
+        for drone_id in drone_ids:
+            self.__notify(self.on_release, drone_id)
+        return drone_ids
+
+    def start(self, interval: float = None):
+        """Запуск фоновой очистки истекших аренд (по умолчанию раз в половину срока аренды)."""
+        if self.__thread is not None:
+            return
+        interval = interval if interval is not None else self.lease_seconds / 2
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, args=(interval,),
+                                         name="drone-lock-sweeper", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self, interval: float):
+        while not self.__stopped.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Ошибка очистки истекших аренд управления: %s", e)
@@ -1,151 +1,481 @@
-import asyncio
-import datetime
-import jwt
+import csv
+import gzip
+import hashlib
+import hmac
+import ipaddress
+import json
 import logging
-import numpy as np
+import math
+import os
+import re
+import secrets
 import time
-from db_modules import Drone, DBConnectionManager, SQLiteDBFactory, SQLiteIDroneRepository
-from flask import Flask, request, redirect, url_for, render_template, flash, session, jsonify
-from flask_socketio import SocketIO, emit
-from functools import wraps
-
-# Логирование для вывода информации и ошибок
-logging.basicConfig(
-    handlers=[
-        logging.FileHandler(filename='server.log', encoding='utf-8', mode='a+')
-    ],
-    format='%(asctime)s - %(levelname)s - %(funcName)s: %(message)s',
-    level=logging.DEBUG)
+from db_modules import (AsyncSQLiteDroneRepository, CachedDroneRepository, Drone, DBConnectionManager, DBExecutor,
+                        DBExecutorOverloadedError, LRUTTLCache, PoolTimeoutError, PostgreSQLDBFactory,
+                        PostgreSQLDroneMapper, SQLiteDBFactory, SQLiteDroneMapper, SQLiteLoginAttemptRepository,
+                        SQLiteSecretRepository, SQLiteTelemetryRepository, SQLiteUserRepository,
+                        TelemetryBatchWriter)
+from auth import LoginRateLimiter, PasswordHasher, SecretKeyProvider, SharedLoginRateLimiter, TokenVerifier
+from drone_io import (EXPORT_MIMETYPES, iter_drone_pages, iter_export_drones, iter_gzip, iter_import_drones,
+                      spool_import_drones)
+from drone_locks import DroneLockManager, lease_owner, lock_room, status_room
+from flask import Flask, Response, g, request, redirect, url_for, render_template, flash, session, jsonify
+from markupsafe import Markup
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from log_config import setup_logging_from_env
+from message_queue import (BROKER_SCHEME, WORKERS_CHANNEL, BrokerClient, BrokerManager, share_invalidations,
+                           share_key_reloads)
+from metrics import MetricsRegistry, instrumented, timed
+from spatial_index import SeparationMonitor, SpatialIndex
+from telemetry import (TelemetryEngine, TelemetryRelay, TelemetryRingBuffer, TelemetryUnavailableError,
+                       telemetry_frame_layout, telemetry_room, UnknownDroneError)
+
+# Логирование для вывода информации и ошибок: записи JSON в server.log пишет фоновый
+# поток пачками, с ротацией по размеру. Уровень задается BPLA_LOG_LEVEL, уровни
+# отдельных модулей - BPLA_LOG_LEVELS (например, "db_modules=WARNING,werkzeug=ERROR")
+setup_logging_from_env('server.log')
+logger = logging.getLogger('flask_server')
+
+# Метрики процесса в формате Prometheus (отдаются по /metrics)
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram('bpla_http_request_duration_seconds',
+                                         'Время обработки HTTP-запроса', ('method', 'route'))
+http_requests = metrics.counter('bpla_http_requests_total', 'HTTP-запросы', ('method', 'route', 'status'))
+db_query_seconds = metrics.histogram('bpla_db_query_duration_seconds',
+                                     'Время выполнения методов мапера дронов', ('method',))
+socket_event_seconds = metrics.histogram('bpla_socketio_event_duration_seconds',
+                                         'Время обработки события Socket.IO', ('event',))
+socket_emits = metrics.counter('bpla_socketio_emits_total', 'Отправленные сообщения Socket.IO', ('event',))
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO со счетчиком отправленных сообщений (emit в обработчиках тоже идет сюда)."""
+    def emit(self, event, *args, **kwargs):
+        socket_emits.inc(event=event)
+        return super().emit(event, *args, **kwargs)
+
 
 app = Flask(__name__)
-socketio = SocketIO(app)
-factory = SQLiteDBFactory()
-
-
-def log_execution_time(func):
-    """Декоратор для логирования времени выполнения функции"""
-
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = await func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        logging.info(
-            f'Функция {func.__name__} выполнена за {execution_time:.4f} секунд.'
-        )
-        return result
+# Работа в несколько процессов (server_workers.py): адрес брокера сообщений задается BPLA_MESSAGE_QUEUE
+# (redis://, amqp:// или встроенный bpla:// для тестов), номер процесса - BPLA_WORKER_ID (процесс 0
+# моделирует телеметрию). Клиенты Socket.IO подключаются только через WebSocket: запросы long-polling
+# одного клиента могут попасть в разные процессы
+MESSAGE_QUEUE = os.environ.get('BPLA_MESSAGE_QUEUE')
+WORKER_ID = int(os.environ.get('BPLA_WORKER_ID', 0))
+if MESSAGE_QUEUE:
+    broker_client = BrokerClient(MESSAGE_QUEUE)
+    SOCKET_TRANSPORTS = ['websocket']
+    if MESSAGE_QUEUE.startswith(f'{BROKER_SCHEME}://'):
+        socketio = InstrumentedSocketIO(app, client_manager=BrokerManager(MESSAGE_QUEUE),
+                                        transports=SOCKET_TRANSPORTS)
+    else:
+        # RedisManager или KombuManager по схеме адреса
+        socketio = InstrumentedSocketIO(app, message_queue=MESSAGE_QUEUE, transports=SOCKET_TRANSPORTS)
+else:
+    broker_client = None
+    SOCKET_TRANSPORTS = ['polling', 'websocket']
+    socketio = InstrumentedSocketIO(app)
+# Пул соединений с БД: размер задается переменной окружения BPLA_DB_POOL_SIZE
+DB_POOL_SIZE = int(os.environ.get('BPLA_DB_POOL_SIZE', 10))
+# Репозитории дронов фабрик используют маперы с замером времени методов (bpla_db_query_duration_seconds)
+factory = SQLiteDBFactory(pool_size=DB_POOL_SIZE, mapper_class=instrumented(SQLiteDroneMapper, db_query_seconds))
+# БД дронов: BPLA_DB_BACKEND = sqlite (по умолчанию, prod.db) или postgresql (строка подключения
+# в BPLA_DB_DSN). Пользователи, SECRET_KEY и телеметрия всегда хранятся в prod.db
+DB_BACKEND = os.environ.get('BPLA_DB_BACKEND', 'sqlite')
+if DB_BACKEND == 'postgresql':
+    drone_factory = PostgreSQLDBFactory(pool_size=DB_POOL_SIZE,
+                                        mapper_class=instrumented(PostgreSQLDroneMapper, db_query_seconds))
+    DRONE_DB = os.environ['BPLA_DB_DSN']
+else:
+    drone_factory = factory
+    DRONE_DB = 'prod.db'
+# Потоки для операций с БД из асинхронных обработчиков: число потоков и длина очереди задач
+# задаются BPLA_DB_WORKERS и BPLA_DB_QUEUE_SIZE. Пулом соединений пользуются и фоновые потоки
+# (очистка аренд, запись телеметрии), экспорт и обработчики Socket.IO, поэтому по умолчанию потоков
+# на BPLA_DB_RESERVED_CONNECTIONS меньше размера пула: занятые исполнителем соединения не блокируют их
+DB_RESERVED_CONNECTIONS = int(os.environ.get('BPLA_DB_RESERVED_CONNECTIONS', 4))
+DB_WORKERS = int(os.environ.get('BPLA_DB_WORKERS', max(DB_POOL_SIZE - DB_RESERVED_CONNECTIONS, 1)))
+if DB_WORKERS >= DB_POOL_SIZE:
+    logger.warning('Потоков БД (%s) не меньше размера пула (%s): фоновые задачи могут ждать соединение',
+                   DB_WORKERS, DB_POOL_SIZE)
+db_executor = DBExecutor(workers=DB_WORKERS, max_queue=int(os.environ.get('BPLA_DB_QUEUE_SIZE', 1000)))
+# Хэширование паролей scrypt: стоимость задается BPLA_SCRYPT_N, BPLA_SCRYPT_R и BPLA_SCRYPT_P.
+# Проверка пароля выполняется в отдельном пуле (BPLA_PASSWORD_WORKERS потоков, очередь
+# BPLA_PASSWORD_QUEUE_SIZE), чтобы волна входов не занимала потоки БД и цикл событий
+password_hasher = PasswordHasher(n=int(os.environ.get('BPLA_SCRYPT_N', 2 ** 14)),
+                                 r=int(os.environ.get('BPLA_SCRYPT_R', 8)),
+                                 p=int(os.environ.get('BPLA_SCRYPT_P', 1)))
+password_executor = DBExecutor(workers=int(os.environ.get('BPLA_PASSWORD_WORKERS', min(os.cpu_count() or 1, 4))),
+                               max_queue=int(os.environ.get('BPLA_PASSWORD_QUEUE_SIZE', 64)),
+                               name='password-hasher')
+# Ограничение попыток входа по логину: BPLA_LOGIN_BURST попыток подряд, затем BPLA_LOGIN_RATE в секунду,
+# и по адресу клиента (перебор многих логинов с одного адреса): BPLA_LOGIN_IP_BURST и BPLA_LOGIN_IP_RATE.
+# При работе в несколько процессов счетчики общие и хранятся в prod.db (tbl_login_attempts)
+LOGIN_LIMITS_SHARED = broker_client is not None
+LOGIN_RATE = float(os.environ.get('BPLA_LOGIN_RATE', 0.2))
+LOGIN_BURST = int(os.environ.get('BPLA_LOGIN_BURST', 5))
+LOGIN_IP_RATE = float(os.environ.get('BPLA_LOGIN_IP_RATE', 1))
+LOGIN_IP_BURST = int(os.environ.get('BPLA_LOGIN_IP_BURST', 20))
+if LOGIN_LIMITS_SHARED:
+    login_limiter = SharedLoginRateLimiter(factory, 'prod.db', 'login', rate=LOGIN_RATE, burst=LOGIN_BURST)
+    address_limiter = SharedLoginRateLimiter(factory, 'prod.db', 'address', rate=LOGIN_IP_RATE, burst=LOGIN_IP_BURST)
+else:
+    login_limiter = LoginRateLimiter(rate=LOGIN_RATE, burst=LOGIN_BURST)
+    address_limiter = LoginRateLimiter(rate=LOGIN_IP_RATE, burst=LOGIN_IP_BURST)
+# Общий кэш дронов и статусов управления: размер и время жизни записей в секундах
+drone_cache = LRUTTLCache(max_size=int(os.environ.get('BPLA_DRONE_CACHE_SIZE', 4096)),
+                          ttl=float(os.environ.get('BPLA_DRONE_CACHE_TTL', 30)))
+# Кэш отрисованных страниц дронов (по версии данных парка) и строк таблицы дронов
+page_cache = LRUTTLCache(max_size=int(os.environ.get('BPLA_PAGE_CACHE_SIZE', 4096)),
+                         ttl=float(os.environ.get('BPLA_PAGE_CACHE_TTL', 300)))
+if broker_client is not None:
+    # Сброс записей кэша дронов в одном процессе сбрасывает их во всех
+    share_invalidations(drone_cache, broker_client)
+
+
+def get_drone_repository(conn):
+    """Репозиторий дронов с кэшированием чтений."""
+    return CachedDroneRepository(drone_factory.create_drone_repository(conn), drone_cache)
+
+
+# Асинхронный репозиторий дронов для обработчиков запросов
+drones_db = AsyncSQLiteDroneRepository(drone_factory, DRONE_DB, db_executor,
+                                       repository_factory=get_drone_repository)
+
+
+@app.errorhandler(DBExecutorOverloadedError)
+def handle_db_overloaded(e):
+    logger.error('Перегрузка БД: %s', e)
+    return jsonify({"error": "Сервер перегружен, повторите запрос позже"}), 503
+
+
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(e):
+    logger.error('Нет свободного соединения с БД: %s', e)
+    return jsonify({"error": "Сервер перегружен, повторите запрос позже"}), 503
+
+
+@app.errorhandler(TelemetryUnavailableError)
+def handle_telemetry_unavailable(e):
+    logger.error('Телеметрия недоступна: %s', e)
+    return jsonify({"error": "Телеметрия временно недоступна, повторите запрос позже"}), 503
+
+
+@app.errorhandler(UnknownDroneError)
+def handle_unknown_drone(e):
+    return jsonify({"error": str(e)}), 404
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    """Время обработки и число запросов по маршруту (шаблону URL, а не самому URL)."""
+    started = g.pop('request_started', None)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if started is not None:
+        http_request_seconds.observe(time.perf_counter() - started, method=request.method, route=route)
+    http_requests.inc(method=request.method, route=route, status=response.status_code)
+    return response
+
+
+# Сжатие ответов: типы содержимого и минимальный размер тела в байтах
+GZIP_MIMETYPES = frozenset({'text/html', 'text/plain', 'application/json'})
+GZIP_MIN_SIZE = 500
+
+
+def gzip_body(data: bytes):
+    """Сжатие тела ответа (mtime=0 - одинаковый результат для одинаковых данных)."""
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+@app.after_request
+def compress_response(response):
+    """Сжатие gzip HTML, JSON и текстовых ответов, если клиент его принимает.
+    Потоковые и уже сжатые ответы (выгрузка парка, кэш страниц) не трогаются."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in GZIP_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip']:
+        response.set_data(gzip_body(data))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def numeric_metrics(groups: dict):
+    """Числовые значения метрик пулов и исполнителей: {(имя, показатель): значение}."""
+    return {(name, stat): value for name, group in groups.items() for stat, value in group.items()
+            if isinstance(value, (int, float))}
+
+
+def collect_pool_metrics():
+    pools = dict(factory.get_pool_metrics())
+    if drone_factory is not factory:
+        # Строка подключения может содержать пароль - в метках только имя бэкенда
+        pools.update((DB_BACKEND, pool) for pool in drone_factory.get_pool_metrics().values())
+    return numeric_metrics(pools)
 
-    return wrapper
 
+metrics.gauge('bpla_db_pool', 'Пулы соединений с БД', ('db', 'stat'), collect_pool_metrics)
+metrics.gauge('bpla_executor', 'Исполнители операций с БД и проверки паролей', ('executor', 'stat'),
+              lambda: numeric_metrics({'db': db_executor.get_metrics(), 'password': password_executor.get_metrics()}))
+metrics.gauge('bpla_drone_cache', 'Кэш дронов и статусов управления', ('stat',),
+              lambda: {(stat,): value for (_, stat), value in numeric_metrics({'': drone_cache.get_metrics()}).items()})
+metrics.gauge('bpla_page_cache', 'Кэш страниц и строк таблицы дронов', ('stat',),
+              lambda: {(stat,): value for (_, stat), value in numeric_metrics({'': page_cache.get_metrics()}).items()})
+metrics.gauge('bpla_telemetry_writer', 'Фоновая запись телеметрии в БД', ('stat',),
+              lambda: {(stat,): value
+                       for (_, stat), value in numeric_metrics({'': telemetry_writer.get_metrics()}).items()})
 
-def get_secret_key():
-    """Функция для получения SECRET_KEY из базы данных"""
+# Доступ к /metrics закрыт по умолчанию. Открывается заголовком Authorization: Bearer <BPLA_METRICS_TOKEN>
+# или для адресов сборщика из BPLA_METRICS_ALLOW (сети через запятую, например "127.0.0.1/32,10.0.0.0/8")
+METRICS_TOKEN = os.environ.get('BPLA_METRICS_TOKEN', '')
+METRICS_ALLOW = [ipaddress.ip_network(network.strip())
+                 for network in os.environ.get('BPLA_METRICS_ALLOW', '').split(',') if network.strip()]
+
+
+def metrics_allowed():
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    if METRICS_TOKEN and hmac.compare_digest(authorization, f'Bearer {METRICS_TOKEN}'.encode('utf-8')):
+        return True
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOW)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики в текстовом формате Prometheus (доступ - см. metrics_allowed)."""
+    if not metrics_allowed():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def load_secret_keys():
+    """Функция для получения ключей подписи (SECRET_KEY) из базы данных"""
+    try:
+        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
+            keys = SQLiteSecretRepository(conn).get_keys()
+            logger.warning('Получен SECRET_KEY!')
+            return keys
+    except Exception as e:
+        logger.error('SECRET_KEY не получен! Проверьте БД! %s', e)
+        raise
+
+
+# Ключи загружаются при старте сервера и перечитываются по SIGHUP, раз в
+# BPLA_SECRET_RELOAD_INTERVAL секунд (0 - только по сигналу) и при токене с неизвестным kid
+# (не чаще раза в BPLA_SECRET_MIN_RELOAD_INTERVAL секунд)
+secret_keys = SecretKeyProvider(load_secret_keys,
+                                min_reload_interval=float(os.environ.get('BPLA_SECRET_MIN_RELOAD_INTERVAL', 5)))
+secret_keys.start(interval=float(os.environ.get('BPLA_SECRET_RELOAD_INTERVAL', 300)) or None)
+secret_keys.install_signal_handler()
+if broker_client is not None:
+    # Смена ключей, замеченная одним процессом, перечитывает ключи во всех
+    share_key_reloads(secret_keys, broker_client)
+# Проверка токенов с кэшем: размер кэша задается переменной окружения BPLA_TOKEN_CACHE_SIZE
+token_verifier = TokenVerifier(secret_keys, lifetime=60 * 60,
+                               cache_size=int(os.environ.get('BPLA_TOKEN_CACHE_SIZE', 10000)))
+
+
+@app.before_request
+def apply_secret_key():
+    """Установка SECRET_KEY в приложении: сессии подписываются текущим ключом,
+    подписанные прежними ключами после ротации продолжают приниматься."""
+    version = secret_keys.version
+    if app.config.get('SECRET_KEY_VERSION') != version:
+        keys = secret_keys.keys()
+        app.config.update(SECRET_KEY=keys[0], SECRET_KEY_FALLBACKS=keys[1:], SECRET_KEY_VERSION=version)
+
+
+def init_db():
+    """Функция для создания индексов БД при старте сервера"""
     try:
+        with DBConnectionManager(drone_factory, path_to_db=DRONE_DB) as conn:
+            drone_repository = drone_factory.create_drone_repository(conn)
+            if DB_BACKEND == 'postgresql':
+                drone_repository.create_tables()
+            drone_repository.create_indexes()
+            drone_repository.create_lock_columns()
+            drone_repository.create_version_table()
         with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT key FROM tbl_secret")
-            logging.warning('Получен SECRET_KEY!')
-            return cursor.fetchone()[0]
+            SQLiteTelemetryRepository(conn).create_tables()
+            SQLiteSecretRepository(conn).create_key_columns()
+            SQLiteLoginAttemptRepository(conn).create_tables()
+            migrated = SQLiteUserRepository(conn).migrate_passwords(password_hasher.hash, password_hasher.is_hashed)
+            if migrated:
+                logger.warning('Пароли пользователей переведены на хэши scrypt: %s.', migrated)
     except Exception as e:
-        logging.error(f'SECRET_KEY не получен! Проверьте БД! {str(e)}')
+        logger.error('Индексы и таблицы БД не созданы! %s', e)
 
 
-# Установка SECRET_KEY в приложении.
-app.secret_key = get_secret_key()
+init_db()
+# Сессия открывается до before_request, поэтому ключ нужен уже к первому запросу;
+# без ключей подписи сервер не запускается
+try:
+    apply_secret_key()
+except Exception:
+    logger.exception('Ключи подписи не загружены, запуск сервера прерван')
+    raise SystemExit(1)
 
 
 def generate_token(username):
     """Создаем JWT-токен для указанного имени пользователя, со сроком годности 60 мин."""
-    payload = {
-        'username': username,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=60)
-    }
-    token = jwt.encode(payload, app.secret_key, algorithm='HS256')
-    logging.info(f'Сгенерирован токен для пользователя: {username}.')
+    token = token_verifier.generate(username)
+    logger.info('Сгенерирован токен для пользователя: %s.', username)
     return token
 
 
 def verify_token(token):
-    """Проверяем действительность токена."""
-    try:
-        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
-        return payload['username']
-    except jwt.ExpiredSignatureError:
-        logging.error('Токен истек')
-        return None  # Токен истек
-    except jwt.InvalidTokenError as e:
-        logging.error(f'Невалидный токен: {str(e)}')
-        return None  # Невалидный токен
+    """Проверяем действительность токена (результат проверки кэшируется до exp)."""
+    return token_verifier.verify(token)
 
 
 def check_session_token(token):
     if not token:
-        logging.warning(
+        logger.warning(
             'Токен отсутствует, перенаправление на страницу логаута')
         return redirect(
             url_for('logout'))  # Перенаправление на страницу логаута
     username = verify_token(token)
     if not username:
-        logging.warning(
+        logger.warning(
             'Недействительный токен, перенаправление на страницу логаута')
         return redirect(
             url_for('logout'))  # Перенаправление на страницу логаута
     return username  # Вернуть имя пользователя, если токен действителен
 
 
+def socket_user():
+    """Имя пользователя сессии в обработчике Socket.IO; если вход не выполнен или токен
+    недействителен, клиенту отправляется error и возвращается None."""
+    token = session.get('token')
+    username = verify_token(token) if token else None
+    if not username:
+        logger.warning('Событие Socket.IO без действительного токена от клиента %s', request.sid)
+        emit('error', {'message': 'Требуется вход в систему'})
+        return None
+    return username
+
+
+def socket_drone_id(data):
+    """id дрона из данных события Socket.IO (обязательный); ValueError - нет или не число."""
+    try:
+        return int(data['drone_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Не задан или некорректен drone_id') from None
+
+
 @socketio.on('get_drone_status')
-@log_execution_time
-async def get_drone_status(data):
-    """Асинхронная функция для получения статуса дронов."""
+@timed(socket_event_seconds, event='get_drone_status')
+def get_drone_status(data):
+    """Функция для получения статуса дронов (обработчик выполняется в своем потоке)."""
     drone_id = data['drone_id']
     try:
-        status_mgn = await asyncio.to_thread(get_drone_status_mgn, drone_id)
+        status_mgn = get_drone_status_mgn(drone_id)
         emit('drone_status_response', {
             'drone_id': drone_id,
             'status': status_mgn
         })
     except Exception as e:
-        logging.error(
-            f'Ошибка получения статуса дрона ID: {drone_id}. {str(e)}')
+        logger.error(
+            'Ошибка получения статуса дрона ID: %s. %s', drone_id, e)
         emit('error', {'message': str(e)})
 
 
-async def get_drone_status_mgn(drone_id: int):
+def get_drone_status_mgn(drone_id: int, use_cache: bool = True):
     """Функция для получения статуса управления дроном (lock или release)"""
     try:
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            drone_repository = SQLiteIDroneRepository(conn)
-            status_mgn = await asyncio.to_thread(
-                drone_repository.get_drone_status_mgn, drone_id)
-            logging.info(
-                f'Получен статус управления дроном ID: {drone_id} - {status_mgn}.'
-            )
+        with DBConnectionManager(drone_factory, path_to_db=DRONE_DB) as conn:
+            drone_repository = get_drone_repository(conn)
+            status_mgn = drone_repository.get_drone_status_mgn(drone_id, use_cache)
+            # Статус опрашивается постоянно - только на уровне DEBUG
+            logger.debug('Получен статус управления дроном ID: %s - %s.', drone_id, status_mgn)
             return status_mgn
     except Exception as e:
-        logging.error(
-            f'Не получен статус управления дроном ID: {drone_id}! {str(e)}')
+        logger.error(
+            'Не получен статус управления дроном ID: %s! %s', drone_id, e)
+
+
+# Максимальное число id дронов в одном запросе статусов
+DRONE_STATUS_IDS_MAX = 10000
 
 
-async def set_drone_status_mgn(drone_id, status: str):
-    """Асинхронная функция для изменения текущего статуса управления дроном (lock)"""
+def parse_drone_ids(value):
+    """Список id дронов из списка или строки "1,2,3"; None - все дроны."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        raise ValueError('Ожидался список id дронов')
     try:
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            drone_repository = SQLiteIDroneRepository(conn)
-            await asyncio.to_thread(drone_repository.update_drone_status_mgn,
-                                    drone_id, status)
-            logging.warning(
-                f'Изменен статус управления дроном ID: {drone_id} - LOCK')
-            await asyncio.to_thread(conn.commit)
-    except Exception as e:
-        logging.error(
-            f'Не изменен статус управления дроном ID: {drone_id}! {str(e)}')
+        drone_ids = [int(drone_id) for drone_id in value]
+    except (TypeError, ValueError):
+        raise ValueError('Некорректный список id дронов') from None
+    if len(drone_ids) > DRONE_STATUS_IDS_MAX:
+        raise ValueError(f'Не больше {DRONE_STATUS_IDS_MAX} id дронов в одном запросе')
+    return drone_ids
+
+
+def get_drones_status(drone_ids=None):
+    """Статусы управления многих (или всех) дронов одним запросом: {id: lock/release}"""
+    with DBConnectionManager(drone_factory, path_to_db=DRONE_DB) as conn:
+        return get_drone_repository(conn).get_drones_status_mgn(drone_ids)
+
+
+@socketio.on('get_drones_status')
+@timed(socket_event_seconds, event='get_drones_status')
+def handle_get_drones_status(data=None):
+    """Статусы списка дронов (drone_ids) или всего парка одним сообщением."""
+    if not socket_user():
+        return
+    try:
+        statuses = get_drones_status(parse_drone_ids((data or {}).get('drone_ids')))
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    emit('drones_status_response', {'statuses': statuses})
 
 
-async def check_drone_status_mgn(drone_id):
-    status_mgn = await get_drone_status_mgn(drone_id)
-    if status_mgn == 'release':
-        return status_mgn
+@socketio.on('subscribe_drone_status')
+@timed(socket_event_seconds, event='subscribe_drone_status')
+def handle_subscribe_drone_status(data=None):
+    """Подписка на переходы lock/release дронов drone_ids (или всего парка):
+    текущие статусы одним сообщением, далее только переходы (drone_status_changed)."""
+    if not socket_user():
+        return
+    try:
+        drone_ids = parse_drone_ids((data or {}).get('drone_ids'))
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    for room in [status_room()] if drone_ids is None else map(status_room, drone_ids):
+        join_room(room)
+    emit('drone_status_snapshot', {'statuses': get_drones_status(drone_ids)})
+
+
+@socketio.on('unsubscribe_drone_status')
+@timed(socket_event_seconds, event='unsubscribe_drone_status')
+def handle_unsubscribe_drone_status(data=None):
+    if not socket_user():
+        return
+    try:
+        drone_ids = parse_drone_ids((data or {}).get('drone_ids'))
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    for room in [status_room()] if drone_ids is None else map(status_room, drone_ids):
+        leave_room(room)
 
 
 @app.route('/')
@@ -153,212 +483,813 @@ def index():
     return redirect(url_for('login'))
 
 
+def get_password_hash(login):
+    """Функция для получения хэша пароля пользователя (None, если пользователя нет)"""
+    with DBConnectionManager(factory, path_to_db='prod.db') as conn:
+        return SQLiteUserRepository(conn).get_password_hash(login)
+
+
+def set_password_hash(login, password_hash):
+    with DBConnectionManager(factory, path_to_db='prod.db') as conn:
+        SQLiteUserRepository(conn).set_password_hash(login, password_hash)
+
+
+async def call_login_limiter(method, key):
+    """Вызов acquire или reset ограничения попыток входа; общие счетчики (в БД) - в потоке БД."""
+    if LOGIN_LIMITS_SHARED:
+        return await db_executor.run(method, key)
+    return method(key)
+
+
+async def check_password(login, password):
+    """Проверка пароля в пуле хэширования; устаревший хэш пересчитывается с текущей стоимостью."""
+    password_hash = await db_executor.run(get_password_hash, login)
+    if not await password_executor.run(password_hasher.verify, password, password_hash):
+        return False
+    if password_hasher.needs_rehash(password_hash):
+        password_hash = await password_executor.run(password_hasher.hash, password)
+        await db_executor.run(set_password_hash, login, password_hash)
+    return True
+
+
 @app.route('/login', methods=['GET', 'POST'])
 async def login():
     if request.method == 'POST':
         login = request.form['login']
         password = request.form['password']
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            cursor = conn.cursor()
-            await asyncio.to_thread(
-                cursor.execute,
-                "SELECT * FROM tbl_users WHERE login = ? AND password = ?",
-                (login, password))
-            user = await asyncio.to_thread(cursor.fetchone)
-            if user:
-                session['token'] = generate_token(login)
-                response = redirect(url_for('list_drones'))
-                logging.warning(f'Пользователь {login} авторизован в системе!')
-                return response
-            else:
-                flash('Неправильный логин или пароль', 'danger')
+        try:
+            retry_after = (await call_login_limiter(address_limiter.acquire, request.remote_addr or '') or
+                           await call_login_limiter(login_limiter.acquire, login))
+            if retry_after:
+                logger.warning('Превышено число попыток входа пользователя %s с адреса %s!',
+                               login, request.remote_addr)
+                flash(f'Слишком много попыток входа, повторите через {math.ceil(retry_after)} с', 'danger')
+                return render_template('login.html'), 429, {'Retry-After': str(math.ceil(retry_after))}
+            valid = await check_password(login, password)
+            if valid:
+                await call_login_limiter(login_limiter.reset, login)
+        except DBExecutorOverloadedError as e:
+            logger.error('Перегрузка пула БД или проверки паролей: %s', e)
+            flash('Сервер перегружен, повторите вход позже', 'danger')
+            return render_template('login.html'), 503
+        if valid:
+            session['token'] = generate_token(login)
+            response = redirect(url_for('list_drones'))
+            logger.warning('Пользователь %s авторизован в системе!', login)
+            return response
+        else:
+            flash('Неправильный логин или пароль', 'danger')
     return render_template('login.html')
 
 
 @app.route('/logout')
 def logout():
     session.pop('token', None)
-    logging.warning(f'Пользователь вышел из системы!')
+    logger.warning('Пользователь вышел из системы!')
     return redirect(url_for('login'))
 
 
+# Размер страницы списка дронов по умолчанию и максимальный
+DRONES_PAGE_SIZE = 50
+DRONES_PAGE_SIZE_MAX = 500
+# Размер страницы выгрузки парка (одно чтение из БД на соединении из пула)
+EXPORT_PAGE_SIZE = int(os.environ.get('BPLA_EXPORT_PAGE_SIZE', 1000))
+
+
+def parse_drone_list_args(args):
+    """Функция для разбора параметров фильтрации, сортировки и пагинации списка дронов"""
+    filters = {
+        'manufacturer': args.get('manufacturer', '').strip() or None,
+        'model': args.get('model', '').strip() or None,
+        'serial_prefix': args.get('serial', '').strip() or None,
+        'year_from': args.get('year_from', type=int),
+        'year_to': args.get('year_to', type=int),
+    }
+    sort = args.get('sort', 'id')
+    if sort not in SQLiteDroneMapper.sortable_cols:
+        raise ValueError(f'Недопустимая колонка сортировки: {sort}')
+    descending = args.get('order', 'asc') == 'desc'
+    limit = args.get('limit', DRONES_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), DRONES_PAGE_SIZE_MAX)
+    return {
+        'filters': filters,
+        'sort': sort,
+        'descending': descending,
+        'limit': limit,
+        'cursor': args.get('cursor') or None
+    }
+
+
+def templates_fingerprint(*names):
+    """Хэш исходников шаблонов: входит в ETag, чтобы после изменения шаблонов
+    клиенты не получали 304 для страниц, отрисованных старыми шаблонами."""
+    digest = hashlib.sha1()
+    for name in names:
+        source, _, _ = app.jinja_loader.get_source(app.jinja_env, name)
+        digest.update(source.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+PAGE_TEMPLATES_FINGERPRINT = templates_fingerprint('list_drones.html', '_drone_row.html', 'update.html')
+
+
+def drone_row_fields(drone: Drone):
+    """Поля дрона, выводимые в строке таблицы списка дронов."""
+    return drone.id, drone.serial_number, drone.model, drone.manufacturer, drone.n_rotors
+
+
+def render_drone_rows(drones):
+    """Строки таблицы списка дронов из кэша фрагментов. Фрагмент отрисовывается
+    заново, если дрона нет в кэше или выводимые поля изменились (например, дрон
+    изменен в другом процессе); изменение и удаление через сервер сбрасывают фрагмент."""
+    template = None
+    rows = []
+    for drone in drones:
+        fields = drone_row_fields(drone)
+        cached = page_cache.get(('row', drone.id))
+        if cached is not None and cached[0] == fields:
+            rows.append(cached[1])
+            continue
+        if template is None:
+            template = app.jinja_env.get_template('_drone_row.html')
+        html = template.render(drone=drone)
+        page_cache.set(('row', drone.id), (fields, html))
+        rows.append(html)
+    return Markup(''.join(rows))
+
+
+async def render_fleet_page(render):
+    """Условный GET для страниц с данными дронов.
+
+    ETag строится по версии данных парка, которую увеличивает каждая запись дронов
+    в той же транзакции: если у клиента актуальная страница (If-None-Match), ответ 304
+    стоит одного чтения версии. Время изменения (секунды) для условного GET не
+    используется: две записи в одну секунду дали бы устаревшую страницу. Иначе
+    страница берется из кэша по (версии, URL) или отрисовывается функцией render
+    и кэшируется вместе со сжатым вариантом. Версия читается до данных, поэтому
+    страница не может оказаться старше своей версии. Страницы с flash-сообщениями
+    отрисовываются всегда и не кэшируются.
+    """
+    if '_flashes' in session:
+        return await render()
+    version, _ = await drones_db.get_fleet_version()
+    etag = f'{PAGE_TEMPLATES_FINGERPRINT}-{version}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        key = ('page', version, request.full_path)
+        cached = page_cache.get(key)
+        if cached is None:
+            body = (await render()).encode('utf-8')
+            cached = (body, gzip_body(body))
+            page_cache.set(key, cached)
+        body, compressed = cached
+        response = Response(body, mimetype='text/html')
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip']:
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag, weak=True)
+    # Браузер хранит страницу, но перед показом всегда проверяет версию
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/drones', methods=['GET'])
-@log_execution_time
 async def list_drones():
     token = session.get('token')
     result = check_session_token(token)
 
     if isinstance(result, str):
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            drone_repository = SQLiteIDroneRepository(conn)
-            drones = await asyncio.to_thread(
-                drone_repository.get_drones_with_id, order_by='id')
-            return render_template('list_drones.html', drones=drones)
+        try:
+            params = parse_drone_list_args(request.args)
+        except ValueError as e:
+            # Некорректный фильтр или курсор: список без параметров с сообщением
+            flash(str(e), 'danger')
+            return redirect(url_for('list_drones'))
+
+        async def render():
+            drones, next_cursor = await drones_db.get_drones_page(**params)
+            return render_template('list_drones.html',
+                                   rows=render_drone_rows(drones),
+                                   next_cursor=next_cursor,
+                                   params=params,
+                                   args=request.args)
+
+        try:
+            return await render_fleet_page(render)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('list_drones'))
+    return result
+
+
+@app.route('/api/drones', methods=['GET'])
+async def api_list_drones():
+    """JSON-версия списка дронов с теми же фильтрами и курсорами"""
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        try:
+            params = parse_drone_list_args(request.args)
+            drones, next_cursor = await drones_db.get_drones_page(**params)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({
+            "drones": [drone.to_dict() for drone in drones],
+            "next_cursor": next_cursor
+        })
+    return result
+
+
+@app.route('/api/drones/status', methods=['GET'])
+async def api_drones_status():
+    """Снимок статусов управления: ?ids=1,2,3 или весь парк"""
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        try:
+            statuses = await drones_db.get_drones_status_mgn(parse_drone_ids(request.args.get('ids')))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"statuses": statuses})
+    return result
+
+
+@app.route('/drones/export', methods=['GET'])
+def export_drones():
+    """Потоковая выгрузка парка: ?format=csv | ndjson и фильтры списка дронов.
+    Дроны читаются keyset-страницами по EXPORT_PAGE_SIZE и сразу отдаются клиенту
+    (память не зависит от размера парка), порядок - по id (order=desc - обратный).
+    Соединение из пула берется на время чтения одной страницы, медленный клиент
+    не держит его и транзакцию чтения. Если клиент принимает gzip, ответ сжимается на лету."""
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        file_format = request.args.get('format', 'csv')
+        if file_format not in EXPORT_MIMETYPES:
+            return jsonify({"error": "Параметр format: csv или ndjson"}), 400
+        try:
+            params = parse_drone_list_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        def fetch_page(cursor):
+            with DBConnectionManager(drone_factory, path_to_db=DRONE_DB) as conn:
+                return drone_factory.create_drone_repository(conn).get_drones_page(
+                    params['filters'], descending=params['descending'], limit=EXPORT_PAGE_SIZE, cursor=cursor)
+
+        headers = {'Content-Disposition': f'attachment; filename=drones.{file_format}', 'Vary': 'Accept-Encoding'}
+        body = iter_export_drones(iter_drone_pages(fetch_page), file_format)
+        if request.accept_encodings['gzip']:
+            body = iter_gzip(body)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(body, mimetype=EXPORT_MIMETYPES[file_format], headers=headers)
     return result
 
 
 @app.route('/drones/add', methods=['GET', 'POST'])
-@log_execution_time
 async def add_drone():
     token = session.get('token')
     result = check_session_token(token)
 
     if isinstance(result, str):
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            drone_repository = SQLiteIDroneRepository(conn)
-            if request.method == 'POST':
-                try:
-                    drone_id = {
-                        'id':
-                        await asyncio.to_thread(drone_repository.get_drone_id)
-                    }
-                    drone_data_without_id = {
-                        key: request.form[key]
-                        for key in request.form
-                    }
-                    drone_data = {**drone_id, **drone_data_without_id}
-                    drone = Drone(**drone_data)
-                    await asyncio.to_thread(drone_repository.add_drone, drone)
-                    logging.info(f'В систему добавлен дрон с ID: {drone_id}')
-                    return redirect(url_for('list_drones'))
-                except Exception as e:
-                    logging.error(
-                        f'Произошла ошибка при добавлении дрона: {str(e)}')
-            return render_template('add_drone.html')
+        if request.method == 'POST':
+            try:
+                drone_id = {
+                    'id': await drones_db.get_drone_id()
+                }
+                drone_data_without_id = {
+                    key: request.form[key]
+                    for key in request.form
+                }
+                drone_data = {**drone_id, **drone_data_without_id}
+                drone = Drone(**drone_data)
+                await drones_db.add_drone(drone)
+                logger.info('В систему добавлен дрон с ID: %s', drone_id)
+                return redirect(url_for('list_drones'))
+            except ValueError as e:
+                logger.warning('Некорректные данные дрона: %s', e)
+                flash(str(e), 'danger')
+            except DBExecutorOverloadedError:
+                raise
+            except Exception as e:
+                logger.error(
+                    'Произошла ошибка при добавлении дрона: %s', e)
+        return render_template('add_drone.html')
+    return result
+
+
+@app.route('/drones/import', methods=['POST'])
+async def import_drones():
+    """Пакетный импорт дронов из CSV или JSON/NDJSON.
+
+    Файл передается полем file (multipart) или телом запроса. Формат задается
+    параметром format, иначе определяется по расширению файла. Файл сначала
+    разбирается во временный файл (ошибка формата - 400 без обращения к БД), затем
+    записывается в БД порциями в одной транзакции: блокировка записи SQLite не
+    держится, пока клиент передает файл.
+    """
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        upload = request.files.get('file')
+        if upload:
+            stream = upload.stream
+            file_format = request.args.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+        else:
+            stream = request.stream
+            file_format = request.args.get('format', 'ndjson')
+        try:
+            spool = spool_import_drones(stream, file_format)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            logger.error('Ошибка импорта дронов: %s', e)
+            return jsonify({"error": str(e)}), 400
+        with spool:
+            batch_result = await drones_db.add_drones(iter_import_drones(spool, 'ndjson'))
+        logger.warning('Импортировано дронов: %s', batch_result.succeeded)
+        return jsonify(batch_result.to_dict())
     return result
 
 
 @app.route('/drones/update/<int:drone_id>', methods=['GET', 'POST'])
-@log_execution_time
 async def update_drone(drone_id):
     token = session.get('token')
     result = check_session_token(token)
 
     if isinstance(result, str):
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            drone_repository = SQLiteIDroneRepository(conn)
-            try:
-                if request.method == 'POST':
-                    drone_data = {
-                        key: request.form[key]
-                        for key in request.form
-                    }
-                    drone_repository.update_drone(drone_id, **drone_data)
-                    logging.warning(
-                        f'В системе обновлен дрон с ID: {drone_id}')
-                    return redirect(url_for('list_drones'))
-
-                drone = drone_repository.get_drone(drone_id)
-                return render_template('update.html', drone=drone)
-            except Exception as e:
-                logging.error(
-                    f'Произошла ошибка при обновлении дрона: {str(e)}')
+        try:
+            if request.method == 'POST':
+                drone_data = {
+                    key: request.form[key]
+                    for key in request.form
+                }
+                try:
+                    await drones_db.update_drone(drone_id, **drone_data)
+                except ValueError as e:
+                    logger.warning('Некорректные данные дрона: %s', e)
+                    flash(str(e), 'danger')
+                    return render_template('update.html', drone=await drones_db.get_drone(drone_id)), 400
+                finally:
+                    page_cache.invalidate(('row', drone_id))
+                logger.warning(
+                    'В системе обновлен дрон с ID: %s', drone_id)
+                return redirect(url_for('list_drones'))
+
+            async def render():
+                return render_template('update.html', drone=await drones_db.get_drone(drone_id))
+
+            return await render_fleet_page(render)
+        except DBExecutorOverloadedError:
+            raise
+        except Exception as e:
+            logger.error(
+                'Произошла ошибка при обновлении дрона: %s', e)
 
     return result
 
 
 @app.route('/drones/delete/<int:drone_id>', methods=['POST'])
-@log_execution_time
 async def delete_drone(drone_id):
     token = session.get('token')
     result = check_session_token(token)
 
     if isinstance(result, str):
-        with DBConnectionManager(factory, path_to_db='prod.db') as conn:
-            drone_repository = SQLiteIDroneRepository(conn)
-            drone_repository.remove_drone(drone_id)
-            logging.warning(f'Из системы удален дрон с ID: {drone_id}')
-            return redirect(url_for('list_drones'))
+        await drones_db.remove_drone(drone_id)
+        page_cache.invalidate(('row', drone_id))
+        spatial_index.remove(drone_id)
+        logger.warning('Из системы удален дрон с ID: %s', drone_id)
+        return redirect(url_for('list_drones'))
 
     return result
 
 
+def emit_drone_status(drone_id, status):
+    """Переход статуса управления - подписчикам дрона и всего парка (каждому один раз)."""
+    socketio.emit('drone_status_changed', {'drone_id': drone_id, 'status': status},
+                  to=[status_room(), status_room(drone_id)])
+
+
+def notify_drone_released(drone_id):
+    """Уведомление операторов, ожидающих освобождения дрона, и подписчиков статусов."""
+    socketio.emit('drone_released', {'drone_id': drone_id}, to=lock_room(drone_id))
+    emit_drone_status(drone_id, 'release')
+
+
+def notify_drone_acquired(drone_id):
+    emit_drone_status(drone_id, 'lock')
+
+
+# Аренда управления дронами: срок аренды в секундах задается переменной окружения BPLA_LOCK_LEASE
+lock_manager = DroneLockManager(drone_factory, DRONE_DB,
+                                lease_seconds=float(os.environ.get('BPLA_LOCK_LEASE', 30)),
+                                repository_factory=get_drone_repository,
+                                on_release=notify_drone_released,
+                                on_acquire=notify_drone_acquired)
+lock_manager.start()
+
+# Токен аренды страницы управления (secrets.token_urlsafe)
+LEASE_RE = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+
+def request_lease_owner(user):
+    """Владелец аренды по токену аренды из запроса страницы управления (None - токена нет)."""
+    lease = request.values.get('lease', '')
+    return lease_owner(user, lease) if LEASE_RE.fullmatch(lease) else None
+
+
 @app.route('/drones/control/<int:drone_id>', methods=['POST'])
 async def control_drone(drone_id):
     token = session.get('token')
     result = check_session_token(token)
 
-    if await check_drone_status_mgn(drone_id) == 'release':
-        await set_drone_status_mgn(drone_id, 'lock')
+    if not isinstance(result, str):
+        return result
+    # Новая аренда на каждую страницу управления: другая вкладка того же оператора ее не освободит
+    lease = secrets.token_urlsafe(16)
+    if await db_executor.run(lock_manager.acquire, drone_id, lease_owner(result, lease)):
+        logger.warning('Оператор %s получил управление дроном ID: %s', result, drone_id)
+        return render_template('control_drone.html',
+                               token=token,
+                               drone_id=drone_id,
+                               lease=lease,
+                               lease_seconds=lock_manager.lease_seconds,
+                               telemetry_frame_layout=telemetry_frame_layout(),
+                               socket_transports=SOCKET_TRANSPORTS)
+    return jsonify({
+        "error":
+        f'Доступ к управлению заблокирован! Дроном ID: {drone_id} управляет другой оператор.',
+        "wait_event": 'drone_released'
+    }), 403
+
+
+@app.route('/drones/heartbeat/<int:drone_id>', methods=['POST'])
+async def drone_heartbeat(drone_id):
+    """Продление аренды управления дроном страницей управления"""
+    token = session.get('token')
+    result = check_session_token(token)
 
-        if isinstance(result, str):
-            return render_template('control_drone.html',
-                                   token=token,
-                                   drone_id=drone_id)
+    if not isinstance(result, str):
         return result
-    else:
-        return jsonify({
-            "error":
-            f'Доступ к управлению заблокирован! Дроном ID: {drone_id} управляет другой оператор.'
-        }), 403
+    owner = request_lease_owner(result)
+    if owner is None:
+        return jsonify({"error": 'Не задан токен аренды управления.'}), 400
+    if await db_executor.run(lock_manager.renew, drone_id, owner):
+        return jsonify({"drone_id": drone_id, "lease_seconds": lock_manager.lease_seconds})
+    return jsonify({"error": f'Аренда управления дроном ID: {drone_id} потеряна.'}), 409
 
 
 @app.route('/drones/release/<int:drone_id>', methods=['GET', 'POST'])
 async def drone_release(drone_id):
     """Функция для выхода из формы управления дроном"""
-    await set_drone_status_mgn(drone_id, 'release')
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        owner = request_lease_owner(result)
+        if owner is not None:
+            await db_executor.run(lock_manager.release, drone_id, owner)
     return redirect(url_for('list_drones', drone_id=drone_id))
 
 
-# Задаем начальные параметры
-center_latitude = np.random.uniform(-90, 90)  # Широта центра
-center_longitude = np.random.uniform(-180, 180)  # Долгота центра
-battery_level = 100.0  # Начальный уровень заряда
-log_data = []  # Хранение логов
-telemetry_data = {}  # Переменная для хранения данных телеметрии
+@socketio.on('wait_drone_release')
+@timed(socket_event_seconds, event='wait_drone_release')
+def handle_wait_drone_release(data=None):
+    """Подписка оператора на уведомление об освобождении занятого дрона."""
+    if not socket_user():
+        return
+    try:
+        drone_id = socket_drone_id(data or {})
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    join_room(lock_room(drone_id))
 
 
-def generate_telemetry():
-    """Генератор случайной телеметрии."""
-    global battery_level, log_data, telemetry_data
+@socketio.on('stop_waiting_drone_release')
+@timed(socket_event_seconds, event='stop_waiting_drone_release')
+def handle_stop_waiting_drone_release(data=None):
+    try:
+        drone_id = socket_drone_id(data or {})
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    leave_room(lock_room(drone_id))
+
+
+# Фоновая запись телеметрии в БД пачками
+telemetry_writer = TelemetryBatchWriter(factory, 'prod.db')
+telemetry_writer.start()
+# Источник телеметрии: частота рассылки задается переменной окружения BPLA_TELEMETRY_RATE_HZ,
+# емкость истории на дрон - переменной окружения BPLA_TELEMETRY_HISTORY
+# Состояние телеметрии без подписчиков удаляется через BPLA_TELEMETRY_STATE_TTL секунд без обращений
+# Пространственный индекс последних позиций дронов: размер ячейки сетки в метрах задается
+# BPLA_SPATIAL_CELL_SIZE, минимальное допустимое расстояние между дронами - BPLA_MIN_SEPARATION
+spatial_index = SpatialIndex(cell_size=float(os.environ.get('BPLA_SPATIAL_CELL_SIZE', 500)))
+separation_monitor = SeparationMonitor(spatial_index, float(os.environ.get('BPLA_MIN_SEPARATION', 50)))
+# При работе в несколько процессов телеметрию моделирует процесс 0, остальные получают ее кадры
+telemetry_relay = TelemetryRelay(broker_client, WORKER_ID, producer=WORKER_ID == 0) if broker_client else None
+
+
+def drone_exists(drone_id: int):
+    """Есть ли дрон в БД (чтение через кэш дронов): телеметрия только для существующих дронов."""
+    with DBConnectionManager(drone_factory, path_to_db=DRONE_DB) as conn:
+        return get_drone_repository(conn).get_drone(drone_id) is not None
+
+
+telemetry_engine = TelemetryEngine(rate_hz=float(os.environ.get('BPLA_TELEMETRY_RATE_HZ', 1.0)),
+                                   history_size=int(os.environ.get('BPLA_TELEMETRY_HISTORY', 3600)),
+                                   recorder=telemetry_writer, spatial_index=spatial_index,
+                                   relay=telemetry_relay, drone_exists=drone_exists,
+                                   state_ttl=float(os.environ.get('BPLA_TELEMETRY_STATE_TTL', 300)))
+if telemetry_relay is not None:
+    metrics.gauge('bpla_telemetry_relay', 'Кадры телеметрии между процессами', ('stat',),
+                  lambda: {(stat,): value for stat, value in telemetry_relay.get_metrics().items()})
+# Максимальное количество записей истории в одном ответе
+TELEMETRY_HISTORY_MAX = 1000
+
+
+@app.route('/telemetry/<int:drone_id>', methods=['GET'])
+def get_telemetry(drone_id):
+    """Текущее состояние телеметрии дрона"""
+    token = session.get('token')
+    result = check_session_token(token)
 
-    # Генерация случайного радиуса в пределах 1000 метров
-    radius = 1000  # Радиус в метрах
-    distance = np.random.uniform(-radius, radius)
+    if isinstance(result, str):
+        return jsonify({"telemetry": telemetry_engine.snapshot(drone_id)})
+    return result
 
-    # Преобразование расстояния в координаты
-    delta_latitude = distance / 111320  # 1 градус широты ~ 111.32 км
-    delta_longitude = distance / (111320 * np.cos(np.radians(center_latitude))
-                                  )  # Корректируем по широте
 
-    # Генерация новых координат
-    current_latitude = center_latitude + delta_latitude * np.random.choice(
-        [-1, 1])
-    current_longitude = center_longitude + delta_longitude * np.random.choice(
-        [-1, 1])
+@app.route('/telemetry/<int:drone_id>/history', methods=['GET'])
+def get_telemetry_history(drone_id):
+    """История телеметрии дрона: ?last=N или ?since=<unix time>&until=<unix time>.
+    С format=text возвращаются строки лога."""
+    token = session.get('token')
+    result = check_session_token(token)
 
-    # Генерация других параметров
-    speed = np.random.uniform(0, 5.56)  # Скорость до 20 км/ч (5.56 м/с)
-    direction = np.random.randint(0, 361)  # Направление
-    altitude = np.random.uniform(0, 500)  # Высота до 500 метров
-    flight_time = np.random.randint(0, 3601)  # Время полета (в секундах)
+    if isinstance(result, str):
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        last = min(request.args.get('last', 100, type=int), TELEMETRY_HISTORY_MAX)
+        entries = telemetry_engine.history(drone_id, last=last, since=since, until=until)
+        if since is not None:
+            # Для окна времени отдаем самые свежие записи в пределах лимита
+            entries = {name: array[-TELEMETRY_HISTORY_MAX:] for name, array in entries.items()}
+        if request.args.get('format') == 'text':
+            return jsonify({"log": TelemetryRingBuffer.format_log(entries)})
+        return jsonify({"history": TelemetryRingBuffer.to_records(entries)})
+    return result
 
-    # Уменьшаем уровень заряда со временем
-    battery_level -= (speed * flight_time / 3600) * (
-        100 / 20)  # Пропорционально скорости и времени
-    battery_level = max(battery_level,
-                        0)  # Уровень заряда не может быть меньше 0%
 
-    telemetry_data["telemetry"] = (
-        f"Координаты: ({current_latitude:.6f}, {current_longitude:.6f})\n"
-        f"Скорость: {speed:.2f} м/с\n"
-        f"Направление: {direction}°\n"
-        f"Высота: {altitude:.2f} м\n"
-        f"Время полета: {flight_time} с\n"
-        f"Уровень заряда: {battery_level:.2f} %")
+@app.route('/telemetry/<int:drone_id>/archive', methods=['GET'])
+def get_telemetry_archive(drone_id):
+    """Сохраненная телеметрия дрона за интервал в формате NDJSON (потоковая выдача).
+    Параметры: since, until (unix time), resolution = raw | 1s | 1m."""
+    token = session.get('token')
+    result = check_session_token(token)
 
-    log_message = f"{time.strftime('%H:%M:%S')} - Телеметрия обновлена: {telemetry_data['telemetry']}"
-    log_data.append(log_message)
+    if isinstance(result, str):
+        until = request.args.get('until', time.time(), type=float)
+        since = request.args.get('since', until - 3600, type=float)
+        resolution = {'raw': None, '1s': 1, '1m': 60}.get(request.args.get('resolution', 'raw'), 'invalid')
+        if resolution == 'invalid':
+            return jsonify({"error": "Параметр resolution: raw, 1s или 1m"}), 400
+
+        def generate():
+            with DBConnectionManager(factory, path_to_db='prod.db') as conn:
+                telemetry_repository = SQLiteTelemetryRepository(conn)
+                if resolution is None:
+                    rows = telemetry_repository.get_samples(drone_id, since, until)
+                else:
+                    rows = telemetry_repository.get_rollups(drone_id, resolution, since, until)
+                for row in rows:
+                    yield json.dumps(row) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+    return result
+
+
+@socketio.on('subscribe_telemetry')
+@timed(socket_event_seconds, event='subscribe_telemetry')
+def handle_subscribe_telemetry(data):
+    """Подписка клиента на телеметрию дрона: полное состояние сразу, далее дельты.
+    С binary = true состояние и обновления приходят двоичными кадрами telemetry_frame
+    (один кадр за шаг со всеми дронами клиента)."""
+    if not socket_user():
+        return
+    try:
+        drone_id = socket_drone_id(data)
+        binary = bool(data.get('binary'))
+        telemetry_engine.subscribe(drone_id, request.sid, binary=binary)
+    except (ValueError, UnknownDroneError) as e:
+        emit('error', {'message': str(e)})
+        return
+    if not binary:
+        join_room(telemetry_room(drone_id))
+    telemetry_engine.start(socketio)
+    if binary:
+        emit('telemetry_frame', telemetry_engine.frame([drone_id]))
+    else:
+        emit('telemetry_snapshot', telemetry_engine.snapshot(drone_id))
+
+
+@socketio.on('unsubscribe_telemetry')
+@timed(socket_event_seconds, event='unsubscribe_telemetry')
+def handle_unsubscribe_telemetry(data):
+    try:
+        drone_id = socket_drone_id(data)
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    leave_room(telemetry_room(drone_id))
+    telemetry_engine.unsubscribe(drone_id, request.sid)
+
+
+@socketio.on('disconnect')
+@timed(socket_event_seconds, event='disconnect')
+def handle_disconnect(*args):
+    telemetry_engine.unsubscribe_all(request.sid)
 
 
 @socketio.on('request_telemetry')
-async def handle_request_telemetry():
-    """Обработчик для запроса телеметрии."""
-    generate_telemetry()
-    emit('telemetry_update', {
-        "telemetry": telemetry_data["telemetry"],
-        "log": "\n".join(log_data)
-    })
+@timed(socket_event_seconds, event='request_telemetry')
+def handle_request_telemetry(data=None):
+    """Обработчик для запроса телеметрии: новый шаг, состояние - числовыми полями
+    (telemetry_update) или двоичным кадром (telemetry_frame) при binary = true.
+    Текст для лога клиент формирует сам. Только для вошедших пользователей и
+    существующих дронов, drone_id обязателен."""
+    if not socket_user():
+        return
+    data = data or {}
+    try:
+        drone_id = socket_drone_id(data)
+        telemetry = telemetry_engine.step(drone_id)
+    except (ValueError, UnknownDroneError) as e:
+        emit('error', {'message': str(e)})
+        return
+    if data.get('binary'):
+        emit('telemetry_frame', telemetry_engine.frame([drone_id]))
+    else:
+        emit('telemetry_update', {"telemetry": telemetry})
+
+
+# Комната Socket.IO подписчиков предупреждений о сближении дронов
+SEPARATION_ROOM = 'separation_alerts'
+# Максимальное количество ближайших дронов в одном ответе
+NEAREST_MAX = 1000
+# Наибольший радиус поиска дронов рядом, м: ответ на большой радиус - почти весь парк
+NEARBY_RADIUS_MAX = float(os.environ.get('BPLA_NEARBY_RADIUS_MAX', 100000))
+# Наибольшее min_distance запроса сближений (по умолчанию - размер ячейки индекса): при большом
+# расстоянии число пар растет как квадрат числа дронов
+SEPARATION_DISTANCE_MAX = float(os.environ.get('BPLA_SEPARATION_DISTANCE_MAX',
+                                               max(spatial_index.cell_size, separation_monitor.min_distance)))
+# Максимальное количество пар сближения в одном ответе (ближайшие)
+SEPARATION_PAIRS_MAX = 1000
+
+
+def spatial_value(data, name: str, low: float, high: float, default=None):
+    """Числовой параметр пространственного запроса из диапазона [low, high];
+    ValueError - не число, не конечное число или вне диапазона."""
+    value = data.get(name, default) if default is not None else data[name]
+    value = float(value)
+    if not low <= value <= high:
+        raise ValueError(f'Параметр {name}: от {low} до {high}')
+    return value
+
+
+def parse_spatial_query(data):
+    """Разбор параметров пространственного запроса (query string или данные события):
+    lat, lon и radius (м, по умолчанию 500, не больше NEARBY_RADIUS_MAX) или k (ближайшие)
+    либо прямоугольник lat_min, lon_min, lat_max, lon_max. Возвращает список результатов индекса."""
+    try:
+        if 'lat_min' in data:
+            return {'drone_ids': spatial_index.within_bbox(
+                spatial_value(data, 'lat_min', -90, 90), spatial_value(data, 'lon_min', -180, 180),
+                spatial_value(data, 'lat_max', -90, 90), spatial_value(data, 'lon_max', -180, 180))}
+        latitude = spatial_value(data, 'lat', -90, 90)
+        longitude = spatial_value(data, 'lon', -180, 180)
+        if data.get('k') is not None:
+            found = spatial_index.nearest(latitude, longitude, min(int(data['k']), NEAREST_MAX))
+        else:
+            found = spatial_index.within_radius(latitude, longitude,
+                                                spatial_value(data, 'radius', 0, NEARBY_RADIUS_MAX, default=500))
+    except KeyError as e:
+        raise ValueError(f'Не задан параметр {e.args[0]}')
+    except TypeError as e:
+        raise ValueError(f'Неверные параметры пространственного запроса: {e}')
+    return {'drones': [{'drone_id': drone_id, 'distance': round(meters, 2)} for drone_id, meters in found]}
+
+
+def format_separation_pairs(pairs):
+    """Пары сближения для ответа: не больше SEPARATION_PAIRS_MAX ближайших."""
+    return [{'drone_ids': [first, second], 'distance': round(meters, 2)}
+            for first, second, meters in pairs[:SEPARATION_PAIRS_MAX]]
+
+
+@app.route('/api/drones/nearby', methods=['GET'])
+def api_drones_nearby():
+    """Дроны с известной позицией: в радиусе (?lat=&lon=&radius=), ближайшие (?lat=&lon=&k=)
+    или в прямоугольнике (?lat_min=&lon_min=&lat_max=&lon_max=)"""
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        try:
+            return jsonify(parse_spatial_query(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return result
+
+
+@app.route('/api/drones/separation', methods=['GET'])
+def api_drones_separation():
+    """Пары дронов ближе min_distance метров (по умолчанию BPLA_MIN_SEPARATION, не больше
+    SEPARATION_DISTANCE_MAX) по всему парку: не больше SEPARATION_PAIRS_MAX ближайших пар,
+    truncated - часть пар отброшена."""
+    token = session.get('token')
+    result = check_session_token(token)
+
+    if isinstance(result, str):
+        min_distance = request.args.get('min_distance', separation_monitor.min_distance, type=float)
+        if not 0 < min_distance <= SEPARATION_DISTANCE_MAX:
+            return jsonify({"error": f"Параметр min_distance: от 0 до {SEPARATION_DISTANCE_MAX} м"}), 400
+        try:
+            pairs = spatial_index.close_pairs(min_distance)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"min_distance": min_distance, "pairs": format_separation_pairs(pairs),
+                        "truncated": len(pairs) > SEPARATION_PAIRS_MAX})
+    return result
+
+
+@socketio.on('find_drones_nearby')
+@timed(socket_event_seconds, event='find_drones_nearby')
+def handle_find_drones_nearby(data=None):
+    """Пространственный запрос по сокету (параметры как у /api/drones/nearby)."""
+    if not socket_user():
+        return
+    try:
+        emit('drones_nearby_response', parse_spatial_query(data or {}))
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+
+
+@socketio.on('subscribe_separation_alerts')
+@timed(socket_event_seconds, event='subscribe_separation_alerts')
+def handle_subscribe_separation_alerts(data=None):
+    """Подписка на предупреждения о сближении: текущие сближения сразу, далее
+    separation_alert только при появлении новых и расхождении прежних пар."""
+    if not socket_user():
+        return
+    join_room(SEPARATION_ROOM)
+    telemetry_engine.start(socketio)
+    # Сближения отслеживает только процесс-производитель телеметрии, остальные считают их по индексу
+    if telemetry_engine.producer:
+        pairs = separation_monitor.active
+    else:
+        pairs = spatial_index.close_pairs(separation_monitor.min_distance)
+    emit('separation_snapshot', {'min_distance': separation_monitor.min_distance,
+                                 'pairs': format_separation_pairs(pairs)})
+
+
+@socketio.on('unsubscribe_separation_alerts')
+@timed(socket_event_seconds, event='unsubscribe_separation_alerts')
+def handle_unsubscribe_separation_alerts(data=None):
+    leave_room(SEPARATION_ROOM)
+
+
+def check_separation(sio):
+    """Проверка сближений после шага телеметрии (вызывается из фоновой рассылки).
+    Предупреждения рассылает только процесс, моделирующий телеметрию, чтобы при
+    нескольких процессах каждое сближение отправлялось один раз. Остальные процессы
+    поиск пар не выполняют."""
+    if not telemetry_engine.producer:
+        return
+    started, cleared = separation_monitor.check()
+    if started or cleared:
+        if started:
+            logger.warning("Сближение дронов ближе %s м: %s", separation_monitor.min_distance, started)
+        sio.emit('separation_alert', {'pairs': format_separation_pairs(started),
+                                      'cleared': [list(pair) for pair in cleared]}, to=SEPARATION_ROOM)
+
+
+telemetry_engine.on_tick = check_separation
+
+if broker_client is not None:
+    broker_client.start()
+    # Рассылка телеметрии запускается сразу: производитель нужен остальным процессам
+    # и до первой подписки у него
+    telemetry_engine.start(socketio)
+    # Процесс группы server_workers.py (рабочий процесс gunicorn, загрузивший приложение)
+    # объявляет готовность с меткой своего запуска
+    if 'BPLA_WORKER_SPAWN' in os.environ and broker_client.wait_connected(10):
+        broker_client.publish(WORKERS_CHANNEL, json.dumps({'worker': WORKER_ID,
+                                                           'spawn': os.environ['BPLA_WORKER_SPAWN']}).encode())
 
 
 if __name__ == '__main__':
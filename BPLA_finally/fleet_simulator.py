@@ -0,0 +1,189 @@
+import argparse
+import time
+import numpy as np
+
+# 1 градус широты ~ 111.32 км
+METERS_PER_DEGREE = 111320.0
+
+
+class FleetSimulator:
+    """Векторизованный симулятор телеметрии парка дронов.
+
+    Состояние всех дронов хранится в массивах NumPy, один шаг step() продвигает
+    весь парк (или его часть) несколькими векторными операциями. Массивы выделяются
+    с запасом (при нехватке емкость удваивается), атрибуты ids, latitude и т.д. -
+    срезы по числу дронов. При одинаковом seed и одинаковой последовательности
+    вызовов результаты воспроизводятся.
+    """
+    # Массивы состояния, которые можно задать извне (set_values)
+    STATE_COLUMNS = ("latitude", "longitude", "heading", "speed", "altitude", "flight_time", "battery_level")
+    # Все массивы по строкам дронов (кроме ids)
+    COLUMNS = ("home_latitude", "home_longitude") + STATE_COLUMNS
+
+    def __init__(self, n_drones: int = 0, seed=None, radius: float = 1000.0,
+                 max_speed: float = 5.56, max_altitude: float = 500.0):
+        self.rng = np.random.default_rng(seed)
+        self.radius = radius  # Радиус полета вокруг точки старта, м
+        self.max_speed = max_speed  # До 20 км/ч (5.56 м/с)
+        self.max_altitude = max_altitude
+        self.__rows = {}  # drone_id -> номер строки в массивах
+        # Массивы с запасом; heading - направление, градусы от севера
+        self.__buffers = {name: np.empty(0) for name in self.COLUMNS}
+        self.__buffers["ids"] = np.empty(0, dtype=np.int64)
+        self.__expose(0)
+        if n_drones:
+            self.add_drones(range(1, n_drones + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __expose(self, n: int):
+        """Атрибуты-массивы - срезы (без копирования) первых n строк буферов."""
+        for name, buffer in self.__buffers.items():
+            setattr(self, name, buffer[:n])
+
+    def add_drones(self, drone_ids):
+        """Добавление дронов в симуляцию (уже известные id пропускаются)."""
+        new_ids = [drone_id for drone_id in dict.fromkeys(drone_ids) if drone_id not in self.__rows]
+        if not new_ids:
+            return
+        n = len(new_ids)
+        first_row = len(self.ids)
+        total = first_row + n
+        capacity = len(self.__buffers["ids"])
+        if total > capacity:
+            # Рост с удвоением: добавление по одному дрону в среднем O(1)
+            capacity = max(total, 2 * capacity)
+            for name, buffer in self.__buffers.items():
+                grown = np.empty(capacity, dtype=buffer.dtype)
+                grown[:first_row] = buffer[:first_row]
+                self.__buffers[name] = grown
+        self.__expose(total)
+        new = slice(first_row, total)
+        self.ids[new] = new_ids
+        self.home_latitude[new] = self.latitude[new] = self.rng.uniform(-60, 60, n)
+        self.home_longitude[new] = self.longitude[new] = self.rng.uniform(-180, 180, n)
+        self.heading[new] = self.rng.uniform(0, 360, n)
+        self.speed[new] = self.rng.uniform(0, self.max_speed, n)
+        self.altitude[new] = self.rng.uniform(0, self.max_altitude, n)
+        self.flight_time[new] = 0.0
+        self.battery_level[new] = 100.0
+        self.__rows.update(zip(new_ids, range(first_row, total)))
+
+    def remove_drones(self, drone_ids):
+        """Удаление дронов из симуляции (неизвестные id пропускаются). На места
+        удаленных строк переносятся последние строки, при заполнении буферов меньше
+        чем на четверть емкость уменьшается вдвое. Возвращает пару массивов
+        (откуда, куда) перенесенных строк - для переноса состояния, хранимого по
+        строкам вне симулятора."""
+        removed = sorted({self.__rows.pop(drone_id) for drone_id in drone_ids if drone_id in self.__rows})
+        total = len(self.ids) - len(removed)
+        removed_tail = {row for row in removed if row >= total}
+        destinations = np.fromiter((row for row in removed if row < total), dtype=np.intp)
+        sources = np.fromiter((row for row in range(total, len(self.ids)) if row not in removed_tail),
+                              dtype=np.intp, count=len(destinations))
+        for buffer in self.__buffers.values():
+            buffer[destinations] = buffer[sources]
+        self.__rows.update(zip(self.__buffers["ids"][destinations].tolist(), destinations.tolist()))
+        capacity = len(self.__buffers["ids"])
+        if total < capacity // 4:
+            capacity //= 2
+            self.__buffers = {name: buffer[:capacity].copy() for name, buffer in self.__buffers.items()}
+        self.__expose(total)
+        return sources, destinations
+
+    def rows(self, drone_ids):
+        """Номера строк массивов для списка id дронов."""
+        return np.fromiter((self.__rows[drone_id] for drone_id in drone_ids), dtype=np.intp)
+
+    def step(self, dt: float = 1.0, rows=None):
+        """Шаг симуляции на dt секунд для всех дронов или для строк rows."""
+        index = slice(None) if rows is None else rows
+        n = len(self.ids) if rows is None else len(rows)
+        if n == 0:
+            return
+        # Случайное блуждание: шум масштабируется как sqrt(dt)
+        noise = self.rng.standard_normal((3, n)) * np.sqrt(dt)
+        latitude = self.latitude[index]
+        longitude = self.longitude[index]
+        # Вышедшие за радиус дроны разворачиваются к точке старта
+        north = (latitude - self.home_latitude[index]) * METERS_PER_DEGREE
+        east = (longitude - self.home_longitude[index]) * METERS_PER_DEGREE * np.cos(np.radians(latitude))
+        outside = north * north + east * east > self.radius * self.radius
+        heading = np.where(outside, np.degrees(np.arctan2(-east, -north)), self.heading[index] + noise[0] * 15.0)
+        speed = np.clip(self.speed[index] + noise[1] * 0.5, 0, self.max_speed)
+        altitude = np.clip(self.altitude[index] + noise[2] * 2.0, 0, self.max_altitude)
+        battery = self.battery_level[index]
+        speed[battery <= 0] = 0.0
+        # Перемещение по направлению с учетом сжатия долготы на широте
+        heading_rad = np.radians(heading)
+        distance = speed * dt
+        latitude_new = latitude + distance * np.cos(heading_rad) / METERS_PER_DEGREE
+        longitude_new = longitude + distance * np.sin(heading_rad) / (
+            METERS_PER_DEGREE * np.cos(np.radians(latitude)))
+        # Уменьшаем уровень заряда пропорционально скорости и времени
+        battery = np.maximum(battery - (speed * dt / 3600) * (100 / 20) - 0.001 * dt, 0)
+        self.latitude[index] = latitude_new
+        self.longitude[index] = longitude_new
+        self.heading[index] = np.mod(heading, 360)
+        self.speed[index] = speed
+        self.altitude[index] = altitude
+        self.flight_time[index] += dt
+        self.battery_level[index] = battery
+
+    def set_values(self, rows, **columns):
+        """Запись значений в строки rows (например, состояния, полученного от
+        другого процесса): set_values(rows, latitude=..., speed=...)."""
+        for name, values in columns.items():
+            if name not in self.STATE_COLUMNS:
+                raise ValueError(f"Неизвестный столбец состояния: {name}")
+            getattr(self, name)[rows] = values
+
+    def values(self, drone_id: int):
+        """Текущие значения телеметрии дрона в виде словаря."""
+        row = self.__rows[drone_id]
+        return {
+            "current_latitude": float(self.latitude[row]),
+            "current_longitude": float(self.longitude[row]),
+            "speed": float(self.speed[row]),
+            "direction": int(self.heading[row]),
+            "altitude": float(self.altitude[row]),
+            "flight_time": float(self.flight_time[row]),
+            "battery_level": float(self.battery_level[row]),
+        }
+
+
+def run_load(n_drones: int, rate_hz: float, seconds: float, seed=None):
+    """Нагрузочный прогон: шаги всего парка с частотой rate_hz в течение seconds.
+    Возвращает статистику времени шага."""
+    simulator = FleetSimulator(n_drones, seed=seed)
+    interval = 1.0 / rate_hz
+    step_times = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        simulator.step(interval)
+        elapsed = time.perf_counter() - started
+        step_times.append(elapsed)
+        time.sleep(max(interval - elapsed, 0))
+    step_times = np.asarray(step_times)
+    return {
+        "drones": n_drones,
+        "rate_hz": rate_hz,
+        "steps": len(step_times),
+        "step_mean_ms": float(step_times.mean() * 1000),
+        "step_p99_ms": float(np.percentile(step_times, 99) * 1000),
+        "budget_ms": interval * 1000,
+        "keeps_up": bool(np.percentile(step_times, 99) < interval),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочный симулятор телеметрии парка дронов")
+    parser.add_argument("--drones", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=10.0, help="Частота шагов, Гц")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    for key, value in run_load(args.drones, args.rate, args.seconds, args.seed).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,201 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+# Атрибуты LogRecord, которые не переносятся в JSON как дополнительные поля (extra)
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON: время, уровень, логгер, функция, сообщение,
+    поля из extra и текст исключения."""
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Файловый обработчик с ротацией по размеру, который не сбрасывает буфер
+    после каждой записи: flush() вызывает BatchingQueueListener после пачки записей.
+    Размер файла считается по записанным байтам, без seek/tell на каждую запись."""
+    def __init__(self, filename, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, encoding="utf-8"):
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.__size = os.path.getsize(self.baseFilename)
+
+    def emit(self, record):
+        try:
+            data = self.format(record) + self.terminator
+            size = len(data.encode(self.encoding))
+            if self.maxBytes > 0 and self.__size > 0 and self.__size + size > self.maxBytes:
+                self.doRollover()
+                self.__size = 0
+            self.stream.write(data)
+            self.__size += size
+        except Exception:
+            self.handleError(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler для ограниченной очереди: при переполнении запись отбрасывается
+    (и учитывается в dropped), а не блокирует поток, который пишет в лог."""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Подстановка аргументов в сообщение и текст исключения - в вызывающем потоке
+        (аргументы могут измениться позже), форматирование записи - в потоке записи."""
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener:
+    """Фоновый поток записи лога: забирает из очереди до batch_size записей,
+    передает их обработчикам и сбрасывает буферы обработчиков один раз на пачку.
+    Если новых записей нет, накопленное сбрасывается не реже раза в flush_interval секунд."""
+    _sentinel = None
+
+    def __init__(self, log_queue, *handlers, batch_size: int = 256, flush_interval: float = 1.0):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.__thread = None
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__thread = threading.Thread(target=self.__run, name="log-writer", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Запись оставшихся в очереди записей и остановка потока."""
+        if self.__thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self.__thread.join()
+        self.__thread = None
+
+    def __handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def __flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+    def __run(self):
+        pending = False
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval if pending else None)
+            except queue.Empty:
+                self.__flush()
+                pending = False
+                continue
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopped = False
+            for record in batch:
+                if record is self._sentinel:
+                    stopped = True
+                    continue
+                self.__handle(record)
+            # Ошибки сбрасываются сразу, остальное - пачкой или по интервалу
+            if stopped or len(batch) >= self.batch_size or any(
+                    item is not None and item.levelno >= logging.ERROR for item in batch):
+                self.__flush()
+                pending = False
+            else:
+                pending = True
+            if stopped:
+                return
+
+
+def parse_levels(spec: str):
+    """Уровни логгеров из строки вида "db_modules=WARNING,werkzeug=ERROR"."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        if not level:
+            raise ValueError(f"Ожидалось имя_логгера=УРОВЕНЬ, получено: {item}")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(filename: str = "server.log", level="INFO", levels: dict = None, json_format: bool = True,
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, batch_size: int = 256,
+                  flush_interval: float = 1.0, queue_size: int = 10000):
+    """Неблокирующее логирование: обработчики корневого логгера заменяются
+    DroppingQueueHandler, запись в файл с ротацией выполняет BatchingQueueListener.
+    levels задает уровни отдельных логгеров (модулей). Возвращает запущенный listener,
+    он останавливается (с записью хвоста очереди) при завершении процесса."""
+    file_handler = BufferedRotatingFileHandler(filename, max_bytes=max_bytes, backup_count=backup_count)
+    file_handler.setFormatter(JSONFormatter() if json_format else logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(name)s.%(funcName)s: %(message)s'))
+    log_queue = queue.Queue(queue_size)
+    listener = BatchingQueueListener(log_queue, file_handler, batch_size=batch_size, flush_interval=flush_interval)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+    listener.start()
+    # Выполняется раньше logging.shutdown, который закрывает файл
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging_from_env(default_filename: str = "server.log"):
+    """setup_logging с параметрами из переменных окружения BPLA_LOG_*."""
+    return setup_logging(
+        filename=os.environ.get("BPLA_LOG_FILE", default_filename),
+        level=os.environ.get("BPLA_LOG_LEVEL", "INFO").upper(),
+        levels=parse_levels(os.environ.get("BPLA_LOG_LEVELS", "")),
+        json_format=os.environ.get("BPLA_LOG_FORMAT", "json") == "json",
+        max_bytes=int(os.environ.get("BPLA_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(os.environ.get("BPLA_LOG_BACKUPS", 5)),
+        batch_size=int(os.environ.get("BPLA_LOG_BATCH_SIZE", 256)),
+        flush_interval=float(os.environ.get("BPLA_LOG_FLUSH_INTERVAL", 1.0)),
+        queue_size=int(os.environ.get("BPLA_LOG_QUEUE_SIZE", 10000)),
+    )
@@ -0,0 +1,670 @@
+"""Публикация/подписка между процессами сервера.
+
+Через брокер процесс-производитель телеметрии публикует кадры, процессы
+сбрасывают друг у друга записи кэша и сообщают о смене ключей подписи токенов,
+а Socket.IO рассылает события клиентам всех процессов. Адрес брокера определяет его вид:
+
+- redis://, rediss:// - Redis Pub/Sub (пакет redis), Socket.IO - RedisManager;
+- amqp://, amqps:// - RabbitMQ и другие брокеры kombu (пакет kombu), Socket.IO -
+  KombuManager; memory:// - транспорт kombu внутри одного процесса;
+- bpla://host:port - встроенный брокер MessageBroker этого модуля (BrokerManager).
+  Он не переживает перезапуск, не масштабируется и нужен только для тестов и
+  отладки на одной машине.
+
+Сообщения не хранятся: подписчик получает только то, что опубликовано, пока он
+подключен. BrokerClient работает с любым из брокеров (open_connection).
+
+Протокол: кадры "длина (4 байта, big-endian) | операция (1 байт) | длина имени
+канала (1 байт) | имя канала | данные". Операции: S - подписка, U - отписка,
+P - публикация (брокер пересылает кадр P всем подписчикам канала, в том числе
+отправителю, если он подписан).
+
+Отдельный брокер: python message_queue.py [--host 127.0.0.1] [--port 5556]
+"""
+import argparse
+from collections import deque
+import contextlib
+import functools
+import json
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+import socketio
+try:
+    import redis
+except ImportError:  # Redis не используется
+    redis = None
+try:
+    import kombu
+except ImportError:  # AMQP не используется
+    kombu = None
+
+logger = logging.getLogger(__name__)
+
+BROKER_SCHEME = "bpla"
+REDIS_SCHEMES = ("redis", "rediss")
+KOMBU_SCHEMES = ("amqp", "amqps", "memory")
+DEFAULT_PORT = 5556
+# Канал сброса записей кэша между процессами
+CACHE_CHANNEL = "bpla-cache"
+# Канал сообщений о смене ключей подписи токенов
+KEYS_CHANNEL = "bpla-keys"
+# Канал сообщений о готовности процессов сервера (server_workers.py)
+WORKERS_CHANNEL = "bpla-workers"
+# Максимальный размер кадра: защита от мусора в потоке
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_LENGTH = struct.Struct(">I")
+_SUBSCRIBE, _UNSUBSCRIBE, _PUBLISH = b"S", b"U", b"P"
+
+
+def parse_broker_url(url: str):
+    """(host, port) из адреса брокера bpla://host:port."""
+    parts = urlsplit(url)
+    if parts.scheme != BROKER_SCHEME or not parts.hostname:
+        raise ValueError(f"Адрес брокера должен иметь вид {BROKER_SCHEME}://host:port, получено: {url}")
+    return parts.hostname, parts.port or DEFAULT_PORT
+
+
+def check_broker_url(url: str):
+    """Проверка адреса брокера: известная схема и установленный для нее пакет.
+    ValueError - неизвестная схема, RuntimeError - нет пакета."""
+    scheme = urlsplit(url).scheme
+    if scheme == BROKER_SCHEME:
+        parse_broker_url(url)
+    elif scheme in REDIS_SCHEMES:
+        if redis is None:
+            raise RuntimeError(f"Для брокера {url} нужен пакет redis")
+    elif scheme in KOMBU_SCHEMES:
+        if kombu is None:
+            raise RuntimeError(f"Для брокера {url} нужен пакет kombu")
+    else:
+        raise ValueError(f"Неизвестный брокер: {url} (поддерживаются {BROKER_SCHEME}://, redis://, amqp://)")
+
+
+def open_connection(url: str, timeout: float = 5.0):
+    """Соединение с брокером по схеме адреса (BrokerConnection, RedisConnection или
+    KombuConnection): publish, subscribe, unsubscribe, receive и close."""
+    scheme = urlsplit(url).scheme
+    if scheme in REDIS_SCHEMES:
+        return RedisConnection(url, timeout)
+    if scheme in KOMBU_SCHEMES:
+        return KombuConnection(url, timeout)
+    return BrokerConnection(url, timeout)
+
+
+def encode_frame(op: bytes, channel: str, data: bytes = b""):
+    name = channel.encode("utf-8")
+    if len(name) > 255:
+        raise ValueError(f"Слишком длинное имя канала: {channel}")
+    body = op + bytes((len(name),)) + name + data
+    return _LENGTH.pack(len(body)) + body
+
+
+def read_frame(file):
+    """Кадр из потока: (операция, канал, данные) или None, если соединение закрыто."""
+    header = file.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        return None
+    size = _LENGTH.unpack(header)[0]
+    if size < 2 or size > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Неверный размер кадра: {size}")
+    body = file.read(size)
+    if len(body) < size:
+        return None
+    end = 2 + body[1]
+    return body[:1], body[2:end].decode("utf-8"), body[end:]
+
+
+class _BrokerSession:
+    """Соединение клиента с брокером: чтение в одном потоке, запись - в другом
+    из ограниченной очереди (медленный подписчик не задерживает публикующих)."""
+    def __init__(self, broker, sock, address, queue_size: int):
+        self.broker = broker
+        self.sock = sock
+        self.address = address
+        self.channels = set()
+        self.outgoing = queue.Queue(queue_size)
+        self.closed = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.__read, name=f"broker-read-{self.address[1]}", daemon=True).start()
+        threading.Thread(target=self.__write, name=f"broker-write-{self.address[1]}", daemon=True).start()
+
+    def send(self, frame: bytes):
+        """Постановка кадра в очередь. Переполнение очереди - отключение подписчика."""
+        try:
+            self.outgoing.put_nowait(frame)
+            return True
+        except queue.Full:
+            logger.warning("Подписчик %s не успевает читать сообщения, соединение закрыто", self.address)
+            self.close()
+            return False
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.broker._remove(self)
+        try:
+            self.outgoing.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def __read(self):
+        try:
+            with self.sock.makefile("rb") as file:
+                while not self.closed.is_set():
+                    frame = read_frame(file)
+                    if frame is None:
+                        break
+                    self.broker._handle(self, *frame)
+        except (OSError, ConnectionError, ValueError) as e:
+            if not self.closed.is_set():
+                logger.warning("Ошибка соединения с клиентом брокера %s: %s", self.address, e)
+        finally:
+            self.close()
+
+    def __write(self):
+        try:
+            while True:
+                frame = self.outgoing.get()
+                if frame is None:
+                    break
+                self.sock.sendall(frame)
+        except OSError:
+            pass
+        finally:
+            self.close()
+
+
+class MessageBroker:
+    """Брокер публикации/подписки поверх TCP для процессов сервера (одна машина
+    или доверенная сеть: аутентификации нет, по умолчанию слушает только 127.0.0.1).
+
+    queue_size - число кадров в очереди отправки одного подписчика; подписчик,
+    переполнивший очередь, отключается (и переподключается сам).
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, queue_size: int = 10000):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.__sock = None
+        self.__sessions = set()
+        self.__subscribers = {}  # канал -> множество сессий
+        self.__lock = threading.Lock()
+        self.__metrics = {"published": 0, "delivered": 0}
+
+    @property
+    def url(self):
+        return f"{BROKER_SCHEME}://{self.host}:{self.port}"
+
+    def start(self):
+        """Запуск приема соединений в фоновом потоке. Возвращает адрес брокера
+        (при port=0 порт выбирает система)."""
+        sock = socket.create_server((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        self.__sock = sock
+        threading.Thread(target=self.__accept, args=(sock,), name="broker-accept", daemon=True).start()
+        logger.info("Брокер сообщений запущен: %s", self.url)
+        return self.url
+
+    def stop(self):
+        sock, self.__sock = self.__sock, None
+        if sock is not None:
+            # shutdown прерывает accept в потоке приема (одного close для этого недостаточно)
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        with self.__lock:
+            sessions = list(self.__sessions)
+        for session in sessions:
+            session.close()
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self.__sock is not None:
+                time.sleep(1)
+        finally:
+            self.stop()
+
+    def get_metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["connections"] = len(self.__sessions)
+            metrics["channels"] = len(self.__subscribers)
+        return metrics
+
+    def __accept(self, sock):
+        while True:
+            try:
+                conn, address = sock.accept()
+            except OSError:
+                break
+            if self.__sock is not sock:  # Брокер остановлен
+                conn.close()
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _BrokerSession(self, conn, address, self.queue_size)
+            with self.__lock:
+                self.__sessions.add(session)
+            session.start()
+
+    def _handle(self, session, op: bytes, channel: str, data: bytes):
+        if op == _PUBLISH:
+            frame = encode_frame(_PUBLISH, channel, data)
+            with self.__lock:
+                subscribers = list(self.__subscribers.get(channel, ()))
+                self.__metrics["published"] += 1
+            delivered = sum(subscriber.send(frame) for subscriber in subscribers)
+            with self.__lock:
+                self.__metrics["delivered"] += delivered
+        elif op == _SUBSCRIBE:
+            with self.__lock:
+                self.__subscribers.setdefault(channel, set()).add(session)
+                session.channels.add(channel)
+        elif op == _UNSUBSCRIBE:
+            with self.__lock:
+                self.__discard(session, channel)
+        else:
+            raise ValueError(f"Неизвестная операция брокера: {op!r}")
+
+    def __discard(self, session, channel: str):
+        subscribers = self.__subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(session)
+            if not subscribers:
+                del self.__subscribers[channel]
+        session.channels.discard(channel)
+
+    def _remove(self, session):
+        with self.__lock:
+            self.__sessions.discard(session)
+            for channel in list(session.channels):
+                self.__discard(session, channel)
+
+
+class BrokerConnection:
+    """Соединение с брокером: публикация и подписка, прием - блокирующим receive().
+    publish можно вызывать из нескольких потоков."""
+    def __init__(self, url: str, timeout: float = 5.0):
+        sock = socket.create_connection(parse_broker_url(url), timeout=timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__sock = sock
+        self.__file = sock.makefile("rb")
+        self.__send_lock = threading.Lock()
+
+    def __send(self, frame: bytes):
+        with self.__send_lock:
+            self.__sock.sendall(frame)
+
+    def publish(self, channel: str, data: bytes):
+        self.__send(encode_frame(_PUBLISH, channel, data))
+
+    def subscribe(self, *channels):
+        self.__send(b"".join(encode_frame(_SUBSCRIBE, channel) for channel in channels))
+
+    def unsubscribe(self, *channels):
+        self.__send(b"".join(encode_frame(_UNSUBSCRIBE, channel) for channel in channels))
+
+    def receive(self):
+        """Следующее сообщение подписки: (канал, данные). ConnectionError - соединение закрыто."""
+        frame = read_frame(self.__file)
+        if frame is None:
+            raise ConnectionError("Соединение с брокером закрыто")
+        _, channel, data = frame
+        return channel, data
+
+    def close(self):
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__file.close()
+        self.__sock.close()
+
+
+class RedisConnection:
+    """Соединение с Redis с интерфейсом BrokerConnection (Redis Pub/Sub): публикация -
+    через пул соединений клиента, прием - через отдельное соединение подписки.
+    Ошибки Redis передаются как ConnectionError."""
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.__redis = redis.Redis.from_url(url, socket_connect_timeout=timeout)
+        self.__pubsub = self.__redis.pubsub(ignore_subscribe_messages=True)
+        self.__closed = False
+        with self.__errors():
+            self.__redis.ping()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def __errors():
+        try:
+            yield
+        except redis.RedisError as e:
+            raise ConnectionError(f"Ошибка Redis: {e}") from e
+
+    def publish(self, channel: str, data: bytes):
+        with self.__errors():
+            self.__redis.publish(channel, data)
+
+    def subscribe(self, *channels):
+        with self.__errors():
+            self.__pubsub.subscribe(*channels)
+
+    def unsubscribe(self, *channels):
+        with self.__errors():
+            self.__pubsub.unsubscribe(*channels)
+
+    def receive(self):
+        """Следующее сообщение подписки: (канал, данные). ConnectionError - соединение закрыто."""
+        while not self.__closed:
+            with self.__errors():
+                message = self.__pubsub.get_message(timeout=1.0)
+            if message is not None and message["type"] == "message":
+                return message["channel"].decode("utf-8"), message["data"]
+        raise ConnectionError("Соединение с брокером закрыто")
+
+    def close(self):
+        self.__closed = True
+        with contextlib.suppress(redis.RedisError):
+            self.__pubsub.close()
+            self.__redis.close()
+
+
+class KombuConnection:
+    """Соединение с брокером kombu (AMQP) с интерфейсом BrokerConnection.
+
+    Канал - fanout-обменник с именем канала, подписка - временная очередь этого
+    соединения, привязанная к обменнику. Публикация и прием идут через отдельные
+    соединения kombu (они не потокобезопасны); подписки, запрошенные из других
+    потоков, применяются в потоке приема.
+    """
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.__publisher = kombu.Connection(url, connect_timeout=timeout)
+        self.__consumer = kombu.Connection(url, connect_timeout=timeout)
+        self.__error_types = (OSError,) + self.__consumer.connection_errors + self.__consumer.channel_errors
+        self.__producer = None
+        self.__publish_lock = threading.Lock()
+        self.__consumers = {}  # канал -> kombu.Consumer
+        self.__pending = deque()  # (подписка True / отписка False, канал)
+        self.__received = deque()
+        self.__closed = False
+        with self.__errors():
+            self.__publisher.ensure_connection(max_retries=1)
+            self.__consumer.ensure_connection(max_retries=1)
+
+    @contextlib.contextmanager
+    def __errors(self):
+        try:
+            yield
+        except self.__error_types as e:
+            raise ConnectionError(f"Ошибка брокера: {e}") from e
+
+    @staticmethod
+    def __exchange(channel: str):
+        return kombu.Exchange(channel, type="fanout", durable=False)
+
+    def publish(self, channel: str, data: bytes):
+        exchange = self.__exchange(channel)
+        with self.__publish_lock, self.__errors():
+            if self.__producer is None:
+                self.__producer = self.__publisher.Producer()
+            self.__producer.publish(data, exchange=exchange, declare=[exchange], routing_key="")
+
+    def subscribe(self, *channels):
+        self.__pending.extend((True, channel) for channel in channels)
+
+    def unsubscribe(self, *channels):
+        self.__pending.extend((False, channel) for channel in channels)
+
+    def __apply_subscriptions(self):
+        while self.__pending:
+            subscribe, channel = self.__pending.popleft()
+            if subscribe and channel not in self.__consumers:
+                subscription = kombu.Queue(f"{channel}.{uuid.uuid4().hex}", exchange=self.__exchange(channel),
+                                           durable=False, auto_delete=True, exclusive=True)
+                consumer = kombu.Consumer(self.__consumer.channel(), [subscription], no_ack=True,
+                                          on_message=functools.partial(self.__on_message, channel))
+                consumer.consume()
+                self.__consumers[channel] = consumer
+            elif not subscribe and channel in self.__consumers:
+                self.__consumers.pop(channel).cancel()
+
+    def __on_message(self, channel: str, message):
+        self.__received.append((channel, message.body))
+
+    def receive(self):
+        """Следующее сообщение подписки: (канал, данные). ConnectionError - соединение закрыто."""
+        while not self.__closed:
+            if self.__received:
+                return self.__received.popleft()
+            with self.__errors():
+                self.__apply_subscriptions()
+                try:
+                    self.__consumer.drain_events(timeout=1.0)
+                except socket.timeout:
+                    pass
+        raise ConnectionError("Соединение с брокером закрыто")
+
+    def close(self):
+        self.__closed = True
+        for connection in (self.__publisher, self.__consumer):
+            with contextlib.suppress(Exception):
+                connection.release()
+
+
+class BrokerClient:
+    """Подключение процесса к брокеру с обработчиками подписок.
+
+    Брокер - любой из поддерживаемых адресов (см. описание модуля). Сообщения
+    принимает фоновый поток и передает обработчику канала callback(data).
+    При обрыве соединение восстанавливается раз в reconnect_interval секунд с
+    повторной подпиской; опубликованное за время обрыва теряется (publish
+    возвращает False).
+    """
+    def __init__(self, url: str, reconnect_interval: float = 1.0):
+        check_broker_url(url)
+        self.url = url
+        self.reconnect_interval = reconnect_interval
+        self.__handlers = {}  # канал -> список обработчиков
+        self.__connection = None
+        self.__lock = threading.Lock()
+        self.__connected = threading.Event()
+        self.__thread = None
+        self.__stopped = threading.Event()
+        self.dropped = 0
+
+    @property
+    def connected(self):
+        return self.__connected.is_set()
+
+    def wait_connected(self, timeout: float = None):
+        return self.__connected.wait(timeout)
+
+    def subscribe(self, channel: str, callback):
+        with self.__lock:
+            first = channel not in self.__handlers
+            self.__handlers.setdefault(channel, []).append(callback)
+            connection = self.__connection
+        if first and connection is not None:
+            try:
+                connection.subscribe(channel)
+            except OSError:
+                pass  # Подписка повторится при переподключении
+
+    def publish(self, channel: str, data: bytes):
+        """Публикация сообщения. Возвращает False, если соединения с брокером нет."""
+        connection = self.__connection
+        if connection is not None:
+            try:
+                connection.publish(channel, data)
+                return True
+            except OSError as e:
+                logger.warning("Ошибка публикации в брокер %s: %s", self.url, e)
+                connection.close()
+        self.dropped += 1
+        return False
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, name="broker-client", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        connection = self.__connection
+        if connection is not None:
+            connection.close()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __connect(self):
+        connection = open_connection(self.url)
+        with self.__lock:
+            channels = list(self.__handlers)
+            if channels:
+                connection.subscribe(*channels)
+            self.__connection = connection
+        self.__connected.set()
+        return connection
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            try:
+                connection = self.__connect()
+            except OSError as e:
+                logger.warning("Нет соединения с брокером %s: %s", self.url, e)
+                self.__stopped.wait(self.reconnect_interval)
+                continue
+            try:
+                while True:
+                    channel, data = connection.receive()
+                    with self.__lock:
+                        handlers = list(self.__handlers.get(channel, ()))
+                    for handler in handlers:
+                        try:
+                            handler(data)
+                        except Exception as e:
+                            logger.error("Ошибка обработки сообщения канала %s: %s", channel, e)
+            except (OSError, ConnectionError, ValueError) as e:
+                if not self.__stopped.is_set():
+                    logger.warning("Соединение с брокером %s потеряно: %s", self.url, e)
+            finally:
+                self.__connected.clear()
+                with self.__lock:
+                    self.__connection = None
+                connection.close()
+
+
+class BrokerManager(socketio.PubSubManager):
+    """Менеджер клиентов Socket.IO через встроенный брокер bpla:// (как RedisManager):
+    emit в любом процессе доходит до клиентов, подключенных к любому процессу.
+    Сообщения передаются в JSON (двоичные данные Socket.IO кодирует в base64 сам).
+    Только для тестов и отладки: с Redis и AMQP используются RedisManager и KombuManager."""
+    name = "bpla"
+
+    def __init__(self, url: str, channel: str = "flask-socketio", write_only: bool = False, logger=None, json=None):
+        parse_broker_url(url)
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.url = url
+        self.reconnect_interval = 1.0
+        self.__connection = None  # Соединение для публикации
+        self.__lock = threading.Lock()
+
+    def _publish(self, data):
+        payload = self.json.dumps(data).encode("utf-8")
+        with self.__lock:
+            for retry in (False, True):
+                try:
+                    if self.__connection is None:
+                        self.__connection = BrokerConnection(self.url)
+                    self.__connection.publish(self.channel, payload)
+                    return
+                except OSError as e:
+                    if self.__connection is not None:
+                        self.__connection.close()
+                        self.__connection = None
+                    if retry:
+                        self._get_logger().error("Сообщение Socket.IO не отправлено в брокер: %s", e)
+
+    def _listen(self):
+        while True:
+            try:
+                connection = BrokerConnection(self.url)
+                connection.subscribe(self.channel)
+            except OSError as e:
+                self._get_logger().warning("Нет соединения с брокером %s: %s", self.url, e)
+                time.sleep(self.reconnect_interval)
+                continue
+            try:
+                while True:
+                    yield connection.receive()[1]
+            except (OSError, ConnectionError, ValueError) as e:
+                self._get_logger().warning("Соединение Socket.IO с брокером потеряно: %s", e)
+            finally:
+                connection.close()
+
+
+def share_invalidations(cache, client: BrokerClient, channel: str = CACHE_CHANNEL):
+    """Согласование кэша (LRUTTLCache) между процессами: записи, сброшенные в этом
+    процессе (invalidate, bump_generation), сбрасываются и в остальных. Ключи
+    кэша - кортежи из строк и чисел."""
+    host_id = uuid.uuid4().hex
+
+    def publish(keys, generation):
+        client.publish(channel, json.dumps({"host": host_id, "keys": keys, "generation": generation}).encode())
+
+    def receive(data):
+        message = json.loads(data)
+        if message["host"] == host_id:
+            return
+        cache.invalidate(*(tuple(key) for key in message["keys"]), propagate=False)
+        if message["generation"]:
+            cache.bump_generation(propagate=False)
+
+    cache.on_change = publish
+    client.subscribe(channel, receive)
+
+
+def share_key_reloads(key_provider, client: BrokerClient, channel: str = KEYS_CHANNEL):
+    """Перечитывание ключей подписи (SecretKeyProvider) во всех процессах: если в этом
+    процессе набор ключей изменился (по интервалу, SIGHUP или токену с неизвестным
+    kid), остальные перечитывают ключи, не дожидаясь своего интервала."""
+    host_id = uuid.uuid4().hex.encode()
+
+    def receive(data):
+        if data != host_id:
+            key_provider.request_reload()
+
+    key_provider.on_change = lambda: client.publish(channel, host_id)
+    client.subscribe(channel, receive)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Брокер сообщений для процессов сервера")
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес (0.0.0.0 - все интерфейсы)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    MessageBroker(args.host, args.port).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
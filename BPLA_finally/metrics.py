@@ -0,0 +1,241 @@
+import bisect
+import functools
+import inspect
+import math
+import threading
+import time
+
+# Границы корзин гистограмм задержек по умолчанию, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, имена меток и значения по наборам меток."""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # значения меток (кортеж) -> значение
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        if len(labels) != len(self.labelnames) or not all(name in labels for name in self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Список (имя, метки, значение) для вывода."""
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Текущее значение. Вместо set() можно задать функцию, которая вызывается
+    при каждом выводе и возвращает число или словарь {кортеж значений меток: число}."""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, dict(zip(self.labelnames, map(str, key))), value) for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """Гистограмма наблюдений (например, задержек) с фиксированными корзинами:
+    хранятся счетчики по корзинам, сумма и число наблюдений."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счетчики корзин (последняя - +Inf), сумма, число
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Контекстный менеджер замера времени блока по perf_counter."""
+        return _Timer(self, labels)
+
+    def get(self, **labels):
+        """Кортеж (число наблюдений, сумма)."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state is not None else (0, 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        result = []
+        for key, counts, total, count in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                result.append((self.name + "_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            result.append((self.name + "_sum", labels, total))
+            result.append((self.name + "_count", labels, count))
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.__histogram = histogram
+        self.__labels = labels
+
+    def __enter__(self):
+        self.__started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__histogram.observe(time.perf_counter() - self.__started, **self.__labels)
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса с выводом в текстовом формате Prometheus."""
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str):
+        return self.__metrics.get(name)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus (version 0.0.4)."""
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def instrumented(cls, histogram: Histogram, label: str = "method", prefix: str = ""):
+    """Подкласс cls с замером времени открытых методов (и унаследованных) в histogram
+    с меткой label. Сам cls не изменяется: замер включается там, где используется
+    подкласс (например, фабрика БД с mapper_class при настройке приложения).
+
+    Для генераторов (например, iter_drones) учитывается время до первого значения,
+    то есть выполнение запроса, без времени чтения результата потребителем.
+    Значение метки: prefix + имя метода.
+    """
+    methods = {}
+    for klass in reversed(cls.__mro__):
+        for name, attribute in vars(klass).items():
+            if name.startswith("_"):
+                continue
+            if inspect.isfunction(attribute):
+                methods[name] = attribute
+            else:
+                methods.pop(name, None)  # Переопределен не функцией (staticmethod, свойство)
+    namespace = {name: _timed(func, histogram, {label: prefix + name}) for name, func in methods.items()}
+    namespace.update(__module__=cls.__module__, __qualname__=cls.__qualname__, __doc__=cls.__doc__)
+    return type(cls.__name__, (cls,), namespace)
+
+
+def _timed(func, histogram: Histogram, labels: dict):
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            iterator = func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                first = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+            try:
+                yield first
+                yield from iterator
+            finally:
+                iterator.close()
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор замера времени вызова функции в histogram с метками labels."""
+    return lambda func: _timed(func, histogram, labels)
@@ -0,0 +1,212 @@
+"""Запуск сервера в несколько процессов (по одному на ядро).
+
+Этот процесс открывает слушающий сокет и запускает workers процессов сервера,
+которые принимают соединения на нем же (ядро распределяет соединения между
+процессами). Каждый процесс - gunicorn с одним рабочим процессом gthread
+(--threads потоков, WebSocket Socket.IO в режиме threading), приложение -
+flask_server:app; нужен пакет gunicorn. Процессы связаны брокером сообщений --broker
+(или BPLA_MESSAGE_QUEUE): в работе - Redis (redis://) или RabbitMQ (amqp://),
+см. message_queue.py. Без адреса здесь же запускается встроенный брокер bpla://,
+пригодный только для тестов и отладки:
+
+- emit Socket.IO в любом процессе доходит до клиентов всех процессов (BrokerManager);
+  клиенты подключаются только через WebSocket, так как запросы long-polling
+  одного клиента могут попасть в разные процессы;
+- телеметрию моделирует процесс 0, остальные получают его кадры (TelemetryRelay);
+- записи кэша дронов, сброшенные в одном процессе, сбрасываются во всех;
+- смена ключей подписи токенов, замеченная одним процессом, перечитывает ключи во всех.
+
+Аренда управления дронами, данные и счетчики попыток входа (SharedLoginRateLimiter,
+tbl_login_attempts в prod.db) хранятся в БД и общие для всех процессов.
+С SQLite (prod.db) запись выполняется по одной на все процессы, для нагрузки на
+запись нужен PostgreSQL (BPLA_DB_BACKEND=postgresql).
+
+Упавший процесс перезапускается. Журнал процесса i - server-<i>.log, его вывод
+(в том числе журнал gunicorn) - server-<i>.out.
+
+python server_workers.py --workers 4 [--threads 100] [--host 127.0.0.1] [--port 5000]
+                         [--broker redis://host:6379/0]
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from message_queue import WORKERS_CHANNEL, BrokerClient, MessageBroker
+
+logger = logging.getLogger(__name__)
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Время на завершение запросов при остановке процесса, с
+GRACEFUL_TIMEOUT = 5
+
+
+class WorkerGroup:
+    """Группа процессов сервера на общем сокете host:port (port=0 - свободный порт).
+
+    threads - потоков на процесс (одновременных запросов и соединений WebSocket),
+    env - дополнительные переменные окружения процессов, cwd - рабочий каталог
+    (в нем prod.db и журналы).
+    """
+    def __init__(self, workers: int, host: str = "127.0.0.1", port: int = 5000, broker_url: str = None,
+                 env: dict = None, cwd: str = None, threads: int = 100):
+        if workers < 1:
+            raise ValueError("Число процессов должно быть больше 0")
+        if importlib.util.find_spec("gunicorn") is None:
+            raise RuntimeError("Для процессов сервера нужен пакет gunicorn")
+        self.workers = workers
+        self.threads = threads
+        self.host = host
+        self.port = port
+        self.broker_url = broker_url
+        self.env = dict(env or {})
+        self.cwd = cwd or os.getcwd()
+        self.__socket = None
+        self.__broker = None
+        self.__client = None
+        self.__processes = {}  # номер процесса -> Popen
+        self.__spawns = {}  # номер процесса -> метка запуска (BPLA_WORKER_SPAWN)
+        self.__ready = {}  # номер процесса -> метка запуска, объявившего готовность
+        self.__ready_changed = threading.Condition()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(socket.SOMAXCONN)
+        self.__socket = sock
+        self.port = sock.getsockname()[1]
+        if self.broker_url is None:
+            self.__broker = MessageBroker(self.host)
+            self.broker_url = self.__broker.start()
+        self.__client = BrokerClient(self.broker_url)
+        self.__client.subscribe(WORKERS_CHANNEL, self.__on_ready)
+        self.__client.start()
+        self.__client.wait_connected(5)
+        for worker_id in range(self.workers):
+            self.__spawn(worker_id)
+        logger.info("Запущено %s процессов сервера на %s (брокер %s)", self.workers, self.url, self.broker_url)
+        return self
+
+    def __spawn(self, worker_id: int):
+        env = dict(os.environ)
+        env.setdefault("BPLA_LOG_FILE", f"server-{worker_id}.log")
+        env.update(self.env)
+        # Готовность объявляет рабочий процесс gunicorn (его pid не совпадает с pid запущенного
+        # процесса), поэтому запуски различаются меткой
+        spawn = uuid.uuid4().hex
+        env.update(BPLA_WORKER_ID=str(worker_id), BPLA_WORKER_SPAWN=spawn, BPLA_MESSAGE_QUEUE=self.broker_url)
+        with self.__ready_changed:
+            self.__ready.pop(worker_id, None)
+            self.__spawns[worker_id] = spawn
+        command = [sys.executable, "-m", "gunicorn", "--bind", f"fd://{self.__socket.fileno()}",
+                   "--workers", "1", "--worker-class", "gthread", "--threads", str(self.threads),
+                   "--graceful-timeout", str(GRACEFUL_TIMEOUT), "--pythonpath", SERVER_DIR,
+                   "--no-control-socket", "--error-logfile", "-", "flask_server:app"]
+        # Вывод процесса (журнал gunicorn и ошибки до настройки журнала) - в server-<i>.out
+        with open(os.path.join(self.cwd, f"server-{worker_id}.out"), "ab") as output:
+            self.__processes[worker_id] = subprocess.Popen(command, cwd=self.cwd, env=env,
+                                                           pass_fds=(self.__socket.fileno(),),
+                                                           stdout=output, stderr=subprocess.STDOUT)
+
+    def __on_ready(self, data: bytes):
+        message = json.loads(data)
+        with self.__ready_changed:
+            self.__ready[message["worker"]] = message["spawn"]
+            self.__ready_changed.notify_all()
+
+    def wait_ready(self, timeout: float = 30.0):
+        """Ожидание готовности всех процессов. RuntimeError - процесс завершился или не успел."""
+        deadline = time.monotonic() + timeout
+        with self.__ready_changed:
+            while True:
+                pending = [worker_id for worker_id in self.__processes
+                           if self.__ready.get(worker_id) != self.__spawns[worker_id]]
+                if not pending:
+                    return
+                for worker_id in pending:
+                    code = self.__processes[worker_id].poll()
+                    if code is not None:
+                        raise RuntimeError(f"Процесс сервера {worker_id} завершился с кодом {code}")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"Процессы сервера не готовы за {timeout} с: {pending}")
+                self.__ready_changed.wait(min(remaining, 0.5))
+
+    def poll(self):
+        """Перезапуск завершившихся процессов. Возвращает список их номеров."""
+        restarted = []
+        for worker_id, process in list(self.__processes.items()):
+            code = process.poll()
+            if code is not None:
+                logger.warning("Процесс сервера %s завершился с кодом %s, перезапуск", worker_id, code)
+                self.__spawn(worker_id)
+                restarted.append(worker_id)
+        return restarted
+
+    def stop(self, timeout: float = 10.0):
+        for process in self.__processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.__processes.values():
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.__processes.clear()
+        if self.__client is not None:
+            self.__client.stop()
+            self.__client = None
+        if self.__broker is not None:
+            self.__broker.stop()
+            self.__broker = None
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер в несколько процессов")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Число процессов")
+    parser.add_argument("--threads", type=int, default=100, help="Потоков на процесс")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--broker", default=os.environ.get("BPLA_MESSAGE_QUEUE"),
+                        help="Адрес брокера: redis://host:port/db или amqp://... (по умолчанию встроенный)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.broker is None:
+        logger.warning("Брокер не задан: запускается встроенный брокер bpla:// (только для тестов и отладки)")
+    group = WorkerGroup(args.workers, args.host, args.port, args.broker, threads=args.threads)
+    try:
+        group.start()
+        group.wait_ready()
+        logger.info("Сервер готов: %s", group.url)
+        while True:
+            time.sleep(1)
+            group.poll()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        group.stop()
+
+
+if __name__ == "__main__":
+    main()
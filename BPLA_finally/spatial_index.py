@@ -0,0 +1,322 @@
+import math
+import threading
+import numpy as np
+from fleet_simulator import METERS_PER_DEGREE
+
+# Радиус Земли, согласованный с METERS_PER_DEGREE симулятора, м
+EARTH_RADIUS = METERS_PER_DEGREE * 180.0 / math.pi
+# Половина длины большого круга - максимальное расстояние между точками, м
+MAX_DISTANCE = math.pi * EARTH_RADIUS
+# Смещения соседних ячеек "вперед" (половина из 26 соседей): каждая пара соседних
+# ячеек просматривается один раз
+_FORWARD_OFFSETS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                    if (dx, dy, dz) > (0, 0, 0)]
+
+
+def to_xyz(latitude, longitude):
+    """Координаты точек на сфере радиуса EARTH_RADIUS (x, y, z в метрах), массив (n, 3)."""
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+    cos_latitude = np.cos(latitude)
+    return np.stack((cos_latitude * np.cos(longitude), cos_latitude * np.sin(longitude),
+                     np.sin(latitude)), axis=-1) * EARTH_RADIUS
+
+
+def _squared_norm(vectors):
+    """Квадраты длин векторов-строк (быстрее np.linalg.norm и без извлечения корня)."""
+    return np.einsum("...i,...i->...", vectors, vectors)
+
+
+def chord_to_distance(chord):
+    """Расстояние по большому кругу, м, по длине хорды."""
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.minimum(np.asarray(chord) / (2.0 * EARTH_RADIUS), 1.0))
+
+
+def distance_to_chord(distance: float):
+    """Длина хорды для расстояния по большому кругу (обратное к chord_to_distance)."""
+    return 2.0 * EARTH_RADIUS * math.sin(min(distance, MAX_DISTANCE) / (2.0 * EARTH_RADIUS))
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """Расстояние по большому кругу между точками, м."""
+    return chord_to_distance(np.sqrt(_squared_norm(to_xyz(latitude1, longitude1) - to_xyz(latitude2, longitude2))))
+
+
+def _check_point(latitude: float, longitude: float):
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        raise ValueError(f"Недопустимые координаты: ({latitude}, {longitude})")
+
+
+class SpatialIndex:
+    """Пространственный индекс последних позиций дронов в памяти.
+
+    Позиции переводятся в декартовы координаты на сфере (x, y, z) и раскладываются
+    по равномерной сетке кубических ячеек со стороной cell_size метров: у сетки нет
+    особых случаев на линии перемены дат и у полюсов. Позиции хранятся в массивах
+    NumPy, пакетное обновление update_many перекладывает в другие ячейки только
+    сместившиеся дроны. Расстояния - по большому кругу (по горизонтали, без высоты).
+    """
+    def __init__(self, cell_size: float = 500.0, capacity: int = 1024):
+        if cell_size <= 0:
+            raise ValueError("Размер ячейки должен быть больше 0")
+        self.cell_size = cell_size
+        self.__slots = {}  # drone_id -> номер строки в массивах
+        self.__cells = {}  # (cx, cy, cz) -> множество номеров строк
+        self.__ids = np.empty(capacity, dtype=np.int64)
+        self.__latitude = np.empty(capacity)
+        self.__longitude = np.empty(capacity)
+        self.__xyz = np.empty((capacity, 3))
+        self.__cell = np.empty((capacity, 3), dtype=np.int64)
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.__size
+
+    def __contains__(self, drone_id):
+        return drone_id in self.__slots
+
+    def __grow(self, size: int):
+        capacity = len(self.__ids)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name in ("ids", "latitude", "longitude", "xyz", "cell"):
+            attribute = f"_SpatialIndex__{name}"
+            old = getattr(self, attribute)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.__size] = old[:self.__size]
+            setattr(self, attribute, new)
+
+    def __cell_of(self, xyz):
+        return np.floor(xyz / self.cell_size).astype(np.int64)
+
+    def update(self, drone_id: int, latitude: float, longitude: float):
+        """Позиция одного дрона (добавляется при первом обновлении)."""
+        _check_point(latitude, longitude)
+        self.update_many([drone_id], [latitude], [longitude])
+
+    def update_many(self, drone_ids, latitudes, longitudes):
+        """Пакетное обновление позиций (id в пакете не повторяются): координаты
+        и ячейки считаются векторно, словарь ячеек меняется только для дронов,
+        перешедших в другую ячейку."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        xyz = to_xyz(latitudes, longitudes)
+        cells = self.__cell_of(xyz)
+        with self.__lock:
+            slots = np.empty(len(latitudes), dtype=np.intp)
+            new = []  # номера в пакете дронов, которых еще нет в индексе
+            for i, drone_id in enumerate(drone_ids):
+                slot = self.__slots.get(drone_id)
+                if slot is None:
+                    slot = self.__slots[drone_id] = self.__size + len(new)
+                    new.append(i)
+                slots[i] = slot
+            if new:
+                self.__grow(self.__size + len(new))
+                new_slots = slots[new]
+                self.__ids[new_slots] = np.fromiter((drone_ids[i] for i in new), dtype=np.int64, count=len(new))
+                self.__size += len(new)
+            moved = np.ones(len(slots), dtype=bool)
+            if len(new) < len(slots):
+                moved = np.any(self.__cell[slots] != cells, axis=1)
+                moved[new] = True
+            added = set(new)
+            for i in np.flatnonzero(moved).tolist():
+                slot = int(slots[i])
+                if i not in added:
+                    self.__discard(slot)
+                self.__cells.setdefault(tuple(cells[i].tolist()), set()).add(slot)
+            self.__latitude[slots] = latitudes
+            self.__longitude[slots] = longitudes
+            self.__xyz[slots] = xyz
+            self.__cell[slots] = cells
+
+    def __discard(self, slot: int):
+        key = tuple(self.__cell[slot].tolist())
+        members = self.__cells[key]
+        members.discard(slot)
+        if not members:
+            del self.__cells[key]
+
+    def remove(self, drone_id: int):
+        """Удаление дрона из индекса: на место его строки переносится последняя."""
+        with self.__lock:
+            slot = self.__slots.pop(drone_id, None)
+            if slot is None:
+                return False
+            self.__discard(slot)
+            last = self.__size - 1
+            if slot != last:
+                self.__cells[tuple(self.__cell[last].tolist())].remove(last)
+                self.__cells[tuple(self.__cell[last].tolist())].add(slot)
+                for array in (self.__ids, self.__latitude, self.__longitude, self.__xyz, self.__cell):
+                    array[slot] = array[last]
+                self.__slots[int(self.__ids[slot])] = slot
+            self.__size = last
+            return True
+
+    def position(self, drone_id: int):
+        """Последняя позиция дрона (широта, долгота) или None."""
+        with self.__lock:
+            slot = self.__slots.get(drone_id)
+            if slot is None:
+                return None
+            return float(self.__latitude[slot]), float(self.__longitude[slot])
+
+    def __candidates(self, center, chord: float):
+        """Строки-кандидаты в кубе со стороной 2 * chord вокруг center. Если обход
+        ячеек куба дороже векторного просмотра всех строк, возвращается None (все строки)."""
+        low = self.__cell_of(center - chord)
+        high = self.__cell_of(center + chord)
+        if np.prod((high - low + 1).astype(np.float64)) > min(max(self.__size // 8, 27), 343):
+            return None
+        slots = []
+        for cx in range(low[0], high[0] + 1):
+            for cy in range(low[1], high[1] + 1):
+                for cz in range(low[2], high[2] + 1):
+                    members = self.__cells.get((cx, cy, cz))
+                    if members:
+                        slots.extend(members)
+        return np.fromiter(slots, dtype=np.intp, count=len(slots))
+
+    def __within(self, latitude: float, longitude: float, radius: float):
+        """Строки и расстояния дронов в радиусе radius, по возрастанию расстояния."""
+        center = to_xyz(latitude, longitude)
+        chord = distance_to_chord(radius)
+        slots = self.__candidates(center, chord)
+        xyz = self.__xyz[:self.__size] if slots is None else self.__xyz[slots]
+        squared = _squared_norm(xyz - center)
+        inside = np.flatnonzero(squared <= chord * chord)
+        distances = chord_to_distance(np.sqrt(squared[inside]))
+        slots = inside if slots is None else slots[inside]
+        order = np.lexsort((self.__ids[slots], distances))
+        return slots[order], distances[order]
+
+    def within_radius(self, latitude: float, longitude: float, radius: float):
+        """Дроны в радиусе radius метров от точки: список (drone_id, расстояние)
+        по возрастанию расстояния."""
+        _check_point(latitude, longitude)
+        if not 0 <= radius < math.inf:
+            raise ValueError(f"Недопустимый радиус: {radius}")
+        with self.__lock:
+            slots, distances = self.__within(latitude, longitude, radius)
+            return list(zip(self.__ids[slots].tolist(), distances.tolist()))
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1):
+        """k ближайших к точке дронов: список (drone_id, расстояние). Радиус поиска
+        начинается с размера ячейки и увеличивается, пока не найдено k дронов."""
+        _check_point(latitude, longitude)
+        if k < 1:
+            raise ValueError("k должно быть не меньше 1")
+        radius = self.cell_size
+        with self.__lock:
+            while True:
+                slots, distances = self.__within(latitude, longitude, radius)
+                if len(slots) >= k or radius >= MAX_DISTANCE:
+                    return list(zip(self.__ids[slots[:k]].tolist(), distances[:k].tolist()))
+                radius *= 4
+
+    def within_bbox(self, latitude_min: float, longitude_min: float, latitude_max: float, longitude_max: float):
+        """Дроны в прямоугольнике координат (список id по возрастанию). Прямоугольник,
+        пересекающий линию перемены дат, задается longitude_min > longitude_max."""
+        _check_point(latitude_min, longitude_min)
+        _check_point(latitude_max, longitude_max)
+        if latitude_min > latitude_max:
+            raise ValueError("latitude_min больше latitude_max")
+        width = (longitude_max - longitude_min) % 360.0 or (360.0 if longitude_max != longitude_min else 0.0)
+        center_latitude = (latitude_min + latitude_max) / 2.0
+        center_longitude = (longitude_min + width / 2.0 + 180.0) % 360.0 - 180.0
+        # Малый прямоугольник почти плоский: все его точки не дальше самого
+        # удаленного угла, с запасом на кривизну. Большой - полный просмотр
+        if width <= 10.0 and latitude_max - latitude_min <= 10.0:
+            radius = 1.01 * float(np.max(distance(center_latitude, center_longitude,
+                                                  [latitude_min, latitude_min, latitude_max, latitude_max],
+                                                  [longitude_min, longitude_max, longitude_min, longitude_max])))
+        else:
+            radius = MAX_DISTANCE
+        with self.__lock:
+            slots = self.__candidates(to_xyz(center_latitude, center_longitude), distance_to_chord(radius))
+            if slots is None:
+                slots = np.arange(self.__size)
+            latitude = self.__latitude[slots]
+            longitude = self.__longitude[slots]
+            inside = (latitude >= latitude_min) & (latitude <= latitude_max)
+            if longitude_min <= longitude_max:
+                inside &= (longitude >= longitude_min) & (longitude <= longitude_max)
+            else:
+                inside &= (longitude >= longitude_min) | (longitude <= longitude_max)
+            return sorted(self.__ids[slots[inside]].tolist())
+
+    def close_pairs(self, min_distance: float):
+        """Пары дронов ближе min_distance метров друг к другу по всему парку:
+        список (id1, id2, расстояние), id1 < id2, по возрастанию расстояния.
+
+        Позиции раскладываются по сетке с ячейкой min_distance, ячейки сортируются,
+        пары ищутся только внутри ячейки и с 13 соседними ячейками "вперед"
+        (searchsorted по отсортированным ключам), без перебора всех N^2 пар.
+        """
+        if min_distance <= 0:
+            raise ValueError("Минимальное расстояние должно быть больше 0")
+        chord = distance_to_chord(min_distance)
+        with self.__lock:
+            ids = self.__ids[:self.__size].copy()
+            xyz = self.__xyz[:self.__size].copy()
+        if len(ids) < 2:
+            return []
+        cells = np.floor(xyz / chord).astype(np.int64)
+        # Ключ ячейки - одно число: смещенные координаты в системе с основанием base
+        cells -= cells.min(axis=0) - 1
+        base = cells.max(axis=0) + 2
+        if float(base[0]) * float(base[1]) * float(base[2]) >= 2 ** 62:
+            raise ValueError(f"Слишком малое расстояние для размеров парка: {min_distance}")
+        keys = cells[:, 0] + base[0] * (cells[:, 1] + base[1] * cells[:, 2])
+        order = np.argsort(keys, kind="stable")
+        keys, xyz, ids = keys[order], xyz[order], ids[order]
+        first, second = [], []
+        for dx, dy, dz in [(0, 0, 0)] + _FORWARD_OFFSETS:
+            target = keys + dx + base[0] * (dy + base[1] * dz)
+            high = np.searchsorted(keys, target, side="right")
+            # Внутри своей ячейки - только пары со следующими за строкой
+            low = np.arange(1, len(keys) + 1) if (dx, dy, dz) == (0, 0, 0) else \
+                np.searchsorted(keys, target, side="left")
+            counts = np.maximum(high - low, 0)
+            total = int(counts.sum())
+            if not total:
+                continue
+            rows = np.repeat(np.arange(len(keys)), counts)
+            starts = np.repeat(np.cumsum(counts) - counts, counts)
+            first.append(rows)
+            second.append(low[rows] + np.arange(total) - starts)
+        if not first:
+            return []
+        first, second = np.concatenate(first), np.concatenate(second)
+        squared = _squared_norm(xyz[first] - xyz[second])
+        close = squared < chord * chord
+        first, second, distances = first[close], second[close], chord_to_distance(np.sqrt(squared[close]))
+        pairs = np.stack((np.minimum(ids[first], ids[second]), np.maximum(ids[first], ids[second])), axis=1)
+        order = np.lexsort((pairs[:, 1], pairs[:, 0], distances))
+        return [(int(a), int(b), float(d)) for (a, b), d in zip(pairs[order], distances[order])]
+
+
+class SeparationMonitor:
+    """Контроль минимального расстояния между дронами: check() возвращает пары,
+    ставшие ближе min_distance с прошлой проверки, и пары, которые разошлись."""
+    def __init__(self, index: SpatialIndex, min_distance: float):
+        self.index = index
+        self.min_distance = min_distance
+        self.__active = {}  # (id1, id2) -> расстояние
+
+    @property
+    def active(self):
+        """Текущие сближения: список (id1, id2, расстояние)."""
+        return [(a, b, d) for (a, b), d in self.__active.items()]
+
+    def check(self):
+        """Кортеж (новые сближения [(id1, id2, расстояние)], разошедшиеся пары [(id1, id2)])."""
+        current = {(a, b): d for a, b, d in self.index.close_pairs(self.min_distance)}
+        started = [(a, b, d) for (a, b), d in current.items() if (a, b) not in self.__active]
+        cleared = [pair for pair in self.__active if pair not in current]
+        self.__active = current
+        return started, cleared
@@ -0,0 +1,857 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+import numpy as np
+from fleet_simulator import FleetSimulator
+
+logger = logging.getLogger(__name__)
+
+# Точность, с которой значения телеметрии передаются клиентам
+FIELD_PRECISION = {
+    "current_latitude": 6,
+    "current_longitude": 6,
+    "speed": 2,
+    "direction": 0,
+    "altitude": 2,
+    "flight_time": 0,
+    "battery_level": 2,
+}
+
+
+# Двоичный кадр телеметрии: заголовок (версия, размер записи) и записи фиксированной
+# структуры, по одной на дрон, little-endian без выравнивания. Координаты - float64
+# (во float32 долгота около 180° теряет до ~1.7 м), остальные поля - float32
+TELEMETRY_FRAME_VERSION = 1
+TELEMETRY_FRAME_HEADER = np.dtype([("version", "<u2"), ("record_size", "<u2")])
+TELEMETRY_FRAME_DTYPE = np.dtype([
+    ("drone_id", "<u4"),
+    ("seq", "<u4"),
+    ("timestamp", "<f8"),
+    ("current_latitude", "<f8"),
+    ("current_longitude", "<f8"),
+    ("speed", "<f4"),
+    ("direction", "<f4"),
+    ("altitude", "<f4"),
+    ("flight_time", "<f4"),
+    ("battery_level", "<f4"),
+])
+
+
+def telemetry_frame_layout():
+    """Описание записи кадра для клиентского декодера: [(поле, тип, смещение)]."""
+    return [(name, TELEMETRY_FRAME_DTYPE[name].str[1:], offset)
+            for name, (_, offset) in TELEMETRY_FRAME_DTYPE.fields.items()]
+
+
+def encode_frame(records):
+    """Кадр из массива TELEMETRY_FRAME_DTYPE или списка словарей (snapshot)."""
+    if not isinstance(records, np.ndarray):
+        records = np.array([tuple(record[name] for name in TELEMETRY_FRAME_DTYPE.names) for record in records],
+                           dtype=TELEMETRY_FRAME_DTYPE)
+    header = np.array((TELEMETRY_FRAME_VERSION, TELEMETRY_FRAME_DTYPE.itemsize), dtype=TELEMETRY_FRAME_HEADER)
+    return header.tobytes() + records.tobytes()
+
+
+def decode_frame(data: bytes):
+    """Разбор кадра в массив TELEMETRY_FRAME_DTYPE (без копирования данных)."""
+    header = np.frombuffer(data, dtype=TELEMETRY_FRAME_HEADER, count=1)[0]
+    if header["version"] != TELEMETRY_FRAME_VERSION or header["record_size"] != TELEMETRY_FRAME_DTYPE.itemsize:
+        raise ValueError(f"Неподдерживаемый кадр телеметрии: версия {header['version']}, "
+                         f"запись {header['record_size']} байт")
+    return np.frombuffer(data, dtype=TELEMETRY_FRAME_DTYPE, offset=TELEMETRY_FRAME_HEADER.itemsize)
+
+
+def format_telemetry(data):
+    """Форматирование одной записи телеметрии для лога."""
+    return (
+        f"Координаты: ({data['current_latitude']:.6f}, {data['current_longitude']:.6f})\n"
+        f"Скорость: {data['speed']:.2f} м/с\n"
+        f"Направление: {data['direction']:.0f}°\n"
+        f"Высота: {data['altitude']:.2f} м\n"
+        f"Время полета: {data['flight_time']:.0f} с\n"
+        f"Уровень заряда: {data['battery_level']:.2f} %")
+
+
+# Каналы брокера сообщений: кадры производителя телеметрии и запросы к нему
+TELEMETRY_CHANNEL = "bpla-telemetry"
+TELEMETRY_CONTROL_CHANNEL = "bpla-telemetry-control"
+
+
+class TelemetryUnavailableError(Exception):
+    """Процесс-производитель телеметрии не ответил за отведенное время."""
+
+
+class UnknownDroneError(LookupError):
+    """Запрошена телеметрия дрона, которого нет в БД."""
+
+
+def telemetry_room(drone_id: int):
+    """Имя комнаты Socket.IO для подписчиков телеметрии дрона."""
+    return f"telemetry_{drone_id}"
+
+
+class TelemetryRingBuffer:
+    """Кольцевые буферы истории телеметрии фиксированной емкости, по одному на строку
+    (дрона). Каждое поле хранится в блоках NumPy формы (capacity, строк блока): запись
+    многих строк - одна векторная операция на поле и блок, а записи одного шага
+    разных строк лежат рядом в памяти. Новые строки добавляются новыми блоками, без
+    копирования уже записанных (около 42 байт на запись). Строки формируются только
+    при чтении, записи добавляются в порядке времени. Методы с параметром row по
+    умолчанию работают с первой строкой (буфер одного дрона).
+    """
+    fields = (
+        ("timestamp", np.float64),
+        ("current_latitude", np.float64),
+        ("current_longitude", np.float64),
+        ("speed", np.float32),
+        ("direction", np.int16),
+        ("altitude", np.float32),
+        ("flight_time", np.float32),
+        ("battery_level", np.float32),
+    )
+    # Наибольшее и наименьшее число строк в блоке
+    block_rows = 1024
+    min_block_rows = 64
+
+    def __init__(self, capacity: int = 3600, rows: int = 1):
+        if capacity < 1:
+            raise ValueError("Емкость буфера телеметрии должна быть больше 0")
+        self.capacity = capacity
+        self.rows = 0
+        self.__blocks = []  # {поле: массив (capacity, строк блока)}
+        self.__block = np.zeros(0, dtype=np.intp)  # Номер блока строки
+        self.__column = np.zeros(0, dtype=np.intp)  # Столбец строки в блоке
+        self.__head = np.zeros(0, dtype=np.intp)  # Позиция следующей записи строки
+        self.__size = np.zeros(0, dtype=np.intp)
+        self.resize(rows)
+
+    def __len__(self):
+        return self.size()
+
+    def size(self, row: int = 0):
+        """Число записей в буфере строки row."""
+        return int(self.__size[row])
+
+    def resize(self, rows: int):
+        """Увеличение числа строк до rows (новые строки пусты). Размер нового блока
+        удваивает выделенное число строк, но не больше block_rows."""
+        allocated = len(self.__head)
+        while allocated < rows:
+            size = min(self.block_rows, max(rows - allocated, allocated, self.min_block_rows))
+            self.__blocks.append({name: np.zeros((self.capacity, size), dtype=dtype) for name, dtype in self.fields})
+            self.__block = np.concatenate((self.__block, np.full(size, len(self.__blocks) - 1, dtype=np.intp)))
+            self.__column = np.concatenate((self.__column, np.arange(size, dtype=np.intp)))
+            self.__head = np.concatenate((self.__head, np.zeros(size, dtype=np.intp)))
+            self.__size = np.concatenate((self.__size, np.zeros(size, dtype=np.intp)))
+            allocated += size
+        self.rows = max(self.rows, rows)
+
+    def clear(self, rows):
+        """Очистка буферов строк rows."""
+        self.__head[rows] = 0
+        self.__size[rows] = 0
+
+    def move_rows(self, sources, destinations):
+        """Перенос записей строк sources в строки destinations (копирование по полям
+        группами строк с одинаковыми блоками источника и назначения)."""
+        sources = np.asarray(sources, dtype=np.intp)
+        destinations = np.asarray(destinations, dtype=np.intp)
+        if not len(sources):
+            return
+        pairs = np.column_stack((self.__block[sources], self.__block[destinations]))
+        for source_block, destination_block in np.unique(pairs, axis=0).tolist():
+            selected = np.flatnonzero((pairs[:, 0] == source_block) & (pairs[:, 1] == destination_block))
+            source_data, destination_data = self.__blocks[source_block], self.__blocks[destination_block]
+            source_columns = self.__column[sources[selected]]
+            destination_columns = self.__column[destinations[selected]]
+            for name, _ in self.fields:
+                destination_data[name][:, destination_columns] = source_data[name][:, source_columns]
+        self.__head[destinations] = self.__head[sources]
+        self.__size[destinations] = self.__size[sources]
+
+    def truncate(self, rows: int):
+        """Уменьшение числа строк до rows: блоки, все строки которых не нужны, освобождаются."""
+        self.rows = min(self.rows, rows)
+        while self.__blocks:
+            first_row = len(self.__head) - next(iter(self.__blocks[-1].values())).shape[1]
+            if first_row < self.rows:
+                break
+            self.__blocks.pop()
+            self.__block = self.__block[:first_row]
+            self.__column = self.__column[:first_row]
+            self.__head = self.__head[:first_row]
+            self.__size = self.__size[:first_row]
+
+    def append(self, timestamp: float, values: dict, row: int = 0):
+        """Добавление записи, самая старая запись вытесняется при заполнении."""
+        self.append_rows([row], timestamp, {name: [values[name]] for name, _ in self.fields[1:]})
+
+    def append_rows(self, rows, timestamps, columns: dict):
+        """Добавление записи в буфер каждой из строк rows (строки не повторяются):
+        timestamps - время (одно на все строки или массив), columns - {поле: массив}."""
+        rows = np.asarray(rows, dtype=np.intp)
+        values = {"timestamp": np.broadcast_to(np.asarray(timestamps, dtype=np.float64), rows.shape)}
+        values.update((name, np.asarray(columns[name])) for name, _ in self.fields[1:])
+        heads = self.__head[rows]
+        blocks = self.__block[rows]
+        if len(rows) and blocks.min() == blocks.max():
+            groups = [(int(blocks[0]), slice(None))]
+        else:
+            groups = [(block, np.flatnonzero(blocks == block)) for block in np.unique(blocks).tolist()]
+        for block, selected in groups:
+            data = self.__blocks[block]
+            index = (heads[selected], self.__column[rows[selected]])
+            for name, array in values.items():
+                data[name][index] = array[selected]
+        self.__head[rows] = (heads + 1) % self.capacity
+        self.__size[rows] = np.minimum(self.__size[rows] + 1, self.capacity)
+
+    def last(self, n: int, row: int = 0):
+        """Последние n записей строки (копируются только они) - словарь массивов по полям."""
+        size = self.size(row)
+        n = max(min(n, size), 0)
+        return self.__slice(row, size - n, size)
+
+    def window(self, since: float, until: float = None, row: int = 0):
+        """Записи строки с since <= timestamp <= until (поиск бинарный, без обхода буфера)."""
+        start = self.__search(row, since, "left")
+        end = self.size(row) if until is None else self.__search(row, until, "right")
+        return self.__slice(row, start, max(end, start))
+
+    def __array(self, name: str, row: int):
+        """Буфер поля строки (срез блока без копирования)."""
+        return self.__blocks[self.__block[row]][name][:, self.__column[row]]
+
+    def __segments(self, row: int):
+        """Хранимые записи строки как два непрерывных отрезка буфера: старые и новые."""
+        head, size = int(self.__head[row]), self.size(row)
+        begin = (head - size) % self.capacity
+        if begin + size <= self.capacity:
+            return (begin, begin + size), (0, 0)
+        return (begin, self.capacity), (0, head)
+
+    def __search(self, row: int, timestamp: float, side: str):
+        """Логический индекс (от самой старой записи строки) для timestamp."""
+        timestamps = self.__array("timestamp", row)
+        (begin1, end1), (begin2, end2) = self.__segments(row)
+        index = int(np.searchsorted(timestamps[begin1:end1], timestamp, side=side))
+        if index < end1 - begin1:
+            return index
+        return index + int(np.searchsorted(timestamps[begin2:end2], timestamp, side=side))
+
+    def __slice(self, row: int, start: int, end: int):
+        """Копия записей строки с логическими индексами [start, end)."""
+        (begin1, end1), (begin2, end2) = self.__segments(row)
+        first = end1 - begin1
+        result = {}
+        for name, _ in self.fields:
+            array = self.__array(name, row)
+            if end <= first:
+                result[name] = array[begin1 + start:begin1 + end].copy()
+            elif start >= first:
+                result[name] = array[begin2 + start - first:begin2 + end - first].copy()
+            else:
+                result[name] = np.concatenate((array[begin1 + start:end1], array[begin2:begin2 + end - first]))
+        return result
+
+    @staticmethod
+    def to_records(entries: dict):
+        """Преобразование результата last/window в список словарей (для JSON)."""
+        columns = {name: array.tolist() for name, array in entries.items()}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    @classmethod
+    def format_log(cls, entries: dict):
+        """Строки лога для результата last/window."""
+        return [
+            f"{time.strftime('%H:%M:%S', time.localtime(record['timestamp']))} - "
+            f"Телеметрия обновлена: {format_telemetry(record)}"
+            for record in cls.to_records(entries)
+        ]
+
+
+def _resized(array, size: int, fill=0):
+    """Копия массива, увеличенная по первой оси до size строк (новые строки - fill)."""
+    result = np.full((size,) + array.shape[1:], fill, dtype=array.dtype)
+    result[:len(array)] = array
+    return result
+
+
+def _discard(subscribers: dict, key, sid):
+    """Удаление sid из множества subscribers[key] (пустое множество удаляется).
+    Возвращает True, если подписчиков key не осталось."""
+    sids = subscribers.get(key)
+    if sids is None:
+        return False
+    sids.discard(sid)
+    if sids:
+        return False
+    del subscribers[key]
+    return True
+
+
+# Поля телеметрии в порядке столбцов матрицы отправленных значений
+TELEMETRY_FIELDS = tuple(FIELD_PRECISION)
+
+
+class TelemetryEngine:
+    """Источник телеметрии: хранит состояние каждого дрона и в фоне рассылает
+    дельты подписчикам через комнаты Socket.IO (одна комната на дрон).
+
+    Состояние хранится в массивах по строкам симулятора: номер шага, время, история
+    (TelemetryRingBuffer) и последние отправленные подписчикам JSON значения. Шаг
+    всего парка, запись истории и поиск изменившихся полей выполняются векторно,
+    словари дельт строятся только для дронов с подписчиками JSON и изменениями.
+
+    С relay (TelemetryRelay) сервер работает в несколько процессов: дроны моделирует
+    только процесс-производитель и публикует их состояние, остальные процессы
+    применяют его кадры (apply_frame) и рассылают телеметрию своим клиентам.
+
+    drone_exists(drone_id) - проверка, что дрон есть в БД: состояние (с историей на
+    history_size записей) создается только для существующих дронов. Состояния без
+    подписчиков, к которым не обращались state_ttl секунд, удаляются (evict_idle).
+    """
+    def __init__(self, rate_hz: float = 1.0, seed=None, history_size: int = 3600, simulator=None,
+                 recorder=None, spatial_index=None, relay=None, drone_exists=None, state_ttl: float = 300.0):
+        if rate_hz <= 0:
+            raise ValueError("Частота телеметрии должна быть больше 0")
+        self.rate_hz = rate_hz
+        self.history_size = history_size
+        self.simulator = simulator if simulator is not None else FleetSimulator(seed=seed)
+        # Получатель образцов для постоянного хранения (метод add_many(drone_ids, timestamp, columns))
+        self.recorder = recorder
+        # Пространственный индекс позиций (SpatialIndex), обновляется на каждом шаге
+        self.spatial_index = spatial_index
+        # Вызывается после каждого шага фоновой рассылки: on_tick(socketio)
+        self.on_tick = None
+        self.drone_exists = drone_exists
+        self.state_ttl = state_ttl
+        self.__states = {}  # drone_id -> строка симулятора (дроны, у которых есть состояние)
+        # Состояние по строкам симулятора
+        self.__history = TelemetryRingBuffer(history_size, rows=0)
+        self.__seq = np.zeros(0, dtype=np.int64)
+        self.__timestamp = np.zeros(0)
+        self.__accessed = np.zeros(0)  # время последнего обращения (time.monotonic)
+        self.__sent = np.zeros((0, len(TELEMETRY_FIELDS)))  # отправленные значения, NaN - не отправлялись
+        self.__subscribers = {}  # drone_id -> множество sid
+        self.__json_subscribers = {}  # drone_id -> множество sid (подписки дельтами JSON)
+        self.__binary_subscribers = {}  # sid -> множество drone_id (подписки двоичными кадрами)
+        self.__lock = threading.Lock()
+        # Оповещение ожидающих кадра производителя (процесс без моделирования)
+        self.__updated = threading.Condition(self.__lock)
+        self.__running = False
+        self.relay = relay
+        if relay is not None:
+            relay.attach(self)
+
+    @property
+    def producer(self):
+        """True, если дроны моделирует этот процесс."""
+        return self.relay is None or self.relay.producer
+
+    def __get_state(self, drone_id: int):
+        """Строка состояния телеметрии дрона (создается при первом обращении,
+        UnknownDroneError - дрона нет в БД). Если дроны моделирует другой процесс,
+        состояние запрашивается у него."""
+        with self.__lock:
+            row = self.__states.get(drone_id)
+            if row is not None:
+                self.__accessed[row] = time.monotonic()
+                return row
+        # Проверка выполняется вне блокировки: это запрос к БД
+        if self.drone_exists is not None and not self.drone_exists(drone_id):
+            raise UnknownDroneError(f"Нет дрона ID = {drone_id}")
+        if self.producer:
+            with self.__lock:
+                self.__create_states([drone_id])
+                row = self.__states[drone_id]
+            self.__publish([drone_id])
+            return row
+        self.relay.request_state([drone_id])
+        with self.__updated:
+            if not self.__updated.wait_for(lambda: drone_id in self.__states, self.relay.timeout):
+                raise TelemetryUnavailableError(f"Нет телеметрии дрона ID = {drone_id}")
+            return self.__states[drone_id]
+
+    def __create_states(self, drone_ids):
+        missing = [drone_id for drone_id in dict.fromkeys(drone_ids) if drone_id not in self.__states]
+        if not missing:
+            return
+        self.simulator.add_drones(missing)
+        self.__reserve(len(self.simulator))
+        rows = self.simulator.rows(missing)
+        self.__history.clear(rows)
+        self.__seq[rows] = 0
+        self.__timestamp[rows] = time.time()
+        self.__accessed[rows] = time.monotonic()
+        self.__sent[rows] = np.nan
+        self.__states.update(zip(missing, rows.tolist()))
+        self.__index_positions(missing, rows)
+
+    def __row(self, drone_id: int):
+        """Строка состояния дрона (вызывается под блокировкой): при удалении
+        состояний (evict_idle) строки других дронов переносятся."""
+        row = self.__states.get(drone_id)
+        if row is None:
+            raise TelemetryUnavailableError(f"Нет телеметрии дрона ID = {drone_id}")
+        return row
+
+    def __reserve(self, rows: int):
+        """Массивы состояния на rows строк симулятора (при нехватке емкость удваивается)."""
+        self.__history.resize(rows)
+        if rows <= len(self.__seq):
+            return
+        size = max(rows, 2 * len(self.__seq))
+        self.__seq = _resized(self.__seq, size)
+        self.__timestamp = _resized(self.__timestamp, size)
+        self.__accessed = _resized(self.__accessed, size)
+        self.__sent = _resized(self.__sent, size, np.nan)
+
+    def __remove_states(self, drone_ids):
+        """Удаление состояний дронов (вызывается под блокировкой): строки симулятора,
+        истории и массивов состояния освобождаются, на их места переносятся последние
+        строки; дроны удаляются из пространственного индекса."""
+        for drone_id in drone_ids:
+            del self.__states[drone_id]
+        sources, destinations = self.simulator.remove_drones(drone_ids)
+        for array in (self.__seq, self.__timestamp, self.__accessed, self.__sent):
+            array[destinations] = array[sources]
+        self.__history.move_rows(sources, destinations)
+        rows = len(self.simulator)
+        self.__history.truncate(rows)
+        self.__states.update((drone_id, row) for drone_id, row in
+                             zip(self.simulator.ids[destinations].tolist(), destinations.tolist())
+                             if drone_id in self.__states)
+        if rows < len(self.__seq) // 4:
+            size = len(self.__seq) // 2
+            self.__seq = self.__seq[:size].copy()
+            self.__timestamp = self.__timestamp[:size].copy()
+            self.__accessed = self.__accessed[:size].copy()
+            self.__sent = self.__sent[:size].copy()
+        if self.spatial_index is not None:
+            for drone_id in drone_ids:
+                self.spatial_index.remove(drone_id)
+
+    def __index_positions(self, drone_ids, rows):
+        if self.spatial_index is not None:
+            self.spatial_index.update_many(drone_ids, self.simulator.latitude[rows], self.simulator.longitude[rows])
+
+    def __columns(self, rows):
+        """Значения полей телеметрии строк симулятора: {поле: массив}."""
+        simulator = self.simulator
+        return {
+            "current_latitude": simulator.latitude[rows],
+            "current_longitude": simulator.longitude[rows],
+            "speed": simulator.speed[rows],
+            "direction": simulator.heading[rows].astype(np.int64),
+            "altitude": simulator.altitude[rows],
+            "flight_time": simulator.flight_time[rows],
+            "battery_level": simulator.battery_level[rows],
+        }
+
+    def __record(self, drone_ids, rows, timestamps, seqs=None, record: bool = False, deltas: bool = True):
+        """Учет нового шага дронов, значения которых уже записаны в строки rows
+        симулятора: номер шага (seqs или +1), время, история, индекс позиций и, если
+        record, постоянное хранение. Возвращает список (drone_id, дельта) для дронов
+        с подписчиками JSON и изменениями (deltas=False - без расчета дельт)."""
+        columns = self.__columns(rows)
+        if seqs is None:
+            self.__seq[rows] += 1
+        else:
+            self.__seq[rows] = seqs
+        self.__timestamp[rows] = timestamps
+        self.__history.append_rows(rows, timestamps, columns)
+        self.__index_positions(drone_ids, rows)
+        if record and self.recorder is not None:
+            self.recorder.add_many(drone_ids, timestamps, {name: column.tolist() for name, column in columns.items()})
+        return self.__deltas(drone_ids, rows, columns) if deltas else []
+
+    def __deltas(self, drone_ids, rows, columns):
+        """Дельты для подписчиков JSON: изменившиеся с последней отправки поля (с учетом
+        точности передачи) ищутся сравнением матриц, словари строятся только для
+        изменившихся дронов - группами с одинаковым набором изменившихся полей."""
+        json_subscribers = self.__json_subscribers
+        selected = [i for i, drone_id in enumerate(drone_ids) if drone_id in json_subscribers]
+        if not selected:
+            return []
+        if len(selected) < len(drone_ids):
+            drone_ids = [drone_ids[i] for i in selected]
+            rows = rows[selected]
+            columns = {name: column[selected] for name, column in columns.items()}
+        values = np.column_stack([np.round(columns[name], FIELD_PRECISION[name]) for name in TELEMETRY_FIELDS])
+        changed = values != self.__sent[rows]  # NaN (не отправлялось) не равно ничему
+        self.__sent[rows] = values
+        # Набор изменившихся полей дрона - битовая маска, 0 - изменений нет
+        masks = changed @ (1 << np.arange(len(TELEMETRY_FIELDS)))
+        drone_ids = np.asarray(drone_ids)
+        updates = []
+        for mask in np.unique(masks[masks > 0]).tolist():
+            group = np.flatnonzero(masks == mask)
+            group_rows = rows[group]
+            fields = [column for column in range(len(TELEMETRY_FIELDS)) if mask >> column & 1]
+            keys = ("drone_id", "seq", "timestamp") + tuple(TELEMETRY_FIELDS[column] for column in fields)
+            group_columns = [drone_ids[group].tolist(), self.__seq[group_rows].tolist(),
+                             self.__timestamp[group_rows].tolist()]
+            for column in fields:
+                field_values = values[group, column]
+                if TELEMETRY_FIELDS[column] == "direction":
+                    field_values = field_values.astype(np.int64)
+                group_columns.append(field_values.tolist())
+            updates.extend((record[0], dict(zip(keys, record))) for record in zip(*group_columns))
+        return updates
+
+    def __publish(self, drone_ids):
+        """Публикация состояния дронов остальным процессам (если они есть)."""
+        if self.relay is not None and self.relay.producer:
+            self.relay.publish_frame(self.frame(drone_ids))
+
+    def publish_state(self, drone_ids):
+        """Публикация текущего состояния дронов без шага (по запросу другого процесса)."""
+        with self.__lock:
+            self.__create_states(drone_ids)
+        self.__publish(drone_ids)
+
+    def snapshot(self, drone_id: int):
+        """Полное текущее состояние дрона (для первичной загрузки на клиенте)."""
+        self.__get_state(drone_id)
+        with self.__lock:
+            return self.__snapshot(drone_id, self.__row(drone_id))
+
+    def __snapshot(self, drone_id: int, row: int):
+        data = {field: round(value, FIELD_PRECISION[field]) for field, value in self.simulator.values(drone_id).items()}
+        data.update(drone_id=drone_id, seq=int(self.__seq[row]), timestamp=float(self.__timestamp[row]))
+        return data
+
+    def history(self, drone_id: int, last: int = None, since: float = None, until: float = None):
+        """История телеметрии дрона: последние last записей или окно [since, until]."""
+        self.__get_state(drone_id)
+        with self.__lock:
+            row = self.__row(drone_id)
+            if since is not None:
+                return self.__history.window(since, until, row)
+            return self.__history.last(last if last is not None else self.__history.size(row), row)
+
+    def step(self, drone_id: int):
+        """Внеочередной шаг телеметрии дрона, возвращает полное состояние."""
+        self.__get_state(drone_id)
+        if not self.producer:
+            return self.__remote_step(drone_id)
+        with self.__lock:
+            row = self.__row(drone_id)
+            rows = np.array([row], dtype=np.intp)
+            self.simulator.step(1.0 / self.rate_hz, rows)
+            # Дельты не считаются: изменения уйдут подписчикам со следующим шагом рассылки
+            self.__record([drone_id], rows, time.time(), record=True, deltas=False)
+            snapshot = self.__snapshot(drone_id, row)
+        self.__publish([drone_id])
+        return snapshot
+
+    def __remote_step(self, drone_id: int):
+        with self.__lock:
+            timestamp = self.__timestamp[self.__row(drone_id)]
+        self.relay.request_step(drone_id)
+        with self.__updated:
+            if not self.__updated.wait_for(lambda: self.__timestamp[self.__row(drone_id)] > timestamp,
+                                           self.relay.timeout):
+                raise TelemetryUnavailableError(f"Нет телеметрии дрона ID = {drone_id}")
+            return self.__snapshot(drone_id, self.__row(drone_id))
+
+    def apply_frame(self, data: bytes):
+        """Применение кадра производителя (процесс без моделирования): значения
+        записываются в состояние, историю и пространственный индекс. Записи не новее
+        текущего состояния (кадры, пришедшие не по порядку) пропускаются; сравнение
+        по времени, так как номер шага начинается заново при перезапуске производителя.
+        Возвращает список (drone_id, дельта) для подписчиков JSON."""
+        records = decode_frame(data)
+        with self.__lock:
+            known = np.fromiter((self.__states.get(drone_id, -1) for drone_id in records["drone_id"].tolist()),
+                                dtype=np.intp, count=len(records))
+            fresh = known < 0
+            old = ~fresh
+            fresh[old] = records["timestamp"][old] > self.__timestamp[known[old]]
+            if not fresh.any():
+                return []
+            records = records[fresh]
+            drone_ids = records["drone_id"].tolist()
+            self.__create_states(drone_ids)
+            rows = self.simulator.rows(drone_ids)
+            self.simulator.set_values(rows, latitude=records["current_latitude"],
+                                      longitude=records["current_longitude"], heading=records["direction"],
+                                      speed=records["speed"], altitude=records["altitude"],
+                                      flight_time=records["flight_time"], battery_level=records["battery_level"])
+            updates = self.__record(drone_ids, rows, records["timestamp"], seqs=records["seq"])
+            self.__updated.notify_all()
+        return updates
+
+    def frame(self, drone_ids):
+        """Двоичный кадр с текущим состоянием дронов (значения берутся из массивов
+        симулятора одной векторной выборкой, без словарей)."""
+        for drone_id in drone_ids:
+            self.__get_state(drone_id)
+        with self.__lock:
+            return encode_frame(self.__frame_records(drone_ids))
+
+    def __frame_records(self, drone_ids):
+        simulator = self.simulator
+        rows = simulator.rows(drone_ids)
+        records = np.empty(len(drone_ids), dtype=TELEMETRY_FRAME_DTYPE)
+        records["drone_id"] = drone_ids
+        records["seq"] = self.__seq[rows]
+        records["timestamp"] = self.__timestamp[rows]
+        records["current_latitude"] = simulator.latitude[rows]
+        records["current_longitude"] = simulator.longitude[rows]
+        records["speed"] = simulator.speed[rows]
+        records["direction"] = np.floor(simulator.heading[rows])
+        records["altitude"] = simulator.altitude[rows]
+        records["flight_time"] = simulator.flight_time[rows]
+        records["battery_level"] = simulator.battery_level[rows]
+        return records
+
+    def subscribe(self, drone_id: int, sid: str, binary: bool = False):
+        """Подписка sid на телеметрию дрона; binary - рассылка двоичными кадрами
+        (frames), а не дельтами JSON через комнату дрона."""
+        self.__get_state(drone_id)
+        with self.__lock:
+            self.__subscribers.setdefault(drone_id, set()).add(sid)
+            if binary:
+                self.__binary_subscribers.setdefault(sid, set()).add(drone_id)
+            else:
+                self.__json_subscribers.setdefault(drone_id, set()).add(sid)
+        self.__share_interest()
+
+    def unsubscribe(self, drone_id: int, sid: str):
+        with self.__lock:
+            drone_ids = self.__binary_subscribers.get(sid)
+            if drone_ids is not None:
+                drone_ids.discard(drone_id)
+                if not drone_ids:
+                    del self.__binary_subscribers[sid]
+            _discard(self.__json_subscribers, drone_id, sid)
+            if _discard(self.__subscribers, drone_id, sid):
+                # Срок хранения состояния без подписчиков отсчитывается от отписки
+                row = self.__states.get(drone_id)
+                if row is not None:
+                    self.__accessed[row] = time.monotonic()
+        self.__share_interest()
+
+    def unsubscribe_all(self, sid: str):
+        """Отписка клиента от всех дронов (при отключении)."""
+        with self.__lock:
+            drone_ids = [drone_id for drone_id, sids in self.__subscribers.items() if sid in sids]
+        for drone_id in drone_ids:
+            self.unsubscribe(drone_id, sid)
+
+    def evict_idle(self, now: float = None):
+        """Удаление состояний дронов без подписчиков (в том числе в других процессах),
+        к которым не обращались state_ttl секунд. Возвращает число удаленных состояний."""
+        now = time.monotonic() if now is None else now
+        remote = self.relay.remote_drones() if self.relay is not None and self.relay.producer else ()
+        with self.__lock:
+            if not self.__states:
+                return 0
+            rows = np.fromiter(self.__states.values(), dtype=np.intp, count=len(self.__states))
+            expired = itertools.compress(list(self.__states), now - self.__accessed[rows] > self.state_ttl)
+            idle = [drone_id for drone_id in expired if drone_id not in self.__subscribers and drone_id not in remote]
+            if idle:
+                self.__remove_states(idle)
+        if idle:
+            logger.debug("Удалено состояний телеметрии без подписчиков: %s", len(idle))
+        return len(idle)
+
+    def __share_interest(self):
+        """Сообщение производителю, на каких дронов есть подписчики в этом процессе."""
+        if not self.producer:
+            with self.__lock:
+                drone_ids = list(self.__subscribers)
+            self.relay.publish_interest(drone_ids)
+
+    def tick(self):
+        """Шаг телеметрии всех дронов, у которых есть подписчики (один векторный
+        шаг симулятора), в том числе подписчики других процессов. Возвращает
+        список (drone_id, дельта) для подписчиков JSON."""
+        remote = self.relay.remote_drones() if self.relay is not None else ()
+        with self.__lock:
+            drone_ids = list(self.__subscribers)
+            if remote:
+                self.__create_states(remote)
+                drone_ids.extend(drone_id for drone_id in remote if drone_id not in self.__subscribers)
+            if not drone_ids:
+                return []
+            rows = self.simulator.rows(drone_ids)
+            self.simulator.step(1.0 / self.rate_hz, rows)
+            updates = self.__record(drone_ids, rows, time.time(), record=True)
+            frame = encode_frame(self.__frame_records(drone_ids)) if self.relay is not None else None
+        if frame is not None:
+            self.relay.publish_frame(frame)
+        return updates
+
+    def frames(self):
+        """Двоичные кадры текущего состояния для подписчиков binary: список (sid, кадр),
+        один кадр на клиента со всеми его дронами. Записи всех дронов собираются
+        одной выборкой, кадр клиента - срез по индексам."""
+        with self.__lock:
+            if not self.__binary_subscribers:
+                return []
+            drone_ids = sorted(set().union(*self.__binary_subscribers.values()))
+            records = self.__frame_records(drone_ids)
+            positions = {drone_id: i for i, drone_id in enumerate(drone_ids)}
+            return [(sid, encode_frame(records[[positions[drone_id] for drone_id in sorted(sid_drones)]]))
+                    for sid, sid_drones in self.__binary_subscribers.items()]
+
+    def start(self, socketio):
+        """Запуск фоновой рассылки телеметрии (повторный вызов ничего не делает)."""
+        with self.__lock:
+            if self.__running:
+                return
+            self.__running = True
+        socketio.start_background_task(self.run, socketio)
+        logger.info("Запущена рассылка телеметрии с частотой %s Гц", self.rate_hz)
+
+    def stop(self):
+        self.__running = False
+
+    def run(self, socketio):
+        """Цикл фоновой рассылки: одно сообщение на комнату дрона за шаг (JSON)
+        и один двоичный кадр на клиента (binary). Процесс без моделирования
+        выполняет шаг по каждому кадру производителя."""
+        interval = 1.0 / self.rate_hz
+        next_eviction = time.monotonic() + self.state_ttl / 10
+        while self.__running:
+            started = time.monotonic()
+            try:
+                if started >= next_eviction:
+                    self.evict_idle(started)
+                    next_eviction = started + self.state_ttl / 10
+                if self.producer:
+                    updates = self.tick()
+                else:
+                    self.__share_interest()
+                    data = self.relay.next_frame(interval)
+                    if data is None:
+                        continue
+                    updates = self.apply_frame(data)
+                # Только клиентам этого процесса (ignore_queue): клиенты остальных
+                # процессов получают телеметрию от своего процесса
+                for drone_id, delta in updates:
+                    socketio.emit("telemetry_delta", delta, to=telemetry_room(drone_id), ignore_queue=True)
+                for sid, frame in self.frames():
+                    socketio.emit("telemetry_frame", frame, to=sid, ignore_queue=True)
+                if self.on_tick is not None:
+                    self.on_tick(socketio)
+            except Exception as e:
+                logger.error("Ошибка рассылки телеметрии: %s", e)
+            if self.producer:
+                socketio.sleep(max(interval - (time.monotonic() - started), 0))
+
+
+class TelemetryRelay:
+    """Обмен телеметрией между процессами сервера через брокер сообщений
+    (клиент с методами publish(канал, данные) и subscribe(канал, обработчик),
+    например message_queue.BrokerClient).
+
+    Производитель (producer=True, один процесс) после каждого шага публикует
+    двоичный кадр с состоянием дронов; остальные процессы применяют кадры и
+    рассылают телеметрию своим клиентам, так что через брокер проходит один кадр
+    на шаг, а не сообщение на каждого подписчика. Процессы сообщают производителю
+    свои подписки (interest: повторяется раз в interest_ttl / 3 секунд, без
+    повторения забывается через interest_ttl) и запрашивают у него состояние новых
+    дронов и внеочередные шаги; ответ ожидается до timeout секунд.
+    """
+    def __init__(self, client, worker_id: int, producer: bool, timeout: float = 2.0,
+                 interest_ttl: float = 5.0, queue_size: int = 1000):
+        self.client = client
+        self.worker_id = worker_id
+        self.producer = producer
+        self.timeout = timeout
+        self.interest_ttl = interest_ttl
+        self.__engine = None
+        self.__remote = {}  # worker_id -> (drone_ids, срок действия)
+        self.__interest = (None, 0.0)  # последние отправленные подписки и время отправки
+        self.__frames = queue.Queue(queue_size)
+        self.__lock = threading.Lock()
+        self.__metrics = {"published": 0, "received": 0, "dropped": 0, "requests": 0}
+
+    def attach(self, engine: TelemetryEngine):
+        self.__engine = engine
+        if self.producer:
+            self.client.subscribe(TELEMETRY_CONTROL_CHANNEL, self.__on_control)
+        else:
+            self.client.subscribe(TELEMETRY_CHANNEL, self.__on_frame)
+
+    def get_metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["remote_workers"] = len(self.__remote)
+        metrics["queued"] = self.__frames.qsize()
+        return metrics
+
+    def __count(self, name: str):
+        with self.__lock:
+            self.__metrics[name] += 1
+
+    # Производитель
+
+    def publish_frame(self, frame: bytes):
+        self.client.publish(TELEMETRY_CHANNEL, frame)
+        self.__count("published")
+
+    def remote_drones(self):
+        """Дроны с подписчиками в других процессах (просроченные сообщения отбрасываются)."""
+        now = time.monotonic()
+        with self.__lock:
+            for worker_id in [worker_id for worker_id, (_, expires) in self.__remote.items() if expires < now]:
+                del self.__remote[worker_id]
+            return set().union(*(drone_ids for drone_ids, _ in self.__remote.values()))
+
+    def __on_control(self, data: bytes):
+        message = json.loads(data)
+        self.__count("requests")
+        kind = message["type"]
+        if kind == "interest":
+            with self.__lock:
+                self.__remote[message["worker"]] = (set(message["drone_ids"]), time.monotonic() + self.interest_ttl)
+        elif kind == "state":
+            self.__engine.publish_state(message["drone_ids"])
+        elif kind == "step":
+            self.__engine.step(message["drone_id"])
+        else:
+            logger.warning("Неизвестный запрос к производителю телеметрии: %s", kind)
+
+    # Процесс без моделирования
+
+    def __send(self, message: dict):
+        self.client.publish(TELEMETRY_CONTROL_CHANNEL, json.dumps(message).encode())
+
+    def publish_interest(self, drone_ids):
+        """Отправка подписок процесса, если они изменились или пора повторить."""
+        drone_ids = sorted(drone_ids)
+        now = time.monotonic()
+        with self.__lock:
+            last, sent_at = self.__interest
+            if drone_ids == last and now - sent_at < self.interest_ttl / 3:
+                return
+            self.__interest = (drone_ids, now)
+        self.__send({"type": "interest", "worker": self.worker_id, "drone_ids": drone_ids})
+
+    def request_state(self, drone_ids):
+        self.__send({"type": "state", "drone_ids": list(drone_ids)})
+
+    def request_step(self, drone_id: int):
+        self.__send({"type": "step", "drone_id": drone_id})
+
+    def next_frame(self, timeout: float = None):
+        """Следующий кадр производителя или None, если за timeout кадров не было."""
+        try:
+            return self.__frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __on_frame(self, data: bytes):
+        self.__count("received")
+        try:
+            self.__frames.put_nowait(data)
+        except queue.Full:
+            self.__count("dropped")
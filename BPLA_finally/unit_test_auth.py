@@ -0,0 +1,274 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+import jwt
+from auth import LoginRateLimiter, PasswordHasher, SecretKeyProvider, SharedLoginRateLimiter, TokenVerifier, key_id
+from db_modules import (DBConnectionManager, SQLiteDBFactory, SQLiteLoginAttemptRepository, SQLiteSecretRepository,
+                        SQLiteUserRepository)
+
+
+class TestSecretKeyProvider(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.execute("CREATE TABLE tbl_secret (key TEXT NOT NULL)")
+        self.conn.execute("INSERT INTO tbl_secret VALUES ('old-key')")
+        self.conn.commit()
+        self.repository = SQLiteSecretRepository(self.conn)
+        self.repository.create_key_columns()
+        self.provider = SecretKeyProvider(self.repository.get_keys)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_legacy_key_without_kid(self):
+        self.assertEqual(self.provider.signing_key(), (key_id('old-key'), 'old-key'))
+        self.assertEqual(self.provider.version, 1)
+        self.assertFalse(self.provider.reload())
+        self.assertEqual(self.provider.version, 1)
+
+    def test_rotation_keeps_previous_keys(self):
+        self.provider.keys()
+        self.repository.add_key('key-2', 'kid2', keep=2)
+        self.repository.add_key('key-3', 'kid3', keep=2)
+        self.assertTrue(self.provider.reload())
+        self.assertEqual(self.provider.version, 2)
+        self.assertEqual(self.provider.signing_key(), ('kid3', 'key-3'))
+        self.assertEqual(self.provider.keys(), ['key-3', 'key-2'])
+        self.assertIsNone(self.provider.get(key_id('old-key')))
+
+    def test_on_change_after_rotation(self):
+        changes = []
+        self.provider.on_change = lambda: changes.append(self.provider.version)
+        # Первая загрузка и перечитывание без изменений не считаются сменой ключей
+        self.provider.keys()
+        self.assertFalse(self.provider.reload())
+        self.assertEqual(changes, [])
+        self.repository.add_key('key-2', 'kid2')
+        self.assertTrue(self.provider.reload())
+        self.assertEqual(changes, [2])
+
+    def test_reload_requested_in_background(self):
+        self.provider.keys()
+        self.provider.start()
+        try:
+            self.repository.add_key('key-2', 'kid2')
+            self.provider.request_reload()
+            deadline = time.time() + 5
+            while self.provider.version == 1 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.provider.stop()
+        self.assertEqual(self.provider.signing_key(), ('kid2', 'key-2'))
+
+
+class TestTokenVerifier(unittest.TestCase):
+    def setUp(self):
+        self.keys = [('key-1', 'kid1')]
+        self.provider = SecretKeyProvider(lambda: self.keys)
+        self.verifier = TokenVerifier(self.provider, lifetime=60)
+
+    def test_generate_and_verify(self):
+        token = self.verifier.generate('admin')
+        self.assertEqual(jwt.get_unverified_header(token)['kid'], 'kid1')
+        self.assertEqual(self.verifier.verify(token), 'admin')
+        self.assertIsNone(self.verifier.verify('not-a-token'))
+
+    def test_cache_hit_skips_decode(self):
+        token = self.verifier.generate('admin')
+        self.assertEqual(self.verifier.verify(token), 'admin')
+        with mock.patch('auth.jwt.decode') as decode:
+            self.assertEqual(self.verifier.verify(token), 'admin')
+        decode.assert_not_called()
+
+    def test_expired_token(self):
+        payload = {'username': 'admin',
+                   'exp': datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)}
+        token = jwt.encode(payload, 'key-1', algorithm='HS256', headers={'kid': 'kid1'})
+        self.assertIsNone(self.verifier.verify(token))
+
+    def test_cached_token_expires(self):
+        token = self.verifier.generate('admin')
+        self.assertEqual(self.verifier.verify(token), 'admin')
+        # После exp запись кэша не используется - токен проверяется заново
+        with mock.patch('auth.time.time', return_value=time.time() + 120), \
+                mock.patch('auth.jwt.decode', side_effect=jwt.ExpiredSignatureError) as decode:
+            self.assertIsNone(self.verifier.verify(token))
+        decode.assert_called_once()
+
+    def test_rotation(self):
+        old_token = self.verifier.generate('admin')
+        self.assertEqual(self.verifier.verify(old_token), 'admin')
+        # Новый ключ: старые токены принимаются, пока их ключ не удален
+        self.keys = [('key-2', 'kid2'), ('key-1', 'kid1')]
+        self.provider.reload()
+        self.assertEqual(self.verifier.verify(old_token), 'admin')
+        new_token = self.verifier.generate('oper')
+        self.assertEqual(jwt.get_unverified_header(new_token)['kid'], 'kid2')
+        self.assertEqual(self.verifier.verify(new_token), 'oper')
+        # Удаление ключа сбрасывает кэшированные результаты проверки
+        self.keys = [('key-3', 'kid3'), ('key-2', 'kid2')]
+        self.provider.reload()
+        self.assertIsNone(self.verifier.verify(old_token))
+        self.assertEqual(self.verifier.verify(new_token), 'oper')
+
+    def test_unknown_kid_reloads_keys_rate_limited(self):
+        loads = []
+        provider = SecretKeyProvider(lambda: loads.append(1) or self.keys, min_reload_interval=60)
+        verifier = TokenVerifier(provider, lifetime=60)
+        provider.keys()
+        # Ключ выпущен другим процессом после загрузки: перечитывание по неизвестному kid
+        self.keys = [('key-2', 'kid2'), ('key-1', 'kid1')]
+        token = jwt.encode({'username': 'oper', 'exp': time.time() + 60}, 'key-2', algorithm='HS256',
+                           headers={'kid': 'kid2'})
+        unknown = jwt.encode({'username': 'x', 'exp': time.time() + 60}, 'k', algorithm='HS256',
+                             headers={'kid': 'nope'})
+        self.assertIsNone(verifier.verify(token))  # сразу после загрузки перечитывание не выполняется
+        with mock.patch('auth.time.monotonic', return_value=time.monotonic() + 120):
+            self.assertEqual(verifier.verify(token), 'oper')
+            self.assertIsNone(verifier.verify(unknown))
+        self.assertEqual(len(loads), 2)
+
+    def test_legacy_token_without_kid(self):
+        payload = {'username': 'admin',
+                   'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5)}
+        self.assertEqual(self.verifier.verify(jwt.encode(payload, 'key-1', algorithm='HS256')), 'admin')
+        self.assertIsNone(self.verifier.verify(jwt.encode(payload, 'other', algorithm='HS256')))
+
+    def test_token_without_exp(self):
+        token = jwt.encode({'username': 'admin'}, 'key-1', algorithm='HS256', headers={'kid': 'kid1'})
+        self.assertIsNone(self.verifier.verify(token))
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def setUp(self):
+        # Минимальная стоимость, чтобы тесты выполнялись быстро
+        self.hasher = PasswordHasher(n=2 ** 4, r=1, p=1)
+
+    def test_hash_and_verify(self):
+        password_hash = self.hasher.hash('пароль')
+        self.assertTrue(password_hash.startswith('scrypt$16$1$1$'))
+        self.assertNotEqual(password_hash, self.hasher.hash('пароль'))
+        self.assertTrue(self.hasher.verify('пароль', password_hash))
+        self.assertFalse(self.hasher.verify('другой', password_hash))
+        self.assertFalse(self.hasher.verify('пароль', None))
+        self.assertFalse(self.hasher.verify('пароль', 'scrypt$broken'))
+        self.assertFalse(self.hasher.needs_rehash(password_hash))
+
+    def test_cost_change(self):
+        password_hash = PasswordHasher(n=2 ** 5, r=1, p=1).hash('admin')
+        self.assertTrue(self.hasher.verify('admin', password_hash))
+        self.assertTrue(self.hasher.needs_rehash(password_hash))
+        with self.assertRaises(ValueError):
+            PasswordHasher(n=1000)
+
+    def test_plaintext_before_migration(self):
+        self.assertTrue(self.hasher.verify('admin', 'admin'))
+        self.assertFalse(self.hasher.verify('admin', 'oper'))
+        self.assertTrue(self.hasher.needs_rehash('admin'))
+
+    def test_migrate_passwords(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE TABLE tbl_users (id INTEGER PRIMARY KEY, login TEXT UNIQUE, password TEXT)")
+        conn.executemany("INSERT INTO tbl_users (login, password) VALUES (?, ?)",
+                         [('admin', 'admin'), ('oper', 'oper')])
+        conn.commit()
+        repository = SQLiteUserRepository(conn)
+        self.assertEqual(repository.migrate_passwords(self.hasher.hash, self.hasher.is_hashed), 2)
+        self.assertEqual(repository.migrate_passwords(self.hasher.hash, self.hasher.is_hashed), 0)
+        self.assertTrue(self.hasher.verify('oper', repository.get_password_hash('oper')))
+        self.assertFalse(self.hasher.verify('admin', repository.get_password_hash('oper')))
+        self.assertIsNone(repository.get_password_hash('nobody'))
+        conn.close()
+
+
+class TestLoginRateLimiter(unittest.TestCase):
+    def test_burst_then_rate(self):
+        limiter = LoginRateLimiter(rate=1.0, burst=2)
+        with mock.patch('auth.time.monotonic', return_value=100.0):
+            self.assertEqual(limiter.acquire('admin'), 0)
+            self.assertEqual(limiter.acquire('admin'), 0)
+            self.assertAlmostEqual(limiter.acquire('admin'), 1.0)
+            # Другие логины не затрагиваются
+            self.assertEqual(limiter.acquire('oper'), 0)
+        with mock.patch('auth.time.monotonic', return_value=101.5):
+            self.assertEqual(limiter.acquire('admin'), 0)
+
+    def test_reset_and_eviction(self):
+        limiter = LoginRateLimiter(rate=0.01, burst=1, max_logins=2)
+        self.assertEqual(limiter.acquire('admin'), 0)
+        self.assertGreater(limiter.acquire('admin'), 0)
+        limiter.reset('admin')
+        self.assertEqual(limiter.acquire('admin'), 0)
+        limiter.acquire('a')
+        limiter.acquire('b')
+        # admin вытеснен как давно неиспользуемый
+        self.assertEqual(limiter.acquire('admin'), 0)
+
+    def test_locked_out_login_not_evicted(self):
+        limiter = LoginRateLimiter(rate=0.01, burst=2, max_logins=2)
+        with mock.patch('auth.time.monotonic', return_value=100.0):
+            limiter.acquire('admin')
+            limiter.acquire('admin')
+            self.assertGreater(limiter.acquire('admin'), 0)
+            # Поток попыток с другими логинами вытесняет их, а не заблокированный admin
+            for i in range(10):
+                limiter.acquire(f'user{i}')
+            self.assertGreater(limiter.acquire('admin'), 0)
+
+
+class TestSharedLoginRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path_to_db = os.path.join(self.tmp_dir.name, 'test.db')
+        self.factory = SQLiteDBFactory(pool_size=2)
+        with DBConnectionManager(self.factory, self.path_to_db) as conn:
+            SQLiteLoginAttemptRepository(conn).create_tables()
+
+    def tearDown(self):
+        self.factory.close()
+        self.tmp_dir.cleanup()
+
+    def limiter(self, scope='login', **kwargs):
+        return SharedLoginRateLimiter(self.factory, self.path_to_db, scope, **kwargs)
+
+    def count(self):
+        with DBConnectionManager(self.factory, self.path_to_db) as conn:
+            return conn.execute('SELECT COUNT(*) FROM tbl_login_attempts').fetchone()[0]
+
+    def test_counted_across_processes(self):
+        # Ограничители разных процессов с одним scope делят счетчики
+        first, second = self.limiter(rate=1.0, burst=2), self.limiter(rate=1.0, burst=2)
+        address = self.limiter('address', rate=1.0, burst=2)
+        with mock.patch('auth.time.time', return_value=100.0):
+            self.assertEqual(first.acquire('admin'), 0)
+            self.assertEqual(second.acquire('admin'), 0)
+            self.assertAlmostEqual(first.acquire('admin'), 1.0)
+            self.assertAlmostEqual(second.acquire('admin'), 1.0)
+            self.assertEqual(first.acquire('oper'), 0)
+            self.assertEqual(address.acquire('admin'), 0)
+        with mock.patch('auth.time.time', return_value=101.5):
+            self.assertEqual(second.acquire('admin'), 0)
+        second.reset('admin')
+        self.assertEqual(first.acquire('admin'), 0)
+
+    def test_recovered_removed(self):
+        limiter = self.limiter(rate=1.0, burst=2, cleanup_interval=0)
+        with mock.patch('auth.time.time', return_value=100.0):
+            limiter.acquire('admin')
+            limiter.acquire('admin')
+            limiter.acquire('oper')
+        self.assertEqual(self.count(), 2)
+        # oper восстановился до burst попыток, admin - еще нет
+        with mock.patch('auth.time.time', return_value=101.0):
+            limiter.acquire('other')
+        with DBConnectionManager(self.factory, self.path_to_db) as conn:
+            keys = [row[0] for row in conn.execute('SELECT key FROM tbl_login_attempts ORDER BY key')]
+        self.assertEqual(keys, ['admin', 'other'])
+
+
+if __name__ == '__main__':
+    unittest.main()
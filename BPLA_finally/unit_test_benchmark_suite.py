@@ -0,0 +1,69 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from benchmark_suite import (bench_mapper, bench_scaling, bench_spatial, bench_telemetry_codec, bench_workers, compare,
+                             prepare_server_directory, summarize)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_summarize(self):
+        result = summarize([0.001, 0.002, 0.003, 0.004])
+        self.assertEqual(result['n'], 4)
+        self.assertAlmostEqual(result['mean_us'], 2500)
+        self.assertAlmostEqual(result['p50_us'], 2500)
+        self.assertAlmostEqual(result['ops_per_s'], 400)
+
+    def test_compare(self):
+        baseline = {'a': {'p50_us': 10.0}, 'b': {'p50_us': 10.0}, 'c': {'p50_us': 10.0}}
+        results = {'a': {'p50_us': 12.0}, 'b': {'p50_us': 13.0}, 'd': {'p50_us': 100.0}}
+        self.assertEqual(compare(results, baseline, tolerance=0.25),
+                         [{'name': 'b', 'baseline': 10.0, 'current': 13.0, 'ratio': 1.3}])
+        self.assertEqual(compare(results, baseline, tolerance=0.5), [])
+
+    def test_bench_mapper(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = bench_mapper(directory, rows=50, number=5)
+        self.assertIn('mapper.get_drone[rows=50]', results)
+        self.assertTrue(all(result['n'] == 5 for result in results.values()))
+
+    def test_bench_spatial(self):
+        results = bench_spatial(drones=200, number=20)
+        self.assertIn('spatial.close_pairs[drones=200]', results)
+        self.assertEqual(results['spatial.within_radius[drones=200]']['n'], 20)
+
+    def test_bench_telemetry_codec(self):
+        results = bench_telemetry_codec(drones=50, number=5)
+        binary = results['telemetry.encode_binary[drones=50]']
+        self.assertLess(binary['bytes_per_drone'], results['telemetry.encode_json[drones=50]']['bytes_per_drone'])
+
+
+CPUS = os.cpu_count() or 1
+
+
+@unittest.skipIf(importlib.util.find_spec('gunicorn') is None, 'gunicorn не установлен')
+class TestWorkersThroughput(unittest.TestCase):
+    """Пропускная способность сервера из нескольких процессов (server_workers.py)."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        prepare_server_directory(self.tmp.name, rows=100)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bench_workers(self):
+        result = bench_workers(self.tmp.name, workers=2, seconds=0.5, clients=2)['workers.api_drones[workers=2]']
+        self.assertGreater(result['n'], 0)
+        self.assertEqual((result['workers'], result['clients']), (2, 2))
+
+    @unittest.skipIf(CPUS < 2, 'Для замера масштабирования нужно не меньше 2 ядер')
+    def test_near_linear_scaling(self):
+        # 2 процесса сервера и 4 процесса нагрузки: пропускная способность почти вдвое выше, чем у одного.
+        # При 2-3 ядрах - по одному процессу нагрузки на процесс сервера и требование мягче
+        clients_per_worker, efficiency = (2, 0.7) if CPUS >= 4 else (1, 0.55)
+        results = bench_scaling(self.tmp.name, [1, 2], seconds=3.0, clients_per_worker=clients_per_worker)
+        self.assertGreaterEqual(results['workers.api_drones[workers=2]']['scaling_efficiency'], efficiency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,23 @@
+import asyncio
+import base64
+import os
 import sqlite3
+import tempfile
+import threading
 import unittest
-from db_modules import Drone, SQLiteDroneMapper
+from db_modules import (AsyncSQLiteDroneRepository, CachedDroneRepository, coerce_value, Drone, DBConnectionManager,
+                        DBExecutor, DBExecutorOverloadedError, LRUTTLCache, PoolTimeoutError, PostgreSQLDBFactory,
+                        PostgreSQLDroneMapper, QueryBuilder, SQLiteConnectionPool, SQLiteDBFactory, SQLiteDroneMapper,
+                        SQLiteIDroneRepository, SQLiteTelemetryRepository, TelemetryBatchWriter)
+from drone_locks import DroneLockManager, lease_owner
 from unittest.mock import MagicMock, patch
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# Строка подключения к тестовой БД PostgreSQL (тесты на живой БД пропускаются без нее)
+PG_DSN = os.environ.get('BPLA_TEST_PG_DSN')
 
 
 class TestDrone(unittest.TestCase):
@@ -41,8 +57,9 @@ class TestSQLiteDroneMapper(unittest.TestCase):
         # Настраиваем mock для выполнения запроса
         self.mock_conn.cursor.return_value.lastrowid = 1  # Эмулируем id последней вставленной записи
         self.mapper.add_drone(drone)
-        # Проверяем, что метод execute был вызван
-        self.mock_conn.cursor.return_value.execute.assert_called_once()
+        # Запись дрона и увеличение версии парка - одна транзакция
+        self.assertEqual(self.mock_conn.cursor.return_value.execute.call_count, 2)
+        self.mock_conn.commit.assert_called_once()
         self.assertEqual(drone.id, 1)  # Проверяем, что id дрона установлен правильно
 
     def test_get_drone(self):
@@ -64,14 +81,963 @@ class TestSQLiteDroneMapper(unittest.TestCase):
         mock_cursor = MagicMock()
         self.mock_conn.cursor.return_value = mock_cursor
         self.mapper.update_drone(drone_id, **updates)
-        mock_cursor.execute.assert_called_once()
+        self.assertEqual(mock_cursor.execute.call_count, 2)
+        self.mock_conn.commit.assert_called_once()
 
     def test_remove_drone(self):
         drone_id = 1
         mock_cursor = MagicMock()
         self.mock_conn.cursor.return_value = mock_cursor
         self.mapper.remove_drone(drone_id)
-        mock_cursor.execute.assert_called_once()
+        self.assertEqual(mock_cursor.execute.call_count, 2)
+        self.mock_conn.commit.assert_called_once()
+
+
+@unittest.skipIf(psycopg2 is None, 'psycopg2 не установлен')
+class TestPostgreSQLDroneMapper(unittest.TestCase):
+    def setUp(self):
+        # Мок соединения psycopg2 без открытой транзакции
+        self.mock_conn = MagicMock()
+        self.mock_conn.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.mock_cursor = self.mock_conn.cursor.return_value
+        self.mapper = PostgreSQLDroneMapper(self.mock_conn)
+
+    def test_format_paramstyle(self):
+        self.mapper.get_drone(1)
+        query, params = self.mock_cursor.execute.call_args[0]
+        self.assertIn('WHERE id=%s', query)
+        self.assertNotIn('?', query)
+        self.assertEqual(params, (1,))
+
+    def test_add_drones_uses_copy(self):
+        self.mock_cursor.fetchall.return_value = [(10,), (11,)]
+        drones = [Drone(None, serial_number='A', model='M', manufacturer='X'),
+                  Drone(None, serial_number='B', model='M', manufacturer='X')]
+        result = self.mapper.add_drones(drones)
+        self.assertEqual(result.succeeded, 2)
+        self.assertEqual([drone.id for drone in drones], [10, 11])
+        query, buffer = self.mock_cursor.copy_expert.call_args[0]
+        self.assertTrue(query.startswith('COPY tbl_drones'))
+        self.assertEqual(buffer.getvalue().splitlines()[0].split(',')[:4], ['10', 'A', 'M', 'X'])
+        self.mock_conn.commit.assert_called_once()
+
+    def test_iter_drones_uses_server_side_cursor(self):
+        self.mock_cursor.fetchmany.side_effect = [[(1,), (2,)], []]
+        self.assertEqual(list(self.mapper.iter_drones('id')), [(1,), (2,)])
+        self.assertTrue(self.mock_conn.cursor.call_args.kwargs['name'].startswith('iter_drones_'))
+        self.mock_cursor.close.assert_called_once()
+
+    def test_column_types_cached_until_schema_change(self):
+        self.mock_cursor.fetchall.return_value = [('year', 'integer')]
+        self.assertEqual(self.mapper.get_column_types('tbl_drones'), {'year': 'INTEGER'})
+        self.mapper.get_column_types('tbl_drones')
+        self.assertEqual(self.mock_cursor.execute.call_count, 1)
+        self.mapper.create_lock_columns()
+        self.mock_cursor.execute.reset_mock()
+        self.mapper.get_column_types('tbl_drones')
+        self.assertEqual(self.mock_cursor.execute.call_count, 1)
+        # У другого преобразователя (соединения) свой кэш
+        self.assertEqual(PostgreSQLDroneMapper(MagicMock()).get_column_types('tbl_drones'), {})
+
+
+# Схема таблиц как в prod.db, для тестов на БД в памяти
+SCHEMA = '''
+CREATE TABLE tbl_drones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT UNIQUE NOT NULL,
+    max_altitude INTEGER,
+    max_speed INTEGER,
+    max_flight_time INTEGER,
+    max_flight_dist INTEGER,
+    payload INTEGER,
+    model TEXT NOT NULL,
+    manufacturer TEXT NOT NULL,
+    battery_capacity INTEGER,
+    n_rotors INTEGER,
+    purchase_date DATE,
+    year INTEGER
+);
+CREATE TABLE tbl_drones_mgn (
+    id INTEGER PRIMARY KEY,
+    status_mgn TEXT,
+    FOREIGN KEY (id) REFERENCES tbl_drones(id)
+);
+'''
+
+
+def create_test_db(n_drones=0):
+    """БД в памяти со схемой prod.db и n_drones тестовыми дронами."""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.executescript(SCHEMA)
+    manufacturers = ['DJI', 'Parrot', 'Autel']
+    for i in range(1, n_drones + 1):
+        conn.execute(
+            'INSERT INTO tbl_drones (id, serial_number, model, manufacturer, n_rotors, year) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (i, f'SN{i:04d}', f'Model{i % 4}', manufacturers[i % 3], 4, 2015 + i % 10))
+        conn.execute('INSERT INTO tbl_drones_mgn (id, status_mgn) VALUES (?, ?)', (i, 'release'))
+    conn.commit()
+    # Как init_db при старте сервера
+    SQLiteDroneMapper(conn).create_version_table()
+    return conn
+
+
+class TestQueryBuilder(unittest.TestCase):
+    def test_where_combined_with_and(self):
+        query_builder = QueryBuilder()
+        query = query_builder.select('tbl_drones', 'id', 'id').where('year>=?', (2020,)).where(
+            'model=?', ('X',)).limit(10).build()
+        self.assertEqual(query, 'SELECT id FROM tbl_drones WHERE year>=? AND model=? ORDER BY id LIMIT ?')
+        self.assertEqual(query_builder.get_params(), [2020, 'X', 10])
+
+    def test_template_cached(self):
+        query = QueryBuilder.get_template('SELECT', 'tbl_drones_mgn', ('status_mgn',), 'id=?', 'id')
+        self.assertEqual(query, 'SELECT status_mgn FROM tbl_drones_mgn WHERE id=? ORDER BY id')
+        self.assertIs(QueryBuilder.get_template('SELECT', 'tbl_drones_mgn', ['status_mgn'], 'id=?', 'id'), query)
+        self.assertEqual(QueryBuilder.get_template('UPDATE', 'tbl_drones', ('model',), 'id=?').split(),
+                         ['UPDATE', 'tbl_drones', 'SET', 'model=?', 'WHERE', 'id=?'])
+        self.assertNotIn('ORDER BY', QueryBuilder.get_template('SELECT', 'tbl_drones', ('id',)))
+        with self.assertRaises(ValueError):
+            QueryBuilder.get_template('MERGE', 'tbl_drones')
+
+    def test_format_paramstyle(self):
+        query_builder = QueryBuilder('format')
+        query = query_builder.select('tbl_drones', 'year ASC NULLS FIRST, id', 'id').where(
+            'year>=?', (2020,)).limit(5).build()
+        self.assertEqual(query, 'SELECT id FROM tbl_drones WHERE year>=%s ORDER BY year ASC NULLS FIRST, id LIMIT %s')
+        self.assertEqual(QueryBuilder.get_template('UPDATE', 'tbl_drones', ('model',), 'id=?', paramstyle='format'),
+                         'UPDATE tbl_drones SET model=%s  WHERE id=%s ')
+        self.assertIn('?', QueryBuilder.get_template('UPDATE', 'tbl_drones', ('model',), 'id=?'))
+
+
+class TestDronesPagination(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(25)
+        self.repository = SQLiteIDroneRepository(self.conn)
+        self.repository.create_indexes()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def collect_pages(self, **kwargs):
+        ids, cursor = [], None
+        while True:
+            drones, cursor = self.repository.get_drones_page(cursor=cursor, **kwargs)
+            ids.extend(drone.id for drone in drones)
+            if cursor is None:
+                return ids
+
+    def test_keyset_pages_cover_all_rows(self):
+        self.assertEqual(self.collect_pages(limit=7), list(range(1, 26)))
+        self.assertEqual(self.collect_pages(limit=7, descending=True), list(range(25, 0, -1)))
+
+    def test_keyset_with_sort_column(self):
+        ids = self.collect_pages(sort='model', limit=4)
+        expected = [row[0] for row in self.conn.execute('SELECT id FROM tbl_drones ORDER BY model, id')]
+        self.assertEqual(ids, expected)
+        ids = self.collect_pages(sort='manufacturer', descending=True, limit=4)
+        expected = [row[0] for row in self.conn.execute(
+            'SELECT id FROM tbl_drones ORDER BY manufacturer DESC, id DESC')]
+        self.assertEqual(ids, expected)
+
+    def test_keyset_with_null_sort_values(self):
+        self.conn.execute('UPDATE tbl_drones SET year=NULL WHERE id IN (3, 10, 11)')
+        expected = [row[0] for row in self.conn.execute('SELECT id FROM tbl_drones ORDER BY year, id')]
+        self.assertEqual(self.collect_pages(sort='year', limit=2), expected)
+        expected.reverse()
+        self.assertEqual(self.collect_pages(sort='year', descending=True, limit=2), expected)
+
+    def test_filters(self):
+        drones, cursor = self.repository.get_drones_page(
+            {'manufacturer': 'DJI', 'year_from': 2018, 'year_to': 2020}, limit=100)
+        self.assertIsNone(cursor)
+        self.assertTrue(drones)
+        for drone in drones:
+            self.assertEqual(drone.manufacturer, 'DJI')
+            self.assertTrue(2018 <= drone.year <= 2020)
+
+    def test_serial_prefix_filter(self):
+        drones, _ = self.repository.get_drones_page({'serial_prefix': 'SN001'}, limit=100)
+        self.assertEqual([drone.id for drone in drones], list(range(10, 20)))
+
+    def test_serial_prefix_last_code_points(self):
+        self.conn.execute("UPDATE tbl_drones SET serial_number='SN\U0010ffff' || id WHERE id IN (1, 2)")
+        self.conn.execute("UPDATE tbl_drones SET serial_number='SN\ud7ff' || id WHERE id = 3")
+        self.conn.execute("UPDATE tbl_drones SET serial_number='SN\ue000' WHERE id = 4")
+        self.conn.commit()
+        for prefix, expected in (('SN\U0010ffff', [1, 2]), ('SN\U0010ffff1', [1]), ('\U0010ffff', []),
+                                 ('SN\ud7ff', [3])):
+            drones, _ = self.repository.get_drones_page({'serial_prefix': prefix}, limit=100)
+            self.assertEqual([drone.id for drone in drones], expected, prefix)
+
+    def test_invalid_sort_and_cursor(self):
+        with self.assertRaises(ValueError):
+            self.repository.get_drones_page(sort='id; DROP TABLE tbl_drones')
+        with self.assertRaises(ValueError):
+            self.repository.get_drones_page(cursor='не-курсор')
+        # Пара с id null, курсор другой длины и не список - тоже ValueError
+        for payload in (b'[1, null]', b'[1]', b'[1, 2, 3]', b'5'):
+            with self.assertRaises(ValueError):
+                SQLiteIDroneRepository.decode_cursor(base64.urlsafe_b64encode(payload).decode('ascii'))
+
+
+class TestBatchOperations(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(3)
+        self.mapper = SQLiteDroneMapper(self.conn)
+        self.mapper.batch_chunk_size = 4
+
+    def tearDown(self):
+        self.conn.close()
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM tbl_drones').fetchone()[0]
+
+    def test_add_drones_assigns_ids(self):
+        drones = (Drone(id=None, serial_number=f'NEW{i}', model='M', manufacturer='X') for i in range(10))
+        result = self.mapper.add_drones(drones)
+        self.assertEqual(result.succeeded, 10)
+        self.assertEqual(result.error_count, 0)
+        self.assertEqual(self.count(), 13)
+        ids = [row[0] for row in self.conn.execute("SELECT id FROM tbl_drones WHERE serial_number LIKE 'NEW%'")]
+        self.assertEqual(sorted(ids), list(range(4, 14)))
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_add_drones_reports_failed_rows(self):
+        drones = [Drone(id=None, serial_number='A1', model='M', manufacturer='X'),
+                  Drone(id=None, serial_number='SN0001', model='M', manufacturer='X'),  # дубликат
+                  Drone(id=None, serial_number='A2', model=None, manufacturer='X'),  # NOT NULL
+                  Drone(id=None, serial_number='A3', model='M', manufacturer='X')]
+        result = self.mapper.add_drones(drones)
+        self.assertEqual(result.succeeded, 2)
+        self.assertEqual([key for key, _ in result.errors], [1, 2])
+        self.assertIsNone(drones[1].id)
+        self.assertEqual(self.count(), 5)
+
+    def test_update_drones(self):
+        result = self.mapper.update_drones({1: {'model': 'U1'}, 2: {'model': 'U2', 'year': 2000},
+                                            3: {'model': 'U3'}})
+        self.assertEqual(result.affected, 3)
+        rows = self.conn.execute('SELECT id, model, year FROM tbl_drones ORDER BY id').fetchall()
+        self.assertEqual([row[1] for row in rows], ['U1', 'U2', 'U3'])
+        self.assertEqual(rows[1][2], 2000)
+
+    def test_remove_drones(self):
+        result = self.mapper.remove_drones(iter([1, 3, 42]))
+        self.assertEqual(result.affected, 2)
+        self.assertEqual(self.count(), 1)
+
+    def test_error_rolls_back_whole_batch(self):
+        def drones():
+            yield Drone(id=None, serial_number='B1', model='M', manufacturer='X')
+            raise ValueError('битый файл')
+        with self.assertRaises(ValueError):
+            self.mapper.add_drones(drones())
+        self.assertEqual(self.count(), 3)
+        self.assertFalse(self.conn.in_transaction)
+
+
+class TestDroneStreaming(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(12)
+        self.repository = SQLiteIDroneRepository(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_drone_has_no_dict(self):
+        drone = Drone(1, serial_number='SN')
+        self.assertFalse(hasattr(drone, '__dict__'))
+        with self.assertRaises(AttributeError):
+            drone.color = 'red'
+
+    def test_from_row(self):
+        row = self.conn.execute(f"SELECT {','.join(Drone.tbl_drones_cols)} FROM tbl_drones WHERE id=3").fetchone()
+        drone = Drone.from_row(None, row)
+        self.assertEqual(drone.to_dict(), dict(zip(Drone.tbl_drones_cols, row)))
+        self.assertEqual(drone, self.repository.get_drone(3))
+
+    def test_iter_drones_is_lazy(self):
+        drones = self.repository.iter_drones('year DESC, id', arraysize=5)
+        self.assertNotIsInstance(drones, list)
+        first = next(drones)
+        self.assertIsInstance(first, Drone)
+        ids = [first.id] + [drone.id for drone in drones]
+        expected = [row[0] for row in self.conn.execute('SELECT id FROM tbl_drones ORDER BY year DESC, id')]
+        self.assertEqual(ids, expected)
+
+    def test_get_drones(self):
+        self.assertEqual([drone.id for drone in self.repository.get_drones_with_id('id')], list(range(1, 13)))
+        self.assertEqual({drone.id for drone in self.repository.get_drones('id')}, {None})
+
+
+class TestColumnValidation(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(3)
+        self.repository = SQLiteIDroneRepository(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_coerce_value(self):
+        self.assertEqual(coerce_value('42', 'INTEGER'), 42)
+        self.assertEqual(coerce_value('12.0', 'INTEGER'), 12)
+        self.assertIsNone(coerce_value('', 'INTEGER'))
+        self.assertEqual(coerce_value(7, 'TEXT'), '7')
+        self.assertEqual(coerce_value('1.5', 'REAL'), 1.5)
+        self.assertEqual(coerce_value(' 2024-01-31 ', 'DATE'), '2024-01-31')
+        for value, declared_type in (('12.5', 'INTEGER'), ('abc', 'INTEGER'), (True, 'INTEGER'),
+                                     ('31.02.2024', 'DATE')):
+            with self.assertRaises(ValueError):
+                coerce_value(value, declared_type)
+
+    def test_update_coerces_form_strings(self):
+        self.repository.update_drone(1, max_speed='65', year='2021', purchase_date='2021-02-14')
+        row = self.conn.execute(
+            'SELECT typeof(max_speed), typeof(year), purchase_date FROM tbl_drones WHERE id=1').fetchone()
+        self.assertEqual(row, ('integer', 'integer', '2021-02-14'))
+
+    def test_unknown_and_readonly_columns_rejected(self):
+        for values in ({'model=?, serial_number': 'X'}, {'id': 5}, {'unknown': 1}):
+            with self.assertRaises(ValueError):
+                self.repository.update_drone(1, **values)
+        with self.assertRaises(ValueError):
+            self.repository.update_drone(1, year='двадцать')
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM tbl_drones WHERE id=1').fetchone()[0], 1)
+
+    def test_query_builder_rejects_injection(self):
+        with self.assertRaises(ValueError):
+            QueryBuilder().update('tbl_drones', **{'model=1 --': 'X'})
+        with self.assertRaises(ValueError):
+            QueryBuilder().select('tbl_drones', 'id; DROP TABLE tbl_drones')
+        with self.assertRaises(ValueError):
+            self.repository.get_drones_with_id('password DESC')
+        self.assertEqual(len(self.repository.get_drones_with_id('year DESC, id')), 3)
+
+    def test_batch_rows_validated(self):
+        drones = [Drone(id=None, serial_number='C1', model='M', manufacturer='X', year='2020'),
+                  Drone(id=None, serial_number='C2', model='M', manufacturer='X', year='не год')]
+        result = self.repository.add_drones(drones)
+        self.assertEqual(result.succeeded, 1)
+        self.assertEqual([key for key, _ in result.errors], [1])
+        self.assertEqual(drones[0].year, 2020)
+        result = self.repository.update_drones({1: {'n_rotors': '6'}, 2: {'id': 9}})
+        self.assertEqual(result.affected, 1)
+        self.assertEqual([key for key, _ in result.errors], [2])
+
+    def test_column_types_per_database(self):
+        self.assertEqual(self.repository.mapper.get_column_types('tbl_drones')['year'], 'INTEGER')
+        # Другая БД с той же таблицей, но другой схемой
+        other = sqlite3.connect(':memory:')
+        other.execute('CREATE TABLE tbl_drones (id INTEGER PRIMARY KEY, year TEXT)')
+        self.assertEqual(SQLiteDroneMapper(other).get_column_types('tbl_drones')['year'], 'TEXT')
+        other.close()
+
+
+def telemetry_values(i):
+    return {'current_latitude': 55.0, 'current_longitude': 37.0, 'speed': float(i), 'direction': 90,
+            'altitude': 100.0, 'flight_time': float(i), 'battery_level': 100.0 - i}
+
+
+class TestTelemetryRepository(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.repository = SQLiteTelemetryRepository(self.conn)
+        self.repository.create_tables()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_samples_range_query(self):
+        self.repository.add_samples((1, 1000.0 + i * 0.5, telemetry_values(i)) for i in range(10))
+        self.repository.add_samples([(2, 1001.0, telemetry_values(0))])
+        samples = list(self.repository.get_samples(1, 1001.0, 1002.0))
+        self.assertEqual([sample['timestamp'] for sample in samples], [1001.0, 1001.5, 1002.0])
+        self.assertEqual(samples[0]['speed'], 2.0)
+
+    def test_rollups_accumulate_across_batches(self):
+        self.repository.add_samples([(1, 1000.0, telemetry_values(2)), (1, 1000.5, telemetry_values(4))])
+        self.repository.add_samples([(1, 1000.9, telemetry_values(6)), (1, 1061.0, telemetry_values(8))])
+        per_second = list(self.repository.get_rollups(1, 1, 1000, 1100))
+        self.assertEqual([(row['timestamp'], row['n'], row['speed']) for row in per_second],
+                         [(1000, 3, 4.0), (1061, 1, 8.0)])
+        per_minute = list(self.repository.get_rollups(1, 60, 1000, 1100))
+        self.assertEqual([(row['timestamp'], row['n']) for row in per_minute], [(960, 3), (1020, 1)])
+        with self.assertRaises(ValueError):
+            list(self.repository.get_rollups(1, 5, 0, 1))
+
+    def test_duplicate_samples_counted_once(self):
+        first = [(1, 1000.0, telemetry_values(2)), (1, 1000.5, telemetry_values(4))]
+        self.assertEqual(self.repository.add_samples(first), 2)
+        # Повтор из прошлой пачки и повтор внутри пачки не перезаписывают образец и не попадают в агрегаты
+        second = [(1, 1000.5, telemetry_values(8)), (1, 1000.9, telemetry_values(6)), (1, 1000.9, telemetry_values(8))]
+        self.assertEqual(self.repository.add_samples(second), 1)
+        per_second = list(self.repository.get_rollups(1, 1, 1000, 1000))
+        self.assertEqual([(row['n'], row['speed']) for row in per_second], [(3, 4.0)])
+        samples = list(self.repository.get_samples(1, 1000.0, 1001.0))
+        self.assertEqual([sample['speed'] for sample in samples], [2.0, 4.0, 6.0])
+
+
+class TestTelemetryBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path_to_db = os.path.join(self.tmp_dir.name, 'test.db')
+        self.factory = SQLiteDBFactory(pool_size=2)
+        with DBConnectionManager(self.factory, self.path_to_db) as conn:
+            SQLiteTelemetryRepository(conn).create_tables()
+
+    def tearDown(self):
+        self.factory.close()
+        self.tmp_dir.cleanup()
+
+    def count(self):
+        with DBConnectionManager(self.factory, self.path_to_db) as conn:
+            return conn.execute('SELECT COUNT(*) FROM tbl_telemetry').fetchone()[0]
+
+    def test_background_flush(self):
+        writer = TelemetryBatchWriter(self.factory, self.path_to_db, batch_size=10, flush_interval=0.05)
+        writer.start()
+        for i in range(25):
+            writer.add(1, float(i), telemetry_values(i))
+        writer.stop()
+        self.assertEqual(self.count(), 25)
+        self.assertEqual(writer.get_metrics()['written'], 25)
+
+    def test_overflow_drops_oldest(self):
+        writer = TelemetryBatchWriter(self.factory, self.path_to_db, max_buffer=5)
+        for i in range(8):
+            writer.add(1, float(i), telemetry_values(i))
+        self.assertEqual(writer.get_metrics()['dropped'], 3)
+        self.assertEqual(writer.flush(), 5)
+        with DBConnectionManager(self.factory, self.path_to_db) as conn:
+            self.assertEqual(conn.execute('SELECT MIN(timestamp) FROM tbl_telemetry').fetchone()[0], 3.0)
+
+
+class TestLRUTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LRUTTLCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get_metrics()['evictions'], 1)
+
+    def test_ttl_expiration(self):
+        cache = LRUTTLCache(ttl=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        metrics = cache.get_metrics()
+        self.assertEqual((metrics['expirations'], metrics['hit_rate']), (1, 0.0))
+
+    def test_stale_set_rejected(self):
+        cache = LRUTTLCache(max_size=2)
+        token = cache.token()
+        cache.invalidate('a')
+        self.assertFalse(cache.set('a', 'old', token))
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.set('b', 1, token))
+        self.assertTrue(cache.set('a', 'new', cache.token()))
+        # Номера сбросов, вытесненные из списка, считаются не старше последнего вытесненного
+        cache.invalidate('c', 'd')
+        self.assertFalse(cache.set('a', 'old', token))
+
+
+class TestCachedDroneRepository(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(3)
+        self.cache = LRUTTLCache()
+        self.repository = CachedDroneRepository(SQLiteIDroneRepository(self.conn), self.cache)
+        # Считаем обращения к БД через trace callback
+        self.queries = []
+        self.conn.set_trace_callback(self.queries.append)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_reads_are_cached(self):
+        self.assertEqual(self.repository.get_drone(1).serial_number, 'SN0001')
+        self.assertEqual(self.repository.get_drone(1).serial_number, 'SN0001')
+        self.assertEqual(self.repository.get_drone_status_mgn(1), 'release')
+        self.assertEqual(self.repository.get_drone_status_mgn(1), 'release')
+        self.assertEqual(len(self.queries), 2)
+        self.repository.get_drone(1, use_cache=False)
+        self.assertEqual(len(self.queries), 3)
+        self.assertEqual(self.cache.get_metrics()['hits'], 2)
+
+    def test_invalidation_during_load_not_overwritten(self):
+        repository = SQLiteIDroneRepository(self.conn)
+        get_drone = repository.get_drone
+
+        def racing_get_drone(drone_id):
+            # Значение прочитано, затем другой поток изменяет дрон и сбрасывает кэш
+            drone = get_drone(drone_id)
+            self.repository.update_drone(drone_id, model='Новая')
+            return drone
+
+        with patch.object(repository, 'get_drone', racing_get_drone):
+            cached = CachedDroneRepository(repository, self.cache)
+            self.assertNotEqual(cached.get_drone(1).model, 'Новая')
+        self.assertEqual(self.repository.get_drone(1).model, 'Новая')
+
+    def test_missing_drone_not_cached(self):
+        self.assertIsNone(self.repository.get_drone(42))
+        self.assertIsNone(self.repository.get_drone(42))
+        self.assertEqual(len(self.queries), 2)
+
+    def test_writes_invalidate(self):
+        self.repository.get_drone(1)
+        self.repository.get_drones_with_id('id')
+        self.repository.update_drone(1, model='Новая')
+        self.assertEqual(self.repository.get_drone(1).model, 'Новая')
+        self.assertEqual(self.repository.get_drones_with_id('id')[0].model, 'Новая')
+        self.repository.get_drone_status_mgn(2)
+        self.repository.update_drone_status_mgn(2, 'lock')
+        self.assertEqual(self.repository.get_drone_status_mgn(2), 'lock')
+        self.repository.remove_drone(3)
+        self.assertIsNone(self.repository.get_drone(3))
+        self.assertEqual(len(self.repository.get_drones_with_id('id')), 2)
+        self.repository.add_drone(Drone(id=4, serial_number='SN0004', model='M', manufacturer='X'))
+        self.assertEqual(len(self.repository.get_drones_with_id('id')), 3)
+
+    def test_other_methods_delegated(self):
+        drones, _ = self.repository.get_drones_page(limit=2)
+        self.assertEqual(len(drones), 2)
+
+    def test_bulk_status_loads_misses_in_one_query(self):
+        self.repository.get_drone_status_mgn(1)
+        self.queries.clear()
+        self.assertEqual(self.repository.get_drones_status_mgn([1, 2, 3, 42]),
+                         {1: 'release', 2: 'release', 3: 'release'})
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.repository.get_drones_status_mgn([2, 3]), {2: 'release', 3: 'release'})
+        self.assertEqual(len(self.queries), 1)
+        self.repository.update_drone_status_mgn(2, 'lock')
+        self.assertEqual(self.repository.get_drones_status_mgn([2])[2], 'lock')
+
+
+class TestIterDronesFilters(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(10)
+        self.repository = SQLiteIDroneRepository(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_filters_match_page(self):
+        filters = {'manufacturer': 'DJI', 'serial_prefix': 'SN000', 'year_from': None}
+        drones, _ = self.repository.get_drones_page(filters, limit=100)
+        streamed = list(self.repository.iter_drones('id DESC', arraysize=2, filters=filters))
+        self.assertEqual([drone.id for drone in streamed], [drone.id for drone in reversed(drones)])
+        self.assertEqual(len(list(self.repository.iter_drones(filters={'model': None}))), 10)
+
+
+class TestBulkDroneStatus(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(5)
+        self.repository = SQLiteIDroneRepository(self.conn)
+        self.conn.execute('DELETE FROM tbl_drones_mgn WHERE id=5')
+        self.conn.commit()
+        self.repository.update_drone_status_mgn(2, 'lock')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_status_for_ids(self):
+        # Нет строки в tbl_drones_mgn - дрон свободен, неизвестные id пропускаются
+        self.assertEqual(self.repository.get_drones_status_mgn([2, 5, 42]), {2: 'lock', 5: 'release'})
+        self.assertEqual(self.repository.get_drones_status_mgn([]), {})
+
+    def test_all_and_chunks(self):
+        self.repository.mapper.batch_chunk_size = 2
+        queries = []
+        self.conn.set_trace_callback(queries.append)
+        statuses = self.repository.get_drones_status_mgn([1, 2, 3, 4, 5])
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(statuses, self.repository.get_drones_status_mgn())
+        self.assertEqual(sorted(statuses), [1, 2, 3, 4, 5])
+
+    def test_single_and_bulk_agree(self):
+        cached = CachedDroneRepository(self.repository, LRUTTLCache())
+        for repository in (self.repository, cached):
+            self.assertEqual(repository.get_drone_status_mgn(5), 'release')
+            self.assertEqual(repository.get_drones_status_mgn([5]), {5: 'release'})
+            self.assertIsNone(repository.get_drone_status_mgn(42))
+
+    def test_bulk_stale_status_not_cached(self):
+        cache = LRUTTLCache()
+        cached = CachedDroneRepository(self.repository, cache)
+        get_statuses = self.repository.get_drones_status_mgn
+
+        def racing_get_statuses(drone_ids=None):
+            # Статусы прочитаны, затем другой поток меняет статус и сбрасывает кэш
+            statuses = get_statuses(drone_ids)
+            cache.invalidate(('status_mgn', 2))
+            return statuses
+
+        with patch.object(self.repository, 'get_drones_status_mgn', racing_get_statuses):
+            self.assertEqual(cached.get_drones_status_mgn([2, 3])[2], 'lock')
+            cached.get_drones_status_mgn()
+        self.assertIsNone(cache.get(('status_mgn', 2)))
+        self.assertEqual(cache.get(('status_mgn', 3)), 'release')
+
+
+class TestFleetVersion(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(3)
+        self.repository = SQLiteIDroneRepository(self.conn)
+        self.repository.create_version_table()  # повторный вызов безопасен
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_writes_bump_version(self):
+        version, updated_at = self.repository.get_fleet_version()
+        self.assertEqual(version, 0)
+        self.repository.add_drone(Drone(4, serial_number='SN4', model='M', manufacturer='X'))
+        self.repository.update_drone(4, model='M2')
+        self.repository.add_drones([Drone(None, serial_number='SN5', model='M', manufacturer='X')])
+        self.repository.update_drones({1: {'model': 'U'}})
+        self.repository.remove_drones([5])
+        self.repository.remove_drone(4)
+        self.assertEqual(self.repository.get_fleet_version()[0], 6)
+        self.assertGreaterEqual(self.repository.get_fleet_version()[1], updated_at)
+
+    def test_status_writes_do_not_bump(self):
+        self.repository.create_lock_columns()
+        self.repository.update_drone_status_mgn(1, 'lock')
+        self.repository.acquire_drone_lock(2, 'oper', lease_until=200, now=100)
+        self.assertEqual(self.repository.get_fleet_version()[0], 0)
+
+    def test_missing_row(self):
+        self.conn.execute('DELETE FROM tbl_fleet_version')
+        self.assertEqual(self.repository.get_fleet_version(), (0, 0.0))
+        self.repository.remove_drone(1)
+        self.assertEqual(self.repository.get_fleet_version()[0], 1)
+
+    def test_version_in_write_transaction(self):
+        # Версия не записалась - не фиксируется и изменение дрона (откат при возврате в пул)
+        self.conn.execute('DROP TABLE tbl_fleet_version')
+        with self.assertRaises(sqlite3.OperationalError):
+            self.repository.update_drone(1, model='Новая')
+        self.conn.rollback()
+        self.assertNotEqual(self.repository.get_drone(1).model, 'Новая')
+        with self.assertRaises(sqlite3.OperationalError):
+            self.repository.remove_drones([2])
+        self.assertIsNotNone(self.repository.get_drone(2))
+
+
+class TestDroneLocks(unittest.TestCase):
+    def setUp(self):
+        self.conn = create_test_db(3)
+        self.repository = SQLiteIDroneRepository(self.conn)
+        self.repository.create_lock_columns()
+        self.repository.create_lock_columns()  # повторный вызов безопасен
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_compare_and_set(self):
+        self.assertTrue(self.repository.acquire_drone_lock(1, 'oper1', lease_until=200, now=100))
+        self.assertFalse(self.repository.acquire_drone_lock(1, 'oper2', lease_until=210, now=110))
+        # Тот же оператор может войти повторно
+        self.assertTrue(self.repository.acquire_drone_lock(1, 'oper1', lease_until=220, now=120))
+        self.assertEqual(self.repository.get_drone_status_mgn(1), 'lock')
+
+    def test_expired_lease_can_be_taken(self):
+        self.repository.acquire_drone_lock(1, 'oper1', lease_until=200, now=100)
+        self.assertTrue(self.repository.acquire_drone_lock(1, 'oper2', lease_until=400, now=300))
+        self.assertFalse(self.repository.renew_drone_lock(1, 'oper1', lease_until=500))
+        self.assertTrue(self.repository.renew_drone_lock(1, 'oper2', lease_until=500))
+
+    def test_legacy_lock_without_lease_is_taken(self):
+        self.repository.update_drone_status_mgn(1, 'lock')
+        self.assertTrue(self.repository.acquire_drone_lock(1, 'oper1', lease_until=200, now=100))
+
+    def test_release_only_by_owner(self):
+        self.repository.acquire_drone_lock(1, 'oper1', lease_until=200, now=100)
+        self.assertFalse(self.repository.release_drone_lock(1, 'oper2'))
+        self.assertTrue(self.repository.release_drone_lock(1, 'oper1'))
+        self.assertEqual(self.repository.get_drone_status_mgn(1), 'release')
+
+    def test_leases_of_one_operator_are_separate(self):
+        first, second = lease_owner('oper1', 'tab1'), lease_owner('oper1', 'tab2')
+        self.assertTrue(self.repository.acquire_drone_lock(1, first, lease_until=200, now=100))
+        # Другая вкладка того же оператора не захватывает, не продлевает и не освобождает чужую аренду
+        self.assertFalse(self.repository.acquire_drone_lock(1, second, lease_until=210, now=110))
+        self.assertFalse(self.repository.renew_drone_lock(1, second, lease_until=220))
+        self.assertFalse(self.repository.release_drone_lock(1, second))
+        self.assertTrue(self.repository.release_drone_lock(1, first))
+
+    def test_release_expired(self):
+        self.repository.acquire_drone_lock(1, 'oper1', lease_until=200, now=100)
+        self.repository.acquire_drone_lock(2, 'oper1', lease_until=400, now=100)
+        self.assertEqual(self.repository.release_expired_locks(now=300), [1])
+        self.assertEqual(self.repository.get_drone_status_mgn(1), 'release')
+        self.assertEqual(self.repository.get_drone_status_mgn(2), 'lock')
+
+    def test_manager_callbacks_on_transitions(self):
+        sent = []
+        manager = DroneLockManager(SQLiteDBFactory(), ':memory:',
+                                   on_acquire=lambda drone_id: sent.append((drone_id, 'lock')),
+                                   on_release=lambda drone_id: sent.append((drone_id, 'release')))
+
+        def call_repository(_, method, *args):
+            return getattr(self.repository, method)(*args)
+
+        with patch.object(DroneLockManager, '_DroneLockManager__call_repository', call_repository):
+            self.assertTrue(manager.acquire(1, 'oper1'))
+            self.assertTrue(manager.acquire(1, 'oper1'))  # повторный вход - не переход
+            self.assertFalse(manager.acquire(1, 'oper2'))
+            self.assertTrue(manager.release(1, 'oper1'))
+            self.assertFalse(manager.release(1, 'oper1'))
+            self.assertTrue(manager.acquire(1, 'oper2'))
+        self.assertEqual(sent, [(1, 'lock'), (1, 'release'), (1, 'lock')])
+
+    def test_missing_status_row_created(self):
+        self.conn.execute('DELETE FROM tbl_drones_mgn WHERE id=3')
+        self.conn.commit()
+        self.assertTrue(self.repository.acquire_drone_lock(3, 'oper1', lease_until=200, now=100))
+        self.assertFalse(self.repository.acquire_drone_lock(42, 'oper1', lease_until=200, now=100))
+
+
+class TestSQLiteConnectionPool(unittest.TestCase):
+    def setUp(self):
+        # Временная БД на диске: в :memory: режим WAL недоступен
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path_to_db = os.path.join(self.tmp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_connection_reused(self):
+        pool = SQLiteConnectionPool(self.path_to_db, size=2)
+        conn1 = pool.acquire()
+        pool.release(conn1)
+        conn2 = pool.acquire()
+        self.assertIs(conn1, conn2)
+        metrics = pool.get_metrics()
+        self.assertEqual(metrics['misses'], 1)
+        self.assertEqual(metrics['hits'], 1)
+        self.assertEqual(metrics['in_use'], 1)
+        pool.release(conn2)
+        pool.close()
+
+    def test_pragmas_applied(self):
+        pool = SQLiteConnectionPool(self.path_to_db, size=1)
+        conn = pool.acquire()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        pool.release(conn)
+        pool.close()
+
+    def test_timeout_when_exhausted(self):
+        pool = SQLiteConnectionPool(self.path_to_db, size=1, timeout=0.05)
+        conn = pool.acquire()
+        with self.assertRaises(PoolTimeoutError):
+            pool.acquire()
+        self.assertEqual(pool.get_metrics()['timeouts'], 1)
+        pool.release(conn)
+        pool.close()
+
+    def test_waiter_gets_released_connection(self):
+        pool = SQLiteConnectionPool(self.path_to_db, size=1, timeout=2)
+        conn = pool.acquire()
+        timer = threading.Timer(0.05, pool.release, args=(conn,))
+        timer.start()
+        self.assertIs(pool.acquire(), conn)
+        timer.join()
+        self.assertEqual(pool.get_metrics()['waits'], 1)
+
+    def test_release_rolls_back_open_transaction(self):
+        pool = SQLiteConnectionPool(self.path_to_db, size=1)
+        conn = pool.acquire()
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        self.assertTrue(conn.in_transaction)
+        pool.release(conn)
+        conn = pool.acquire()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+        pool.release(conn)
+        pool.close()
+
+    def test_broken_connection_replaced(self):
+        pool = SQLiteConnectionPool(self.path_to_db, size=1, health_check_interval=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        new_conn = pool.acquire()
+        self.assertIsNot(new_conn, conn)
+        self.assertEqual(pool.get_metrics()['discarded'], 1)
+        pool.release(new_conn)
+        pool.close()
+
+    def test_connection_manager_returns_to_pool(self):
+        factory = SQLiteDBFactory(pool_size=1)
+        with DBConnectionManager(factory, self.path_to_db) as conn1:
+            pass
+        with DBConnectionManager(factory, self.path_to_db) as conn2:
+            pass
+        self.assertIs(conn1, conn2)
+        self.assertEqual(factory.get_pool_metrics()[self.path_to_db]['idle'], 1)
+        factory.close()
+
+    def test_factory_connect_propagates_timeout(self):
+        factory = SQLiteDBFactory(pool_size=1, timeout=0.05)
+        conn = factory.connect(self.path_to_db)
+        with self.assertRaises(PoolTimeoutError):
+            factory.connect(self.path_to_db)
+        factory.release(conn)
+        factory.close()
+
+
+class TestDBExecutor(unittest.TestCase):
+    def test_run_in_worker_thread(self):
+        executor = DBExecutor(workers=2)
+        try:
+            name = asyncio.run(executor.run(lambda: threading.current_thread().name))
+            self.assertTrue(name.startswith('db-executor-'))
+            with self.assertRaises(ZeroDivisionError):
+                asyncio.run(executor.run(lambda: 1 / 0))
+            metrics = executor.get_metrics()
+            self.assertEqual((metrics['completed'], metrics['failed']), (1, 1))
+        finally:
+            executor.shutdown()
+
+    def test_bounded_queue_rejects(self):
+        executor = DBExecutor(workers=1, max_queue=1)
+        started, blocker = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            blocker.wait()
+        try:
+            first = executor.submit(block)
+            started.wait(1)
+            second = executor.submit(lambda: 'ok')  # ждет в очереди
+            with self.assertRaises(DBExecutorOverloadedError):
+                executor.submit(lambda: 'лишняя задача')
+            blocker.set()
+            first.result(1)
+            self.assertEqual(second.result(1), 'ok')
+            self.assertEqual(executor.get_metrics()['rejected'], 1)
+        finally:
+            blocker.set()
+            executor.shutdown()
+
+
+class TestAsyncSQLiteDroneRepository(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path_to_db = os.path.join(self.tmp_dir.name, 'test.db')
+        conn = sqlite3.connect(self.path_to_db)
+        conn.executescript(SCHEMA)
+        SQLiteDroneMapper(conn).create_version_table()
+        conn.close()
+        self.factory = SQLiteDBFactory(pool_size=2)
+        self.executor = DBExecutor(workers=2)
+        self.repository = AsyncSQLiteDroneRepository(self.factory, self.path_to_db, self.executor)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.factory.close()
+        self.tmp_dir.cleanup()
+
+    def test_crud(self):
+        async def scenario():
+            await self.repository.add_drone(Drone(1, serial_number='A1', model='M', manufacturer='X'))
+            await self.repository.update_drone(1, year='2020')
+            drone = await self.repository.get_drone(1)
+            count = await self.repository.run_in_connection(
+                lambda conn: conn.execute('SELECT COUNT(*) FROM tbl_drones').fetchone()[0])
+            await self.repository.remove_drone(1)
+            return drone, count, await self.repository.get_drone(1)
+        drone, count, removed = asyncio.run(scenario())
+        self.assertEqual((drone.serial_number, drone.year), ('A1', 2020))
+        self.assertEqual(count, 1)
+        self.assertIsNone(removed)
+        self.assertEqual(self.factory.get_pool_metrics()[self.path_to_db]['in_use'], 0)
+
+    def test_concurrent_calls_share_bounded_threads(self):
+        async def scenario():
+            return await asyncio.gather(*(self.repository.get_drone(i) for i in range(20)))
+        self.assertEqual(asyncio.run(scenario()), [None] * 20)
+        self.assertLessEqual(self.factory.get_pool_metrics()[self.path_to_db]['created'], 2)
+
+
+@unittest.skipUnless(PG_DSN, 'не задана BPLA_TEST_PG_DSN')
+class TestPostgreSQLBackend(unittest.TestCase):
+    """Тесты на живой БД PostgreSQL (таблицы дронов пересоздаются)."""
+    def setUp(self):
+        self.factory = PostgreSQLDBFactory(pool_size=2, timeout=0.1)
+        self.conn = self.factory.connect(PG_DSN)
+        cursor = self.conn.cursor()
+        cursor.execute('DROP TABLE IF EXISTS tbl_drones, tbl_drones_mgn, tbl_fleet_version')
+        self.conn.commit()
+        self.repository = self.factory.create_drone_repository(self.conn)
+        self.repository.create_tables()
+        self.repository.create_indexes()
+        self.repository.create_version_table()
+        self.repository.mapper.batch_chunk_size = 4
+        self.result = self.repository.add_drones(
+            Drone(None, serial_number=f'SN{i:04d}', model=f'Model{i % 4}', manufacturer='DJI',
+                  year=None if i % 5 == 0 else 2015 + i % 10, purchase_date='2020-01-01') for i in range(1, 26))
+
+    def tearDown(self):
+        self.factory.release(self.conn)
+        self.factory.close()
+
+    def test_copy_import_and_row_errors(self):
+        self.assertEqual(self.result.succeeded, 25)
+        drones = [Drone(None, serial_number='SN0001', model='M', manufacturer='X'),
+                  Drone(None, serial_number='NEW', model='M', manufacturer='X')]
+        result = self.repository.add_drones(drones)
+        self.assertEqual(result.succeeded, 1)
+        self.assertEqual([key for key, _ in result.errors], [0])
+        self.assertIsNone(drones[0].id)
+        self.assertEqual(self.repository.get_drone(drones[1].id).purchase_date, None)
+        self.assertEqual(self.repository.get_drone(1).purchase_date, '2020-01-01')
+        self.assertGreater(self.repository.get_drone_id(), drones[1].id)
+
+    def test_keyset_pages_with_nulls_match_sqlite_order(self):
+        for descending in (False, True):
+            ids, cursor = [], None
+            while True:
+                drones, cursor = self.repository.get_drones_page(sort='year', descending=descending,
+                                                                 limit=4, cursor=cursor)
+                ids.extend(drone.id for drone in drones)
+                if cursor is None:
+                    break
+            rows = [(drone.year, drone.id) for drone in self.repository.get_drones_with_id('id')]
+            expected = sorted(rows, key=lambda row: (row[0] is not None, row[0] or 0, row[1]), reverse=descending)
+            self.assertEqual(ids, [drone_id for _, drone_id in expected])
+
+    def test_streaming_and_batch_update(self):
+        self.assertEqual(sum(1 for _ in self.repository.iter_drones('id', arraysize=3)), 25)
+        self.assertEqual([drone.model for drone in self.repository.iter_drones(filters={'model': 'Model1'})],
+                         ['Model1'] * 7)
+        result = self.repository.update_drones({1: {'model': 'U'}, 2: {'serial_number': 'SN0003'}})
+        self.assertEqual((result.affected, result.error_count), (1, 1))
+        self.assertEqual(self.repository.remove_drones([1, 2, 999]).affected, 2)
+        # add_drones в setUp, update_drones и remove_drones
+        self.assertEqual(self.repository.get_fleet_version()[0], 3)
+
+    def test_locks(self):
+        self.repository.create_lock_columns()
+        self.assertTrue(self.repository.acquire_drone_lock(3, 'a', 100.0, 50.0))
+        self.assertFalse(self.repository.acquire_drone_lock(3, 'b', 100.0, 50.0))
+        self.assertEqual(self.repository.release_expired_locks(150.0), [3])
+        self.assertTrue(self.repository.acquire_drone_lock(3, 'b', 300.0, 150.0))
+        self.assertEqual(self.repository.get_drones_status_mgn([2, 3, 999]), {2: 'release', 3: 'lock'})
+        self.assertEqual(len(self.repository.get_drones_status_mgn()), 25)
+
+    def test_pool_timeout(self):
+        other = self.factory.connect(PG_DSN)
+        with self.assertRaises(PoolTimeoutError):
+            self.factory.get_pool(PG_DSN).acquire()
+        self.factory.release(other)
+        self.assertEqual(self.factory.get_pool_metrics()[PG_DSN]['in_use'], 1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+import gzip
+import io
+import json
+import unittest
+from db_modules import Drone
+from drone_io import (iter_drone_pages, iter_export_drones, iter_gzip, iter_import_drones, iter_json_records,
+                      spool_import_drones)
+
+
+class TestDroneImport(unittest.TestCase):
+    def test_csv(self):
+        data = 'serial_number,model,manufacturer,year,unknown\nSN1,M1,DJI,2020,x\nSN2,M2,Parrot,,y\n'
+        drones = list(iter_import_drones(io.BytesIO(data.encode('utf-8')), 'csv'))
+        self.assertEqual([drone.serial_number for drone in drones], ['SN1', 'SN2'])
+        self.assertIsNone(drones[0].id)
+        self.assertEqual(drones[0].year, '2020')
+        self.assertIsNone(drones[1].year)
+
+    def test_json_array_and_ndjson(self):
+        array = b'[{"serial_number": "SN1", "model": "M"}, {"serial_number": "SN2", "model": "M"}]'
+        ndjson = b'{"serial_number": "SN1", "model": "M"}\n{"serial_number": "SN2", "model": "M"}\n'
+        for data in (array, ndjson):
+            drones = list(iter_import_drones(io.BytesIO(data), 'json'))
+            self.assertEqual([drone.serial_number for drone in drones], ['SN1', 'SN2'])
+
+    def test_json_objects_split_across_chunks(self):
+        records = [{'serial_number': f'SN{i}', 'model': 'Модель ' * 50} for i in range(2000)]
+        data = ('[' + ','.join(['{"serial_number": "%s", "model": "%s"}' % (r['serial_number'], r['model'])
+                                for r in records]) + ']').encode('utf-8')
+        self.assertEqual(list(iter_json_records(io.BytesIO(data))), records)
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            list(iter_import_drones(io.BytesIO(b'{"serial_number": '), 'json'))
+        with self.assertRaises(ValueError):
+            list(iter_import_drones(io.BytesIO(b'[1, 2]'), 'json'))
+        with self.assertRaises(ValueError):
+            list(iter_import_drones(io.BytesIO(b''), 'xml'))
+
+    def test_spool(self):
+        data = 'serial_number,model,year\nSN1,Модель,2020\nSN2,M2,\n'.encode('utf-8')
+        with spool_import_drones(io.BytesIO(data), 'csv', max_memory=16) as spool:
+            drones = list(iter_import_drones(spool, 'ndjson'))
+        self.assertEqual([(drone.serial_number, drone.model, drone.year) for drone in drones],
+                         [('SN1', 'Модель', '2020'), ('SN2', 'M2', None)])
+        # Ошибка формата - при разборе, до возврата файла
+        with self.assertRaises(ValueError):
+            spool_import_drones(io.BytesIO(b'{"serial_number": "SN1"}\n{"serial'), 'ndjson')
+
+
+class TestDroneExport(unittest.TestCase):
+    def setUp(self):
+        self.drones = [Drone(id=i, serial_number=f'SN{i}', model='Модель, "A"', manufacturer='DJI',
+                             year=None if i % 2 else 2020) for i in range(1, 201)]
+
+    def test_csv_round_trip(self):
+        chunks = list(iter_export_drones(self.drones, 'csv', chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith(','.join(Drone.tbl_drones_cols)))
+        imported = list(iter_import_drones(io.BytesIO(''.join(chunks).encode('utf-8')), 'csv'))
+        self.assertEqual([drone.serial_number for drone in imported], [drone.serial_number for drone in self.drones])
+        self.assertEqual(imported[0].model, 'Модель, "A"')
+        self.assertIsNone(imported[0].year)
+
+    def test_ndjson(self):
+        chunks = list(iter_export_drones(self.drones, 'ndjson', chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        records = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual(records[1], self.drones[1].to_dict())
+        self.assertEqual(list(iter_export_drones([], 'ndjson')), [])
+        with self.assertRaises(ValueError):
+            iter_export_drones(self.drones, 'xml')
+
+    def test_pages(self):
+        calls = []
+
+        def fetch_page(cursor):
+            calls.append(cursor)
+            start = cursor or 0
+            return self.drones[start:start + 64], start + 64 if start + 64 < len(self.drones) else None
+
+        self.assertEqual(list(iter_drone_pages(fetch_page)), self.drones)
+        self.assertEqual(calls, [None, 64, 128, 192])
+
+    def test_gzip(self):
+        chunks = list(iter_export_drones(self.drones, 'csv', chunk_size=1024))
+        data = b''.join(iter_gzip(iter(chunks)))
+        self.assertEqual(gzip.decompress(data).decode('utf-8'), ''.join(chunks))
+        self.assertEqual(gzip.decompress(b''.join(iter_gzip([]))), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+from fleet_simulator import FleetSimulator, METERS_PER_DEGREE
+
+
+class TestFleetSimulator(unittest.TestCase):
+    def test_seed_reproducible(self):
+        sim1 = FleetSimulator(100, seed=42)
+        sim2 = FleetSimulator(100, seed=42)
+        for _ in range(10):
+            sim1.step(0.1)
+            sim2.step(0.1)
+        np.testing.assert_array_equal(sim1.latitude, sim2.latitude)
+        np.testing.assert_array_equal(sim1.battery_level, sim2.battery_level)
+
+    def test_limits(self):
+        sim = FleetSimulator(500, seed=1)
+        for _ in range(200):
+            sim.step(60)
+        self.assertTrue((sim.battery_level >= 0).all())
+        self.assertTrue((sim.speed >= 0).all() and (sim.speed <= sim.max_speed).all())
+        self.assertTrue((sim.altitude >= 0).all() and (sim.altitude <= sim.max_altitude).all())
+        # Дроны не улетают от точки старта дальше радиуса плюс один шаг
+        north = (sim.latitude - sim.home_latitude) * METERS_PER_DEGREE
+        east = (sim.longitude - sim.home_longitude) * METERS_PER_DEGREE * np.cos(np.radians(sim.latitude))
+        self.assertTrue((np.hypot(north, east) <= sim.radius + sim.max_speed * 60 + 1).all())
+
+    def test_step_subset(self):
+        sim = FleetSimulator(seed=1)
+        sim.add_drones([10, 20, 30])
+        sim.add_drones([20])
+        self.assertEqual(len(sim), 3)
+        before = sim.flight_time.copy()
+        sim.step(1.0, sim.rows([20]))
+        self.assertEqual((sim.flight_time - before).tolist(), [0.0, 1.0, 0.0])
+        self.assertEqual(sim.values(20)['flight_time'], 1.0)
+
+    def test_add_drones_one_by_one(self):
+        sim = FleetSimulator(seed=1)
+        for drone_id in range(1, 101):
+            sim.add_drones([drone_id])
+        sim.step(1.0)
+        self.assertEqual(len(sim), 100)
+        self.assertEqual(sim.ids.tolist(), list(range(1, 101)))
+        self.assertEqual(len(sim.latitude), 100)
+        self.assertEqual(sim.rows([100, 1]).tolist(), [99, 0])
+        self.assertTrue((sim.flight_time == 1.0).all())
+        self.assertEqual(sim.values(100)['current_latitude'], float(sim.latitude[99]))
+
+    def test_set_values(self):
+        sim = FleetSimulator(seed=1)
+        sim.add_drones([10, 20])
+        sim.set_values(sim.rows([20]), latitude=[55.5], battery_level=[42.0])
+        self.assertEqual(sim.values(20)['current_latitude'], 55.5)
+        self.assertEqual(sim.values(20)['battery_level'], 42.0)
+        self.assertNotEqual(sim.values(10)['battery_level'], 42.0)
+        with self.assertRaises(ValueError):
+            sim.set_values(sim.rows([10]), ids=[1])
+
+    def test_remove_drones(self):
+        sim = FleetSimulator(10, seed=1)
+        sim.step(1.0)
+        values = sim.values(9)
+        sources, destinations = sim.remove_drones([2, 10, 42])
+        self.assertEqual(len(sim), 8)
+        # Строка дрона 9 перенесена на место удаленного дрона 2
+        self.assertEqual((sources.tolist(), destinations.tolist()), ([8], [1]))
+        self.assertEqual(sim.ids.tolist(), [1, 9, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(sim.rows([9]).tolist(), [1])
+        self.assertEqual(sim.values(9), values)
+        with self.assertRaises(KeyError):
+            sim.rows([2])
+        sim.add_drones([2])
+        self.assertEqual(sim.rows([2]).tolist(), [8])
+
+    def test_remove_drones_shrinks_buffers(self):
+        sim = FleetSimulator(1000, seed=1)
+        sim.remove_drones(range(1, 1000))
+        self.assertEqual(sim.ids.tolist(), [1000])
+        sim.step(1.0)
+        self.assertEqual(sim.values(1000)['flight_time'], 1.0)
+        sim.add_drones(range(1, 100))
+        self.assertEqual(len(sim), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import unittest
+from log_config import (BatchingQueueListener, BufferedRotatingFileHandler, DroppingQueueHandler, JSONFormatter,
+                        parse_levels, setup_logging)
+
+
+class TestLogConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'server.log')
+        root = logging.getLogger()
+        self.root_state = (root.handlers[:], root.level)
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        handlers, level = self.root_state
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+        logging.getLogger('test_quiet').setLevel(logging.NOTSET)
+        self.tmp.cleanup()
+
+    def read_records(self, path=None):
+        with open(path or self.path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_json_formatter(self):
+        logger = logging.getLogger('test_json')
+        try:
+            raise ValueError('ошибка')
+        except ValueError:
+            record = logger.makeRecord('test_json', logging.ERROR, __file__, 1, 'Дрон %s', (7,),
+                                       sys.exc_info(), func='f', extra={'drone_id': 7})
+        data = json.loads(JSONFormatter().format(record))
+        self.assertEqual(data['message'], 'Дрон 7')
+        self.assertEqual(data['level'], 'ERROR')
+        self.assertEqual(data['logger'], 'test_json')
+        self.assertEqual(data['drone_id'], 7)
+        self.assertIn('ValueError: ошибка', data['exc_info'])
+
+    def test_pipeline_and_levels(self):
+        listener = setup_logging(self.path, level='DEBUG', levels={'test_quiet': 'WARNING'}, flush_interval=0.05)
+        args = [1]
+        logging.getLogger('test_loud').debug('Аргументы %s', args)
+        args.append(2)  # Подстановка выполнена до постановки в очередь
+        logging.getLogger('test_quiet').info('Не записывается')
+        logging.getLogger('test_quiet').warning('Записывается')
+        try:
+            raise KeyError('k')
+        except KeyError:
+            logging.getLogger('test_loud').exception('Исключение')
+        listener.stop()
+        records = self.read_records()
+        self.assertEqual([record['message'] for record in records], ['Аргументы [1]', 'Записывается', 'Исключение'])
+        self.assertIn('KeyError', records[2]['exc_info'])
+
+    def test_rotation(self):
+        log_queue = queue.Queue()
+        handler = BufferedRotatingFileHandler(self.path, max_bytes=1000, backup_count=2)
+        handler.setFormatter(JSONFormatter())
+        listener = BatchingQueueListener(log_queue, handler, batch_size=8)
+        listener.start()
+        queue_handler = DroppingQueueHandler(log_queue)
+        for i in range(100):
+            queue_handler.handle(logging.LogRecord('test', logging.INFO, __file__, 1, 'Запись %s', (i,), None))
+        listener.stop()
+        handler.close()
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        for path in (self.path, self.path + '.1'):
+            self.assertLessEqual(os.path.getsize(path), 1000)
+        self.assertEqual(self.read_records()[-1]['message'], 'Запись 99')
+
+    def test_full_queue_drops_records(self):
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for i in range(5):
+            handler.handle(logging.LogRecord('test', logging.INFO, __file__, 1, 'Запись', None, None))
+        self.assertEqual(handler.dropped, 3)
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels(' db_modules=warning, werkzeug=ERROR ,'),
+                         {'db_modules': 'WARNING', 'werkzeug': 'ERROR'})
+        self.assertEqual(parse_levels(''), {})
+        with self.assertRaises(ValueError):
+            parse_levels('db_modules')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+import io
+import json
+import threading
+import time
+import unittest
+import socketio
+from db_modules import LRUTTLCache
+from message_queue import (BrokerClient, BrokerConnection, BrokerManager, KombuConnection, MessageBroker,
+                           check_broker_url, encode_frame, kombu, parse_broker_url, read_frame, share_invalidations,
+                           share_key_reloads)
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestFrames(unittest.TestCase):
+    def test_round_trip(self):
+        file = io.BytesIO(encode_frame(b'P', 'канал', b'\x00data') + encode_frame(b'S', 'a'))
+        self.assertEqual(read_frame(file), (b'P', 'канал', b'\x00data'))
+        self.assertEqual(read_frame(file), (b'S', 'a', b''))
+        self.assertIsNone(read_frame(file))
+
+    def test_parse_broker_url(self):
+        self.assertEqual(parse_broker_url('bpla://127.0.0.1:7000'), ('127.0.0.1', 7000))
+        self.assertEqual(parse_broker_url('bpla://localhost'), ('localhost', 5556))
+        with self.assertRaises(ValueError):
+            parse_broker_url('redis://localhost:6379')
+
+    def test_check_broker_url(self):
+        check_broker_url('bpla://127.0.0.1:7000')
+        with self.assertRaises(ValueError):
+            check_broker_url('zmq://localhost')
+
+
+class TestMessageBroker(unittest.TestCase):
+    def setUp(self):
+        self.broker = MessageBroker()
+        self.url = self.broker.start()
+
+    def tearDown(self):
+        self.broker.stop()
+
+    def subscribed(self, *channels):
+        """Соединение с подтвержденной подпиской: собственная публикация возвращается
+        только после обработки подписки брокером."""
+        connection = BrokerConnection(self.url)
+        connection.subscribe(*channels)
+        connection.publish(channels[0], b'ready')
+        self.assertEqual(connection.receive(), (channels[0], b'ready'))
+        return connection
+
+    def test_publish_subscribe(self):
+        subscriber = self.subscribed('a', 'b')
+        publisher = BrokerConnection(self.url)
+        publisher.publish('c', b'never')
+        publisher.publish('b', b'1')
+        publisher.publish('a', b'2')
+        self.assertEqual(subscriber.receive(), ('b', b'1'))
+        self.assertEqual(subscriber.receive(), ('a', b'2'))
+        subscriber.unsubscribe('b')
+        subscriber.publish('a', b'sync')
+        self.assertEqual(subscriber.receive(), ('a', b'sync'))
+        publisher.publish('b', b'3')
+        publisher.publish('a', b'4')
+        self.assertEqual(subscriber.receive(), ('a', b'4'))
+        self.assertEqual(self.broker.get_metrics()['connections'], 2)
+        publisher.close()
+        subscriber.close()
+
+    def test_client_callbacks_and_reconnect(self):
+        received = []
+        client = BrokerClient(self.url, reconnect_interval=0.05)
+        client.subscribe('a', received.append)
+        client.start()
+        try:
+            self.assertTrue(client.wait_connected(5))
+            self.assertTrue(wait_for(lambda: client.publish('a', b'1') and received))
+            self.assertEqual(received[0], b'1')
+            # Перезапуск брокера на том же порту: клиент переподключается и подписывается снова
+            port = self.broker.port
+            self.broker.stop()
+            self.assertTrue(wait_for(lambda: not client.connected))
+            self.assertFalse(client.publish('a', b'lost'))
+            self.broker = MessageBroker(port=port)
+            self.broker.start()
+            self.assertTrue(client.wait_connected(5))
+            received.clear()
+            self.assertTrue(wait_for(lambda: client.publish('a', b'2') and received))
+            self.assertEqual(received[0], b'2')
+            self.assertGreaterEqual(client.dropped, 1)
+        finally:
+            client.stop()
+
+    def test_share_invalidations(self):
+        caches = [LRUTTLCache(), LRUTTLCache()]
+        clients = [BrokerClient(self.url), BrokerClient(self.url)]
+        try:
+            for cache, client in zip(caches, clients):
+                share_invalidations(cache, client)
+                client.start()
+                self.assertTrue(client.wait_connected(5))
+                cache.set(('drone', 1), 'a')
+                cache.set(('drone', 2), 'b')
+            # Подписки обрабатываются брокером асинхронно: сброс повторяется до доставки
+            self.assertTrue(wait_for(lambda: caches[0].invalidate(('drone', 1)) or
+                                     caches[1].get(('drone', 1)) is None))
+            self.assertEqual(caches[1].get(('drone', 2)), 'b')
+            caches[1].bump_generation()
+            self.assertTrue(wait_for(lambda: caches[0].generation == 1))
+            self.assertEqual(caches[1].generation, 1)
+        finally:
+            for client in clients:
+                client.stop()
+
+    def test_share_key_reloads(self):
+        class KeyProvider:
+            on_change = None
+            requests = 0
+
+            def request_reload(self):
+                self.requests += 1
+
+        providers = [KeyProvider(), KeyProvider()]
+        clients = [BrokerClient(self.url), BrokerClient(self.url)]
+        try:
+            for provider, client in zip(providers, clients):
+                share_key_reloads(provider, client)
+                client.start()
+                self.assertTrue(client.wait_connected(5))
+            # Смена ключей в процессе 0 запрашивает перечитывание только в остальных
+            self.assertTrue(wait_for(lambda: providers[0].on_change() or providers[1].requests))
+            self.assertEqual(providers[0].requests, 0)
+        finally:
+            for client in clients:
+                client.stop()
+
+    def test_socketio_emit_across_servers(self):
+        sender = socketio.Server(client_manager=BrokerManager(self.url))
+        receiver = socketio.Server(client_manager=BrokerManager(self.url))
+        sent = []
+        # Пакеты клиента получателя записываются вместо отправки (как в тестовом клиенте Flask-SocketIO)
+        receiver._send_eio_packet = lambda eio_sid, pkt: sent.append((eio_sid, pkt.data))
+        receiver.manager.initialize()
+        receiver.manager.connect('eio-1', '/')
+
+        def delivered():
+            sender.emit('drone_status_changed', {'drone_id': 1, 'status': 'lock'})
+            return sent
+
+        # Прием начинается после подписки менеджера получателя на брокере
+        self.assertTrue(wait_for(delivered))
+        eio_sid, data = sent[0]
+        self.assertEqual(eio_sid, 'eio-1')
+        self.assertEqual(json.loads(data[1:]), ['drone_status_changed', {'drone_id': 1, 'status': 'lock'}])
+
+
+@unittest.skipIf(kombu is None, 'kombu не установлен')
+class TestKombuBroker(unittest.TestCase):
+    """Брокер kombu на транспорте memory:// (сообщения в пределах процесса)."""
+    url = 'memory://'
+
+    def test_publish_subscribe(self):
+        subscriber, publisher = KombuConnection(self.url), KombuConnection(self.url)
+        try:
+            subscriber.subscribe('a')
+            # Подписка применяется в receive: публикация повторяется до доставки
+            delivered = threading.Event()
+            publishing = threading.Thread(target=lambda: wait_for(
+                lambda: publisher.publish('a', b'\x00data') or delivered.wait(0.05)))
+            publishing.start()
+            self.assertEqual(subscriber.receive(), ('a', b'\x00data'))
+            delivered.set()
+            publishing.join()
+        finally:
+            subscriber.close()
+            publisher.close()
+        with self.assertRaises(ConnectionError):
+            subscriber.receive()
+
+    def test_client_share_invalidations(self):
+        caches = [LRUTTLCache(), LRUTTLCache()]
+        clients = [BrokerClient(self.url), BrokerClient(self.url)]
+        try:
+            for cache, client in zip(caches, clients):
+                share_invalidations(cache, client)
+                client.start()
+                self.assertTrue(client.wait_connected(5))
+                cache.set(('drone', 1), 'a')
+            self.assertTrue(wait_for(lambda: caches[0].invalidate(('drone', 1)) or
+                                     caches[1].get(('drone', 1)) is None))
+        finally:
+            for client in clients:
+                client.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
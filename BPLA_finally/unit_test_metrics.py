@@ -0,0 +1,107 @@
+import unittest
+from unittest import mock
+from metrics import MetricsRegistry, instrumented, timed
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('requests_total', 'Запросы', ('route',))
+        counter.inc(route='/a')
+        counter.inc(2, route='/a')
+        self.assertEqual(counter.get(route='/a'), 3)
+        with self.assertRaises(ValueError):
+            counter.inc(path='/a')
+        self.registry.gauge('pool', 'Пул', ('stat',), lambda: {('idle',): 2, ('in_use',): 1})
+        text = self.registry.render()
+        self.assertIn('# TYPE requests_total counter\nrequests_total{route="/a"} 3\n', text)
+        self.assertIn('pool{stat="idle"} 2\npool{stat="in_use"} 1\n', text)
+        with self.assertRaises(ValueError):
+            self.registry.counter('requests_total', 'Повтор')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency_seconds', 'Задержка', ('op',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, op='get')
+        self.assertEqual(histogram.get(op='get'), (4, 3.65))
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{op="get",le="0.1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{op="get",le="1"} 3\n', text)
+        self.assertIn('latency_seconds_bucket{op="get",le="+Inf"} 4\n', text)
+        self.assertIn('latency_seconds_count{op="get"} 4\n', text)
+        with histogram.time(op='put'):
+            pass
+        self.assertEqual(histogram.get(op='put')[0], 1)
+
+    def test_label_escaping(self):
+        self.registry.counter('events_total', 'События', ('name',)).inc(name='a"b\\c\nd')
+        self.assertIn('events_total{name="a\\"b\\\\c\\nd"} 1\n', self.registry.render())
+
+    def test_instrumented(self):
+        histogram = self.registry.histogram('calls_seconds', 'Вызовы', ('method',))
+
+        class Mapper:
+            def get(self, value):
+                return value * 2
+
+            def iter_values(self):
+                yield from range(3)
+
+            def _private(self):
+                return None
+
+        class ChildMapper(Mapper):
+            def put(self):
+                raise KeyError('put')
+
+        mapper = instrumented(ChildMapper, histogram)()
+        self.assertIsInstance(mapper, ChildMapper)
+        self.assertEqual(mapper.get(2), 4)
+        self.assertEqual(list(mapper.iter_values()), [0, 1, 2])
+        mapper._private()
+        with self.assertRaises(KeyError):
+            mapper.put()
+        self.assertEqual(histogram.get(method='get')[0], 1)
+        self.assertEqual(histogram.get(method='iter_values')[0], 1)
+        self.assertEqual(histogram.get(method='put')[0], 1)
+        self.assertEqual(histogram.get(method='_private')[0], 0)
+        # Исходные классы не изменяются
+        ChildMapper().get(1)
+        self.assertEqual(histogram.get(method='get')[0], 1)
+
+    def test_generator_timed_until_first_value(self):
+        histogram = self.registry.histogram('iter_seconds', 'Генераторы', ('method',))
+        closed = []
+
+        class Mapper:
+            def iter_rows(self):
+                try:
+                    yield from range(3)
+                finally:
+                    closed.append(True)
+
+        rows = instrumented(Mapper, histogram)().iter_rows()
+        self.assertEqual(histogram.get(method='iter_rows')[0], 0)  # запрос выполняется при чтении
+        self.assertEqual(next(rows), 0)
+        self.assertEqual(histogram.get(method='iter_rows')[0], 1)
+        with mock.patch('metrics.time.perf_counter', side_effect=AssertionError('замер после первого значения')):
+            self.assertEqual(next(rows), 1)
+        rows.close()
+        self.assertEqual(closed, [True])
+
+    def test_timed_decorator(self):
+        histogram = self.registry.histogram('handler_seconds', 'Обработчики', ('event',))
+
+        @timed(histogram, event='ping')
+        def handler(data):
+            return data
+
+        self.assertEqual(handler.__name__, 'handler')
+        self.assertEqual(handler(1), 1)
+        self.assertEqual(histogram.get(event='ping')[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
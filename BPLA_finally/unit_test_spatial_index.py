@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+from spatial_index import SeparationMonitor, SpatialIndex, distance
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.ids = list(range(1, 2001))
+        self.latitude = 55.75 + rng.uniform(-0.05, 0.05, len(self.ids))
+        self.longitude = 37.6 + rng.uniform(-0.08, 0.08, len(self.ids))
+        self.index = SpatialIndex(cell_size=200.0, capacity=16)
+        self.index.update_many(self.ids, self.latitude, self.longitude)
+
+    def brute_force(self, latitude, longitude):
+        return distance(latitude, longitude, self.latitude, self.longitude)
+
+    def test_radius_and_nearest_match_full_scan(self):
+        distances = self.brute_force(55.75, 37.6)
+        found = self.index.within_radius(55.75, 37.6, 300)
+        self.assertEqual(sorted(drone_id for drone_id, _ in found),
+                         [drone_id for drone_id, d in zip(self.ids, distances) if d <= 300])
+        self.assertEqual([d for _, d in found], sorted(d for _, d in found))
+        nearest = self.index.nearest(55.75, 37.6, 25)
+        self.assertEqual([drone_id for drone_id, _ in nearest],
+                         [self.ids[i] for i in np.argsort(distances, kind='stable')[:25]])
+        # Радиус больше сетки - полный просмотр
+        self.assertEqual(len(self.index.within_radius(55.75, 37.6, 100000)), len(self.ids))
+        self.assertEqual(len(self.index.nearest(0, 0, 5000)), len(self.ids))
+
+    def test_bbox(self):
+        expected = [drone_id for drone_id, latitude, longitude in zip(self.ids, self.latitude, self.longitude)
+                    if 55.74 <= latitude <= 55.76 and 37.55 <= longitude <= 37.62]
+        self.assertEqual(self.index.within_bbox(55.74, 37.55, 55.76, 37.62), expected)
+        with self.assertRaises(ValueError):
+            self.index.within_bbox(56, 37, 55, 38)
+
+    def test_close_pairs_match_full_scan(self):
+        matrix = distance(self.latitude[:, None], self.longitude[:, None], self.latitude, self.longitude)
+        first, second = np.nonzero(np.triu(matrix < 40, k=1))
+        pairs = self.index.close_pairs(40)
+        self.assertEqual(sorted((a, b) for a, b, _ in pairs),
+                         sorted(zip((first + 1).tolist(), (second + 1).tolist())))
+        self.assertEqual([d for _, _, d in pairs], sorted(d for _, _, d in pairs))
+
+    def test_incremental_update_and_remove(self):
+        self.index.update(5, 0.0, 0.0)
+        self.assertEqual(self.index.nearest(0.0, 0.0), [(5, 0.0)])
+        self.assertTrue(self.index.remove(5))
+        self.assertFalse(self.index.remove(5))
+        self.assertIsNone(self.index.position(5))
+        self.assertEqual(len(self.index), len(self.ids) - 1)
+        # Строка последнего дрона перенесена на место удаленного
+        self.assertEqual(self.index.position(2000), (self.latitude[-1], self.longitude[-1]))
+        self.assertEqual(self.index.within_radius(self.latitude[-1], self.longitude[-1], 0)[0][0], 2000)
+        with self.assertRaises(ValueError):
+            self.index.update(1, 91.0, 0.0)
+        for radius in (-1.0, float('nan'), float('inf')):
+            with self.assertRaises(ValueError):
+                self.index.within_radius(55.75, 37.6, radius)
+
+    def test_dateline(self):
+        index = SpatialIndex(cell_size=100.0)
+        index.update_many([1, 2, 3], [0.0, 0.0, 0.0], [179.9995, -179.9995, 170.0])
+        self.assertEqual([drone_id for drone_id, _ in index.within_radius(0.0, 180.0, 100)], [1, 2])
+        self.assertEqual(index.within_bbox(-1, 179, 1, -179), [1, 2])
+        self.assertEqual([(a, b) for a, b, _ in index.close_pairs(150)], [(1, 2)])
+
+
+class TestSeparationMonitor(unittest.TestCase):
+    def test_transitions(self):
+        index = SpatialIndex()
+        index.update_many([1, 2], [10.0, 10.0], [20.0, 20.01])
+        monitor = SeparationMonitor(index, 50)
+        self.assertEqual(monitor.check(), ([], []))
+        index.update(2, 10.0, 20.0002)
+        started, cleared = monitor.check()
+        self.assertEqual([(a, b) for a, b, _ in started], [(1, 2)])
+        self.assertEqual(monitor.check(), ([], []))
+        index.update(2, 10.0, 20.01)
+        self.assertEqual(monitor.check(), ([], [(1, 2)]))
+        self.assertEqual(monitor.active, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
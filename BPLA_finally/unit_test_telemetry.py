@@ -0,0 +1,322 @@
+import threading
+import time
+import unittest
+from message_queue import BrokerClient, MessageBroker
+from spatial_index import SpatialIndex
+from telemetry import (decode_frame, encode_frame, TELEMETRY_FRAME_DTYPE, TelemetryEngine,
+                       TelemetryRelay, TelemetryRingBuffer, TelemetryUnavailableError, telemetry_frame_layout,
+                       telemetry_room, UnknownDroneError)
+
+
+def make_values(i):
+    return {
+        'current_latitude': 55.0 + i, 'current_longitude': 37.0, 'speed': 1.0, 'direction': i % 360,
+        'altitude': 10.0, 'flight_time': i, 'battery_level': 100.0 - i % 100,
+    }
+
+
+class TestTelemetryRingBuffer(unittest.TestCase):
+    def test_capacity_bounded(self):
+        buffer = TelemetryRingBuffer(capacity=5)
+        for i in range(12):
+            buffer.append(float(i), make_values(i))
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(buffer.last(10)['timestamp'].tolist(), [7, 8, 9, 10, 11])
+        self.assertEqual(buffer.last(2)['flight_time'].tolist(), [10, 11])
+        self.assertEqual(buffer.last(0)['timestamp'].tolist(), [])
+
+    def test_window_across_wrap(self):
+        buffer = TelemetryRingBuffer(capacity=6)
+        for i in range(10):
+            buffer.append(float(i), make_values(i))
+        self.assertEqual(buffer.window(5, 8)['timestamp'].tolist(), [5, 6, 7, 8])
+        self.assertEqual(buffer.window(0)['timestamp'].tolist(), [4, 5, 6, 7, 8, 9])
+        self.assertEqual(buffer.window(8.5)['timestamp'].tolist(), [9])
+        self.assertEqual(buffer.window(20)['timestamp'].tolist(), [])
+        self.assertEqual(buffer.window(7, 3)['timestamp'].tolist(), [])
+
+    def test_records_and_log(self):
+        buffer = TelemetryRingBuffer(capacity=3)
+        buffer.append(0.0, make_values(1))
+        records = TelemetryRingBuffer.to_records(buffer.last(1))
+        self.assertEqual(records[0]['current_latitude'], 56.0)
+        self.assertEqual(records[0]['direction'], 1)
+        log = TelemetryRingBuffer.format_log(buffer.last(1))
+        self.assertIn('Координаты: (56.000000, 37.000000)', log[0])
+
+
+    def test_rows(self):
+        buffer = TelemetryRingBuffer(capacity=3, rows=0)
+        buffer.resize(2)
+        for i in range(4):
+            buffer.append_rows([0, 1], float(i), {name: [i, 10 * i] for name, _ in buffer.fields[1:]})
+        buffer.resize(5)
+        self.assertEqual(buffer.last(5, row=0)['timestamp'].tolist(), [1, 2, 3])
+        self.assertEqual(buffer.window(2, row=1)['flight_time'].tolist(), [20, 30])
+        self.assertEqual(buffer.size(4), 0)
+        buffer.clear([1])
+        self.assertEqual(buffer.size(1), 0)
+        self.assertEqual(buffer.size(0), 3)
+
+    def test_move_rows_and_truncate(self):
+        # Строки 0-63 и 64-127 - в разных блоках
+        buffer = TelemetryRingBuffer(capacity=3, rows=64)
+        buffer.resize(100)
+        for i in range(4):
+            buffer.append_rows([1, 99], float(i), {name: [i, 10 * i] for name, _ in buffer.fields[1:]})
+        buffer.move_rows([99, 1], [0, 2])
+        self.assertEqual(buffer.last(3, row=0)['flight_time'].tolist(), [10, 20, 30])
+        self.assertEqual(buffer.window(2, row=2)['flight_time'].tolist(), [2, 3])
+        buffer.truncate(3)
+        self.assertEqual(buffer.rows, 3)
+        self.assertEqual(buffer.last(3, row=0)['timestamp'].tolist(), [1, 2, 3])
+        with self.assertRaises(IndexError):
+            buffer.size(64)
+        buffer.resize(100)
+        self.assertEqual(buffer.size(99), 0)
+
+
+class TestTelemetryEngine(unittest.TestCase):
+    def test_states_are_per_drone(self):
+        engine = TelemetryEngine(seed=1)
+        engine.step(1)
+        self.assertEqual(engine.snapshot(1)['seq'], 1)
+        self.assertEqual(engine.snapshot(2)['seq'], 0)
+
+    def test_history(self):
+        engine = TelemetryEngine(seed=1, history_size=2)
+        for _ in range(3):
+            engine.step(1)
+        self.assertEqual(engine.snapshot(1)['seq'], 3)
+        history = engine.history(1, last=5)
+        self.assertEqual(len(history['timestamp']), 2)
+        self.assertEqual(history['current_latitude'][-1], engine.simulator.latitude[0])
+
+    def test_delta_contains_only_changed_fields(self):
+        producer = TelemetryEngine(seed=1)
+        producer.step(1)
+        frame = producer.frame([1])
+        follower = TelemetryEngine(seed=2)
+        follower.apply_frame(frame)
+        follower.subscribe(1, 'sid-a')
+        records = decode_frame(frame).copy()
+        records['timestamp'] += 1
+        ((drone_id, first),) = follower.apply_frame(encode_frame(records))
+        self.assertEqual((drone_id, first['seq']), (1, 1))
+        self.assertIn('current_latitude', first)
+        self.assertIsInstance(first['direction'], int)
+        # Те же значения с более поздним временем: полей для отправки нет, дельты нет
+        records['timestamp'] += 1
+        self.assertEqual(follower.apply_frame(encode_frame(records)), [])
+        records['timestamp'] += 1
+        records['speed'] += 1
+        ((_, second),) = follower.apply_frame(encode_frame(records))
+        self.assertEqual(set(second), {'drone_id', 'seq', 'timestamp', 'speed'})
+
+    def test_tick_only_subscribed_drones(self):
+        engine = TelemetryEngine(seed=1)
+        engine.subscribe(1, 'sid-a')
+        engine.subscribe(1, 'sid-b')
+        engine.subscribe(2, 'sid-a')
+        self.assertEqual(sorted(drone_id for drone_id, _ in engine.tick()), [1, 2])
+        engine.unsubscribe_all('sid-a')
+        self.assertEqual([drone_id for drone_id, _ in engine.tick()], [1])
+        engine.unsubscribe(1, 'sid-b')
+        self.assertEqual(engine.tick(), [])
+
+    def test_unknown_drone(self):
+        engine = TelemetryEngine(seed=1, drone_exists=lambda drone_id: 0 < drone_id < 10)
+        engine.snapshot(1)
+        with self.assertRaises(UnknownDroneError):
+            engine.snapshot(10)
+        with self.assertRaises(UnknownDroneError):
+            engine.subscribe(-1, 'sid-a')
+        self.assertEqual(len(engine.simulator), 1)
+
+    def test_evict_idle(self):
+        engine = TelemetryEngine(seed=1, state_ttl=60)
+        engine.snapshot(1)
+        engine.subscribe(2, 'sid-a')
+        now = time.monotonic()
+        self.assertEqual(engine.evict_idle(now), 0)
+        # Без обращений дольше state_ttl удаляется только состояние без подписчиков
+        self.assertEqual(engine.evict_idle(now + 61), 1)
+        engine.unsubscribe(2, 'sid-a')
+        self.assertEqual(engine.evict_idle(time.monotonic() + 30), 0)
+        self.assertEqual(engine.evict_idle(time.monotonic() + 61), 1)
+        self.assertEqual(engine.snapshot(1)['seq'], 0)
+
+    def test_evict_idle_frees_rows(self):
+        index = SpatialIndex()
+        engine = TelemetryEngine(seed=1, spatial_index=index, state_ttl=0)
+        for drone_id in range(1, 2001):
+            engine.snapshot(drone_id)
+        engine.subscribe(2000, 'sid-a')
+        engine.step(2000)
+        before = engine.snapshot(2000)
+        self.assertEqual(engine.evict_idle(time.monotonic() + 1), 1999)
+        # Строки симулятора, истории и индекса освобождены, строка дрона 2000 перенесена
+        self.assertEqual(len(engine.simulator), 1)
+        self.assertEqual(len(index), 1)
+        nearby = index.within_radius(before['current_latitude'], before['current_longitude'], 1e7)
+        self.assertEqual([drone_id for drone_id, _ in nearby], [2000])
+        self.assertEqual(engine.snapshot(2000), before)
+        self.assertEqual(len(engine.history(2000)['timestamp']), 1)
+        # Новые состояния занимают освобожденные строки
+        for drone_id in range(3001, 5000):
+            engine.snapshot(drone_id)
+        self.assertEqual(len(engine.simulator), 2000)
+        self.assertEqual(len(index), 2000)
+
+    def test_spatial_index_follows_positions(self):
+        engine = TelemetryEngine(seed=1, spatial_index=SpatialIndex())
+        engine.subscribe(1, 'sid-a')
+        engine.step(2)
+        engine.tick()
+        for drone_id in (1, 2):
+            snapshot = engine.simulator.values(drone_id)
+            self.assertEqual(engine.spatial_index.position(drone_id),
+                             (snapshot['current_latitude'], snapshot['current_longitude']))
+
+    def test_apply_frame_skips_stale_records(self):
+        producer = TelemetryEngine(seed=1)
+        producer.step(1)
+        first = producer.frame([1])
+        producer.step(1)
+        second = producer.frame([1])
+        follower = TelemetryEngine(seed=2)
+        follower.apply_frame(first)
+        follower.subscribe(1, 'sid-a')
+        self.assertEqual([drone_id for drone_id, _ in follower.apply_frame(second)], [1])
+        self.assertEqual(follower.apply_frame(first), [])
+        snapshot = follower.snapshot(1)
+        self.assertEqual(snapshot['seq'], 2)
+        self.assertEqual(snapshot['current_latitude'], round(producer.snapshot(1)['current_latitude'], 6))
+
+
+class TestTelemetryFrame(unittest.TestCase):
+    def test_round_trip(self):
+        record = dict(make_values(1), drone_id=7, seq=3, timestamp=1700000000.25)
+        frame = encode_frame([record, dict(record, drone_id=8)])
+        self.assertEqual(len(frame), 4 + 2 * TELEMETRY_FRAME_DTYPE.itemsize)
+        decoded = decode_frame(frame)
+        self.assertEqual(decoded['drone_id'].tolist(), [7, 8])
+        self.assertEqual(decoded[0]['current_latitude'], 56.0)
+        self.assertEqual(decoded[0]['timestamp'], 1700000000.25)
+        self.assertAlmostEqual(float(decoded[0]['battery_level']), 99.0, places=5)
+        self.assertEqual(len(decode_frame(encode_frame([]))), 0)
+        with self.assertRaises(ValueError):
+            decode_frame(b'\x02\x00' + frame[2:])
+
+    def test_layout(self):
+        layout = telemetry_frame_layout()
+        self.assertEqual(layout[0], ('drone_id', 'u4', 0))
+        self.assertEqual(layout[-1], ('battery_level', 'f4', TELEMETRY_FRAME_DTYPE.itemsize - 4))
+
+    def test_engine_binary_subscribers(self):
+        engine = TelemetryEngine(seed=1)
+        engine.subscribe(1, 'sid-a', binary=True)
+        engine.subscribe(2, 'sid-a', binary=True)
+        engine.subscribe(2, 'sid-b')
+        # Дельты JSON - только для дронов с подписчиками JSON
+        self.assertEqual([drone_id for drone_id, _ in engine.tick()], [2])
+        frames = dict(engine.frames())
+        self.assertEqual(list(frames), ['sid-a'])
+        records = decode_frame(frames['sid-a'])
+        self.assertEqual(records['drone_id'].tolist(), [1, 2])
+        self.assertEqual(records['seq'].tolist(), [1, 1])
+        self.assertAlmostEqual(records[1]['current_longitude'], engine.snapshot(2)['current_longitude'], places=6)
+        engine.unsubscribe_all('sid-a')
+        self.assertEqual(engine.frames(), [])
+        self.assertEqual(decode_frame(engine.frame([5]))['drone_id'].tolist(), [5])
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class RecordingSocketIO:
+    """SocketIO для фоновой рассылки в тестах: задачи - потоки, emit записывается."""
+    def __init__(self):
+        self.emitted = []
+
+    def start_background_task(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def emit(self, event, data, **kwargs):
+        self.emitted.append((event, data, kwargs))
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class TestTelemetryRelay(unittest.TestCase):
+    """Производитель и процесс без моделирования, связанные локальным брокером."""
+    def setUp(self):
+        self.broker = MessageBroker()
+        url = self.broker.start()
+        self.clients = [BrokerClient(url), BrokerClient(url)]
+        self.producer = TelemetryEngine(rate_hz=20, seed=1,
+                                        relay=TelemetryRelay(self.clients[0], 0, producer=True))
+        self.follower = TelemetryEngine(rate_hz=20, seed=2, spatial_index=SpatialIndex(),
+                                        relay=TelemetryRelay(self.clients[1], 1, producer=False, timeout=5))
+        for client in self.clients:
+            client.start()
+            self.assertTrue(client.wait_connected(5))
+        # Кадры и запросы доходят, когда брокер обработал подписки обоих процессов
+        self.assertTrue(wait_for(lambda: self.broker.get_metrics()['channels'] == 2))
+        self.producer_socketio = RecordingSocketIO()
+        self.follower_socketio = RecordingSocketIO()
+        self.producer.start(self.producer_socketio)
+        self.follower.start(self.follower_socketio)
+
+    def tearDown(self):
+        self.producer.stop()
+        self.follower.stop()
+        for client in self.clients:
+            client.stop()
+        self.broker.stop()
+
+    def test_state_from_producer(self):
+        snapshot = self.follower.snapshot(5)
+        expected = self.producer.snapshot(5)
+        self.assertEqual(snapshot['current_latitude'], expected['current_latitude'])
+        self.assertEqual(snapshot['battery_level'], expected['battery_level'])
+        values = self.follower.simulator.values(5)
+        self.assertEqual(self.follower.spatial_index.position(5),
+                         (values['current_latitude'], values['current_longitude']))
+
+    def test_subscribers_receive_producer_steps(self):
+        self.follower.subscribe(3, 'sid-a')
+        self.assertTrue(wait_for(lambda: len(self.follower_socketio.emitted) >= 3))
+        event, delta, kwargs = self.follower_socketio.emitted[-1]
+        self.assertEqual((event, kwargs), ('telemetry_delta', {'to': telemetry_room(3), 'ignore_queue': True}))
+        # Клиентам процесса-производителя (подписчиков у него нет) ничего не отправляется
+        self.assertEqual(self.producer_socketio.emitted, [])
+        self.assertGreaterEqual(self.producer.snapshot(3)['seq'], delta['seq'])
+        self.follower.unsubscribe(3, 'sid-a')
+        self.assertTrue(wait_for(lambda: not self.producer.relay.remote_drones()))
+
+    def test_remote_step(self):
+        before = self.follower.snapshot(4)
+        after = self.follower.step(4)
+        self.assertGreater(after['timestamp'], before['timestamp'])
+        self.assertEqual(after['seq'], 1)
+        self.assertEqual(self.producer.snapshot(4)['seq'], 1)
+
+    def test_unavailable_producer(self):
+        self.producer.relay.client.stop()
+        self.follower.relay.timeout = 0.1
+        with self.assertRaises(TelemetryUnavailableError):
+            self.follower.snapshot(6)
+
+
+if __name__ == '__main__':
+    unittest.main()